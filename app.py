@@ -3,20 +3,31 @@
 from flask_caching import Cache
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file
+from flask import (Flask, render_template, request, redirect, url_for, flash, session, send_file, jsonify,
+                   make_response)
 from dotenv import load_dotenv
 from database.odoo_manager import OdooManager
 from database.google_sheets_manager import GoogleSheetsManager
 from database.supabase_manager import SupabaseManager
+from database.sales_store import SalesStore
 from services.validation_service import ValidationService
 from services.security_logger import SecurityLogger
+from services.dashboard_aggregation import DashboardAggregationEngine
+from services.dataset_context import DatasetContext
+from services.layered_cache import LayeredCache
+from services.single_flight import SingleFlight
+from services.columnar import encode_columns
+from services.pagination import PAGINATION_COUNT, build_keyset_pagination, decode_page_token
+from services.http_compression import HttpCompression
+from services.export_formats import build_export, discard_export, export_response, format_available
+from services.export_jobs import ExportJobManager, ExportQueueFull
+from services.tracing import RequestTracer, name_trace, span
 import os
-import pandas as pd
+import time
+import hashlib
 import json
-import io
 import calendar
 from datetime import datetime, timedelta
-from openpyxl.worksheet.table import Table, TableStyleInfo
 import logging
 
 # Google OAuth2
@@ -90,27 +101,64 @@ else:
     app.config['SESSION_COOKIE_SECURE'] = False  # Permitir HTTP en local
 
 # --- Configuración de Caché ---
+# CACHE_TYPE elige el backend. SimpleCache (por defecto) vive en la memoria de cada
+# worker; con gunicorn conviene uno compartido entre procesos:
+#   - sqlite:     archivo SQLite con tope de tamaño y LRU (database/shared_cache.py)
+#   - filesystem: FileSystemCache en CACHE_DIR
+#   - redis:      RedisCache en CACHE_REDIS_URL
+CACHE_BACKENDS = {
+    'simple': 'SimpleCache',
+    'sqlite': 'database.shared_cache.SQLiteCache',
+    'filesystem': 'FileSystemCache',
+    'redis': 'RedisCache',
+}
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+cache_type = os.getenv('CACHE_TYPE', 'SimpleCache')
 cache_config = {
-    "CACHE_TYPE": "SimpleCache",  # Almacenamiento en memoria simple
-    "CACHE_DEFAULT_TIMEOUT": 600  # 10 minutos de caché por defecto
+    "CACHE_TYPE": CACHE_BACKENDS.get(cache_type.lower(), cache_type),
+    "CACHE_DEFAULT_TIMEOUT": 600,  # 10 minutos de caché por defecto
+    "CACHE_THRESHOLD": _env_int('CACHE_THRESHOLD', 500),  # Máximo de entradas
+    "CACHE_DIR": os.getenv('CACHE_DIR', os.path.join('data', 'cache')),
+    "CACHE_REDIS_URL": os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0'),
+    "CACHE_SQLITE_PATH": os.getenv('CACHE_SQLITE_PATH', os.path.join('data', 'cache.sqlite3')),
+    "CACHE_SQLITE_MAX_BYTES": _env_int('CACHE_SQLITE_MAX_BYTES', 256 * 1024 * 1024),
+    "CACHE_SQLITE_COMPRESS_LEVEL": _env_int('CACHE_SQLITE_COMPRESS_LEVEL', 6),
 }
 cache = Cache(config=cache_config)
 cache.init_app(app)
 
+# --- Trazas de rendimiento por petición (TRACING_ENABLED=true) ---
+# Se registra antes que el resto de los hooks para que el total los incluya:
+# cabecera Server-Timing y desglose por ruta en /api/v1/tracing
+tracer = RequestTracer(app)
+
 # --- Configuración de Rate Limiting ---
-# Previene ataques de fuerza bruta y DoS
+# Previene ataques de fuerza bruta y DoS.
+# RATELIMIT_STORAGE_URI comparte los contadores entre workers, p. ej.
+# sqlite:///data/ratelimit.sqlite3 (esquema registrado en database/shared_cache.py) o redis://localhost:6379/1
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://",
+    storage_uri=os.getenv('RATELIMIT_STORAGE_URI', 'memory://'),
     strategy="fixed-window"
 )
 
 # Configuración para deshabilitar cache de templates
 app.config['TEMPLATES_AUTO_RELOAD'] = True
+# Estáticos sin hash en la URL: el navegador revalida siempre (ETag/304). Las URLs
+# de url_for('static', ...) llevan ?v=<hash> y se cachean STATIC_MAX_AGE (ver HttpCompression)
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 
+# --- Compresión gzip/brotli de respuestas y estáticos precomprimidos ---
+compression = HttpCompression(app)
+
 # Logging configuration: keep server output concise unless an error occurs
 logging.basicConfig(level=logging.INFO)
 # Reduce verbosity of the Flask/Werkzeug request logger
@@ -213,14 +261,22 @@ def refresh_session():
 # --- Inicialización de Managers ---
 data_manager = OdooManager()
 
+# Copia local de las líneas de venta (sincronización incremental desde Odoo)
+if os.getenv('SALES_STORE_ENABLED', 'true').lower() == 'true':
+    try:
+        data_manager.sales_store = SalesStore(data_manager)
+    except Exception as e:
+        logging.error(f"❌ No se pudo inicializar SalesStore, se consultará Odoo directamente: {e}")
+
 # Google Sheets Manager (mantener para compatibilidad con otras funciones)
 gs_manager = GoogleSheetsManager(
     credentials_file='credentials.json',
-    sheet_name=os.getenv('GOOGLE_SHEET_NAME')
+    sheet_name=os.getenv('GOOGLE_SHEET_NAME'),
+    cache=cache
 )
 
 # Supabase Manager (para metas de clientes)
-supabase_manager = SupabaseManager()
+supabase_manager = SupabaseManager(cache=cache)
 
 # Validation Service (para validación centralizada de inputs)
 validation_service = ValidationService()
@@ -228,6 +284,23 @@ validation_service = ValidationService()
 # Security Logger (para auditoría de eventos de seguridad)
 security_logger = SecurityLogger()
 
+# Caché por capas del dashboard: datasets de Odoo y view-models (no HTML)
+dashboard_cache = LayeredCache(cache)
+
+# Datasets compartidos por los consumidores de un render (memo por petición + TTL corto
+# + capa 'datasets' de la caché)
+dataset_context = DatasetContext(data_manager, layers=dashboard_cache)
+
+# Cálculo del view-model del dashboard: una sola vez por filtro aunque sus secciones
+# lleguen en paralelo (candado en la caché compartida entre workers)
+view_model_flight = SingleFlight(cache, prefix='vuelo_vm')
+
+# Exportaciones en segundo plano (pool acotado por proceso, estado junto a los archivos en EXPORT_JOB_DIR)
+export_jobs = ExportJobManager(secret_key=app.secret_key)
+
+# El selector de formato solo ofrece los formatos con sus dependencias instaladas (Parquet requiere pyarrow)
+app.add_template_global(format_available, 'format_available')
+
 # --- Funciones Auxiliares ---
 
 def create_mock_sales_data():
@@ -451,6 +524,21 @@ def index():
     # Redirigir la ruta raíz al dashboard
     return redirect(url_for('dashboard'))
 
+def paginacion_por_offset(total, page, per_page):
+    """Contexto de paginación numerada (?page=N) de /sales y /pending."""
+    pages = max(1, (total + per_page - 1) // per_page)
+    return {
+        'mode': 'offset',
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'pages': pages,
+        'showing_from': (page - 1) * per_page + 1 if total > 0 else 0,
+        'showing_to': min(page * per_page, total),
+        'has_prev': page > 1,
+        'has_next': page < pages
+    }
+
 @app.route('/sales', methods=['GET', 'POST'])
 def sales():
     if 'username' not in session:
@@ -502,31 +590,31 @@ def sales():
         except (ValueError, TypeError):
             per_page = 1000
 
-        # Obtener datos y paginación directamente de OdooManager
-        sales_data_filtered, pagination_data = data_manager.get_sales_lines(
-            page=page,
-            per_page=per_page,
-            date_from=query_filters.get('date_from'),
-            date_to=query_filters.get('date_to'),
-            partner_id=query_filters.get('partner_id'),
-            search=query_filters.get('search_term')
-        )
-
-        total = pagination_data.get('total', 0)
-        pages = max(1, (total + per_page - 1) // per_page)
-        showing_from = (page - 1) * per_page + 1 if total > 0 else 0
-        showing_to = min(page * per_page, total)
-
-        pagination = {
-            'page': page,
-            'per_page': per_page,
-            'total': total,
-            'pages': pages,
-            'showing_from': showing_from,
-            'showing_to': showing_to,
-            'has_prev': page > 1,
-            'has_next': page < pages
-        }
+        if 'page' in request.args:
+            # Paginación numerada por offset (enlaces antiguos con ?page=N)
+            sales_data_filtered, pagination_data = data_manager.get_sales_lines(
+                page=page,
+                per_page=per_page,
+                date_from=query_filters.get('date_from'),
+                date_to=query_filters.get('date_to'),
+                partner_id=query_filters.get('partner_id'),
+                search=query_filters.get('search_term')
+            )
+            pagination = paginacion_por_offset(pagination_data.get('total', 0), page, per_page)
+        else:
+            # Paginación por keyset: ?cursor=<token> continúa desde la última fila vista,
+            # sin offset y sin volver a contar (el total viene en el token)
+            cursor = decode_page_token(request.args.get('cursor'), selected_filters)
+            sales_data_filtered, pagination_data = data_manager.get_sales_lines(
+                per_page=per_page,
+                date_from=query_filters.get('date_from'),
+                date_to=query_filters.get('date_to'),
+                partner_id=query_filters.get('partner_id'),
+                search=query_filters.get('search_term'),
+                keyset=cursor['keyset'] if cursor else {'key': None, 'direction': 'next'},
+                count=PAGINATION_COUNT and cursor is None
+            )
+            pagination = build_keyset_pagination(pagination_data, len(sales_data_filtered), selected_filters, cursor)
 
         return render_template(
             'sales.html',
@@ -600,28 +688,24 @@ def pending():
         except (ValueError, TypeError):
             per_page = 1000
 
-        # Obtener datos y paginación directamente de OdooManager
-        pending_data, pagination_data = data_manager.get_pending_orders(
-            page=page,
-            per_page=per_page,
-            filters=selected_filters
-        )
-
-        total = pagination_data.get('total', 0)
-        pages = max(1, (total + per_page - 1) // per_page)
-        showing_from = (page - 1) * per_page + 1 if total > 0 else 0
-        showing_to = min(page * per_page, total)
-
-        pagination = {
-            'page': page,
-            'per_page': per_page,
-            'total': total,
-            'pages': pages,
-            'showing_from': showing_from,
-            'showing_to': showing_to,
-            'has_prev': page > 1,
-            'has_next': page < pages
-        }
+        if 'page' in request.args:
+            # Paginación numerada por offset (enlaces antiguos con ?page=N)
+            pending_data, pagination_data = data_manager.get_pending_orders(
+                page=page,
+                per_page=per_page,
+                filters=selected_filters
+            )
+            pagination = paginacion_por_offset(pagination_data.get('total', 0), page, per_page)
+        else:
+            # Paginación por keyset (ver /sales)
+            cursor = decode_page_token(request.args.get('cursor'), selected_filters)
+            pending_data, pagination_data = data_manager.get_pending_orders(
+                per_page=per_page,
+                filters=selected_filters,
+                keyset=cursor['keyset'] if cursor else {'key': None, 'direction': 'next'},
+                count=PAGINATION_COUNT and cursor is None
+            )
+            pagination = build_keyset_pagination(pagination_data, len(pending_data), selected_filters, cursor)
         
         return render_template('pending.html', 
                              pending_data=pending_data,
@@ -646,1376 +730,1124 @@ def pending():
                              fecha_actual=datetime.now(),
                              pagination=pagination_default)
 
-@app.route('/dashboard', methods=['GET', 'POST'])
-@limiter.limit("100 per minute")
-def dashboard():
-    # ⏱️ MEDICIÓN DE TIEMPO: Inicio de carga del dashboard
-    import time
-    dashboard_start = time.time()
+def excluir_codigos_servicio(items):
+    """Filas sin los códigos de servicio (los que empiezan con "81000" o "SERV")."""
+    return [
+        item for item in items
+        if not (
+            (item.get('codigo_odoo', '') or '').startswith('81000') or
+            (item.get('codigo_odoo', '') or '').startswith('SERV')
+        )
+    ]
+
+
+def es_codigo_exportable(item):
+    """False para las filas con códigos de servicio (ver excluir_codigos_servicio)."""
+    codigo = item.get('codigo_odoo', '') or ''
+    return not (codigo.startswith('81000') or codigo.startswith('SERV'))
+
+
+def describir_edad_datos(obtenido_en):
+    """Antigüedad legible de los datos ("hace 3 min"), o None si no se conoce."""
+    if not obtenido_en:
+        return None
+    segundos = max(0, int(time.time() - obtenido_en))
+    if segundos < 60:
+        return "hace unos segundos"
+    if segundos < 3600:
+        return f"hace {segundos // 60} min"
+    return f"hace {segundos // 3600} h {segundos % 3600 // 60} min"
+
+
+# Secciones del dashboard que sirve /api/v1/dashboard/<seccion>: claves del view-model
+# que necesita cada grupo de gráficos. 'resumen' (KPIs y tabla por línea, ya en HTML)
+# y 'detalle' (filas de ventas y pendientes) se arman aparte.
+DASHBOARD_SECCIONES = {
+    'lineas': ('datos_lineas', 'productos_por_linea'),
+    'productos': ('datos_productos', 'datos_productos_pendientes'),
+    'drilldown': ('datos_forma_farmaceutica', 'drilldown_data', 'drilldown_titles', 'pie_chart_data_by_level'),
+    'clientes': ('bullet_chart_data', 'orders_chart_data', 'avance_cliente_seleccionado',
+                 'products_chart_data_entrega', 'products_chart_data_confirmacion'),
+    'mapa': ('datos_mapa_mundial',),
+}
+DASHBOARD_SECCIONES_PAGINA = ('resumen', 'detalle') + tuple(DASHBOARD_SECCIONES)
+
+# Campos de las filas de detalle que lee la página; viajan en formato columnar
+# (services/columnar.py). name y default_code son copias de producto y codigo_odoo.
+CAMPOS_VENTAS = ('fecha', 'pedido', 'move_name', 'partner_id', 'cliente', 'pais', 'linea_comercial',
+                 'codigo_odoo', 'producto', 'descripcion', 'cantidad_facturada', 'total', 'amount_currency')
+ALIAS_VENTAS = {'name': 'producto', 'default_code': 'codigo_odoo'}
+CAMPOS_PENDIENTES = ('fecha', 'fecha_confirmacion', 'commitment_date', 'pedido', 'order_state',
+                     'partner_id', 'cliente_id', 'cliente', 'pais', 'linea_comercial', 'codigo_odoo',
+                     'producto', 'descripcion', 'cantidad_pendiente', 'total_pendiente')
+# Arrays de objetos homogéneos del view-model que también se envían en columnas
+DASHBOARD_CLAVES_COLUMNARES = ('products_chart_data_entrega', 'products_chart_data_confirmacion')
+
+# Parte fija de los ETag de las secciones: cambia con cada despliegue del código o de
+# las plantillas que dan forma a la respuesta (APP_VERSION la fija explícitamente)
+DASHBOARD_ETAG_BUILD = os.getenv('APP_VERSION') or hashlib.sha1(b''.join(
+    ruta.read_bytes() for ruta in sorted([
+        pathlib.Path(__file__),
+        *pathlib.Path(app.root_path, 'services').glob('*.py'),
+        *pathlib.Path(app.root_path, 'templates', 'partials').glob('*.html'),
+    ])
+)).hexdigest()[:10]
+
+
+def resolver_filtros_dashboard(args):
+    """Filtros validados del dashboard (página y API) a partir de los parámetros GET.
     
-    # Calcular tiempo desde login si existe
-    login_timestamp = session.get('login_timestamp')
-    if login_timestamp:
-        time_since_login = dashboard_start - login_timestamp
-        app.logger.info(f"⏱️ ===== DASHBOARD INICIADO ===== | Tiempo desde login: {time_since_login:.3f}s")
-    else:
-        app.logger.info(f"⏱️ ===== DASHBOARD INICIADO ===== | Sin timestamp de login")
+    Returns:
+        dict con año_seleccionado, partner_id, date_from, date_to, cache_key (filtros
+        normalizados) y query (los parámetros que repiten las peticiones de secciones)
     
-    if 'username' not in session:
-        return redirect(url_for('login'))
+    Raises:
+        ValueError: Si los parámetros no son válidos
+    """
+    validated_filters = validation_service.validate_dashboard_filters(args)
+    año_seleccionado = validated_filters['año']
+    cliente_id_param = validated_filters.get('cliente_id')
+    date_from_param = validated_filters.get('date_from')
+    date_to_param = validated_filters.get('date_to')
     
-    # Validar filtros usando ValidationService
-    try:
-        validated_filters = validation_service.validate_dashboard_filters(request.args)
-        año_seleccionado = validated_filters['año']
-        cliente_id_param = validated_filters.get('cliente_id')
-        date_from_param = validated_filters.get('date_from')
-        date_to_param = validated_filters.get('date_to')
-    except ValueError as e:
-        app.logger.warning(f"Validación de filtros falló: {e}")
-        
-        # ✅ Log evento de seguridad: error de validación
-        security_logger.log_validation_error(
-            param='dashboard_filters',
-            value=str(request.args),
-            request=request,
-            error_type="DASHBOARD_VALIDATION"
-        )
-        
-        flash('Los parámetros de búsqueda no son válidos', 'warning')
-        return redirect(url_for('dashboard'))
+    query = {'año': año_seleccionado}
+    if cliente_id_param:
+        query['cliente_id'] = cliente_id_param
+    if date_from_param:
+        query['date_from'] = date_from_param
+    if date_to_param:
+        query['date_to'] = date_to_param
     
-    # Construir una clave de caché única basada en los filtros validados
-    cache_key_parts = [
-        'dashboard',
-        request.method,
-        validation_service.sanitize_for_cache_key(cliente_id_param or 'all'),
-        str(año_seleccionado),
-        validation_service.sanitize_for_cache_key(date_from_param or ''),
-        validation_service.sanitize_for_cache_key(date_to_param or '')
-    ]
-    cache_key = '_'.join(cache_key_parts)
+    return {
+        'año_seleccionado': año_seleccionado,
+        'partner_id': cliente_id_param,
+        # Establecer date_from y date_to según el año seleccionado
+        'date_from': date_from_param or f"{año_seleccionado}-01-01",
+        'date_to': date_to_param or f"{año_seleccionado}-12-31",
+        # Clave del view-model (estructuras ya agregadas) basada en los filtros validados
+        'cache_key': (
+            validation_service.sanitize_for_cache_key(cliente_id_param or 'all'),
+            str(año_seleccionado),
+            validation_service.sanitize_for_cache_key(date_from_param or ''),
+            validation_service.sanitize_for_cache_key(date_to_param or '')
+        ),
+        'query': query
+    }
+
+
+def construir_dashboard_view_model(año_seleccionado, partner_id, date_from, date_to, rpc_calls):
+    """Calcula el view-model del dashboard: todas las estructuras ya agregadas.
     
-    # Intentar obtener datos de caché solo para GET requests
-    if request.method == 'GET':
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            app.logger.info(f"Sirviendo dashboard desde caché: {cache_key}")
-            return cached_data
+    Incluye todo lo que el template necesita salvo las filas de detalle (capa de
+    datasets) y los valores propios de la petición (filtros, fecha actual).
+    """
+    # Obtener opciones de filtro básicas
+    filter_options = dataset_context.filter_options()
     
-    # Inicializar variables que necesitaremos en el except
-    filter_options = {'lineas': [], 'clientes': []}
-    selected_filters = {'cliente_id': None}
+    # Generar lista de años disponibles (desde 2020 hasta el año actual + 5)
+    años_disponibles = list(range(
+        validation_service.MIN_YEAR,
+        validation_service.MAX_YEAR + 1
+    ))
     
-    try:
-        # Obtener opciones de filtro básicas
-        filter_options = data_manager.get_filter_options()
-        
-        # Obtener filtros del formulario o de los parámetros GET
-        if request.method == 'POST':
-            selected_filters = {'cliente_id': request.form.get('cliente_id')}
-            selected_filters['date_from'] = request.form.get('date_from')
-            selected_filters['date_to'] = request.form.get('date_to')
-            selected_filters['año'] = request.form.get('año')
-        else:
-            selected_filters = {'cliente_id': request.args.get('cliente_id')}
-            selected_filters['año'] = request.args.get('año')
-
-        # Usar filtros ya validados
-        partner_id = cliente_id_param
-        
-        # Generar lista de años disponibles (desde 2020 hasta el año actual + 5)
-        años_disponibles = list(range(
-            validation_service.MIN_YEAR,
-            validation_service.MAX_YEAR + 1
-        ))
-        
-        # Establecer date_from y date_to según el año seleccionado
-        date_from = date_from_param or f"{año_seleccionado}-01-01"
-        date_to = date_to_param or f"{año_seleccionado}-12-31"
-        
-        # CORRECCIÓN: get_sales_lines ahora devuelve una tupla (datos, paginación).
-        # Desempaquetamos y solo usamos los datos.
-        sales_data_year, _ = data_manager.get_sales_lines(
-            # Pasar las fechas dinámicas a la función.
+    with data_manager.collect_rpc_timings(rpc_calls), span('datasets.sales_lines'):
+        # Todas las líneas del rango (sin paginación), compartidas con los demás
+        # consumidores del render a través del contexto de datasets
+        sales_data_year = dataset_context.sales_lines(
             date_from=date_from,
             date_to=date_to,
-            partner_id=partner_id,
-            page=1,
-            per_page=99999 # Pedir un número muy grande para obtener todos los registros
+            partner_id=partner_id
         )
     # Debug info removed
-        
-        # Los datos para KPIs y gráficos ahora provienen de la misma fuente
-        sales_data_raw = sales_data_year
-
-        # CORRECCIÓN: get_pending_orders ahora devuelve una tupla (datos, paginación).
-        # Desempaquetamos y solo usamos los datos.
-        pending_data, _ = data_manager.get_pending_orders(
-            partner_id=partner_id, # CORRECCIÓN: Pasar partner_id directamente para asegurar que los filtros base se apliquen.
-            page=1,
-            per_page=99999  # Pedir un número muy grande para obtener todos los registros
-        )
-
-        # --- Agregación por pedido (backend) para gráfico de pedidos del cliente seleccionado ---
-        orders_chart_data = []
-        if partner_id:
-            # Agrupar facturado por pedido desde sales_data_year
-            # Esta lógica es crucial para identificar el nombre del pedido de las líneas de factura
-            facturado_by_pedido = {}
-            pedido_cliente_map = {}  # mapa pedido -> (cliente_id, cliente_name)
-            for s in sales_data_raw: # Usar los datos crudos para la agregación
-                # Lógica mejorada para obtener el nombre del pedido de forma fiable
-                order_name_from_order = s.get('pedido')
-                origin_from_invoice = s.get('invoice_origin')
-                move_name = s.get('move_name')
-                
-                pedido_name = order_name_from_order or origin_from_invoice or move_name or ''
-                if not pedido_name or not isinstance(pedido_name, str):
-                    continue
-                facturado_by_pedido[pedido_name] = facturado_by_pedido.get(pedido_name, 0) + (s.get('amount_currency', 0) or 0)
-                # intentar obtener cliente id y nombre desde la línea de venta
-                partner = s.get('partner_id') or s.get('partner') or s.get('cliente_id') or s.get('cliente')
-                cliente_id = None
-                cliente_name = None
-                if partner:
-                    if isinstance(partner, (list, tuple)) and len(partner) > 0:
-                        cliente_id = partner[0]
-                        if len(partner) > 1:
-                            cliente_name = partner[1]
-                    else:
-                        # partner puede ser solo id o nombre
-                        try:
-                            cliente_id = int(partner)
-                        except Exception:
-                            cliente_name = str(partner)
-                if pedido_name and (cliente_id or cliente_name):
-                    # solo setear si no existe para no sobreescribir con valores distintos
-                    if pedido_name not in pedido_cliente_map:
-                        pedido_cliente_map[pedido_name] = {
-                            'cliente_id': cliente_id,
-                            'cliente': cliente_name,
-                            'order_id': s.get('order_id')[0] if s.get('order_id') else None,
-                            'partner': s.get('partner_id') or s.get('partner')
-                        }
+    
+    # Los datos para KPIs y gráficos ahora provienen de la misma fuente
+    sales_data_raw = sales_data_year
+
+    with data_manager.collect_rpc_timings(rpc_calls), span('datasets.pending_orders'):
+        # Todas las líneas pendientes del cliente (partner_id asegura los filtros base)
+        pending_data = dataset_context.pending_orders(partner_id=partner_id)
+
+    # --- Agregación por pedido (backend) para gráfico de pedidos del cliente seleccionado ---
+    orders_chart_data = []
+    if partner_id:
+        # Agrupar facturado por pedido desde sales_data_year
+        # Esta lógica es crucial para identificar el nombre del pedido de las líneas de factura
+        facturado_by_pedido = {}
+        pedido_cliente_map = {}  # mapa pedido -> (cliente_id, cliente_name)
+        for s in sales_data_raw: # Usar los datos crudos para la agregación
+            # Lógica mejorada para obtener el nombre del pedido de forma fiable
+            order_name_from_order = s.get('pedido')
+            origin_from_invoice = s.get('invoice_origin')
+            move_name = s.get('move_name')
+            
+            pedido_name = order_name_from_order or origin_from_invoice or move_name or ''
+            if not pedido_name or not isinstance(pedido_name, str):
+                continue
+            facturado_by_pedido[pedido_name] = facturado_by_pedido.get(pedido_name, 0) + (s.get('amount_currency', 0) or 0)
+            # intentar obtener cliente id y nombre desde la línea de venta
+            partner = s.get('partner_id') or s.get('partner') or s.get('cliente_id') or s.get('cliente')
+            cliente_id = None
+            cliente_name = None
+            if partner:
+                if isinstance(partner, (list, tuple)) and len(partner) > 0:
+                    cliente_id = partner[0]
+                    if len(partner) > 1:
+                        cliente_name = partner[1]
+                else:
+                    # partner puede ser solo id o nombre
+                    try:
+                        cliente_id = int(partner)
+                    except Exception:
+                        cliente_name = str(partner)
+            if pedido_name and (cliente_id or cliente_name):
+                # solo setear si no existe para no sobreescribir con valores distintos
+                if pedido_name not in pedido_cliente_map:
+                    pedido_cliente_map[pedido_name] = {
+                        'cliente_id': cliente_id,
+                        'cliente': cliente_name,
+                        'order_id': s.get('order_id')[0] if s.get('order_id') else None,
+                        'partner': s.get('partner_id') or s.get('partner')
+                    }
 
-            # Agrupar pendiente por pedido desde pending_data
-            pendiente_by_pedido = {}
-            for p in pending_data: # Usar los datos completos de pendientes
-                pedido_name = p.get('pedido') or p.get('order_name') or p.get('move_name') or ''
-                if not pedido_name:
-                    continue
-                pendiente_by_pedido[pedido_name] = pendiente_by_pedido.get(pedido_name, 0) + (p.get('total_pendiente', 0) or 0)
-                # intentar obtener cliente desde pending
-                partner = p.get('partner_id') or p.get('partner') or p.get('cliente_id') or p.get('cliente')
-                cliente_id = None
-                cliente_name = None
-                if partner:
-                    if isinstance(partner, (list, tuple)) and len(partner) > 0:
-                        cliente_id = partner[0]
-                        if len(partner) > 1:
-                            cliente_name = partner[1]
-                    else:
-                        try:
-                            cliente_id = int(partner)
-                        except Exception:
-                            cliente_name = str(partner)
-                if pedido_name and (cliente_id or cliente_name):
-                    if pedido_name not in pedido_cliente_map:
-                        pedido_cliente_map[pedido_name] = {
-                            'cliente_id': cliente_id,
-                            'cliente': cliente_name,
-                            'order_id': p.get('order_id') if p.get('order_id') else None,
-                            'partner': p.get('partner_id') or p.get('partner')
-                        }
+        # Agrupar pendiente por pedido desde pending_data
+        pendiente_by_pedido = {}
+        for p in pending_data: # Usar los datos completos de pendientes
+            pedido_name = p.get('pedido') or p.get('order_name') or p.get('move_name') or ''
+            if not pedido_name:
+                continue
+            pendiente_by_pedido[pedido_name] = pendiente_by_pedido.get(pedido_name, 0) + (p.get('total_pendiente', 0) or 0)
+            # intentar obtener cliente desde pending
+            partner = p.get('partner_id') or p.get('partner') or p.get('cliente_id') or p.get('cliente')
+            cliente_id = None
+            cliente_name = None
+            if partner:
+                if isinstance(partner, (list, tuple)) and len(partner) > 0:
+                    cliente_id = partner[0]
+                    if len(partner) > 1:
+                        cliente_name = partner[1]
+                else:
+                    try:
+                        cliente_id = int(partner)
+                    except Exception:
+                        cliente_name = str(partner)
+            if pedido_name and (cliente_id or cliente_name):
+                if pedido_name not in pedido_cliente_map:
+                    pedido_cliente_map[pedido_name] = {
+                        'cliente_id': cliente_id,
+                        'cliente': cliente_name,
+                        'order_id': p.get('order_id') if p.get('order_id') else None,
+                        'partner': p.get('partner_id') or p.get('partner')
+                    }
 
-            # --- NUEVA LÓGICA: Construir orders_chart_data a partir de los sale.orders del partner ---
-            # Esto asegura que el 'total' de la barra sea el amount_total original del pedido
+        # --- NUEVA LÓGICA: Construir orders_chart_data a partir de los sale.orders del partner ---
+        # Esto asegura que el 'total' de la barra sea el amount_total original del pedido
+        with data_manager.collect_rpc_timings(rpc_calls):
             partner_sale_orders = data_manager.get_sale_orders_for_partner(partner_id)
 
-            for order_obj in partner_sale_orders:
-                order_name = order_obj.get('name')
-                if not order_name:
-                    continue
+        for order_obj in partner_sale_orders:
+            order_name = order_obj.get('name')
+            if not order_name:
+                continue
+
+            fact = facturado_by_pedido.get(order_name, 0)
+            pend = pendiente_by_pedido.get(order_name, 0)
+            original_total_order = order_obj.get('amount_total', 0)
+
+            # Solo añadir si hay un total original o alguna actividad (facturado/pendiente)
+            if original_total_order > 0 or fact > 0 or pend > 0:
+                orders_chart_data.append({
+                    'pedido': order_name,
+                    'total': original_total_order, # Usar el amount_total original del pedido
+                    'facturado': fact,
+                    'pendiente': pend,
+                    'cliente_id': partner_id, # Ya sabemos que es este partner
+                    'cliente': order_obj.get('partner_id')[1] if order_obj.get('partner_id') else '',
+                    'order_id': order_obj.get('id'),
+                    'partner': order_obj.get('partner_id')
+                })
 
-                fact = facturado_by_pedido.get(order_name, 0)
-                pend = pendiente_by_pedido.get(order_name, 0)
-                original_total_order = order_obj.get('amount_total', 0)
-
-                # Solo añadir si hay un total original o alguna actividad (facturado/pendiente)
-                if original_total_order > 0 or fact > 0 or pend > 0:
-                    orders_chart_data.append({
-                        'pedido': order_name,
-                        'total': original_total_order, # Usar el amount_total original del pedido
-                        'facturado': fact,
-                        'pendiente': pend,
-                        'cliente_id': partner_id, # Ya sabemos que es este partner
-                        'cliente': order_obj.get('partner_id')[1] if order_obj.get('partner_id') else '',
-                        'order_id': order_obj.get('id'),
-                        'partner': order_obj.get('partner_id')
-                    })
-
-            # Ordenar por total descendente
-            orders_chart_data = sorted(orders_chart_data, key=lambda x: x['total'], reverse=True)
-            # Removed verbose debug logging for orders_chart_data
-        else:
-            orders_chart_data = []
-        
-        # ✅ FILTRO GLOBAL: Excluir códigos que empiezan con "81000" o "SERV" de TODOS los datos
-        sales_data_year = [
-            item for item in sales_data_year
-            if not (
-                (item.get('codigo_odoo', '') or '').startswith('81000') or
-                (item.get('codigo_odoo', '') or '').startswith('SERV')
-            )
-        ]
-        
-        pending_data = [
-            item for item in pending_data
-            if not (
-                (item.get('codigo_odoo', '') or '').startswith('81000') or
-                (item.get('codigo_odoo', '') or '').startswith('SERV')
-            )
-        ]
-        
-        # Usar todos los datos del año (ya filtrados)
-        sales_data = sales_data_year
-        sales_data_international = sales_data_year
-        
-        ventas_por_linea = {}
-        total_sales_year = 0
-        
-        # NUEVA LÓGICA: Primero agrupar por factura (move_name) para cancelar positivos/negativos
-        ventas_por_factura = {}
-        
-        # Debug logs removed: sales_data_international sampling
-        
-        todas_las_lineas = set()
-        por_facturar_por_linea = {} # Inicializar para evitar errores
-        total_por_facturar = 0 # Inicializar para evitar errores
+        # Ordenar por total descendente
+        orders_chart_data = sorted(orders_chart_data, key=lambda x: x['total'], reverse=True)
+        # Removed verbose debug logging for orders_chart_data
+    else:
+        orders_chart_data = []
+    
+    # ✅ FILTRO GLOBAL: Excluir códigos que empiezan con "81000" o "SERV" de TODOS los datos
+    sales_data_year = excluir_codigos_servicio(sales_data_year)
+    pending_data = excluir_codigos_servicio(pending_data)
+    
+    # Usar todos los datos del año (ya filtrados)
+    sales_data_international = sales_data_year
+    
+    # Totales agrupados por producto y cliente (read_group / GROUP BY local):
+    # mismas claves que las líneas pero con importes sumados, ya sin códigos 81000/SERV.
+    # Si no están disponibles se agregan las líneas de detalle como antes.
+    with data_manager.collect_rpc_timings(rpc_calls), span('datasets.sales_aggregates'):
+        sales_aggregates = dataset_context.sales_aggregates(
+            date_from=date_from, date_to=date_to, partner_id=partner_id
+        )
+    sales_rows = sales_aggregates if sales_aggregates is not None else sales_data_international
+    
+    # Motor de agregación: los DataFrames de ventas y pendientes se construyen una
+    # sola vez y todas las estructuras del dashboard salen de operaciones agrupadas.
+    with span('aggregation'):
+        agregados = DashboardAggregationEngine(
+            sales_rows, pending_data, sales_lines=sales_data_international
+        ).build()
+    
+    total_sales_year = agregados['total_sales_year']
+    
+    # Pendientes por línea comercial y por año de compromiso (commitment_date)
+    por_facturar_por_linea = agregados['por_facturar_por_linea']
+    total_por_facturar = agregados['total_por_facturar']
+    por_facturar_2025_por_linea = agregados['por_facturar_por_año']['2025']
+    por_facturar_2026_por_linea = agregados['por_facturar_por_año']['2026']
+    por_facturar_2027_por_linea = agregados['por_facturar_por_año']['2027']
+    por_facturar_otros_por_linea = agregados['por_facturar_otros_por_linea']  # Lo que no es 2025, 2026, 2027
+    total_por_facturar_2025 = agregados['total_por_facturar_por_año']['2025']
+    total_por_facturar_2026 = agregados['total_por_facturar_por_año']['2026']
+    total_por_facturar_2027 = agregados['total_por_facturar_por_año']['2027']
+    total_por_facturar_otros = agregados['total_por_facturar_otros']
+    
+    # Log temporal para debug
+    pendientes_con_fecha = agregados['pendientes_con_fecha']
+    logging.info(f"DEBUG: Total pedidos pendientes: {len(pending_data)}")
+    logging.info(f"DEBUG: Pedidos con commitment_date: {pendientes_con_fecha['total']}")
+    logging.info(f"DEBUG: Pedidos 2025: {pendientes_con_fecha['2025']}, 2026: {pendientes_con_fecha['2026']}, 2027: {pendientes_con_fecha['2027']}")
+    
+    # Datos para la tabla y el gráfico (ordenados por venta descendente)
+    datos_lineas = agregados['datos_lineas']
+    
+    # Gráficos de productos facturados y pendientes (Top 7 global y por línea)
+    datos_productos = agregados['datos_productos']
+    productos_por_linea_top = agregados['productos_por_linea']
+    datos_productos_pendientes = agregados['datos_productos_pendientes']
+    
+    # Calcular KPIs adicionales
+    unique_clients = agregados['unique_clients']
+    total_products = agregados['total_products']
+    total_invoices = agregados['total_invoices']
+    
+    # --- INTEGRACIÓN DE METAS POR CLIENTE ---
+    # 1. Cargar metas de clientes para el año seleccionado (no el año actual)
+    # Solo las metas del año (caché por año, ver SupabaseManager.read_metas_año)
+    año_str = str(año_seleccionado)  # Usar año_seleccionado en lugar de datetime.now().year
+    metas_clientes_año = supabase_manager.read_metas_año(año_str)
+
+    # 2. Calcular la meta total para el KPI principal (condicional al filtro de cliente)
+    meta_total_general = 0
+    if partner_id:
+        # Si hay un cliente seleccionado, la meta es solo la de ese cliente
+        metas_del_cliente = metas_clientes_año.get(str(partner_id), {})
+        meta_total_general = sum(v for k, v in metas_del_cliente.items() if k != 'cliente_nombre')
+    else:
+        # Si no hay cliente seleccionado, sumar las metas de todos
+        for cliente_id, metas_lineas in metas_clientes_año.items():
+            meta_total_general += sum(v for k, v in metas_lineas.items() if k != 'cliente_nombre')
+
+    # 3. Calcular Brecha Comercial con la meta real
+    # La venta proyectada ya está acotada al cliente seleccionado (si lo hay)
+    brecha_comercial = (total_sales_year + total_por_facturar) - meta_total_general
+
+    # --- LÓGICA PARA GRÁFICOS ADICIONALES (Forma Farmacéutica y Drilldown Jerárquico) ---
+    datos_forma_farmaceutica = agregados['datos_forma_farmaceutica']
+    drilldown_data = agregados['drilldown_data']
+    drilldown_titles = agregados['drilldown_titles']
+    pie_chart_data_by_level = agregados['pie_chart_data_by_level']
+
+    # Para la tabla (agregar datos adicionales si es necesario)
+    datos_lineas_tabla = datos_lineas.copy()
+    for linea in datos_lineas_tabla:
+        # --- INTEGRACIÓN DE METAS POR LÍNEA ---
+        # Sumar las metas de todos los clientes para esta línea comercial específica
+        # Convertir el nombre de la línea (ej. "AGROVET") a su ID (ej. "agrovet")
+        linea_id_actual = linea.get('nombre', '').lower().replace(' ', '_')
         
-        for sale in sales_data_international:
-            # Usar 'commercial_line_international_id' para consistencia
-            linea_comercial_obj = sale.get('commercial_line_international_id')
-            nombre_linea = "Sin Línea Comercial"
-            if linea_comercial_obj and isinstance(linea_comercial_obj, list) and len(linea_comercial_obj) > 1:
-                nombre_linea = linea_comercial_obj[1]
-            
-            todas_las_lineas.add(nombre_linea)
-            
-            # Usar 'amount_currency' que ya tiene el signo correcto desde OdooManager
-            venta_amount = sale.get('amount_currency', 0)
-            
-            ventas_por_linea[nombre_linea] = ventas_por_linea.get(nombre_linea, 0) + venta_amount
-            total_sales_year += venta_amount
-        
-        # Procesar datos pendientes para la tabla - POR AÑO
-        pending_data_filtered = pending_data
-        
-        por_facturar_2025_por_linea = {}
-        por_facturar_2026_por_linea = {}
-        por_facturar_2027_por_linea = {}
-        por_facturar_otros_por_linea = {}  # Lo que no es 2025, 2026, 2027
-        total_por_facturar_2025 = 0
-        total_por_facturar_2026 = 0
-        total_por_facturar_2027 = 0
-        total_por_facturar_otros = 0
-        
-        # Debug temporal: contar cuántos pedidos tienen commitment_date
-        debug_count_with_date = 0
-        debug_count_2025 = 0
-        debug_count_2026 = 0
-        debug_count_2027 = 0
-        
-        for pending_item in pending_data_filtered:
-            linea_nombre = pending_item.get('linea_comercial', 'Sin Línea Comercial')
-            total_pendiente = pending_item.get('total_pendiente', 0)
-            commitment_year = pending_item.get('commitment_year', '')
+        if partner_id:
+            # Si hay cliente, la meta de la línea es solo la de ese cliente
+            meta_linea = metas_clientes_año.get(str(partner_id), {}).get(linea_id_actual, 0)
+        else:
+            # Si no hay cliente, sumar las metas de todos para esa línea
+            meta_linea = sum(metas_cliente.get(linea_id_actual, 0) for metas_cliente in metas_clientes_año.values())
+
+        venta_total_linea = linea.get('venta', 0)
+        por_facturar_linea = por_facturar_otros_por_linea.get(linea['nombre'], 0)  # Solo "otros" años
+        por_facturar_2025_linea = por_facturar_2025_por_linea.get(linea['nombre'], 0)
+        por_facturar_2026_linea = por_facturar_2026_por_linea.get(linea['nombre'], 0)
+        por_facturar_2027_linea = por_facturar_2027_por_linea.get(linea['nombre'], 0)
+        
+        # Calcular brecha y avance (usando el total real de por facturar)
+        total_por_facturar_linea_real = por_facturar_por_linea.get(linea['nombre'], 0)
+        venta_proyectada = venta_total_linea + total_por_facturar_linea_real
+        brecha = venta_proyectada - meta_linea # Brecha contra la meta real
+        porcentaje_avance_meta = (venta_proyectada / meta_linea * 100) if meta_linea > 0 else 0
+
+        linea.update({
+            'por_facturar': por_facturar_linea,  # Solo "otros" años
+            'por_facturar_2025': por_facturar_2025_linea,
+            'por_facturar_2026': por_facturar_2026_linea,
+            'por_facturar_2027': por_facturar_2027_linea,
+            'porcentaje_sobre_total': (venta_total_linea / total_sales_year * 100) if total_sales_year > 0 else 0,
+            'meta': meta_linea,
+            'brecha': brecha,
+            'porcentaje_avance_meta': porcentaje_avance_meta
+        })
+    
+    venta_proyectada_total = total_sales_year + total_por_facturar
+    porcentaje_avance_total = (venta_proyectada_total / meta_total_general * 100) if meta_total_general > 0 else 0
+
+    kpis = {
+        # KPIs que el template espera (usando total_sales_year para consistencia con la tabla)
+        'meta_total': meta_total_general,
+        'venta_total': total_sales_year,  # Usar el total del año que coincide con la suma de líneas comerciales
+        'total_por_facturar': total_por_facturar_otros,  # Solo "otros" años
+        'total_por_facturar_2025': total_por_facturar_2025,
+        'total_por_facturar_2026': total_por_facturar_2026,
+        'total_por_facturar_2027': total_por_facturar_2027,
+        'porcentaje_avance': (total_sales_year / meta_total_general * 100) if meta_total_general > 0 else 0, # Avance sobre facturado
+        'total_brecha': brecha_comercial
+    }
+    
+    # --- LÓGICA PARA GRÁFICO DE AVANCE POR CLIENTE ---
+    # Ahora se basa en Venta Facturada vs Meta Anual
+    facturado_por_cliente = {}
+    cliente_id_map = {} # Mapa de nombre de cliente a su ID
+    for sale in sales_data_international:
+        cliente_nombre = sale.get('cliente')
+        partner = sale.get('partner_id')
+        cliente_id = None
+        if partner and isinstance(partner, list) and len(partner) > 0:
+            cliente_id = str(partner[0])
+        
+        if cliente_nombre and cliente_id:
+            cliente_id_map[cliente_nombre] = cliente_id
+
+        if cliente_nombre:
+            facturado_por_cliente[cliente_nombre] = facturado_por_cliente.get(cliente_nombre, 0) + sale.get('amount_currency', 0)
+
+    pendiente_por_cliente = {}
+    # CAMBIO: Almacenar TODAS las fechas de entrega por cliente, CONSOLIDADAS por fecha única
+    # Estructura: { 'cliente': [ {'commitment_date': ..., 'fecha_confirmacion': ..., 'monto': ...}, ... ] }
+    fechas_por_cliente = {}
+    
+    # Estados válidos para cálculo de tiempo esperado (gráfico V2)
+    estados_pedido_validos = ['sale', 'credit', 'done']  # Ordenes de venta, En créditos, En logística
+    
+    for pending in pending_data:
+        cliente_nombre = pending.get('cliente')
+        if cliente_nombre:
+            # Mapear cliente_id también desde pending_data (para clientes sin facturado)
+            partner = pending.get('partner_id')
+            if partner and isinstance(partner, list) and len(partner) > 0:
+                cliente_id = str(partner[0])
+                if cliente_nombre not in cliente_id_map:
+                    cliente_id_map[cliente_nombre] = cliente_id
             
-            # Debug
-            if commitment_year:
-                debug_count_with_date += 1
-                if commitment_year == '2025':
-                    debug_count_2025 += 1
-                elif commitment_year == '2026':
-                    debug_count_2026 += 1
-                elif commitment_year == '2027':
-                    debug_count_2027 += 1
+            pendiente_por_cliente[cliente_nombre] = pendiente_por_cliente.get(cliente_nombre, 0) + pending.get('total_pendiente', 0)
             
-            por_facturar_por_linea[linea_nombre] = por_facturar_por_linea.get(linea_nombre, 0) + total_pendiente
-            total_por_facturar += total_pendiente
+            # Extraer fechas SOLO si el pedido está en estado válido (no cotización, no cancelado)
+            order_state = pending.get('order_state', '')
+            commitment_date_str = pending.get('commitment_date', '')
+            fecha_confirmacion_str = pending.get('fecha_confirmacion', '')
+            total_pendiente = pending.get('total_pendiente', 0)
             
-            # Acumular por año según commitment_date
-            if commitment_year == '2025':
-                por_facturar_2025_por_linea[linea_nombre] = por_facturar_2025_por_linea.get(linea_nombre, 0) + total_pendiente
-                total_por_facturar_2025 += total_pendiente
-            elif commitment_year == '2026':
-                por_facturar_2026_por_linea[linea_nombre] = por_facturar_2026_por_linea.get(linea_nombre, 0) + total_pendiente
-                total_por_facturar_2026 += total_pendiente
-            elif commitment_year == '2027':
-                por_facturar_2027_por_linea[linea_nombre] = por_facturar_2027_por_linea.get(linea_nombre, 0) + total_pendiente
-                total_por_facturar_2027 += total_pendiente
-            else:
-                # Lo que no tiene fecha o es de otro año
-                por_facturar_otros_por_linea[linea_nombre] = por_facturar_otros_por_linea.get(linea_nombre, 0) + total_pendiente
-                total_por_facturar_otros += total_pendiente
+            # Filtrar: solo pedidos en estados activos con fechas válidas
+            if order_state in estados_pedido_validos and commitment_date_str and fecha_confirmacion_str:
+                if cliente_nombre not in fechas_por_cliente:
+                    fechas_por_cliente[cliente_nombre] = {}
+                
+                # Consolidar por fecha única: si ya existe la fecha, sumar monto
+                fecha_key = commitment_date_str.split(' ')[0]  # Solo YYYY-MM-DD
+                if fecha_key not in fechas_por_cliente[cliente_nombre]:
+                    fechas_por_cliente[cliente_nombre][fecha_key] = {
+                        'commitment_date': commitment_date_str,
+                        'fecha_confirmacion': fecha_confirmacion_str,
+                        'monto_pendiente': 0
+                    }
+                fechas_por_cliente[cliente_nombre][fecha_key]['monto_pendiente'] += total_pendiente
+
+    # Unir todos los clientes que tienen datos facturados o pendientes
+    all_clients = set(facturado_por_cliente.keys()) | set(pendiente_por_cliente.keys())
+    
+    bullet_chart_data = []
+    for cliente in all_clients:
+        facturado = max(0, facturado_por_cliente.get(cliente, 0))
+        pendiente = max(0, pendiente_por_cliente.get(cliente, 0))
+        # Intentar obtener la meta total del cliente desde las metas por cliente (si existe)
+        cliente_id = cliente_id_map.get(cliente)
+        total_meta_cliente = 0
+        if cliente_id and metas_clientes_año:
+            metas_del_cliente = metas_clientes_año.get(str(cliente_id), {})
+            # metas_del_cliente puede contener 'cliente_nombre' como clave, excluirla
+            total_meta_cliente = sum(v for k, v in metas_del_cliente.items() if k != 'cliente_nombre')
+
+        # Si existe una meta definida para el cliente, usarla como "Total Cliente ($)",
+        # en caso contrario usar la suma facturado + pendiente (fallback)
+        total_cliente = total_meta_cliente if total_meta_cliente > 0 else (facturado + pendiente)
+
+        # Calcular tiempo esperado para Versión 2 del gráfico de bullet
+        # CAMBIO: Enviar TODAS las fechas ÚNICAS (consolidadas), no solo la más próxima
+        todas_fechas = []
+        commitment_date = None  # Para compatibilidad con código existente, guardar la más próxima
+        fecha_confirmacion = None
+        dias_transcurridos = None
+        dias_totales = None
+        tiempo_esperado_pct = None
+        
+        if cliente in fechas_por_cliente and len(fechas_por_cliente[cliente]) > 0:
+            from datetime import datetime
+            # Convertir dict de fechas a lista y ordenar por commitment_date (más próxima primero)
+            fechas_list = list(fechas_por_cliente[cliente].values())
+            fechas_ordenadas = sorted(fechas_list, key=lambda x: x['commitment_date'])
+            todas_fechas = fechas_ordenadas
             
-            todas_las_lineas.add(linea_nombre)
-        
-        # Log temporal para debug
-        logging.info(f"DEBUG: Total pedidos pendientes: {len(pending_data)}")
-        logging.info(f"DEBUG: Pedidos con commitment_date: {debug_count_with_date}")
-        logging.info(f"DEBUG: Pedidos 2025: {debug_count_2025}, 2026: {debug_count_2026}, 2027: {debug_count_2027}")
-        
-        # La línea que añadía "OTROS" ha sido eliminada. Ahora solo se mostrarán líneas con datos.
-        
-        # Generar datos para la tabla y el gráfico
-        datos_lineas = []
-        for nombre_linea in todas_las_lineas:
-            venta = ventas_por_linea.get(nombre_linea, 0)
-            datos_lineas.append({
-                'nombre': nombre_linea,
-                'venta': venta
+            # Para compatibilidad, calcular valores de la fecha más próxima
+            try:
+                commitment_date = fechas_ordenadas[0]['commitment_date']
+                fecha_confirmacion = fechas_ordenadas[0]['fecha_confirmacion']
+                
+                # Parsear fechas
+                fecha_entrega_obj = datetime.strptime(commitment_date.split(' ')[0], '%Y-%m-%d')
+                fecha_conf_obj = datetime.strptime(fecha_confirmacion.split(' ')[0], '%Y-%m-%d')
+                fecha_hoy = datetime.now()
+                
+                # Calcular días transcurridos desde confirmación hasta hoy
+                dias_transcurridos = (fecha_hoy - fecha_conf_obj).days
+                
+                # Calcular días totales desde confirmación hasta entrega
+                dias_totales = (fecha_entrega_obj - fecha_conf_obj).days
+                
+                # Calcular % de tiempo esperado (cuánto tiempo debería llevar facturado según el calendario)
+                if dias_totales > 0:
+                    tiempo_esperado_pct = round((dias_transcurridos / dias_totales) * 100, 1)
+                else:
+                    tiempo_esperado_pct = 100  # Si ya pasó la fecha o es el mismo día
+            except Exception as e:
+                # Si hay error en parsing, dejar valores None
+                pass
+
+        if total_cliente > 0:
+            bullet_chart_data.append({
+                'total_cliente_meta': total_cliente,
+                'cliente': cliente,
+                'facturado': facturado,
+                'pendiente': pendiente,
+                'cliente_id': cliente_id,
+                # Campos para Versión 2 (compatibilidad - fecha más próxima)
+                'commitment_date': commitment_date,
+                'fecha_confirmacion': fecha_confirmacion,
+                'dias_transcurridos': dias_transcurridos,
+                'dias_totales': dias_totales,
+                'tiempo_esperado_pct': tiempo_esperado_pct,
+                # NUEVO: Todas las fechas de entrega del cliente
+                'todas_fechas': todas_fechas,
+                'num_fechas': len(todas_fechas)
             })
-        
-        # Ordenar por venta descendente
-        datos_lineas = sorted(datos_lineas, key=lambda x: x['venta'], reverse=True)
-        
-        # Procesar datos por producto para gráfico (usando ventas internacionales del año)
-        ventas_por_producto = {}
-        producto_a_linea = {}  # Mapeo de producto a línea comercial
-        
-        for sale in sales_data_international:
-            # Usar el campo "name" directamente para el nombre del producto
-            nombre_producto = sale.get('name', 'Producto Sin Nombre')
-            linea_comercial = sale.get('linea_comercial', 'Sin Línea')
-            
-            # MODIFICACIÓN: Usar 'amount_currency' para consistencia con el cálculo de líneas comerciales.
-            # 'total' puede ser 0 si la factura está pagada, pero 'amount_currency' mantiene el valor de la línea.
-            venta_amount = sale.get('amount_currency', 0)
-            if venta_amount > 0:  # Solo procesar ventas con monto
-                ventas_por_producto[nombre_producto] = ventas_por_producto.get(nombre_producto, 0) + venta_amount
-                # Guardar la línea comercial del producto
-                if nombre_producto not in producto_a_linea:
-                    producto_a_linea[nombre_producto] = linea_comercial
-        
-        # Generar datos para el gráfico de productos (Top 7)
-        productos_ordenados = sorted(ventas_por_producto.items(), key=lambda x: x[1], reverse=True)[:7]
-        datos_productos = []
-        for nombre_producto, venta in productos_ordenados:
-            if venta > 0:
-                datos_productos.append({
-                    'nombre': nombre_producto,
-                    'venta': venta,
-                    'linea_comercial': producto_a_linea.get(nombre_producto, 'Sin Línea')
-                })
-        
-        # Crear diccionario completo de productos por línea comercial para interactividad
-        productos_por_linea = {}
-        for sale in sales_data_international:
-            linea = sale.get('linea_comercial', 'Sin Línea')
-            producto = sale.get('name', 'Producto Sin Nombre')
-            venta = sale.get('amount_currency', 0)
-            
-            if linea not in productos_por_linea:
-                productos_por_linea[linea] = {}
-            
-            if producto not in productos_por_linea[linea]:
-                productos_por_linea[linea][producto] = 0
-            productos_por_linea[linea][producto] += venta
-        
-        # Convertir a formato para JavaScript (Top 7 por cada línea)
-        productos_por_linea_top = {}
-        for linea, productos in productos_por_linea.items():
-            top_productos = sorted(productos.items(), key=lambda x: x[1], reverse=True)[:7]
-            productos_por_linea_top[linea] = [
-                {'nombre': nombre, 'venta': venta} for nombre, venta in top_productos if venta > 0
-            ]
-        
-        # Generar datos para el gráfico de productos PENDIENTES (Top 7)
-        # IMPORTANTE: Agrupar por código de producto, NO por nombre (cada código = presentación única)
-        pendientes_por_producto = {}
-        producto_pendiente_info = {}  # Guardar info completa por código
-        for pending in pending_data:
-            codigo_producto = pending.get('codigo_odoo', '') or pending.get('default_code', '') or 'S/C'
-            nombre_producto = pending.get('producto', 'Producto Sin Nombre')
-            descripcion = pending.get('descripcion', '')
-            total_pendiente = pending.get('total_pendiente', 0)
-            cantidad_pendiente = pending.get('cantidad_pendiente', 0)
-            linea_comercial = pending.get('linea_comercial', 'Sin Línea')
+    
+    # Obtener nombre del cliente seleccionado
+    nombre_cliente_seleccionado = None
+    if partner_id and filter_options.get('clientes'):
+        for cliente in filter_options['clientes']:
+            if cliente[0] == partner_id:
+                nombre_cliente_seleccionado = cliente[1]
+                break
+
+    # --- LÓGICA PARA AVANCE DEL CLIENTE SELECCIONADO (NUEVA TARJETA) ---
+    avance_cliente_seleccionado = None
+    if partner_id and bullet_chart_data and nombre_cliente_seleccionado:
+        # SOLUCIÓN DEFINITIVA: Si se filtra por un cliente, bullet_chart_data solo tendrá un elemento.
+        # No es necesario buscar por nombre, simplemente usamos el primer (y único) elemento.
+        # Esto evita problemas con nombres inconsistentes como "BREMER LANKA (PVT) LTD."
+        if len(bullet_chart_data) == 1:
+            data = bullet_chart_data[0]
+            total_cliente_meta_val = data.get('total_cliente_meta', 0)
+            facturado_val = data.get('facturado', 0)
+            pendiente_val = data.get('pendiente', 0)
+            avance_cliente_seleccionado = {
+                'nombre': data.get('cliente', nombre_cliente_seleccionado), # Usar el nombre de los datos, o el del filtro como fallback
+                'facturado': facturado_val,
+                'pendiente': pendiente_val,
+                'total_cliente_meta': total_cliente_meta_val,
+                'porcentaje': (facturado_val / total_cliente_meta_val * 100) if total_cliente_meta_val > 0 else 0
+            }
+    
+    # --- NUEVO: GRÁFICO DE AVANCE POR PRODUCTO (DOS VERSIONES) ---
+    products_chart_data_confirmacion = []  # Con fecha de confirmación (date_order) + 150 días
+    products_chart_data_entrega = []  # Con fecha de entrega (commitment_date) + días hasta entrega
+    if not partner_id:  # Solo mostrar cuando NO hay cliente seleccionado
+        # Primero, recopilar toda la información de productos
+        product_info = {}
+        facturado_by_product = {}
+        pendiente_by_product = {}
+        qty_facturada_by_product = {}
+        qty_pendiente_by_product = {}
+        fecha_entrega_by_product = {}  # commitment_date (fecha de entrega)
+        fecha_confirmacion_by_product = {}  # date_order (fecha de confirmación)
+        
+        # Procesar datos de ventas
+        for s in sales_data_raw:
+            codigo = s.get('codigo_odoo', '')
+            if not codigo:
+                continue
             
-            if codigo_producto not in pendientes_por_producto:
-                pendientes_por_producto[codigo_producto] = {'total': 0, 'cantidad': 0}
-                # Usar descripción si existe, sino usar nombre
-                nombre_display = descripcion if descripcion and descripcion.strip() else nombre_producto
-                producto_pendiente_info[codigo_producto] = {
-                    'nombre': nombre_display,
-                    'linea_comercial': linea_comercial
-                }
+            producto_nombre = s.get('producto', '')
+            descripcion = s.get('descripcion', '')
+            linea_comercial_obj = s.get('commercial_line_international_id')
+            linea_comercial = ''
             
-            pendientes_por_producto[codigo_producto]['total'] += total_pendiente
-            pendientes_por_producto[codigo_producto]['cantidad'] += cantidad_pendiente
-        
-        # Ordenar y tomar top 7 productos pendientes (por monto total)
-        productos_pendientes_ordenados = sorted(pendientes_por_producto.items(), key=lambda x: x[1]['total'], reverse=True)[:7]
-        datos_productos_pendientes = []
-        for codigo_producto, datos in productos_pendientes_ordenados:
-            if datos['total'] > 0:
-                info = producto_pendiente_info.get(codigo_producto, {'nombre': codigo_producto, 'linea_comercial': 'Sin Línea'})
-                datos_productos_pendientes.append({
-                    'codigo': codigo_producto,
-                    'nombre': info['nombre'],
-                    'total_pendiente': datos['total'],
-                    'cantidad_pendiente': datos['cantidad'],
-                    'linea_comercial': info['linea_comercial']
-                })
-        
-        # Crear diccionario completo de productos pendientes por línea comercial
-        productos_pendientes_por_linea = {}
-        cantidad_pendientes_por_linea = {}
-        for pending in pending_data:
-            linea = pending.get('linea_comercial', 'Sin Línea')
-            producto = pending.get('producto', 'Producto Sin Nombre')
-            total_pendiente = pending.get('total_pendiente', 0)
-            cantidad_pendiente = pending.get('cantidad_pendiente', 0)
+            # Obtener categoría
+            categ_obj = s.get('categ_id')
+            categoria = ''
+            if categ_obj and isinstance(categ_obj, list) and len(categ_obj) > 1:
+                categoria = categ_obj[1]
             
-            if linea not in productos_pendientes_por_linea:
-                productos_pendientes_por_linea[linea] = {}
-                cantidad_pendientes_por_linea[linea] = {}
+            if linea_comercial_obj and isinstance(linea_comercial_obj, list) and len(linea_comercial_obj) > 1:
+                linea_comercial = linea_comercial_obj[1]
             
-            if producto not in productos_pendientes_por_linea[linea]:
-                productos_pendientes_por_linea[linea][producto] = 0
-                cantidad_pendientes_por_linea[linea][producto] = 0
-            productos_pendientes_por_linea[linea][producto] += total_pendiente
-            cantidad_pendientes_por_linea[linea][producto] += cantidad_pendiente
-        
-        # Convertir a formato para JavaScript (Top 7 por cada línea)
-        productos_pendientes_por_linea_top = {}
-        for linea, productos in productos_pendientes_por_linea.items():
-            top_productos_pendientes = sorted(productos.items(), key=lambda x: x[1], reverse=True)[:7]
-            productos_pendientes_por_linea_top[linea] = [
-                {
-                    'nombre': nombre, 
-                    'total_pendiente': total,
-                    'cantidad_pendiente': cantidad_pendientes_por_linea[linea].get(nombre, 0)
-                } for nombre, total in top_productos_pendientes if total > 0
-            ]
-        
-        # Calcular KPIs adicionales
-        unique_clients = len(set(sale['cliente'] for sale in sales_data_international if sale.get('cliente')))
-        total_products = len(set(sale['producto'] for sale in sales_data_international if sale.get('producto')))
-        total_invoices = len(set(sale['factura'] for sale in sales_data_international if sale.get('factura')))
-        
-        # --- INTEGRACIÓN DE METAS POR CLIENTE ---
-        # 1. Cargar metas de clientes para el año seleccionado (no el año actual)
-        metas_clientes_historicas = supabase_manager.read_metas_por_cliente()
-        año_str = str(año_seleccionado)  # Usar año_seleccionado en lugar de datetime.now().year
-        metas_clientes_año = metas_clientes_historicas.get(año_str, {})
-
-        # 2. Calcular la meta total para el KPI principal (condicional al filtro de cliente)
-        meta_total_general = 0
-        if partner_id:
-            # Si hay un cliente seleccionado, la meta es solo la de ese cliente
-            metas_del_cliente = metas_clientes_año.get(str(partner_id), {})
-            meta_total_general = sum(v for k, v in metas_del_cliente.items() if k != 'cliente_nombre')
-        else:
-            # Si no hay cliente seleccionado, sumar las metas de todos
-            for cliente_id, metas_lineas in metas_clientes_año.items():
-                meta_total_general += sum(v for k, v in metas_lineas.items() if k != 'cliente_nombre')
-
-        # 3. Calcular Brecha Comercial con la meta real
-        # La venta proyectada también debe ajustarse al cliente seleccionado
-        if partner_id:
-            total_sales_year = sum(sale.get('amount_currency', 0) for sale in sales_data_international)
-            total_por_facturar = sum(pending.get('total_pendiente', 0) for pending in pending_data)
-        brecha_comercial = (total_sales_year + total_por_facturar) - meta_total_general
-
-        # --- LÓGICA PARA GRÁFICOS ADICIONALES (Ciclo de Vida, Forma Farmacéutica) ---
-        ventas_por_forma_farmaceutica = {}
-        
-        for sale in sales_data_international:
-            venta_amount = sale.get('amount_currency', 0)
+            # Acumular facturado y cantidad
+            facturado_by_product[codigo] = facturado_by_product.get(codigo, 0) + (s.get('amount_currency', 0) or 0)
+            qty_facturada_by_product[codigo] = qty_facturada_by_product.get(codigo, 0) + (s.get('quantity', 0) or 0)
             
-            # Agrupar por forma farmacéutica
-            forma_farma = sale.get('pharmaceutical_forms_id')
-            nombre_forma = forma_farma[1] if forma_farma and len(forma_farma) > 1 else 'Instrumental'
-            ventas_por_forma_farmaceutica[nombre_forma] = ventas_por_forma_farmaceutica.get(nombre_forma, 0) + venta_amount
-
-        datos_forma_farmaceutica = [{'forma': f, 'venta': v} for f, v in ventas_por_forma_farmaceutica.items()]
-        # --- LÓGICA PARA GRÁFICO DRILLDOWN JERÁRQUICO ---
-        drilldown_data = {}
-        drilldown_titles = {}
-        top_products_by_level = {}
-        pie_chart_data_by_level = {}
-
-        if sales_data_international:
-            df_sales = pd.DataFrame(sales_data_international)
+            # Guardar info solo si no existe (primera vez que vemos este código)
+            if codigo not in product_info:
+                # Usar descripcion si existe y tiene contenido, sino usar producto_nombre
+                nombre_completo = descripcion if descripcion and descripcion.strip() else producto_nombre
+                product_info[codigo] = {
+                    'nombre_completo': nombre_completo,
+                    'linea_comercial': linea_comercial,
+                    'categoria': categoria
+                }
+            # Actualizar linea comercial o categoria si están vacías y ahora tenemos una
+            elif linea_comercial and not product_info[codigo].get('linea_comercial'):
+                product_info[codigo]['linea_comercial'] = linea_comercial
+            elif categoria and not product_info[codigo].get('categoria'):
+                product_info[codigo]['categoria'] = categoria
+        
+        # Procesar datos pendientes
+        for p in pending_data:
+            codigo = p.get('codigo_odoo', '')
+            if not codigo:
+                continue
             
-            # Asegurarse de que la columna de venta exista y sea numérica
-            if 'amount_currency' in df_sales.columns:
-                df_sales['venta'] = pd.to_numeric(df_sales['amount_currency'], errors='coerce').fillna(0)
-
-                # Extraer nombres de campos relacionados
-                def extract_name(field):
-                    if isinstance(field, list) and len(field) > 1:
-                        return field[1]
-                    return 'No Definido'
-
-                df_sales['linea_comercial_nombre'] = df_sales['commercial_line_international_id'].apply(extract_name)
-                df_sales['clasificacion_farma_nombre'] = df_sales['pharmacological_classification_id'].apply(extract_name)
-                df_sales['producto_nombre'] = df_sales['name']
-                df_sales['forma_farma_nombre'] = df_sales['pharmaceutical_forms_id'].apply(extract_name)
-                df_sales['via_admin_nombre'] = df_sales['administration_way_id'].apply(extract_name)
-                df_sales['linea_prod_nombre'] = df_sales['production_line_id'].apply(extract_name)
-                
-                # Agregar código único de producto para agrupación
-                df_sales['producto_codigo'] = df_sales.apply(
-                    lambda x: x.get('default_code') or x.get('codigo_odoo') or 'S/C', 
-                    axis=1
-                )
-                
-                # Función para normalizar nombres de productos (simplificar para gráfico de pastel)
-                def normalizar_nombre_producto(nombre):
-                    if not nombre or nombre == 'No Definido':
-                        return nombre
-                    nombre_upper = str(nombre).upper()
-                    
-                    # Mapeo de nombres simplificados
-                    productos_simplificados = {
-                        'ATREVIA 360°': ['ATREVIA 360°', 'ATREVIA 360'],
-                        'ATREVIA 360° SPOT ON': ['ATREVIA 360° SPOT ON', 'ATREVIA 360 SPOT ON'],
-                        'ATREVIA ONE': ['ATREVIA ONE', 'ATREVIA ONE (N)'],
-                        'ATREVIA TRIO CATS': ['ATREVIA TRIO CATS'],
-                        'ATREVIA VERSA GEL': ['ATREVIA VERSA GEL'],
-                        'ATREVIA XR': ['ATREVIA XR', 'ATREVIA XR (N)'],
-                        'BIOCAN': ['BIOCAN'],
-                        'SURALAN': ['SURALAN'],
-                        'EARTHBORN': ['EARTHBORN'],
-                        'FORMULA NATURAL': ['FORMULA NATURAL'],
-                        'GO NATIVE': ['GO NATIVE'],
-                        'GO NATIVE ESSENTIALS': ['GO NATIVE ESSENTIALS'],
-                        'NUTRIBITES': ['NUTRIBITES']
-                    }
-                    
-                    # Buscar si el nombre contiene alguna de las palabras clave
-                    for nombre_simple, variantes in productos_simplificados.items():
-                        for variante in variantes:
-                            if variante in nombre_upper:
-                                return nombre_simple
-                    
-                    # Si no coincide con ninguno, devolver el nombre original
-                    return nombre
-                
-                df_sales['producto_nombre_display'] = df_sales['producto_nombre'].apply(normalizar_nombre_producto)
-                
-                # Filtrar registros con "No Definido" en clasificación farmacológica (nivel raíz)
-                df_sales = df_sales[df_sales['clasificacion_farma_nombre'] != 'No Definido']
-
-                # --- NUEVA JERARQUÍA ---
-                # Nivel 0 (Raíz): Clasificación Farmacológica
-                level0_data = df_sales.groupby('clasificacion_farma_nombre')['venta'].sum().reset_index()
-                level0_data = level0_data.sort_values('venta', ascending=False)  # Ordenar de mayor a menor
-                drilldown_data['root'] = [
-                    [row['clasificacion_farma_nombre'], row['venta'], 'root', f"level1_{row['clasificacion_farma_nombre']}"]
-                    for _, row in level0_data.iterrows()
-                ]
-                drilldown_titles['root'] = 'Ventas por Clasificación Farmacológica'
-                
-                # El gráfico de pastel en el nivel raíz muestra PRODUCTOS agrupados por nombre simplificado
-                # Filtrar productos "No Definido"
-                pie_data_root = df_sales[df_sales['producto_nombre_display'] != 'No Definido'].groupby('producto_nombre_display')['venta'].sum().reset_index()
-                pie_data_root = pie_data_root.sort_values('venta', ascending=False).head(20)  # Top 20 productos
-                pie_chart_data_by_level['root'] = [
-                    {'name': r['producto_nombre_display'], 'value': r['venta']} 
-                    for _, r in pie_data_root.iterrows()
-                ]
-
-                # Nivel 1: Formas Farmacéuticas
-                for clasif, group_clasif in df_sales.groupby('clasificacion_farma_nombre'):
-                    level1_id = f"level1_{clasif}"
-                    level1_data = group_clasif.groupby('forma_farma_nombre')['venta'].sum().reset_index()
-                    level1_data = level1_data.sort_values('venta', ascending=False)  # Ordenar de mayor a menor
-                    drilldown_data[level1_id] = [
-                        [row['forma_farma_nombre'], row['venta'], level1_id, f"level2_{clasif}_{row['forma_farma_nombre']}"]
-                        for _, row in level1_data.iterrows()
-                    ]
-                    drilldown_titles[level1_id] = f'Ventas de {clasif}'
-                    # Gráfico de pastel muestra PRODUCTOS del siguiente nivel (filtrar "No Definido")
-                    pie_data_level1 = group_clasif[group_clasif['producto_nombre_display'] != 'No Definido'].groupby('producto_nombre_display')['venta'].sum().reset_index()
-                    pie_data_level1 = pie_data_level1.sort_values('venta', ascending=False).head(20)  # Top 20
-                    pie_chart_data_by_level[level1_id] = [{'name': r['producto_nombre_display'], 'value': r['venta']} for _, r in pie_data_level1.iterrows() if r['venta'] > 0]
-
-                    # Nivel 2: Vía de Administración
-                    for forma, group_forma in group_clasif.groupby('forma_farma_nombre'):
-                        level2_id = f"level2_{clasif}_{forma}"
-                        level2_data = group_forma.groupby('via_admin_nombre')['venta'].sum().reset_index()
-                        level2_data = level2_data.sort_values('venta', ascending=False)  # Ordenar de mayor a menor
-                        drilldown_data[level2_id] = [
-                            [row['via_admin_nombre'], row['venta'], level2_id, f"level3_{clasif}_{forma}_{row['via_admin_nombre']}"]
-                            for _, row in level2_data.iterrows()
-                        ]
-                        drilldown_titles[level2_id] = f'Ventas de {forma}'
-                        # Gráfico de pastel muestra PRODUCTOS (filtrar "No Definido")
-                        pie_data_level2 = group_forma[group_forma['producto_nombre_display'] != 'No Definido'].groupby('producto_nombre_display')['venta'].sum().reset_index()
-                        pie_data_level2 = pie_data_level2.sort_values('venta', ascending=False).head(20)  # Top 20
-                        pie_chart_data_by_level[level2_id] = [{'name': r['producto_nombre_display'], 'value': r['venta']} for _, r in pie_data_level2.iterrows() if r['venta'] > 0]
-
-                        # Nivel 3: Línea de Producción
-                        for via, group_via in group_forma.groupby('via_admin_nombre'):
-                            level3_id = f"level3_{clasif}_{forma}_{via}"
-                            level3_data = group_via.groupby('linea_prod_nombre')['venta'].sum().reset_index()
-                            level3_data = level3_data.sort_values('venta', ascending=False)  # Ordenar de mayor a menor
-                            drilldown_data[level3_id] = [
-                                [row['linea_prod_nombre'], row['venta'], level3_id, f"level4_{clasif}_{forma}_{via}_{row['linea_prod_nombre']}"]
-                                for _, row in level3_data.iterrows()
-                            ]
-                            drilldown_titles[level3_id] = f'Ventas por Vía {via}'
-                            # Gráfico de pastel muestra PRODUCTOS (filtrar "No Definido")
-                            pie_data_level3 = group_via[group_via['producto_nombre_display'] != 'No Definido'].groupby('producto_nombre_display')['venta'].sum().reset_index()
-                            pie_data_level3 = pie_data_level3.sort_values('venta', ascending=False).head(20)  # Top 20
-                            pie_chart_data_by_level[level3_id] = [{'name': r['producto_nombre_display'], 'value': r['venta']} for _, r in pie_data_level3.iterrows() if r['venta'] > 0]
-                            
-                            # Nivel 4: Producto (último nivel)
-                            for linea_prod, group_linea_prod in group_via.groupby('linea_prod_nombre'):
-                                level4_id = f"level4_{clasif}_{forma}_{via}_{linea_prod}"
-                                level4_data = group_linea_prod.groupby('producto_nombre_display')['venta'].sum().reset_index()
-                                level4_data = level4_data.sort_values('venta', ascending=False)  # Ordenar de mayor a menor
-                                drilldown_data[level4_id] = [
-                                    [row['producto_nombre_display'], row['venta'], level4_id, None] # No hay childGroupId
-                                    for _, row in level4_data.iterrows()
-                                ]
-                                drilldown_titles[level4_id] = f'Ventas de {linea_prod}'
-                                # Gráfico de pastel muestra PRODUCTOS (filtrar "No Definido")
-                                pie_data_level4 = level4_data[level4_data['producto_nombre_display'] != 'No Definido']
-                                pie_chart_data_by_level[level4_id] = [{'name': r['producto_nombre_display'], 'value': r['venta']} for _, r in pie_data_level4.iterrows() if r['venta'] > 0]
-
-        # Convertir todos los datos de gráficos a JSON
-        all_stacked_chart_data = json.dumps(
-            data_manager.get_commercial_lines_stacked_data(date_from=date_from, date_to=date_to, partner_id=partner_id)
-        )
-
-        # Para la tabla (agregar datos adicionales si es necesario)
-        datos_lineas_tabla = datos_lineas.copy()
-        for linea in datos_lineas_tabla:
-            # --- INTEGRACIÓN DE METAS POR LÍNEA ---
-            # Sumar las metas de todos los clientes para esta línea comercial específica
-            # Convertir el nombre de la línea (ej. "AGROVET") a su ID (ej. "agrovet")
-            linea_id_actual = linea.get('nombre', '').lower().replace(' ', '_')
+            producto_nombre = p.get('producto', '')
+            descripcion = p.get('descripcion', '')
+            linea_comercial = p.get('linea_comercial', '')
             
-            if partner_id:
-                # Si hay cliente, la meta de la línea es solo la de ese cliente
-                meta_linea = metas_clientes_año.get(str(partner_id), {}).get(linea_id_actual, 0)
-            else:
-                # Si no hay cliente, sumar las metas de todos para esa línea
-                meta_linea = sum(metas_cliente.get(linea_id_actual, 0) for metas_cliente in metas_clientes_año.values())
-
-            venta_total_linea = linea.get('venta', 0)
-            por_facturar_linea = por_facturar_otros_por_linea.get(linea['nombre'], 0)  # Solo "otros" años
-            por_facturar_2025_linea = por_facturar_2025_por_linea.get(linea['nombre'], 0)
-            por_facturar_2026_linea = por_facturar_2026_por_linea.get(linea['nombre'], 0)
-            por_facturar_2027_linea = por_facturar_2027_por_linea.get(linea['nombre'], 0)
+            # Obtener categoría
+            categ_obj = p.get('categ_id')
+            categoria = ''
+            if categ_obj and isinstance(categ_obj, list) and len(categ_obj) > 1:
+                categoria = categ_obj[1]
             
-            # Calcular brecha y avance (usando el total real de por facturar)
-            total_por_facturar_linea_real = por_facturar_por_linea.get(linea['nombre'], 0)
-            venta_proyectada = venta_total_linea + total_por_facturar_linea_real
-            brecha = venta_proyectada - meta_linea # Brecha contra la meta real
-            porcentaje_avance_meta = (venta_proyectada / meta_linea * 100) if meta_linea > 0 else 0
-
-            linea.update({
-                'por_facturar': por_facturar_linea,  # Solo "otros" años
-                'por_facturar_2025': por_facturar_2025_linea,
-                'por_facturar_2026': por_facturar_2026_linea,
-                'por_facturar_2027': por_facturar_2027_linea,
-                'porcentaje_sobre_total': (venta_total_linea / total_sales_year * 100) if total_sales_year > 0 else 0,
-                'meta': meta_linea,
-                'brecha': brecha,
-                'porcentaje_avance_meta': porcentaje_avance_meta
-            })
-        
-        venta_proyectada_total = total_sales_year + total_por_facturar
-        porcentaje_avance_total = (venta_proyectada_total / meta_total_general * 100) if meta_total_general > 0 else 0
-
-        kpis = {
-            # KPIs que el template espera (usando total_sales_year para consistencia con la tabla)
-            'meta_total': meta_total_general,
-            'venta_total': total_sales_year,  # Usar el total del año que coincide con la suma de líneas comerciales
-            'total_por_facturar': total_por_facturar_otros,  # Solo "otros" años
-            'total_por_facturar_2025': total_por_facturar_2025,
-            'total_por_facturar_2026': total_por_facturar_2026,
-            'total_por_facturar_2027': total_por_facturar_2027,
-            'porcentaje_avance': (total_sales_year / meta_total_general * 100) if meta_total_general > 0 else 0, # Avance sobre facturado
-            'total_brecha': brecha_comercial
-        }
-        
-        # --- LÓGICA PARA GRÁFICO DE AVANCE POR CLIENTE ---
-        # Ahora se basa en Venta Facturada vs Meta Anual
-        facturado_por_cliente = {}
-        cliente_id_map = {} # Mapa de nombre de cliente a su ID
-        for sale in sales_data_international:
-            cliente_nombre = sale.get('cliente')
-            partner = sale.get('partner_id')
-            cliente_id = None
-            if partner and isinstance(partner, list) and len(partner) > 0:
-                cliente_id = str(partner[0])
+            # Acumular pendiente y cantidad
+            pendiente_by_product[codigo] = pendiente_by_product.get(codigo, 0) + (p.get('total_pendiente', 0) or 0)
+            qty_pendiente_by_product[codigo] = qty_pendiente_by_product.get(codigo, 0) + (p.get('cantidad_pendiente', 0) or 0)
             
-            if cliente_nombre and cliente_id:
-                cliente_id_map[cliente_nombre] = cliente_id
-
-            if cliente_nombre:
-                facturado_por_cliente[cliente_nombre] = facturado_por_cliente.get(cliente_nombre, 0) + sale.get('amount_currency', 0)
-
-        pendiente_por_cliente = {}
-        # CAMBIO: Almacenar TODAS las fechas de entrega por cliente, CONSOLIDADAS por fecha única
-        # Estructura: { 'cliente': [ {'commitment_date': ..., 'fecha_confirmacion': ..., 'monto': ...}, ... ] }
-        fechas_por_cliente = {}
-        
-        # Estados válidos para cálculo de tiempo esperado (gráfico V2)
-        estados_pedido_validos = ['sale', 'credit', 'done']  # Ordenes de venta, En créditos, En logística
-        
-        for pending in pending_data:
-            cliente_nombre = pending.get('cliente')
-            if cliente_nombre:
-                # Mapear cliente_id también desde pending_data (para clientes sin facturado)
-                partner = pending.get('partner_id')
-                if partner and isinstance(partner, list) and len(partner) > 0:
-                    cliente_id = str(partner[0])
-                    if cliente_nombre not in cliente_id_map:
-                        cliente_id_map[cliente_nombre] = cliente_id
-                
-                pendiente_por_cliente[cliente_nombre] = pendiente_por_cliente.get(cliente_nombre, 0) + pending.get('total_pendiente', 0)
-                
-                # Extraer fechas SOLO si el pedido está en estado válido (no cotización, no cancelado)
-                order_state = pending.get('order_state', '')
-                commitment_date_str = pending.get('commitment_date', '')
-                fecha_confirmacion_str = pending.get('fecha_confirmacion', '')
-                total_pendiente = pending.get('total_pendiente', 0)
-                
-                # Filtrar: solo pedidos en estados activos con fechas válidas
-                if order_state in estados_pedido_validos and commitment_date_str and fecha_confirmacion_str:
-                    if cliente_nombre not in fechas_por_cliente:
-                        fechas_por_cliente[cliente_nombre] = {}
-                    
-                    # Consolidar por fecha única: si ya existe la fecha, sumar monto
-                    fecha_key = commitment_date_str.split(' ')[0]  # Solo YYYY-MM-DD
-                    if fecha_key not in fechas_por_cliente[cliente_nombre]:
-                        fechas_por_cliente[cliente_nombre][fecha_key] = {
-                            'commitment_date': commitment_date_str,
-                            'fecha_confirmacion': fecha_confirmacion_str,
-                            'monto_pendiente': 0
-                        }
-                    fechas_por_cliente[cliente_nombre][fecha_key]['monto_pendiente'] += total_pendiente
-
-        # Unir todos los clientes que tienen datos facturados o pendientes
-        all_clients = set(facturado_por_cliente.keys()) | set(pendiente_por_cliente.keys())
-        
-        bullet_chart_data = []
-        for cliente in all_clients:
-            facturado = max(0, facturado_por_cliente.get(cliente, 0))
-            pendiente = max(0, pendiente_por_cliente.get(cliente, 0))
-            # Intentar obtener la meta total del cliente desde las metas por cliente (si existe)
-            cliente_id = cliente_id_map.get(cliente)
-            total_meta_cliente = 0
-            if cliente_id and metas_clientes_año:
-                metas_del_cliente = metas_clientes_año.get(str(cliente_id), {})
-                # metas_del_cliente puede contener 'cliente_nombre' como clave, excluirla
-                total_meta_cliente = sum(v for k, v in metas_del_cliente.items() if k != 'cliente_nombre')
-
-            # Si existe una meta definida para el cliente, usarla como "Total Cliente ($)",
-            # en caso contrario usar la suma facturado + pendiente (fallback)
-            total_cliente = total_meta_cliente if total_meta_cliente > 0 else (facturado + pendiente)
-
-            # Calcular tiempo esperado para Versión 2 del gráfico de bullet
-            # CAMBIO: Enviar TODAS las fechas ÚNICAS (consolidadas), no solo la más próxima
-            todas_fechas = []
-            commitment_date = None  # Para compatibilidad con código existente, guardar la más próxima
-            fecha_confirmacion = None
-            dias_transcurridos = None
-            dias_totales = None
-            tiempo_esperado_pct = None
+            # Guardar AMBAS fechas: entrega (commitment_date) y confirmación (date_order)
+            # Fecha de ENTREGA (commitment_date) - más antigua
+            fecha_entrega_str = p.get('fecha', '')  # commitment_date
+            if fecha_entrega_str:
+                try:
+                    fecha_entrega = datetime.strptime(fecha_entrega_str, '%Y-%m-%d')
+                    if codigo not in fecha_entrega_by_product:
+                        fecha_entrega_by_product[codigo] = fecha_entrega
+                    else:
+                        if fecha_entrega < fecha_entrega_by_product[codigo]:
+                            fecha_entrega_by_product[codigo] = fecha_entrega
+                except ValueError:
+                    pass
             
-            if cliente in fechas_por_cliente and len(fechas_por_cliente[cliente]) > 0:
-                from datetime import datetime
-                # Convertir dict de fechas a lista y ordenar por commitment_date (más próxima primero)
-                fechas_list = list(fechas_por_cliente[cliente].values())
-                fechas_ordenadas = sorted(fechas_list, key=lambda x: x['commitment_date'])
-                todas_fechas = fechas_ordenadas
-                
-                # Para compatibilidad, calcular valores de la fecha más próxima
+            # Fecha de CONFIRMACIÓN (date_order) - más antigua
+            fecha_confirmacion_str = p.get('fecha_confirmacion', '')  # date_order
+            if fecha_confirmacion_str:
                 try:
-                    commitment_date = fechas_ordenadas[0]['commitment_date']
-                    fecha_confirmacion = fechas_ordenadas[0]['fecha_confirmacion']
-                    
-                    # Parsear fechas
-                    fecha_entrega_obj = datetime.strptime(commitment_date.split(' ')[0], '%Y-%m-%d')
-                    fecha_conf_obj = datetime.strptime(fecha_confirmacion.split(' ')[0], '%Y-%m-%d')
-                    fecha_hoy = datetime.now()
-                    
-                    # Calcular días transcurridos desde confirmación hasta hoy
-                    dias_transcurridos = (fecha_hoy - fecha_conf_obj).days
-                    
-                    # Calcular días totales desde confirmación hasta entrega
-                    dias_totales = (fecha_entrega_obj - fecha_conf_obj).days
-                    
-                    # Calcular % de tiempo esperado (cuánto tiempo debería llevar facturado según el calendario)
-                    if dias_totales > 0:
-                        tiempo_esperado_pct = round((dias_transcurridos / dias_totales) * 100, 1)
+                    fecha_confirmacion = datetime.strptime(fecha_confirmacion_str, '%Y-%m-%d')
+                    if codigo not in fecha_confirmacion_by_product:
+                        fecha_confirmacion_by_product[codigo] = fecha_confirmacion
                     else:
-                        tiempo_esperado_pct = 100  # Si ya pasó la fecha o es el mismo día
-                except Exception as e:
-                    # Si hay error en parsing, dejar valores None
+                        if fecha_confirmacion < fecha_confirmacion_by_product[codigo]:
+                            fecha_confirmacion_by_product[codigo] = fecha_confirmacion
+                except ValueError:
                     pass
-
-            if total_cliente > 0:
-                bullet_chart_data.append({
-                    'total_cliente_meta': total_cliente,
-                    'cliente': cliente,
-                    'facturado': facturado,
-                    'pendiente': pendiente,
-                    'cliente_id': cliente_id,
-                    # Campos para Versión 2 (compatibilidad - fecha más próxima)
-                    'commitment_date': commitment_date,
-                    'fecha_confirmacion': fecha_confirmacion,
-                    'dias_transcurridos': dias_transcurridos,
-                    'dias_totales': dias_totales,
-                    'tiempo_esperado_pct': tiempo_esperado_pct,
-                    # NUEVO: Todas las fechas de entrega del cliente
-                    'todas_fechas': todas_fechas,
-                    'num_fechas': len(todas_fechas)
-                })
-        
-        # Variables para el template
-        fecha_actual = datetime.now()
-        mes_nombre = fecha_actual.strftime('%B %Y').title()  # Ejemplo: "October 2025"
-        dia_actual = fecha_actual.day
-        
-        # Obtener nombre del cliente seleccionado
-        nombre_cliente_seleccionado = None
-        if partner_id and filter_options.get('clientes'):
-            for cliente in filter_options['clientes']:
-                if cliente[0] == partner_id:
-                    nombre_cliente_seleccionado = cliente[1]
-                    break
-
-        # --- LÓGICA PARA AVANCE DEL CLIENTE SELECCIONADO (NUEVA TARJETA) ---
-        avance_cliente_seleccionado = None
-        if partner_id and bullet_chart_data and nombre_cliente_seleccionado:
-            # SOLUCIÓN DEFINITIVA: Si se filtra por un cliente, bullet_chart_data solo tendrá un elemento.
-            # No es necesario buscar por nombre, simplemente usamos el primer (y único) elemento.
-            # Esto evita problemas con nombres inconsistentes como "BREMER LANKA (PVT) LTD."
-            if len(bullet_chart_data) == 1:
-                data = bullet_chart_data[0]
-                total_cliente_meta_val = data.get('total_cliente_meta', 0)
-                facturado_val = data.get('facturado', 0)
-                pendiente_val = data.get('pendiente', 0)
-                avance_cliente_seleccionado = {
-                    'nombre': data.get('cliente', nombre_cliente_seleccionado), # Usar el nombre de los datos, o el del filtro como fallback
-                    'facturado': facturado_val,
-                    'pendiente': pendiente_val,
-                    'total_cliente_meta': total_cliente_meta_val,
-                    'porcentaje': (facturado_val / total_cliente_meta_val * 100) if total_cliente_meta_val > 0 else 0
+            
+            # Guardar info solo si no existe
+            if codigo not in product_info:
+                # Usar descripcion si existe y tiene contenido, sino usar producto_nombre
+                nombre_completo = descripcion if descripcion and descripcion.strip() else producto_nombre
+                product_info[codigo] = {
+                    'nombre_completo': nombre_completo,
+                    'linea_comercial': linea_comercial,
+                    'categoria': categoria
                 }
-        
-        # --- NUEVO: GRÁFICO DE AVANCE POR PRODUCTO (DOS VERSIONES) ---
-        products_chart_data_confirmacion = []  # Con fecha de confirmación (date_order) + 150 días
-        products_chart_data_entrega = []  # Con fecha de entrega (commitment_date) + días hasta entrega
-        if not partner_id:  # Solo mostrar cuando NO hay cliente seleccionado
-            # Primero, recopilar toda la información de productos
-            product_info = {}
-            facturado_by_product = {}
-            pendiente_by_product = {}
-            qty_facturada_by_product = {}
-            qty_pendiente_by_product = {}
-            fecha_entrega_by_product = {}  # commitment_date (fecha de entrega)
-            fecha_confirmacion_by_product = {}  # date_order (fecha de confirmación)
+            # Actualizar linea comercial o categoria si están vacías y ahora tenemos una
+            elif linea_comercial and not product_info[codigo].get('linea_comercial'):
+                product_info[codigo]['linea_comercial'] = linea_comercial
+            elif categoria and not product_info[codigo].get('categoria'):
+                product_info[codigo]['categoria'] = categoria
+        
+        # Combinar y crear chart data (una entrada por código único)
+        all_product_codes = set(facturado_by_product.keys()) | set(pendiente_by_product.keys())
+        
+        for codigo in all_product_codes:
+            facturado = facturado_by_product.get(codigo, 0)
+            pendiente = pendiente_by_product.get(codigo, 0)
+            total = facturado + pendiente
             
-            # Procesar datos de ventas
-            for s in sales_data_raw:
-                codigo = s.get('codigo_odoo', '')
-                if not codigo:
-                    continue
-                
-                producto_nombre = s.get('producto', '')
-                descripcion = s.get('descripcion', '')
-                linea_comercial_obj = s.get('commercial_line_international_id')
-                linea_comercial = ''
-                
-                # Obtener categoría
-                categ_obj = s.get('categ_id')
-                categoria = ''
-                if categ_obj and isinstance(categ_obj, list) and len(categ_obj) > 1:
-                    categoria = categ_obj[1]
-                
-                if linea_comercial_obj and isinstance(linea_comercial_obj, list) and len(linea_comercial_obj) > 1:
-                    linea_comercial = linea_comercial_obj[1]
-                
-                # Acumular facturado y cantidad
-                facturado_by_product[codigo] = facturado_by_product.get(codigo, 0) + (s.get('amount_currency', 0) or 0)
-                qty_facturada_by_product[codigo] = qty_facturada_by_product.get(codigo, 0) + (s.get('quantity', 0) or 0)
-                
-                # Guardar info solo si no existe (primera vez que vemos este código)
-                if codigo not in product_info:
-                    # Usar descripcion si existe y tiene contenido, sino usar producto_nombre
-                    nombre_completo = descripcion if descripcion and descripcion.strip() else producto_nombre
-                    product_info[codigo] = {
-                        'nombre_completo': nombre_completo,
-                        'linea_comercial': linea_comercial,
-                        'categoria': categoria
-                    }
-                # Actualizar linea comercial o categoria si están vacías y ahora tenemos una
-                elif linea_comercial and not product_info[codigo].get('linea_comercial'):
-                    product_info[codigo]['linea_comercial'] = linea_comercial
-                elif categoria and not product_info[codigo].get('categoria'):
-                    product_info[codigo]['categoria'] = categoria
+            qty_facturada = qty_facturada_by_product.get(codigo, 0)
+            qty_pendiente = qty_pendiente_by_product.get(codigo, 0)
+            qty_total = qty_facturada + qty_pendiente
             
-            # Procesar datos pendientes
-            for p in pending_data:
-                codigo = p.get('codigo_odoo', '')
-                if not codigo:
-                    continue
+            if total > 0:
+                info = product_info.get(codigo, {'nombre_completo': '', 'linea_comercial': '', 'categoria': ''})
                 
-                producto_nombre = p.get('producto', '')
-                descripcion = p.get('descripcion', '')
-                linea_comercial = p.get('linea_comercial', '')
+                # Limpiar nombre_completo para evitar que el código aparezca duplicado
+                nombre_limpio = info['nombre_completo']
+                # Remover el código si aparece al inicio entre corchetes
+                if nombre_limpio.startswith(f'[{codigo}]'):
+                    nombre_limpio = nombre_limpio[len(f'[{codigo}]'):].strip()
+                # También remover si aparece sin corchetes al inicio
+                if nombre_limpio.startswith(codigo):
+                    nombre_limpio = nombre_limpio[len(codigo):].strip()
                 
-                # Obtener categoría
-                categ_obj = p.get('categ_id')
-                categoria = ''
-                if categ_obj and isinstance(categ_obj, list) and len(categ_obj) > 1:
-                    categoria = categ_obj[1]
+                # Crear display name sin duplicar el código
+                producto_display = nombre_limpio if nombre_limpio else codigo
                 
-                # Acumular pendiente y cantidad
-                pendiente_by_product[codigo] = pendiente_by_product.get(codigo, 0) + (p.get('total_pendiente', 0) or 0)
-                qty_pendiente_by_product[codigo] = qty_pendiente_by_product.get(codigo, 0) + (p.get('cantidad_pendiente', 0) or 0)
+                # ==== VERSIÓN 1: Fecha de CONFIRMACIÓN (date_order) + 150 días ====
+                fecha_conf = fecha_confirmacion_by_product.get(codigo)
+                dias_transcurridos_conf = None
+                dias_restantes_conf = None
+                fecha_conf_str = None
                 
-                # Guardar AMBAS fechas: entrega (commitment_date) y confirmación (date_order)
-                # Fecha de ENTREGA (commitment_date) - más antigua
-                fecha_entrega_str = p.get('fecha', '')  # commitment_date
-                if fecha_entrega_str:
+                if fecha_conf:
                     try:
-                        fecha_entrega = datetime.strptime(fecha_entrega_str, '%Y-%m-%d')
-                        if codigo not in fecha_entrega_by_product:
-                            fecha_entrega_by_product[codigo] = fecha_entrega
+                        fecha_actual = datetime.now()
+                        if fecha_conf > fecha_actual:
+                            dias_transcurridos_conf = 0
+                            dias_restantes_conf = 150
                         else:
-                            if fecha_entrega < fecha_entrega_by_product[codigo]:
-                                fecha_entrega_by_product[codigo] = fecha_entrega
-                    except ValueError:
-                        pass
+                            delta = fecha_actual - fecha_conf
+                            dias_transcurridos_conf = delta.days
+                            dias_restantes_conf = 150 - dias_transcurridos_conf
+                        fecha_conf_str = fecha_conf.strftime('%Y-%m-%d')
+                    except Exception as e:
+                        logging.warning(f"Error calculando días (confirmación) para producto {codigo}: {e}")
                 
-                # Fecha de CONFIRMACIÓN (date_order) - más antigua
-                fecha_confirmacion_str = p.get('fecha_confirmacion', '')  # date_order
-                if fecha_confirmacion_str:
-                    try:
-                        fecha_confirmacion = datetime.strptime(fecha_confirmacion_str, '%Y-%m-%d')
-                        if codigo not in fecha_confirmacion_by_product:
-                            fecha_confirmacion_by_product[codigo] = fecha_confirmacion
-                        else:
-                            if fecha_confirmacion < fecha_confirmacion_by_product[codigo]:
-                                fecha_confirmacion_by_product[codigo] = fecha_confirmacion
-                    except ValueError:
-                        pass
-                
-                # Guardar info solo si no existe
-                if codigo not in product_info:
-                    # Usar descripcion si existe y tiene contenido, sino usar producto_nombre
-                    nombre_completo = descripcion if descripcion and descripcion.strip() else producto_nombre
-                    product_info[codigo] = {
-                        'nombre_completo': nombre_completo,
-                        'linea_comercial': linea_comercial,
-                        'categoria': categoria
-                    }
-                # Actualizar linea comercial o categoria si están vacías y ahora tenemos una
-                elif linea_comercial and not product_info[codigo].get('linea_comercial'):
-                    product_info[codigo]['linea_comercial'] = linea_comercial
-                elif categoria and not product_info[codigo].get('categoria'):
-                    product_info[codigo]['categoria'] = categoria
-            
-            # Combinar y crear chart data (una entrada por código único)
-            all_product_codes = set(facturado_by_product.keys()) | set(pendiente_by_product.keys())
-            
-            for codigo in all_product_codes:
-                facturado = facturado_by_product.get(codigo, 0)
-                pendiente = pendiente_by_product.get(codigo, 0)
-                total = facturado + pendiente
-                
-                qty_facturada = qty_facturada_by_product.get(codigo, 0)
-                qty_pendiente = qty_pendiente_by_product.get(codigo, 0)
-                qty_total = qty_facturada + qty_pendiente
+                products_chart_data_confirmacion.append({
+                    'codigo': codigo,
+                    'producto': producto_display,
+                    'facturado': facturado,
+                    'pendiente': pendiente,
+                    'total': total,
+                    'porcentaje': (facturado / total * 100) if total > 0 else 0,
+                    'qty_facturada': qty_facturada,
+                    'qty_pendiente': qty_pendiente,
+                    'qty_total': qty_total,
+                    'linea_comercial': info.get('linea_comercial', 'Sin Línea'),
+                    'categoria': info.get('categoria', 'Sin Categoría'),
+                    'fecha_pedido': fecha_conf_str,
+                    'dias_transcurridos': dias_transcurridos_conf,
+                    'dias_restantes': dias_restantes_conf
+                })
                 
-                if total > 0:
-                    info = product_info.get(codigo, {'nombre_completo': '', 'linea_comercial': '', 'categoria': ''})
-                    
-                    # Limpiar nombre_completo para evitar que el código aparezca duplicado
-                    nombre_limpio = info['nombre_completo']
-                    # Remover el código si aparece al inicio entre corchetes
-                    if nombre_limpio.startswith(f'[{codigo}]'):
-                        nombre_limpio = nombre_limpio[len(f'[{codigo}]'):].strip()
-                    # También remover si aparece sin corchetes al inicio
-                    if nombre_limpio.startswith(codigo):
-                        nombre_limpio = nombre_limpio[len(codigo):].strip()
-                    
-                    # Crear display name sin duplicar el código
-                    producto_display = nombre_limpio if nombre_limpio else codigo
-                    
-                    # ==== VERSIÓN 1: Fecha de CONFIRMACIÓN (date_order) + 150 días ====
-                    fecha_conf = fecha_confirmacion_by_product.get(codigo)
-                    dias_transcurridos_conf = None
-                    dias_restantes_conf = None
-                    fecha_conf_str = None
-                    
-                    if fecha_conf:
-                        try:
-                            fecha_actual = datetime.now()
-                            if fecha_conf > fecha_actual:
-                                dias_transcurridos_conf = 0
-                                dias_restantes_conf = 150
-                            else:
-                                delta = fecha_actual - fecha_conf
-                                dias_transcurridos_conf = delta.days
-                                dias_restantes_conf = 150 - dias_transcurridos_conf
-                            fecha_conf_str = fecha_conf.strftime('%Y-%m-%d')
-                        except Exception as e:
-                            logging.warning(f"Error calculando días (confirmación) para producto {codigo}: {e}")
-                    
-                    products_chart_data_confirmacion.append({
-                        'codigo': codigo,
-                        'producto': producto_display,
-                        'facturado': facturado,
-                        'pendiente': pendiente,
-                        'total': total,
-                        'porcentaje': (facturado / total * 100) if total > 0 else 0,
-                        'qty_facturada': qty_facturada,
-                        'qty_pendiente': qty_pendiente,
-                        'qty_total': qty_total,
-                        'linea_comercial': info.get('linea_comercial', 'Sin Línea'),
-                        'categoria': info.get('categoria', 'Sin Categoría'),
-                        'fecha_pedido': fecha_conf_str,
-                        'dias_transcurridos': dias_transcurridos_conf,
-                        'dias_restantes': dias_restantes_conf
-                    })
-                    
-                    # ==== VERSIÓN 2: Fecha de ENTREGA (commitment_date) + días hasta entrega ====
-                    fecha_ent = fecha_entrega_by_product.get(codigo)
-                    dias_para_entrega = None
-                    fecha_ent_str = None
-                    
-                    if fecha_ent:
-                        try:
-                            fecha_actual = datetime.now()
-                            delta = fecha_ent - fecha_actual
-                            dias_para_entrega = delta.days
-                            fecha_ent_str = fecha_ent.strftime('%Y-%m-%d')
-                        except Exception as e:
-                            logging.warning(f"Error calculando días (entrega) para producto {codigo}: {e}")
-                    
-                    products_chart_data_entrega.append({
-                        'codigo': codigo,
-                        'producto': producto_display,
-                        'facturado': facturado,
-                        'pendiente': pendiente,
-                        'total': total,
-                        'porcentaje': (facturado / total * 100) if total > 0 else 0,
-                        'qty_facturada': qty_facturada,
-                        'qty_pendiente': qty_pendiente,
-                        'qty_total': qty_total,
-                        'linea_comercial': info.get('linea_comercial', 'Sin Línea'),
-                        'categoria': info.get('categoria', 'Sin Categoría'),
-                        'fecha_entrega': fecha_ent_str,
-                        'dias_para_entrega': dias_para_entrega
-                    })
-            
-            # Debug: verificar duplicados en ambas versiones
-            for nombre_version, dataset in [('Confirmación', products_chart_data_confirmacion), ('Entrega', products_chart_data_entrega)]:
-                codigos_vistos = set()
-                duplicados = []
-                for item in dataset:
-                    if item['codigo'] in codigos_vistos:
-                        duplicados.append(item['codigo'])
-                    codigos_vistos.add(item['codigo'])
+                # ==== VERSIÓN 2: Fecha de ENTREGA (commitment_date) + días hasta entrega ====
+                fecha_ent = fecha_entrega_by_product.get(codigo)
+                dias_para_entrega = None
+                fecha_ent_str = None
                 
-                if duplicados:
-                    logging.warning(f"DEBUG [{nombre_version}]: Productos duplicados encontrados: {duplicados[:5]}")
+                if fecha_ent:
+                    try:
+                        fecha_actual = datetime.now()
+                        delta = fecha_ent - fecha_actual
+                        dias_para_entrega = delta.days
+                        fecha_ent_str = fecha_ent.strftime('%Y-%m-%d')
+                    except Exception as e:
+                        logging.warning(f"Error calculando días (entrega) para producto {codigo}: {e}")
                 
-                logging.info(f"DEBUG [{nombre_version}]: Total productos únicos: {len(dataset)}")
-            
-            # Ordenar ambos arrays por total descendente
-            products_chart_data_confirmacion = sorted(products_chart_data_confirmacion, key=lambda x: x['total'], reverse=True)
-            products_chart_data_entrega = sorted(products_chart_data_entrega, key=lambda x: x['total'], reverse=True)
-        
-        # --- MAPA MUNDIAL: VENTAS POR PAÍS Y REGIÓN ---
-        
-        # Mapeo de nombres de países de Odoo a nombres del mapa ECharts
-        mapeo_nombres_paises = {
-            'Emiratos Árabes Unidos': 'United Arab Emirates',
-            'Reino Unido': 'United Kingdom',
-            'Corea del Sur': 'Korea',
-            'República Dominicana': 'Dominican Rep.',
-            'Surinam': 'Suriname',
-            'Argelia': 'Algeria',
-            'Bahréin': 'Bahrain',
-            'Etiopía': 'Ethiopia',
-            'México': 'Mexico',
-            'Panamá': 'Panama',
-            'Yibuti': 'Djibouti'
-        }
-        
-        # Mapeo de países a regiones (usando nombres DESPUÉS del mapeo - inglés/ECharts)
-        regiones_paises = {
-            'Sudamérica': ['Argentina', 'Bolivia', 'Brasil', 'Chile', 'Colombia', 'Ecuador', 'Guyana', 'Paraguay', 'Perú', 'Suriname', 'Uruguay', 'Venezuela'],
-            'Centroamérica': ['Belice', 'Costa Rica', 'El Salvador', 'Guatemala', 'Honduras', 'Nicaragua', 'Panama'],
-            'Norteamérica': ['Canadá', 'Estados Unidos', 'Mexico'],
-            'Caribe': ['Antigua y Barbuda', 'Bahamas', 'Barbados', 'Cuba', 'Dominica', 'Granada', 'Haití', 'Jamaica', 'Dominican Rep.', 'San Cristóbal y Nieves', 'Santa Lucía', 'San Vicente y las Granadinas', 'Trinidad y Tobago'],
-            'Europa': ['Alemania', 'España', 'Francia', 'Italia', 'Portugal', 'United Kingdom', 'Ucrania', 'Albania'],
-            'Asia': ['China', 'India', 'Japón', 'Korea', 'Vietnam', 'Indonesia', 'Sri Lanka', 'Bahrain', 'United Arab Emirates', 'Jordania', 'Kuwait', 'Qatar'],
-            'África': ['Algeria', 'Ethiopia', 'Djibouti'],
-            'Otros': []
-        }
-        
-        # Mapeo inverso: país -> región
-        pais_a_region = {}
-        for region, paises in regiones_paises.items():
-            for pais in paises:
-                pais_a_region[pais] = region
+                products_chart_data_entrega.append({
+                    'codigo': codigo,
+                    'producto': producto_display,
+                    'facturado': facturado,
+                    'pendiente': pendiente,
+                    'total': total,
+                    'porcentaje': (facturado / total * 100) if total > 0 else 0,
+                    'qty_facturada': qty_facturada,
+                    'qty_pendiente': qty_pendiente,
+                    'qty_total': qty_total,
+                    'linea_comercial': info.get('linea_comercial', 'Sin Línea'),
+                    'categoria': info.get('categoria', 'Sin Categoría'),
+                    'fecha_entrega': fecha_ent_str,
+                    'dias_para_entrega': dias_para_entrega
+                })
         
-        # Agrupar ventas facturadas por país y cliente
-        ventas_por_pais = {}
-        for sale in sales_data_international:
-            pais_odoo = sale.get('pais', 'No Definido')
+        # Debug: verificar duplicados en ambas versiones
+        for nombre_version, dataset in [('Confirmación', products_chart_data_confirmacion), ('Entrega', products_chart_data_entrega)]:
+            codigos_vistos = set()
+            duplicados = []
+            for item in dataset:
+                if item['codigo'] in codigos_vistos:
+                    duplicados.append(item['codigo'])
+                codigos_vistos.add(item['codigo'])
             
-            # Convertir nombre de país de Odoo a nombre del mapa
-            pais = mapeo_nombres_paises.get(pais_odoo, pais_odoo)
+            if duplicados:
+                logging.warning(f"DEBUG [{nombre_version}]: Productos duplicados encontrados: {duplicados[:5]}")
             
-            cliente = sale.get('cliente', 'No Definido')
-            partner_id = sale.get('partner_id', None)
-            monto = sale.get('amount_currency', 0)
-            
-            if pais and pais != 'No Definido':
-                # Asignar región
-                region = pais_a_region.get(pais, 'Otros')
-                
-                if pais not in ventas_por_pais:
-                    ventas_por_pais[pais] = {
-                        'pais': pais,
-                        'region': region,
-                        'facturado': 0,
-                        'pendiente': 0,
-                        'clientes': {}
-                    }
-                
-                ventas_por_pais[pais]['facturado'] += monto
-                
-                # Agrupar por cliente
-                if cliente and cliente != 'No Definido':
-                    if cliente not in ventas_por_pais[pais]['clientes']:
-                        ventas_por_pais[pais]['clientes'][cliente] = {
-                            'nombre': cliente,
-                            'partner_id': partner_id,
-                            'facturado': 0,
-                            'pendiente': 0
-                        }
-                    ventas_por_pais[pais]['clientes'][cliente]['facturado'] += monto
+            logging.info(f"DEBUG [{nombre_version}]: Total productos únicos: {len(dataset)}")
         
-        # Agregar datos de pedidos pendientes por país
-        for order in pending_data:
-            pais_odoo = order.get('pais', 'No Definido')
-            
-            # Convertir nombre de país de Odoo a nombre del mapa
-            pais = mapeo_nombres_paises.get(pais_odoo, pais_odoo)
-            
-            cliente = order.get('cliente', 'No Definido')
-            partner_id = order.get('partner_id', None)
-            monto = order.get('total_pendiente', 0)
-            
-            if pais and pais != 'No Definido':
-                # Asignar región
-                region = pais_a_region.get(pais, 'Otros')
-                
-                if pais not in ventas_por_pais:
-                    ventas_por_pais[pais] = {
-                        'pais': pais,
-                        'region': region,
-                        'facturado': 0,
-                        'pendiente': 0,
-                        'clientes': {}
-                    }
-                
-                ventas_por_pais[pais]['pendiente'] += monto
-                
-                # Agrupar por cliente
-                if cliente and cliente != 'No Definido':
-                    if cliente not in ventas_por_pais[pais]['clientes']:
-                        ventas_por_pais[pais]['clientes'][cliente] = {
-                            'nombre': cliente,
-                            'partner_id': partner_id,
-                            'facturado': 0,
-                            'pendiente': 0
-                        }
-                    ventas_por_pais[pais]['clientes'][cliente]['pendiente'] += monto
-        
-        # Convertir a lista y ordenar
-        datos_mapa_mundial = []
-        for pais, datos in ventas_por_pais.items():
-            # Convertir clientes a lista
-            clientes_lista = sorted(
-                [{'nombre': c['nombre'], 'partner_id': c['partner_id'], 
-                  'facturado': c['facturado'], 'pendiente': c['pendiente'],
-                  'total': c['facturado'] + c['pendiente']} 
-                 for c in datos['clientes'].values()],
-                key=lambda x: x['total'],
-                reverse=True
+        # Ordenar ambos arrays por total descendente
+        products_chart_data_confirmacion = sorted(products_chart_data_confirmacion, key=lambda x: x['total'], reverse=True)
+        products_chart_data_entrega = sorted(products_chart_data_entrega, key=lambda x: x['total'], reverse=True)
+    
+    # --- MAPA MUNDIAL: VENTAS POR PAÍS Y REGIÓN ---
+    # Facturado y pendiente por país y cliente, ordenado por total descendente
+    datos_mapa_mundial = agregados['datos_mapa_mundial']
+    
+    # View-model: todo lo que el template necesita salvo las filas de detalle
+    # (capa de datasets) y los valores propios de la petición (filtros, fecha actual)
+    view_model = dict(
+                         kpis=kpis, # kpis ahora se basa en el total del año
+                         nombre_cliente_seleccionado=nombre_cliente_seleccionado,
+                         # Variables adicionales que el template pueda necesitar
+                         meses_disponibles=get_meses_del_año(año_seleccionado),
+                         año_seleccionado=año_seleccionado,
+                         años_disponibles=años_disponibles,
+                         datos_lineas=datos_lineas,
+                         datos_lineas_tabla=datos_lineas_tabla,
+                         datos_productos=datos_productos,
+                         productos_por_linea=productos_por_linea_top,
+                         datos_productos_pendientes=datos_productos_pendientes,
+                         datos_forma_farmaceutica=datos_forma_farmaceutica,
+                         drilldown_data=drilldown_data,                             
+                         total_sales=total_sales_year + total_por_facturar, # Suma de facturado + por facturar
+                         unique_clients=unique_clients,
+                         total_products=total_products,
+                         total_invoices=total_invoices,
+                         meta_total_kpi=meta_total_general,
+                         brecha_comercial=brecha_comercial,
+                         bullet_chart_data=bullet_chart_data,
+                         products_chart_data_confirmacion=products_chart_data_confirmacion,  # Versión con fecha confirmación + 150 días
+                         products_chart_data_entrega=products_chart_data_entrega,  # Versión con fecha entrega + días hasta entrega
+                         orders_chart_data=orders_chart_data,
+                         avance_cliente_seleccionado=avance_cliente_seleccionado,
+                         drilldown_titles=drilldown_titles,
+                         pie_chart_data_by_level=pie_chart_data_by_level,
+                         datos_mapa_mundial=datos_mapa_mundial,
+                         # Avance agregado (suma de todos los clientes)
+                         aggregated_advance={
+                             'facturado_total': total_sales_year,
+                             'pendiente_total': total_por_facturar,
+                             'meta_total': meta_total_general,
+                             'porcentaje_facturado_sobre_meta': (total_sales_year / meta_total_general * 100) if meta_total_general > 0 else 0,
+                             'porcentaje_proyectado_sobre_meta': ((total_sales_year + total_por_facturar) / meta_total_general * 100) if meta_total_general > 0 else 0
+                         },
+                         avance_lineal_pct=0,
+                         faltante_meta=0,
+                         avance_lineal_ipn_pct=0,
+                         faltante_meta_ipn=0)
+    
+    return view_model
+
+
+def version_datos_dashboard(filtros, rpc_calls):
+    """Toca los datasets del filtro (memo/caché, o Odoo) y devuelve su versión."""
+    partner_id = filtros['partner_id']
+    with data_manager.collect_rpc_timings(rpc_calls):
+        dataset_context.sales_lines(date_from=filtros['date_from'], date_to=filtros['date_to'], partner_id=partner_id)
+        dataset_context.pending_orders(partner_id=partner_id)
+        dataset_context.sales_aggregates(date_from=filtros['date_from'], date_to=filtros['date_to'],
+                                         partner_id=partner_id)
+        dataset_context.filter_options()
+    # Las metas del año entran en el view-model: guardar metas cambia la versión
+    return dataset_context.version() + f",metas@{supabase_manager.metas_version(filtros['año_seleccionado'])}"
+
+
+def obtener_dashboard_view_model(filtros, rpc_calls):
+    """View-model de la caché por capas, o calculado una sola vez por filtro.
+    
+    La clave se versiona con la fecha de obtención de los datasets de los que sale:
+    cuando un refresco en segundo plano los reemplaza, el view-model anterior deja
+    de coincidir. Las secciones llegan en paralelo: solo una petición calcula el
+    view-model y las demás esperan su resultado (también entre workers).
+    """
+    partner_id = filtros['partner_id']
+    date_from = filtros['date_from']
+    date_to = filtros['date_to']
+    
+    cache_key = filtros['cache_key'] + (version_datos_dashboard(filtros, rpc_calls),)
+    
+    view_model = dashboard_cache.get('view_model', cache_key)
+    if view_model is not None:
+        return view_model
+    
+    def calcular():
+        view_model = construir_dashboard_view_model(
+            filtros['año_seleccionado'], partner_id, date_from, date_to, rpc_calls
+        )
+        # Huella del contenido para los ETags: no cambia si un refresco trae los mismos datos
+        view_model['_huella'] = hashlib.sha1(
+            json.dumps(view_model, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+        # Guardar el view-model en caché (5 minutos)
+        dashboard_cache.set('view_model', cache_key, view_model, timeout=300)
+        return view_model
+    
+    return view_model_flight.do(
+        cache_key, calcular,
+        buscar=lambda: dashboard_cache.get('view_model', cache_key)
+    )
+
+
+def construir_seccion_dashboard(seccion, filtros, rpc_calls):
+    """Datos JSON de una sección del dashboard (ver DASHBOARD_SECCIONES)."""
+    partner_id = filtros['partner_id']
+    
+    if seccion == 'detalle':
+        # Filas de detalle directamente de los datasets: no esperan a la agregación
+        with data_manager.collect_rpc_timings(rpc_calls):
+            sales_data = dataset_context.sales_lines(
+                date_from=filtros['date_from'], date_to=filtros['date_to'], partner_id=partner_id
             )
-            
-            datos_mapa_mundial.append({
-                'pais': pais,
-                'region': datos['region'],
-                'facturado': datos['facturado'],
-                'pendiente': datos['pendiente'],
-                'total': datos['facturado'] + datos['pendiente'],
-                'clientes': clientes_lista
-            })
-        
-        # Ordenar por total descendente
-        datos_mapa_mundial = sorted(datos_mapa_mundial, key=lambda x: x['total'], reverse=True)
-        
-        response = render_template('dashboard_clean.html',
-                             sales_data=sales_data,
-                             kpis=kpis, # kpis ahora se basa en el total del año
-                             filter_options=filter_options,
-                             selected_filters=selected_filters,
-                             fecha_actual=fecha_actual,
-                             mes_nombre=mes_nombre,
-                             dia_actual=dia_actual,
-                             nombre_cliente_seleccionado=nombre_cliente_seleccionado,
-                             # Variables adicionales que el template pueda necesitar
-                             meses_disponibles=get_meses_del_año(año_seleccionado),
-                             mes_seleccionado=fecha_actual.strftime('%Y-%m'),
-                             año_seleccionado=año_seleccionado,
-                             años_disponibles=años_disponibles,
-                             datos_lineas=datos_lineas,
-                             datos_lineas_tabla=datos_lineas_tabla,
-                             datos_productos=datos_productos,
-                             productos_por_linea=productos_por_linea_top,
-                             datos_productos_pendientes=datos_productos_pendientes,
-                             productos_pendientes_por_linea=productos_pendientes_por_linea_top,
-                             datos_forma_farmaceutica=datos_forma_farmaceutica,
-                             drilldown_data=drilldown_data,                             
-                             total_sales=total_sales_year + total_por_facturar, # Suma de facturado + por facturar
-                             unique_clients=unique_clients,
-                             total_products=total_products,
-                             total_invoices=total_invoices,
-                             meta_total_kpi=meta_total_general,
-                             brecha_comercial=brecha_comercial,
-                             bullet_chart_data=bullet_chart_data,
-                             products_chart_data_confirmacion=products_chart_data_confirmacion,  # Versión con fecha confirmación + 150 días
-                             products_chart_data_entrega=products_chart_data_entrega,  # Versión con fecha entrega + días hasta entrega
-                             orders_chart_data=orders_chart_data,
-                             avance_cliente_seleccionado=avance_cliente_seleccionado,
-                             drilldown_titles=drilldown_titles,
-                             top_products_by_level=top_products_by_level,
-                             pie_chart_data_by_level=pie_chart_data_by_level,
-                             all_stacked_chart_data=all_stacked_chart_data,
-                             pending_data=pending_data,
-                             datos_mapa_mundial=datos_mapa_mundial,
-                             # Avance agregado (suma de todos los clientes)
-                             aggregated_advance={
-                                 'facturado_total': total_sales_year,
-                                 'pendiente_total': total_por_facturar,
-                                 'meta_total': meta_total_general,
-                                 'porcentaje_facturado_sobre_meta': (total_sales_year / meta_total_general * 100) if meta_total_general > 0 else 0,
-                                 'porcentaje_proyectado_sobre_meta': ((total_sales_year + total_por_facturar) / meta_total_general * 100) if meta_total_general > 0 else 0
-                             },
-                             avance_lineal_pct=0,
-                             faltante_meta=0,
-                             avance_lineal_ipn_pct=0,
-                             faltante_meta_ipn=0)
-        
-        # ⏱️ MEDICIÓN DE TIEMPO: Fin de carga del dashboard
-        dashboard_end = time.time()
-        total_time = dashboard_end - dashboard_start
-        
-        # Calcular tiempo total desde login si existe
-        if login_timestamp:
-            total_from_login = dashboard_end - login_timestamp
-            app.logger.info(f"⏱️ ===== DASHBOARD COMPLETADO ===== | Tiempo de carga: {total_time:.3f}s | Tiempo total desde login: {total_from_login:.3f}s")
-        else:
-            app.logger.info(f"⏱️ ===== DASHBOARD COMPLETADO ===== | Tiempo de carga: {total_time:.3f}s")
+            pending_data = dataset_context.pending_orders(partner_id=partner_id)
+        return {
+            'sales_data': encode_columns(excluir_codigos_servicio(sales_data), CAMPOS_VENTAS, ALIAS_VENTAS),
+            'pending_data': encode_columns(excluir_codigos_servicio(pending_data), CAMPOS_PENDIENTES)
+        }
+    
+    view_model = obtener_dashboard_view_model(filtros, rpc_calls)
+    
+    if seccion == 'resumen':
+        # KPIs, tabla por línea y avance del cliente ya renderizados
+        contexto = dict(
+            view_model,
+            selected_filters={'cliente_id': str(partner_id) if partner_id else None}
+        )
+        datos_obtenidos_en = dataset_context.data_timestamp()
+        return {
+            'html': {
+                'kpis': render_template('partials/dashboard_kpis.html', **contexto),
+                'tabla_lineas': render_template('partials/dashboard_tabla_lineas.html', **contexto),
+                'avance_cliente': render_template('partials/dashboard_avance_cliente.html', **contexto)
+            },
+            'datos_actualizados_en': (
+                datetime.fromtimestamp(datos_obtenidos_en).strftime('%d/%m/%Y %H:%M')
+                if datos_obtenidos_en else None
+            ),
+            'edad_datos': describir_edad_datos(datos_obtenidos_en),
+            'datos_actualizando': dataset_context.refreshing()
+        }
+    
+    datos = {clave: view_model.get(clave) for clave in DASHBOARD_SECCIONES[seccion]}
+    for clave in DASHBOARD_CLAVES_COLUMNARES:
+        if isinstance(datos.get(clave), list):
+            datos[clave] = encode_columns(datos[clave])
+    return datos
+
+
+def etag_seccion_dashboard(seccion, filtros, rpc_calls):
+    """ETag de una sección a partir del contenido de sus datos (sin armar la respuesta).
+    
+    Combina el despliegue, los filtros y la huella del contenido del view-model
+    en caché: recargar o refrescar datasets que traen los mismos datos no lo
+    cambia. Devuelve None si el view-model todavía no está en caché y para
+    'detalle' (su ETag sale del cuerpo de la respuesta, ver etag_cuerpo).
+    """
+    if seccion == 'detalle':
+        return None
+    version = version_datos_dashboard(filtros, rpc_calls)
+    entrada = dashboard_cache.get_with_age('view_model', filtros['cache_key'] + (version,))
+    if entrada is None or not entrada[0].get('_huella'):
+        return None
+    partes = [DASHBOARD_ETAG_BUILD, seccion, repr(filtros['cache_key']), entrada[0]['_huella']]
+    if seccion == 'resumen':
+        # La cabecera muestra la antigüedad de los datos y si se están refrescando
+        partes += [describir_edad_datos(dataset_context.data_timestamp()), str(dataset_context.refreshing())]
+    return hashlib.sha1('|'.join(partes).encode('utf-8')).hexdigest()
+
+
+def etag_cuerpo(seccion, response):
+    """ETag de una sección a partir del cuerpo ya serializado de su respuesta."""
+    digest = hashlib.sha1(f"{DASHBOARD_ETAG_BUILD}|{seccion}|".encode('utf-8'))
+    digest.update(response.get_data())
+    return digest.hexdigest()
+
+
+def registrar_tiempos_dashboard(rpc_calls):
+    """Loguea las llamadas JSON-RPC a Odoo y el estado de las cachés de un render."""
+    rpc_summary = OdooManager.summarize_rpc_timings(rpc_calls)
+    app.logger.info(
+        f"⏱️ Odoo JSON-RPC: {rpc_summary['calls']} llamadas | {rpc_summary['total_seconds']:.3f}s | "
+        f"conexiones nuevas: {rpc_summary['new_connections']} | "
+        f"handshake estimado: {rpc_summary['estimated_handshake_seconds']:.3f}s"
+    )
+    master_stats = data_manager.master_data.get_stats() if hasattr(data_manager, 'master_data') else {}
+    if master_stats:
+        app.logger.info("🗂️ Caché datos maestros: " + " | ".join(
+            f"{model}: {st['hits'] + st['revalidated']} aciertos / {st['misses'] + st['updated']} lecturas ({st['size']} en caché)"
+            for model, st in master_stats.items()
+        ))
+    
+    app.logger.info(f"🗂️ Caché por capas: {dashboard_cache.describe()}")
+
+
+@app.route('/dashboard', methods=['GET', 'POST'])
+@limiter.limit("100 per minute")
+def dashboard():
+    # ⏱️ MEDICIÓN DE TIEMPO: Inicio de carga del dashboard
+    dashboard_start = time.time()
+    
+    # Calcular tiempo desde login si existe
+    login_timestamp = session.get('login_timestamp')
+    if login_timestamp:
+        time_since_login = dashboard_start - login_timestamp
+        app.logger.info(f"⏱️ ===== DASHBOARD INICIADO ===== | Tiempo desde login: {time_since_login:.3f}s")
+    else:
+        app.logger.info(f"⏱️ ===== DASHBOARD INICIADO ===== | Sin timestamp de login")
+    
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    
+    # Validar filtros usando ValidationService
+    try:
+        filtros = resolver_filtros_dashboard(request.args)
+    except ValueError as e:
+        app.logger.warning(f"Validación de filtros falló: {e}")
         
-        # Guardar en caché solo para GET requests (5 minutos)
-        if request.method == 'GET':
-            cache.set(cache_key, response, timeout=300)
-            app.logger.info(f"Dashboard guardado en caché: {cache_key}")
+        # ✅ Log evento de seguridad: error de validación
+        security_logger.log_validation_error(
+            param='dashboard_filters',
+            value=str(request.args),
+            request=request,
+            error_type="DASHBOARD_VALIDATION"
+        )
         
-        return response
+        flash('Los parámetros de búsqueda no son válidos', 'warning')
+        return redirect(url_for('dashboard'))
+    
+    # Obtener filtros del formulario o de los parámetros GET
+    if request.method == 'POST':
+        selected_filters = {'cliente_id': request.form.get('cliente_id')}
+        selected_filters['date_from'] = request.form.get('date_from')
+        selected_filters['date_to'] = request.form.get('date_to')
+        selected_filters['año'] = request.form.get('año')
+    else:
+        selected_filters = {'cliente_id': request.args.get('cliente_id')}
+        selected_filters['año'] = request.args.get('año')
     
+    partner_id = filtros['partner_id']
+    
+    # Solo el armazón de la página (filtros y contenedores): cada sección pide sus datos
+    # a /api/v1/dashboard/<seccion> en paralelo, así el primer render no espera a Odoo
+    # ni a la agregación.
+    filter_options = {'lineas': [], 'clientes': []}
+    try:
+        filter_options = dataset_context.filter_options() or filter_options
     except Exception as e:
         # Registrar el error en logs pero NO mostrar alertas al usuario en el dashboard
         app.logger.error(f"ERROR EN DASHBOARD: {str(e)}")
         app.logger.exception(e)
+    
+    # Obtener nombre del cliente seleccionado
+    nombre_cliente_seleccionado = None
+    if partner_id and filter_options.get('clientes'):
+        for cliente in filter_options['clientes']:
+            if cliente[0] == partner_id:
+                nombre_cliente_seleccionado = cliente[1]
+                break
+    
+    response = make_response(render_template('dashboard_clean.html',
+                               filter_options=filter_options,
+                               selected_filters=selected_filters,
+                               nombre_cliente_seleccionado=nombre_cliente_seleccionado,
+                               año_seleccionado=filtros['año_seleccionado'],
+                               años_disponibles=list(range(
+                                   validation_service.MIN_YEAR,
+                                   validation_service.MAX_YEAR + 1
+                               )),
+                               dashboard_query=filtros['query'],
+                               dashboard_secciones=DASHBOARD_SECCIONES_PAGINA))
+    # El armazón casi nunca cambia: ETag del contenido para responder 304
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.make_conditional(request)
+    
+    # ⏱️ MEDICIÓN DE TIEMPO: Fin de carga del dashboard
+    dashboard_end = time.time()
+    total_time = dashboard_end - dashboard_start
+    
+    # Calcular tiempo total desde login si existe
+    if login_timestamp:
+        total_from_login = dashboard_end - login_timestamp
+        app.logger.info(f"⏱️ ===== DASHBOARD COMPLETADO ===== | Tiempo de carga: {total_time:.3f}s | Tiempo total desde login: {total_from_login:.3f}s")
+    else:
+        app.logger.info(f"⏱️ ===== DASHBOARD COMPLETADO ===== | Tiempo de carga: {total_time:.3f}s")
+    
+    return response
 
-        # Preparar datos por defecto para renderizar la plantilla de error
-        fecha_actual = datetime.now()
-        mes_nombre = fecha_actual.strftime('%B %Y').title()
-        dia_actual = fecha_actual.day
 
-        # Obtener filter_options incluso en caso de error si no se pudo antes
-        if not filter_options or filter_options == {'lineas': [], 'clientes': []}:
-            try:
-                filter_options = data_manager.get_filter_options()
-            except Exception:
-                filter_options = {'lineas': [], 'clientes': []}
+@app.route('/api/v1/dashboard/<seccion>')
+@limiter.limit("600 per minute")
+def dashboard_api(seccion):
+    """Datos JSON de una sección del dashboard para los filtros de la query string."""
+    if 'username' not in session:
+        return jsonify({'error': 'Sesión no iniciada'}), 401
+    
+    if seccion not in DASHBOARD_SECCIONES_PAGINA:
+        return jsonify({'error': f'Sección desconocida: {seccion}'}), 404
+    
+    try:
+        filtros = resolver_filtros_dashboard(request.args)
+    except ValueError as e:
+        app.logger.warning(f"Validación de filtros falló: {e}")
+        security_logger.log_validation_error(
+            param='dashboard_filters',
+            value=str(request.args),
+            request=request,
+            error_type="DASHBOARD_VALIDATION"
+        )
+        return jsonify({'error': 'Los parámetros de búsqueda no son válidos'}), 400
+    
+    # Desglose de tiempos por sección (las secciones tienen costos muy distintos)
+    name_trace(f"dashboard_api:{seccion}")
+    inicio = time.time()
+    rpc_calls = []
+    try:
+        # Si el navegador ya tiene esta versión de los datos no se arma la respuesta
+        with span('etag'):
+            etag = etag_seccion_dashboard(seccion, filtros, rpc_calls)
+        if etag and request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        else:
+            datos = construir_seccion_dashboard(seccion, filtros, rpc_calls)
+            with span('serialize'):
+                response = jsonify(datos)
+            etag = etag or etag_seccion_dashboard(seccion, filtros, rpc_calls) or etag_cuerpo(seccion, response)
+            if request.if_none_match.contains_weak(etag):
+                # Mismo contenido que el que ya tiene el navegador (p. ej. 'detalle')
+                response = app.response_class(status=304)
+    except Exception as e:
+        app.logger.error(f"ERROR EN DASHBOARD [{seccion}]: {str(e)}")
+        app.logger.exception(e)
+        return jsonify({'error': 'No se pudieron cargar los datos del dashboard'}), 500
+    
+    if etag:
+        response.set_etag(etag)
+    # Privado y siempre revalidado: con el ETag, los datos sin cambios responden 304
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    
+    app.logger.info(f"⏱️ Sección '{seccion}' del dashboard en {time.time() - inicio:.3f}s ({response.status_code})")
+    registrar_tiempos_dashboard(rpc_calls)
+    return response
 
-        return render_template('dashboard_clean.html',
-                             sales_data=[],
-                             kpis={
-                                 'meta_total': 0,
-                                 'venta_total': 0,
-                                 'total_por_facturar': 0,
-                                 'porcentaje_avance': 0
-                             },
-                             filter_options=filter_options,
-                             selected_filters=selected_filters,
-                             fecha_actual=fecha_actual, # Mantener para consistencia
-                             mes_nombre=mes_nombre,
-                             dia_actual=dia_actual,
-                             meses_disponibles=[],
-                             mes_seleccionado=fecha_actual.strftime('%Y-%m'),
-                             datos_lineas=[],
-                             datos_lineas_tabla=[],
-                             datos_productos=[],
-                             datos_productos_pendientes=[],
-                             productos_pendientes_por_linea={},
-                             datos_forma_farmaceutica=[],
-                             total_sales=0,
-                             unique_clients=0,
-                             total_products=0,
-                             total_invoices=0,
-                             meta_total_kpi=0,
-                             brecha_comercial=0,
-                             bullet_chart_data=[],
-                             avance_cliente_seleccionado=None,
-                             drilldown_data={},
-                             drilldown_titles={},
-                             top_products_by_level={},
-                             pie_chart_data_by_level={},
-                             all_stacked_chart_data="{}",
-                             avance_lineal_pct=0,
-                             faltante_meta=0,
-                             avance_lineal_ipn_pct=0,
-                             faltante_meta_ipn=0,
-                             pending_data=[],
-                             products_chart_data_confirmacion=[],
-                             products_chart_data_entrega=[],
-                             orders_chart_data=[],
-                             datos_mapa_mundial=[],
-                             aggregated_advance={
-                                 'facturado_total': 0,
-                                 'pendiente_total': 0,
-                                 'meta_total': 0,
-                                 'porcentaje_facturado_sobre_meta': 0,
-                                 'porcentaje_proyectado_sobre_meta': 0
-                             },
-                             productos_por_linea={},
-                             años_disponibles=list(range(2025, datetime.now().year + 2)),
-                             año_seleccionado=datetime.now().year)
+
+@app.route('/api/v1/tracing')
+def tracing_breakdown():
+    """Desglose de tiempos por ruta de las últimas peticiones de este worker."""
+    if 'username' not in session:
+        return jsonify({'error': 'Sesión no iniciada'}), 401
+    if not tracer.enabled:
+        return jsonify({'error': 'Las trazas están desactivadas (TRACING_ENABLED=false)'}), 404
+    return jsonify({'window': tracer.window, 'routes': tracer.get_route_breakdown()})
 
 @app.route('/dashboard_linea')
 def dashboard_linea():
@@ -2538,11 +2370,8 @@ def metas_cliente():
 
         if request.method == 'POST':
             año_formulario = request.form.get('año_seleccionado', año_seleccionado)
-            # Leer las metas existentes para actualizarlas
-            metas_historicas = supabase_manager.read_metas_por_cliente()
-            
-            # Crear o actualizar la entrada para el mes actual
-            metas_del_año = metas_historicas.get(año_formulario, {})
+            # Leer las metas existentes del año para actualizarlas
+            metas_del_año = supabase_manager.read_metas_año(año_formulario)
 
             for cliente in clientes:
                 cliente_id_str = str(cliente[0])
@@ -2579,16 +2408,17 @@ def metas_cliente():
                 elif cliente_id_str in metas_del_año:
                     del metas_del_año[cliente_id_str]
 
-            # Actualizar las metas del mes en la estructura histórica
-            metas_historicas[año_formulario] = metas_del_año
-
-            # Guardar en Supabase
-            supabase_manager.write_metas_por_cliente(metas_historicas)
+            # Guardar en Supabase solo los cambios de los clientes del formulario
+            # (inserta, actualiza o borra por lotes; invalida la caché de ese año)
+            resultado = supabase_manager.save_metas_año(año_formulario, metas_del_año,
+                                                       clientes=[str(c[0]) for c in clientes])
             
-            # Guardar las metas recién guardadas en la sesión para evitar latencia de lectura
-            # La sesión ahora debe guardar la estructura completa del año
-            if año_formulario in metas_historicas:
-                session[f'metas_cliente_{año_formulario}'] = metas_historicas[año_formulario]
+            if resultado['ok']:
+                # Guardar las metas recién guardadas en la sesión para evitar latencia de lectura
+                # La sesión ahora debe guardar la estructura completa del año
+                session[f'metas_cliente_{año_formulario}'] = metas_del_año
+            else:
+                flash('No se pudieron guardar las metas por cliente. Inténtelo de nuevo.', 'danger')
 
             
             # flash(f'Metas para clientes guardadas exitosamente para el mes seleccionado.', 'success')
@@ -2597,8 +2427,6 @@ def metas_cliente():
             return redirect(url_for('metas_cliente', año=año_formulario))
 
         # GET request: Cargar y mostrar datos
-        metas_historicas = supabase_manager.read_metas_por_cliente()
-
         # Lógica para evitar latencia de Google Sheets:
         # 1. Intentar obtener las metas de la sesión (que se guardaron en el POST)
         session_key = f'metas_cliente_{año_seleccionado}'
@@ -2606,10 +2434,8 @@ def metas_cliente():
             # La sesión contiene el diccionario de metas para el año específico
             metas_actuales = session.pop(session_key)
         else:
-            # 2. Si no hay nada en la sesión, leer de Google Sheets como de costumbre
-            # CORRECCIÓN: Asegurarse de obtener el diccionario del año correcto.
-            # metas_historicas es {'2024': {cliente_id: {...}}, '2025': ...}
-            metas_actuales = metas_historicas.get(año_seleccionado, {})
+            # 2. Si no hay nada en la sesión, leer las metas del año (caché por año de Supabase)
+            metas_actuales = supabase_manager.read_metas_año(año_seleccionado)
 
         # Asegurar que los clientes que sólo existen en las metas también se muestren
         try:
@@ -2643,6 +2469,115 @@ def metas_cliente():
                              clientes=[], lineas_comerciales=[], metas_actuales={},
                              años_disponibles=[], año_seleccionado="", fecha_actual=datetime.now())
 
+def describir_trabajo_exportacion(job):
+    """Estado público de un trabajo de exportación (sin rutas del servidor)."""
+    datos = {
+        'job_id': job['id'],
+        'estado': job['estado'],
+        'filas': job['filas'],
+        'error': job['error'],
+        'status_url': url_for('export_job_status', job_id=job['id'])
+    }
+    if job['estado'] == 'listo' and job['filas']:
+        datos['download_url'] = url_for('export_job_download', token=export_jobs.download_token(job))
+    return datos
+
+
+def formato_exportacion():
+    """Formato pedido en ?formato= (xlsx por defecto), o None si no existe o falta su dependencia."""
+    formato = (request.args.get('formato') or 'xlsx').strip().lower()
+    return formato if format_available(formato) else None
+
+
+def responder_exportacion(export_type, lotes, opciones, nombre_base, filters, mensaje_vacio=None, url_vacio=None):
+    """Encola la exportación si se pide como trabajo (Accept: application/json) o la genera en la petición.
+    
+    El botón del dashboard la pide como trabajo y consulta /export/jobs/<id> hasta
+    que el archivo está listo; un enlace directo la sigue descargando al momento.
+    El formato sale de ?formato= (xlsx, csv o parquet). Todos se generan completos
+    en un archivo temporal antes de responder: un fallo de Odoo a mitad de camino
+    se informa como error en lugar de dejar un archivo truncado que parece completo.
+    
+    Args:
+        lotes: Función sin argumentos que devuelve el iterable de lotes de filas
+        opciones: columns, sheet_title, table_name, row_filter y formatters de build_export
+        nombre_base: Nombre de descarga sin extensión
+    """
+    user = session.get('username', 'Unknown')
+    pide_trabajo = request.accept_mimetypes.best == 'application/json'
+    formato = formato_exportacion()
+    if formato is None:
+        mensaje = f"Formato de exportación no disponible: {request.args.get('formato')}"
+        if pide_trabajo:
+            return jsonify({'error': mensaje}), 400
+        flash(mensaje, 'warning')
+        return redirect(url_vacio or url_for('dashboard'))
+    
+    filename = f'{nombre_base}.{formato}'
+    
+    def generar():
+        return build_export(formato, lotes(), **opciones)
+    
+    if pide_trabajo:
+        try:
+            job = export_jobs.submit(user, export_type, generar, filename, filters)
+        except ExportQueueFull as e:
+            return jsonify({'error': str(e)}), 429
+        return jsonify(describir_trabajo_exportacion(job)), 202
+    
+    ruta, num_registros = generar()
+    if not num_registros and mensaje_vacio:
+        discard_export(ruta)
+        flash(mensaje_vacio, 'info')
+        return redirect(url_vacio or url_for('dashboard'))
+    
+    # ✅ Log evento de seguridad: exportación de datos
+    security_logger.log_export_request(
+        user=user,
+        export_type=export_type,
+        filters=filters,
+        num_records=num_registros,
+        request=request
+    )
+    return export_response(ruta, filename)
+
+
+@app.route('/export/jobs/<job_id>')
+@limiter.limit("120 per minute")
+def export_job_status(job_id):
+    """Estado de un trabajo de exportación del usuario (para el sondeo del navegador)."""
+    if 'username' not in session:
+        return jsonify({'error': 'Sesión no iniciada'}), 401
+    
+    job = export_jobs.get(job_id)
+    if not job or job['user'] != session.get('username'):
+        return jsonify({'error': 'Exportación no encontrada o vencida'}), 404
+    return jsonify(describir_trabajo_exportacion(job))
+
+
+@app.route('/export/jobs/download/<token>')
+@limiter.limit("30 per minute")
+def export_job_download(token):
+    """Descarga el archivo de un trabajo terminado con su URL firmada (vence con EXPORT_JOB_TTL)."""
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    
+    job = export_jobs.resolve_download(token, session.get('username'))
+    if job is None:
+        flash('El enlace de descarga venció o no es válido. Vuelva a generar la exportación.', 'warning')
+        return redirect(url_for('dashboard'))
+    
+    # ✅ Log evento de seguridad: exportación de datos
+    security_logger.log_export_request(
+        user=job['user'],
+        export_type=job['export_type'],
+        filters=job['filters'],
+        num_records=job['filas'],
+        request=request
+    )
+    return send_file(job['ruta'], as_attachment=True, download_name=job['filename'])
+
+
 @app.route('/export/excel/sales')
 @limiter.limit("10 per minute")
 def export_excel_sales():
@@ -2689,96 +2624,45 @@ def export_excel_sales():
         date_from = f"{año_seleccionado}-01-01"
         date_to = f"{año_seleccionado}-12-31"
         
-        # CORRECCIÓN: Desempaquetar la tupla devuelta por get_sales_lines
-        sales_data_raw, _ = data_manager.get_sales_lines(
-            date_from=date_from, 
-            date_to=date_to, 
-            partner_id=partner_id,
-            page=1,
-            per_page=15000  # ✅ Límite aumentado pero controlado (antes 99999)
-        )
-        
-        # ✅ FILTRO GLOBAL: Excluir códigos que empiezan con "81000" o "SERV"
-        sales_data_raw = [
-            item for item in sales_data_raw
-            if not (
-                (item.get('codigo_odoo', '') or '').startswith('81000') or
-                (item.get('codigo_odoo', '') or '').startswith('SERV')
-            )
+        # Columnas del export (clave en la línea de venta → encabezado)
+        columnas = [
+            ('pedido', 'Pedido'),
+            ('factura', 'Factura'),
+            ('cliente', 'Cliente'),
+            ('pais', 'País'),
+            ('fecha', 'Fecha'),
+            ('mes', 'Mes'),
+            ('codigo_odoo', 'Código Odoo'),
+            ('producto', 'Producto'),
+            ('descripcion', 'Descripcion'),
+            ('linea_comercial', 'Linea Comercial'),
+            ('clasificacion_farmacologica', 'Clasificación farmacológica'),
+            ('formas_farmaceuticas', 'Formas Farmacéuticas'),
+            ('via_administracion', 'Vía de Administración'),
+            ('linea_produccion', 'Línea de producción'),
+            ('cantidad_facturada', 'Cantidad Facturada'),
+            ('precio_unitario', 'Precio unitario ($)'),
+            ('amount_currency', 'Total ($)')  # Usar amount_currency para el total
         ]
         
-        # ✅ VALIDACIÓN: Verificar límite de registros DESPUÉS de obtener datos
-        if len(sales_data_raw) >= 15000:
-            flash(f'Resultado truncado: se encontraron {len(sales_data_raw)}+ registros. '
-                  f'Por favor, filtre por cliente o rango de fechas más pequeño.', 'warning')
-        
-        # Crear DataFrame
-        df = pd.DataFrame(sales_data_raw)
-        
-        # Seleccionar y renombrar las columnas según lo solicitado
-        column_mapping = {
-            'pedido': 'Pedido',
-            'factura': 'Factura',
-            'cliente': 'Cliente',
-            'pais': 'País',
-            'fecha': 'Fecha',
-            'mes': 'Mes',
-            'codigo_odoo': 'Código Odoo',
-            'producto': 'Producto',
-            'descripcion': 'Descripcion',
-            'linea_comercial': 'Linea Comercial',
-            'clasificacion_farmacologica': 'Clasificación farmacológica',
-            'formas_farmaceuticas': 'Formas Farmacéuticas',
-            'via_administracion': 'Vía de Administración',
-            'linea_produccion': 'Línea de producción',
-            'cantidad_facturada': 'Cantidad Facturada',
-            'precio_unitario': 'Precio unitario ($)',
-            'amount_currency': 'Total ($)' # Usar amount_currency para el total
+        # Las líneas llegan por lotes y se escriben sin acumularlas (sin tope de filas).
+        # ✅ FILTRO GLOBAL: Excluir códigos que empiezan con "81000" o "SERV"
+        def lotes():
+            return data_manager.iter_sales_lines(date_from=date_from, date_to=date_to, partner_id=partner_id)
+        
+        opciones = {
+            'columns': columnas,
+            'sheet_title': 'Detalle_Ventas_Internacional',
+            'table_name': 'VentasFacturadas',
+            'row_filter': es_codigo_exportable
         }
         
-        # Filtrar el DataFrame para que solo contenga las columnas deseadas
-        df_export = df[list(column_mapping.keys())].copy()
-        
-        # Renombrar las columnas
-        df_export.rename(columns=column_mapping, inplace=True)
-        
-        # Crear archivo Excel en memoria
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df_export.to_excel(writer, sheet_name='Detalle_Ventas_Internacional', index=False)
-
-            # Aplicar estilo de tabla
-            workbook = writer.book
-            worksheet = writer.sheets['Detalle_Ventas_Internacional']
-            
-            (max_row, max_col) = df_export.shape
-            # El rango de la tabla es desde A1 hasta la última celda con datos
-            table_ref = f"A1:{chr(ord('A') + max_col - 1)}{max_row + 1}"
-            table = Table(displayName="VentasFacturadas", ref=table_ref)
-            style = TableStyleInfo(name="TableStyleLight9", showFirstColumn=False, showLastColumn=False, showRowStripes=True, showColumnStripes=False)
-            table.tableStyleInfo = style
-            worksheet.add_table(table)
-
-        output.seek(0)
-        
-        # ✅ Log evento de seguridad: exportación de datos
-        security_logger.log_export_request(
-            user=session.get('username', 'Unknown'),
-            export_type='sales',
-            filters={'cliente_id': partner_id, 'año': año_seleccionado},
-            num_records=len(df_export),
-            request=request
-        )
-        
-        # Generar nombre de archivo con fecha en formato dd-mm-yyyy
+        # Generar nombre de archivo con fecha en formato dd-mm-yyyy (la extensión depende del formato)
         timestamp = datetime.now().strftime("%d-%m-%Y")
-        filename = f'Pedidos_Facturados_{timestamp}.xlsx'
         
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        return responder_exportacion(
+            'sales', lotes, opciones, f'Pedidos_Facturados_{timestamp}',
+            filters={'cliente_id': partner_id, 'año': año_seleccionado}
         )
         
     except Exception as e:
@@ -2822,95 +2706,43 @@ def export_excel_pending():
             flash(f'Rango de año inválido. Use entre {año_actual - 5} y {año_actual + 2}.', 'warning')
             return redirect(url_for('dashboard'))
         
-        # Obtener datos de pedidos pendientes para el cliente seleccionado
-        # CORRECCIÓN: Desempaquetar la tupla y pedir todos los registros
-        pending_data_raw, _ = data_manager.get_pending_orders(
-            filters={'partner_id': partner_id},
-            page=1,
-            per_page=15000  # ✅ Límite controlado (antes 99999)
-        )
-        
-        # ✅ FILTRO GLOBAL: Excluir códigos que empiezan con "81000" o "SERV"
-        pending_data_raw = [
-            item for item in pending_data_raw
-            if not (
-                (item.get('codigo_odoo', '') or '').startswith('81000') or
-                (item.get('codigo_odoo', '') or '').startswith('SERV')
-            )
-        ]
-        
-        # ✅ VALIDACIÓN: Verificar límite de registros
-        if len(pending_data_raw) >= 15000:
-            flash(f'Resultado truncado: se encontraron {len(pending_data_raw)}+ registros pendientes. '
-                  f'Por favor, filtre por cliente específico.', 'warning')
-        
-        if not pending_data_raw:
-            flash('No hay datos pendientes de facturar para exportar.', 'info')
-            return redirect(url_for('dashboard', cliente_id=cliente_id))
-
-        # Crear DataFrame
-        df = pd.DataFrame(pending_data_raw)
-        
         # Seleccionar y renombrar las columnas para el export
         # Usamos un subconjunto de las columnas disponibles en pending_data
-        column_mapping = {
-            'pedido': 'Pedido', 'cliente': 'Cliente', 'pais': 'País',
-            'fecha': 'Fecha Pedido', 'codigo_odoo': 'Código Odoo',
-            'producto': 'Producto', 'descripcion': 'Descripcion',
-            'linea_comercial': 'Linea Comercial',
-            # --- NUEVAS COLUMNAS ---
-            'clasificacion_farmacologica': 'Clasificación farmacológica',
-            'formas_farmaceuticas': 'Formas Farmacéuticas',
-            'via_administracion': 'Vía de Administración',
-            'linea_produccion': 'Línea de producción',
-            'commitment_date': 'Fecha de entrega',
-            # --- FIN NUEVAS COLUMNAS ---
-            'cantidad_pendiente': 'Cantidad Pendiente', 'precio_unitario': 'Precio unitario ($)',
-            'total_pendiente': 'Total Pendiente ($)'
-        }
-        
-        df_export = df[list(column_mapping.keys())].copy()
-        df_export.rename(columns=column_mapping, inplace=True)
-        
-        # Formatear fecha de entrega para mostrar solo la fecha sin hora
-        if 'commitment_date' in df_export.columns:
-            df_export['Fecha de entrega'] = pd.to_datetime(df_export['Fecha de entrega'], errors='coerce').dt.strftime('%Y-%m-%d')
-        
-        # Crear archivo Excel en memoria
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df_export.to_excel(writer, sheet_name='Pendiente_Facturar', index=False)
-
-            # Aplicar estilo de tabla
-            workbook = writer.book
-            worksheet = writer.sheets['Pendiente_Facturar']
-
-            (max_row, max_col) = df_export.shape
-            table_ref = f"A1:{chr(ord('A') + max_col - 1)}{max_row + 1}"
-            table = Table(displayName="PendienteFacturar", ref=table_ref)
-            style = TableStyleInfo(name="TableStyleLight9", showFirstColumn=False, showLastColumn=False, showRowStripes=True, showColumnStripes=False)
-            table.tableStyleInfo = style
-            worksheet.add_table(table)
-
-        output.seek(0)
+        columnas = [
+            ('pedido', 'Pedido'), ('cliente', 'Cliente'), ('pais', 'País'),
+            ('fecha', 'Fecha Pedido'), ('codigo_odoo', 'Código Odoo'),
+            ('producto', 'Producto'), ('descripcion', 'Descripcion'),
+            ('linea_comercial', 'Linea Comercial'),
+            ('clasificacion_farmacologica', 'Clasificación farmacológica'),
+            ('formas_farmaceuticas', 'Formas Farmacéuticas'),
+            ('via_administracion', 'Vía de Administración'),
+            ('linea_produccion', 'Línea de producción'),
+            ('commitment_date', 'Fecha de entrega'),
+            ('cantidad_pendiente', 'Cantidad Pendiente'), ('precio_unitario', 'Precio unitario ($)'),
+            ('total_pendiente', 'Total Pendiente ($)')
+        ]
         
-        # ✅ Log evento de seguridad: exportación de datos pendientes
-        security_logger.log_export_request(
-            user=session.get('username', 'Unknown'),
-            export_type='pending',
-            filters={'cliente_id': partner_id, 'año': año_seleccionado},
-            num_records=len(df_export),
-            request=request
-        )
+        # Pedidos pendientes del cliente por lotes, escritos sin acumularlos (sin tope de filas).
+        # ✅ FILTRO GLOBAL: Excluir códigos que empiezan con "81000" o "SERV"
+        def lotes():
+            return data_manager.iter_pending_orders(partner_id=partner_id)
+        
+        opciones = {
+            'columns': columnas,
+            'sheet_title': 'Pendiente_Facturar',
+            'table_name': 'PendienteFacturar',
+            'row_filter': es_codigo_exportable,
+            # Fecha de entrega solo con la fecha, sin hora
+            'formatters': {'commitment_date': lambda valor: valor[:10] if isinstance(valor, str) and valor else None}
+        }
         
         timestamp = datetime.now().strftime("%d-%m-%Y")
-        filename = f'Pedidos_Pendientes_{timestamp}.xlsx'
         
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        return responder_exportacion(
+            'pending', lotes, opciones, f'Pedidos_Pendientes_{timestamp}',
+            filters={'cliente_id': partner_id, 'año': año_seleccionado},
+            mensaje_vacio='No hay datos pendientes de facturar para exportar.',
+            url_vacio=url_for('dashboard', cliente_id=cliente_id)
         )
         
     except Exception as e:
@@ -3075,75 +2907,52 @@ def export_dashboard_details():
         ultimo_dia = calendar.monthrange(int(año_sel), int(mes_sel))[1]
         fecha_fin = f"{año_sel}-{mes_sel}-{ultimo_dia}"
 
-        # Obtener datos de ventas reales desde Odoo para ese mes
-        sales_data = data_manager.get_sales_lines(
-            date_from=fecha_inicio,
-            date_to=fecha_fin,
-            limit=15000  # ✅ Límite aumentado pero controlado (antes 10000)
-        )
-        
-        # ✅ VALIDACIÓN: Advertir si se alcanzó el límite
-        if len(sales_data) >= 15000:
-            flash(f'Advertencia: resultado truncado a 15,000 registros. '
-                  f'Considere exportar por rango de fechas más pequeño.', 'warning')
-
-        # Filtrar VENTA INTERNACIONAL (exportaciones), igual que en el dashboard
-        sales_data_filtered = []
-        for sale in sales_data:
+        def es_venta_nacional_exportable(sale):
+            """Excluye VENTA INTERNACIONAL (exportaciones), igual que en el dashboard, y los códigos de servicio."""
             linea_comercial = sale.get('commercial_line_national_id')
             if linea_comercial and isinstance(linea_comercial, list) and len(linea_comercial) > 1:
                 if 'VENTA INTERNACIONAL' in linea_comercial[1].upper():
-                    continue
+                    return False
             
             canal_ventas = sale.get('sales_channel_id')
             if canal_ventas and isinstance(canal_ventas, list) and len(canal_ventas) > 1:
                 nombre_canal = canal_ventas[1].upper()
                 if 'VENTA INTERNACIONAL' in nombre_canal or 'INTERNACIONAL' in nombre_canal:
-                    continue
+                    return False
             
-            sales_data_filtered.append(sale)
+            # ✅ FILTRO GLOBAL: Excluir códigos que empiezan con "81000" o "SERV"
+            codigo = sale.get('codigo_odoo', '') or sale.get('default_code', '') or ''
+            return not (codigo.startswith('81000') or codigo.startswith('SERV'))
         
-        # ✅ FILTRO GLOBAL: Excluir códigos que empiezan con "81000" o "SERV"
-        sales_data_filtered = [
-            item for item in sales_data_filtered
-            if not (
-                (item.get('codigo_odoo', '') or item.get('default_code', '') or '').startswith('81000') or
-                (item.get('codigo_odoo', '') or item.get('default_code', '') or '').startswith('SERV')
-            )
-        ]
-
-        # Convertir el balance a positivo para que coincida con el dashboard
-        for sale in sales_data_filtered:
-            if 'balance' in sale and sale['balance'] is not None:
-                sale['balance'] = float(sale['balance']) # Ya viene con el signo correcto desde OdooManager
-
-        # Crear DataFrame de Pandas con los datos filtrados
-        df = pd.DataFrame(sales_data_filtered)
-
-        # Crear archivo Excel en memoria
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name=f'Detalle Ventas {mes_seleccionado}', index=False)
-        output.seek(0)
+        formato = formato_exportacion()
+        if formato is None:
+            flash(f"Formato de exportación no disponible: {request.args.get('formato')}", 'warning')
+            return redirect(url_for('dashboard'))
+        
+        # Ventas reales del mes por lotes, con todas las columnas de la línea (sin tope de filas).
+        # El balance ya viene con el signo correcto desde OdooManager.
+        ruta_excel, num_registros = build_export(
+            formato,
+            data_manager.iter_sales_lines(date_from=fecha_inicio, date_to=fecha_fin),
+            columns=None,
+            sheet_title=f'Detalle Ventas {mes_seleccionado}',
+            row_filter=es_venta_nacional_exportable,
+            formatters={'balance': lambda valor: float(valor) if valor is not None else None}
+        )
 
         # ✅ Log evento de seguridad: exportación detallada del dashboard
         security_logger.log_export_request(
             user=session.get('username', 'Unknown'),
             export_type='dashboard_details',
             filters={'mes': mes_seleccionado},
-            num_records=len(df),
+            num_records=num_registros,
             request=request
         )
 
         # Generar nombre de archivo
-        filename = f'detalle_ventas_{mes_seleccionado}.xlsx'
+        filename = f'detalle_ventas_{mes_seleccionado}.{formato}'
 
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        return export_response(ruta_excel, filename)
 
     except Exception as e:
         flash(f'Error al exportar los detalles del dashboard: {str(e)}', 'danger')
@@ -5,5 +5,7 @@ Database package - Gestión de conexiones y operaciones con bases de datos
 from .odoo_manager import OdooManager
 from .supabase_manager import SupabaseManager
 from .google_sheets_manager import GoogleSheetsManager
+from .sales_store import SalesStore
+from .shared_cache import SQLiteCache, SQLiteLimiterStorage
 
-__all__ = ['OdooManager', 'SupabaseManager', 'GoogleSheetsManager']
+__all__ = ['OdooManager', 'SupabaseManager', 'GoogleSheetsManager', 'SalesStore', 'SQLiteCache', 'SQLiteLimiterStorage']
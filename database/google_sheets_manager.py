@@ -1,11 +1,63 @@
+"""
+Google Sheets Manager - equipos y metas de vendedores y por línea.
+
+Las pestañas que lee la app (Equipos, Metas, MetasPorLinea) se piden juntas
+en una sola llamada values_batch_get y se guardan ya procesadas en una foto
+(snapshot) durante SHEETS_CACHE_TTL segundos: /dashboard_linea, /meta y
+/metas_vendedor ya no esperan una ida y vuelta a la API de Google por pestaña
+ni consumen la cuota de lecturas en cada petición. La foto va a la caché
+compartida de la app si se pasa una (si no, queda en memoria del proceso) y
+las escrituras de la propia app la invalidan.
+
+Las escrituras no borran la pestaña para volver a subirla entera: comparan
+cada fila por su clave (p. ej. equipo, vendedor y mes) con lo que hay en la
+hoja y envían en una sola llamada batch_update solo las filas que cambiaron,
+las nuevas (al final o en los huecos de filas borradas) y las borradas (en
+blanco). Guardar un mes de un equipo no reescribe el historial ni deja la
+pestaña vacía para quien la lee en ese momento.
+"""
+
 import gspread
+from gspread.utils import fill_gaps, numericise_all, rowcol_to_a1, to_records
 from google.oauth2.service_account import Credentials
 import pandas as pd
 import logging
 import json
+import os
+import copy
+import time
+import threading
+
+from services.tracing import traced
+
+try:
+    SHEETS_CACHE_TTL = int(os.getenv('SHEETS_CACHE_TTL', '120'))
+except Exception:
+    SHEETS_CACHE_TTL = 120
+
+# Pestañas de la foto → (rango del encabezado, encabezado, filas, columnas) para
+# crearlas si no existen; None = no se crea (se avisa)
+SHEETS_SNAPSHOT_TABS = {
+    'Equipos': ('A1:C1', ['equipo_id', 'vendedor_id', 'vendedor_nombre'], '200', '3'),
+    'Metas': ('A1:E1', ['equipo_id', 'vendedor_id', 'mes', 'meta', 'meta_ipn'], '1000', '5'),
+    'MetasPorLinea': None,
+}
 
 class GoogleSheetsManager:
-    def __init__(self, credentials_file, sheet_name):
+    def __init__(self, credentials_file, sheet_name, cache=None, ttl=None):
+        """
+        Args:
+            credentials_file: Archivo de la cuenta de servicio
+            sheet_name: Nombre de la hoja de cálculo
+            cache: Caché compartida (Flask-Caching) para la foto de las pestañas; None = memoria del proceso
+            ttl: Segundos de vida de la foto (por defecto SHEETS_CACHE_TTL o 120)
+        """
+        self.cache = cache
+        self.ttl = SHEETS_CACHE_TTL if ttl is None else ttl
+        self._snapshot_local = (0, None)
+        self._snapshot_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'batch_reads': 0, 'fallback_reads': 0, 'invalidations': 0}
         try:
             scopes = [
                 "https://www.googleapis.com/auth/spreadsheets",
@@ -22,41 +74,298 @@ class GoogleSheetsManager:
             self.client = None
             self.sheet = None
 
-    def read_equipos(self):
-        """Lee la asignación de equipos desde la pestaña 'Equipos'."""
-        if not self.sheet:
-            return {}
+    # ------------------------------------------------------------------
+    # Foto de las pestañas (una lectura por lotes, caché con TTL)
+    # ------------------------------------------------------------------
+
+    _SNAPSHOT_KEY = 'sheets_snapshot'
+
+    def _contar(self, contador):
+        with self._stats_lock:
+            self._stats[contador] += 1
+
+    @staticmethod
+    def _registros(valores):
+        """Filas de una pestaña como las devuelve worksheet.get_all_records()."""
+        if not valores or valores == [[]]:
+            return []
+        valores = fill_gaps(valores)
+        claves = valores[0]
+        if len(claves) != len(set(claves)):
+            raise gspread.exceptions.GSpreadException("the header row in the worksheet is not unique")
+        filas = [numericise_all(fila) for fila in valores[1:] if any(valor != '' for valor in fila)]
+        return to_records(claves, filas)
+
+    @traced('sheets.read_tab')
+    def _registros_pestaña(self, titulo):
+        """Lee una sola pestaña (y la crea si falta); respaldo de la lectura por lotes."""
+        self._contar('fallback_reads')
         try:
-            worksheet = self.sheet.worksheet("Equipos")
-            records = worksheet.get_all_records()
-            equipos_dict = {}
-            for row in records:
-                equipo_id = row.get('equipo_id')
-                vendedor_id = row.get('vendedor_id')
-                if equipo_id:
-                    if equipo_id not in equipos_dict:
-                        equipos_dict[equipo_id] = []
-                    if vendedor_id and str(vendedor_id).isdigit():
-                        equipos_dict[equipo_id].append(int(vendedor_id))
-            return equipos_dict
+            # Las filas borradas por _escribir_por_clave quedan en blanco: se omiten
+            records = self.sheet.worksheet(titulo).get_all_records()
+            return [row for row in records if any(valor != '' for valor in row.values())]
         except gspread.exceptions.WorksheetNotFound:
-            logging.warning("Pestaña 'Equipos' no encontrada en Google Sheet. Creándola...")
-            self.sheet.add_worksheet(title="Equipos", rows="200", cols="3")
-            worksheet = self.sheet.worksheet("Equipos")
-            worksheet.update('A1:C1', [['equipo_id', 'vendedor_id', 'vendedor_nombre']])
-            return {}
+            creacion = SHEETS_SNAPSHOT_TABS.get(titulo)
+            if creacion is None:
+                logging.warning(f"Pestaña '{titulo}' no encontrada. Por favor, créala manualmente.")
+                return []
+            rango, encabezado, filas, columnas = creacion
+            logging.warning(f"Pestaña '{titulo}' no encontrada en Google Sheet. Creándola...")
+            self.sheet.add_worksheet(title=titulo, rows=filas, cols=columnas)
+            self.sheet.worksheet(titulo).update(rango, [encabezado])
+            return []
+
+    @traced('sheets.read_snapshot')
+    def _leer_snapshot(self):
+        """Pide todas las pestañas en una llamada y las procesa."""
+        titulos = list(SHEETS_SNAPSHOT_TABS)
+        inicio = time.time()
+        try:
+            respuesta = self.sheet.values_batch_get([f"'{titulo}'" for titulo in titulos])
+            rangos = respuesta.get('valueRanges', [])
+            registros = {titulo: self._registros(rango.get('values', [])) for titulo, rango in zip(titulos, rangos)}
+            self._contar('batch_reads')
         except Exception as e:
-            logging.error(f"Error al leer la pestaña 'Equipos': {e}")
+            # Falta alguna pestaña (rango inválido), encabezado repetido, ...: pestaña por pestaña
+            logging.warning(f"⚠️ Lectura por lotes de Google Sheets falló ({e}); se leen las pestañas por separado")
+            registros = {}
+        for titulo in titulos:
+            if titulo not in registros:
+                try:
+                    registros[titulo] = self._registros_pestaña(titulo)
+                except Exception as e:
+                    logging.error(f"Error al leer la pestaña '{titulo}': {e}")
+                    registros[titulo] = None
+
+        snapshot = {}
+        for parte, titulo, parse in (('equipos', 'Equipos', self._parse_equipos),
+                                     ('metas', 'Metas', self._parse_metas),
+                                     ('metas_por_linea', 'MetasPorLinea', self._parse_metas_por_linea)):
+            snapshot[parte] = None
+            if registros[titulo] is not None:
+                try:
+                    snapshot[parte] = parse(registros[titulo])
+                except Exception as e:
+                    logging.error(f"Error al leer la pestaña '{titulo}': {e}")
+        logging.info(f"📗 Google Sheets: {len(titulos)} pestañas leídas en {time.time() - inicio:.2f}s")
+        return snapshot
+
+    def _snapshot_en_cache(self):
+        if self.cache is not None:
+            try:
+                return self.cache.get(self._SNAPSHOT_KEY)
+            except Exception as e:
+                logging.warning(f"⚠️ Caché de Google Sheets no disponible: {e}")
+                return None
+        vence, snapshot = self._snapshot_local
+        if snapshot is None or vence <= time.time():
+            return None
+        return copy.deepcopy(snapshot)
+
+    def _guardar_snapshot(self, snapshot):
+        if self.cache is not None:
+            try:
+                self.cache.set(self._SNAPSHOT_KEY, snapshot, timeout=self.ttl)
+            except Exception as e:
+                logging.warning(f"⚠️ No se pudo guardar la foto de Google Sheets en caché: {e}")
+            return
+        self._snapshot_local = (time.time() + self.ttl, copy.deepcopy(snapshot))
+
+    def _snapshot(self, parte):
+        """Estructura procesada de una pestaña desde la foto (la lee si venció). None = error de lectura."""
+        snapshot = self._snapshot_en_cache()
+        if snapshot is None:
+            # Un solo hilo del proceso lee la foto; los demás esperan y la toman de la caché
+            with self._snapshot_lock:
+                snapshot = self._snapshot_en_cache()
+                if snapshot is None:
+                    self._contar('misses')
+                    snapshot = self._leer_snapshot()
+                    if all(valor is not None for valor in snapshot.values()):
+                        self._guardar_snapshot(snapshot)
+                    return copy.deepcopy(snapshot[parte])
+        self._contar('hits')
+        return snapshot[parte]
+
+    def invalidate_snapshot(self):
+        """Descarta la foto de las pestañas (la próxima lectura vuelve a pedirla)."""
+        self._contar('invalidations')
+        self._snapshot_local = (0, None)
+        if self.cache is not None:
+            try:
+                self.cache.delete(self._SNAPSHOT_KEY)
+            except Exception:
+                pass
+
+    def get_snapshot_stats(self):
+        """Aciertos y fallos de la foto, lecturas por lotes y pestaña por pestaña."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    # ------------------------------------------------------------------
+    # Escritura por diferencias
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _celda(valor):
+        """Valor comparable de una celda: números como float, vacíos como ''."""
+        if valor is None or (isinstance(valor, float) and valor != valor):
+            return ''
+        if isinstance(valor, bool):
+            return valor
+        if isinstance(valor, (int, float)):
+            return float(valor)
+        texto = str(valor).strip()
+        try:
+            return float(texto)
+        except ValueError:
+            return texto
+
+    @staticmethod
+    def _rangos_contiguos(cambios, ancho):
+        """Agrupa {fila: valores} en rangos de filas consecutivas para batch_update."""
+        rangos = []
+        for fila in sorted(cambios):
+            if rangos and rangos[-1]['hasta'] == fila - 1:
+                rangos[-1]['hasta'] = fila
+                rangos[-1]['values'].append(cambios[fila])
+            else:
+                rangos.append({'desde': fila, 'hasta': fila, 'values': [cambios[fila]]})
+        return [{'range': f"A{r['desde']}:{rowcol_to_a1(r['hasta'], ancho)}", 'values': r['values']}
+                for r in rangos]
+
+    @traced('sheets.write')
+    def _escribir_por_clave(self, titulo, encabezado, filas, clave):
+        """
+        Deja la pestaña con 'filas' cambiando solo lo necesario.
+
+        Lee la pestaña (una llamada) y compara cada fila por las columnas de
+        'clave'. Las filas con cambios, las nuevas y las que sobran (en blanco)
+        se envían en un único batch_update; si hace falta se agregan filas o
+        columnas a la hoja antes. Si el encabezado cambió, la tabla se reescribe
+        entera desde A1, igualmente sin borrar la pestaña.
+
+        Args:
+            titulo: Nombre de la pestaña
+            encabezado: Columnas de la tabla
+            filas: Filas completas en el orden de 'encabezado'
+            clave: Columnas que identifican una fila
+
+        Returns:
+            {'actualizadas', 'nuevas', 'borradas', 'sin_cambios', 'reescrita'}
+        """
+        inicio = time.time()
+        worksheet = self.sheet.worksheet(titulo)
+        actuales = worksheet.get_values()
+        ancho = len(encabezado)
+        vacia = [''] * ancho
+        filas = [[('' if valor is None else valor) for valor in fila] for fila in filas]
+        encabezado_actual = list(actuales[0]) if actuales else []
+        while encabezado_actual and encabezado_actual[-1] == '':
+            encabezado_actual.pop()
+        resultado = {'actualizadas': 0, 'nuevas': 0, 'borradas': 0, 'sin_cambios': 0, 'reescrita': False}
+
+        if encabezado_actual != list(encabezado):
+            # Tabla nueva o columnas distintas: todo desde A1 y en blanco lo que sobre
+            ancho = max(ancho, len(encabezado_actual))
+            tabla = [list(encabezado)] + filas
+            tabla = [fila + [''] * (ancho - len(fila)) for fila in tabla]
+            tabla += [[''] * ancho for _ in range(max(0, len(actuales) - len(tabla)))]
+            cambios = {numero: valores for numero, valores in enumerate(tabla, start=1)}
+            resultado.update(reescrita=True, nuevas=len(filas), borradas=max(0, len(actuales) - 1 - len(filas)))
+        else:
+            indices = [encabezado.index(columna) for columna in clave]
+
+            def clave_de(fila):
+                return tuple(self._celda(fila[i] if i < len(fila) else '') for i in indices)
+
+            # Filas actuales por clave (una clave repetida guarda todas sus filas, en orden)
+            por_clave = {}
+            huecos = []
+            for numero, fila in enumerate(actuales[1:], start=2):
+                if all(valor == '' for valor in fila):
+                    huecos.append(numero)
+                    continue
+                por_clave.setdefault(clave_de(fila), []).append((numero, fila))
+
+            cambios = {}
+            nuevas = []
+            for fila in filas:
+                existentes = por_clave.get(clave_de(fila))
+                if not existentes:
+                    nuevas.append(fila)
+                    continue
+                numero, actual = existentes.pop(0)
+                actual = list(actual) + [''] * (ancho - len(actual))
+                if [self._celda(v) for v in actual[:ancho]] == [self._celda(v) for v in fila]:
+                    resultado['sin_cambios'] += 1
+                else:
+                    cambios[numero] = fila
+                    resultado['actualizadas'] += 1
+
+            sobrantes = sorted(numero for existentes in por_clave.values() for numero, _ in existentes)
+            for numero in sobrantes:
+                cambios[numero] = vacia
+            resultado['borradas'] = len(sobrantes)
+
+            # Las filas nuevas ocupan primero los huecos (incluidos los recién borrados) y luego van al final
+            libres = sorted(set(huecos) | set(sobrantes))
+            siguiente = len(actuales) + 1 if actuales else 2
+            for fila in nuevas:
+                if libres:
+                    numero = libres.pop(0)
+                else:
+                    numero, siguiente = siguiente, siguiente + 1
+                cambios[numero] = fila
+            resultado['nuevas'] = len(nuevas)
+
+        if not cambios:
+            logging.info(f"📗 '{titulo}': sin cambios ({resultado['sin_cambios']} filas)")
+            return resultado
+
+        ultima = max(cambios)
+        if ultima > worksheet.row_count:
+            worksheet.add_rows(ultima - worksheet.row_count)
+        if ancho > worksheet.col_count:
+            worksheet.add_cols(ancho - worksheet.col_count)
+        worksheet.batch_update(self._rangos_contiguos(cambios, ancho), value_input_option='USER_ENTERED')
+        logging.info(
+            f"📗 '{titulo}': {resultado['actualizadas']} actualizadas, {resultado['nuevas']} nuevas, "
+            f"{resultado['borradas']} borradas, {resultado['sin_cambios']} sin cambios"
+            f"{' (reescrita)' if resultado['reescrita'] else ''} en {time.time() - inicio:.2f}s"
+        )
+        return resultado
+
+    # ------------------------------------------------------------------
+    # Equipos
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _parse_equipos(records):
+        equipos_dict = {}
+        for row in records:
+            equipo_id = row.get('equipo_id')
+            vendedor_id = row.get('vendedor_id')
+            if equipo_id:
+                if equipo_id not in equipos_dict:
+                    equipos_dict[equipo_id] = []
+                if vendedor_id and str(vendedor_id).isdigit():
+                    equipos_dict[equipo_id].append(int(vendedor_id))
+        return equipos_dict
+
+    def read_equipos(self):
+        """Lee la asignación de equipos desde la pestaña 'Equipos'."""
+        if not self.sheet:
             return {}
+        return self._snapshot('equipos') or {}
 
     def write_equipos(self, equipos_data, todos_los_vendedores):
         """Escribe la asignación de equipos en la pestaña 'Equipos'."""
         if not self.sheet:
             return
         try:
-            worksheet = self.sheet.worksheet("Equipos")
             header = ['equipo_id', 'vendedor_id', 'vendedor_nombre']
-            rows = [header]
+            rows = []
             vendedores_por_id = {v['id']: v['name'] for v in todos_los_vendedores}
 
             for equipo_id, vendedor_ids_list in equipos_data.items():
@@ -64,47 +373,45 @@ class GoogleSheetsManager:
                     vendedor_nombre = vendedores_por_id.get(vendedor_id, 'Nombre no encontrado')
                     rows.append([equipo_id, vendedor_id, vendedor_nombre])
 
-            worksheet.clear()
-            worksheet.update(rows, value_input_option='USER_ENTERED')
+            self._escribir_por_clave("Equipos", header, rows, clave=('equipo_id', 'vendedor_id'))
         except Exception as e:
             logging.error(f"Error al escribir en la pestaña 'Equipos': {e}")
+        finally:
+            self.invalidate_snapshot()
 
-    def read_metas(self):
-        """Lee las metas desde la pestaña 'Metas' y las transforma a la estructura anidada."""
-        if not self.sheet:
+    # ------------------------------------------------------------------
+    # Metas de vendedores
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _parse_metas(records):
+        df = pd.DataFrame(records)
+
+        metas_anidadas = {}
+        if df.empty:
             return {}
-        try:
-            worksheet = self.sheet.worksheet("Metas")
-            df = pd.DataFrame(worksheet.get_all_records())
+
+        for _, row in df.iterrows():
+            equipo_id = str(row['equipo_id'])
+            vendedor_id = str(row['vendedor_id'])
+            mes = str(row['mes'])
             
-            metas_anidadas = {}
-            if df.empty:
-                return {}
+            if equipo_id not in metas_anidadas:
+                metas_anidadas[equipo_id] = {}
+            if vendedor_id not in metas_anidadas[equipo_id]:
+                metas_anidadas[equipo_id][vendedor_id] = {}
+            
+            metas_anidadas[equipo_id][vendedor_id][mes] = {
+                'meta': float(row.get('meta', 0)),
+                'meta_ipn': float(row.get('meta_ipn', 0))
+            }
+        return metas_anidadas
 
-            for _, row in df.iterrows():
-                equipo_id = str(row['equipo_id'])
-                vendedor_id = str(row['vendedor_id'])
-                mes = str(row['mes'])
-                
-                if equipo_id not in metas_anidadas:
-                    metas_anidadas[equipo_id] = {}
-                if vendedor_id not in metas_anidadas[equipo_id]:
-                    metas_anidadas[equipo_id][vendedor_id] = {}
-                
-                metas_anidadas[equipo_id][vendedor_id][mes] = {
-                    'meta': float(row.get('meta', 0)),
-                    'meta_ipn': float(row.get('meta_ipn', 0))
-                }
-            return metas_anidadas
-        except gspread.exceptions.WorksheetNotFound:
-            logging.warning("Pestaña 'Metas' no encontrada en Google Sheet. Creándola...")
-            self.sheet.add_worksheet(title="Metas", rows="1000", cols="5")
-            worksheet = self.sheet.worksheet("Metas")
-            worksheet.update('A1:E1', [['equipo_id', 'vendedor_id', 'mes', 'meta', 'meta_ipn']])
-            return {}
-        except Exception as e:
-            logging.error(f"Error al leer la pestaña 'Metas': {e}")
+    def read_metas(self):
+        """Lee las metas desde la pestaña 'Metas' y las transforma a la estructura anidada."""
+        if not self.sheet:
             return {}
+        return self._snapshot('metas') or {}
 
     def write_metas(self, metas_anidadas):
         """Toma la estructura anidada, la aplana y la escribe en la pestaña 'Metas'."""
@@ -123,54 +430,55 @@ class GoogleSheetsManager:
                         'meta_ipn': valores.get('meta_ipn', 0)
                     })
         
-        df = pd.DataFrame(flat_data)
-        worksheet = self.sheet.worksheet("Metas")
-        worksheet.clear()
-        worksheet.update([df.columns.values.tolist()] + df.values.tolist(), value_input_option='USER_ENTERED')
+        header = ['equipo_id', 'vendedor_id', 'mes', 'meta', 'meta_ipn']
+        try:
+            self._escribir_por_clave("Metas", header, [[fila[col] for col in header] for fila in flat_data],
+                                     clave=('equipo_id', 'vendedor_id', 'mes'))
+        finally:
+            self.invalidate_snapshot()
+
+    # ------------------------------------------------------------------
+    # Metas por línea
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _parse_metas_por_linea(records):
+        metas_por_linea = {}
+        for row in records:
+            mes_key = row.get('mes_key')
+            if mes_key:
+                # Eliminar la clave del mes para no incluirla en los diccionarios de metas
+                del row['mes_key']
+
+                metas = {}
+                for k, v in row.items():
+                    if not k.endswith('_ipn') and v != '':
+                        try:
+                            metas[k] = float(v)
+                        except (ValueError, TypeError):
+                            metas[k] = 0.0
+
+                metas_ipn = {}
+                for k, v in row.items():
+                    if k.endswith('_ipn') and v != '':
+                        try:
+                            metas_ipn[k.replace('_ipn', '')] = float(v)
+                        except (ValueError, TypeError):
+                            metas_ipn[k.replace('_ipn', '')] = 0.0
+
+                metas_por_linea[mes_key] = {
+                    'metas': metas,
+                    'metas_ipn': metas_ipn,
+                    'total': sum(metas.values()),
+                    'total_ipn': sum(metas_ipn.values())
+                }
+        return metas_por_linea
 
     def read_metas_por_linea(self):
         """Lee las metas por línea desde la pestaña 'MetasPorLinea'."""
         if not self.sheet:
             return {}
-        try:
-            worksheet = self.sheet.worksheet("MetasPorLinea")
-            records = worksheet.get_all_records()
-            metas_por_linea = {}
-            for row in records:
-                mes_key = row.get('mes_key')
-                if mes_key:
-                    # Eliminar la clave del mes para no incluirla en los diccionarios de metas
-                    del row['mes_key']
-                    
-                    metas = {}
-                    for k, v in row.items():
-                        if not k.endswith('_ipn') and v != '':
-                            try:
-                                metas[k] = float(v)
-                            except (ValueError, TypeError):
-                                metas[k] = 0.0
-
-                    metas_ipn = {}
-                    for k, v in row.items():
-                        if k.endswith('_ipn') and v != '':
-                            try:
-                                metas_ipn[k.replace('_ipn', '')] = float(v)
-                            except (ValueError, TypeError):
-                                metas_ipn[k.replace('_ipn', '')] = 0.0
-                    
-                    metas_por_linea[mes_key] = {
-                        'metas': metas,
-                        'metas_ipn': metas_ipn,
-                        'total': sum(metas.values()),
-                        'total_ipn': sum(metas_ipn.values())
-                    }
-            return metas_por_linea
-        except gspread.exceptions.WorksheetNotFound:
-            logging.warning("Pestaña 'MetasPorLinea' no encontrada. Por favor, créala manualmente.")
-            return {}
-        except Exception as e:
-            logging.error(f"Error al leer la pestaña 'MetasPorLinea': {e}")
-            return {}
+        return self._snapshot('metas_por_linea') or {}
 
     def write_metas_por_linea(self, metas_data):
         """Escribe las metas por línea en la pestaña 'MetasPorLinea'."""
@@ -187,12 +495,14 @@ class GoogleSheetsManager:
             flat_data.append(row)
         
         header = sorted(list(all_keys), key=lambda x: (x.endswith('_ipn'), x))
-        df = pd.DataFrame(flat_data, columns=header)
+        rows = [[row.get(col, '') for col in header] for row in flat_data]
         
-        worksheet = self.sheet.worksheet("MetasPorLinea")
-        worksheet.clear()
-        worksheet.update([df.columns.values.tolist()] + df.fillna('').values.tolist(), value_input_option='USER_ENTERED')
+        try:
+            self._escribir_por_clave("MetasPorLinea", header, rows, clave=('mes_key',))
+        finally:
+            self.invalidate_snapshot()
 
+    @traced('sheets.read_metas_cliente')
     def read_metas_por_cliente(self):
         """Lee las metas por cliente desde la hoja 'Metas_cliente' en formato ancho."""
         sheet_name = 'Metas_cliente'
@@ -249,6 +559,7 @@ class GoogleSheetsManager:
             logging.error(f"Error al leer la hoja '{sheet_name}': {e}")
             return {}
 
+    @traced('sheets.write_metas_cliente')
     def write_metas_por_cliente(self, data):
         """Toma la estructura anidada, la convierte a formato ancho y la escribe en 'Metas_cliente'."""
         sheet_name = 'Metas_cliente'
@@ -11,20 +11,246 @@ import logging
 import re
 import requests
 import json
+import time
+import threading
+import contextvars
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from .pending_orders import PendingOrdersEngine
+from services.tracing import span, traced
 
 # Load environment variables
 load_dotenv()
 
-class OdooManager:
-    def get_commercial_lines_stacked_data(self, date_from=None, date_to=None, linea_id=None, partner_id=None):
-        """Devuelve datos para gráfico apilado por línea comercial y 5 categorías"""
-        # CORRECCIÓN: get_sales_lines devuelve una tupla (datos, paginación). Solo necesitamos los datos.
-        sales_lines, _ = self.get_sales_lines(
-            date_from=date_from,
-            date_to=date_to,
-            partner_id=partner_id,
-            linea_id=linea_id
+# Registro de llamadas RPC del contexto actual (ver OdooManager.collect_rpc_timings)
+_rpc_call_log = contextvars.ContextVar('odoo_rpc_call_log', default=None)
+
+# Conexiones TCP abiertas por la petición en curso de cada hilo (ver _OdooHTTPAdapter)
+_rpc_connections = threading.local()
+
+
+def _count_new_connection(conn):
+    # Sin socket: esta petición abre la conexión (TCP + TLS) en el hilo que la hace
+    if getattr(conn, 'sock', None) is None:
+        _rpc_connections.new = getattr(_rpc_connections, 'new', 0) + 1
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _make_request(self, conn, *args, **kwargs):
+        _count_new_connection(conn)
+        return super()._make_request(conn, *args, **kwargs)
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _make_request(self, conn, *args, **kwargs):
+        _count_new_connection(conn)
+        return super()._make_request(conn, *args, **kwargs)
+
+
+class _OdooHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter cuyos pools cuentan cada conexión nueva para la llamada que la abrió.
+    
+    Con varias llamadas en paralelo (_run_task_graph) comparar el total del pool
+    antes y después atribuía la conexión de una llamada a otra; aquí se marca en
+    el propio hilo de la petición, justo antes de usar la conexión.
+    """
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+# Filas por lote de los iteradores de exportación (iter_sales_lines, iter_pending_orders)
+try:
+    EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '2000'))
+except Exception:
+    EXPORT_BATCH_SIZE = 2000
+
+class OdooMasterDataCache:
+    """Caché read-through de datos maestros de Odoo (productos, clientes, impuestos).
+    
+    Guarda cada registro por id con su write_date. Mientras el registro está
+    dentro del TTL se sirve desde memoria; al vencer, se pregunta a Odoo solo
+    por los ids cuyo write_date cambió y el resto se revalida sin releerlos.
+    Cada modelo tiene su propio LRU acotado. El contexto de lectura (idioma) es
+    parte de la clave: un registro leído en es_PE no se sirve a quien lo pide
+    sin idioma, y viceversa.
+    """
+    
+    # Contexto por defecto de las lecturas (el de get_sales_lines)
+    DEFAULT_CONTEXT = {'lang': 'es_PE'}
+    
+    # Unión de los campos que usan get_sales_lines y get_pending_orders
+    MODEL_FIELDS = {
+        'product.product': [
+            'name', 'default_code', 'categ_id', 'commercial_line_national_id',
+            'display_name', 'commercial_line_international_id',
+            'pharmacological_classification_id', 'pharmaceutical_forms_id',
+            'administration_way_id', 'production_line_id', 'product_life_cycle',
+        ],
+        'res.partner': ['vat', 'name', 'country_id'],
+        'account.tax': ['name'],
+    }
+    
+    def __init__(self, manager, ttl=None, max_size=None):
+        self.manager = manager
+        if ttl is None:
+            try:
+                ttl = int(os.getenv('ODOO_MASTER_CACHE_TTL', '900'))
+            except Exception:
+                ttl = 900
+        if max_size is None:
+            try:
+                max_size = int(os.getenv('ODOO_MASTER_CACHE_SIZE', '20000'))
+            except Exception:
+                max_size = 20000
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self._lock = threading.Lock()
+        # {modelo: OrderedDict((contexto, id) -> (registro, validado_en, write_date))}
+        self._entries = {model: OrderedDict() for model in self.MODEL_FIELDS}
+        self._stats = {model: {'hits': 0, 'misses': 0, 'revalidated': 0, 'updated': 0, 'evictions': 0}
+                       for model in self.MODEL_FIELDS}
+    
+    def _read(self, model, domain, fields, context):
+        # active_test=False: los ids vienen de documentos existentes, aunque el registro esté archivado
+        return self.manager.models.execute_kw(
+            self.manager.db, self.manager.uid, self.manager.password, model, 'search_read',
+            [domain],
+            {'fields': fields, 'context': dict(context, active_test=False)}
         )
+    
+    def get_records(self, model, ids, context=None):
+        """Devuelve {id: registro} para los ids pedidos, consultando a Odoo solo lo necesario.
+        
+        context: contexto de lectura de Odoo (por defecto DEFAULT_CONTEXT; {} = sin idioma,
+        como un read sin contexto). Los registros se guardan por contexto.
+        """
+        ids = list(set(i for i in ids if i))
+        if not ids:
+            return {}
+        
+        context = dict(self.DEFAULT_CONTEXT if context is None else context)
+        ctx = tuple(sorted(context.items()))
+        now = time.monotonic()
+        result = {}
+        missing = []
+        stale = {}
+        with self._lock:
+            entries = self._entries[model]
+            stats = self._stats[model]
+            for record_id in ids:
+                entry = entries.get((ctx, record_id))
+                if entry is None:
+                    missing.append(record_id)
+                    continue
+                entries.move_to_end((ctx, record_id))
+                if now - entry[1] < self.ttl:
+                    result[record_id] = entry[0]
+                    stats['hits'] += 1
+                else:
+                    stale[record_id] = entry
+            stats['misses'] += len(missing)
+        
+        # Registros vencidos: solo se releen los que cambiaron en Odoo desde la última lectura
+        to_fetch = list(missing)
+        if stale:
+            oldest = min((entry[2] for entry in stale.values() if entry[2]), default=False)
+            domain = [('id', 'in', list(stale.keys()))]
+            if oldest:
+                domain.append(('write_date', '>', oldest))
+            changed = self._read(model, domain, ['write_date'], context)
+            if changed is None:
+                # Odoo no respondió: se sirve lo que hay en memoria
+                changed = []
+                for record_id, entry in stale.items():
+                    result[record_id] = entry[0]
+            changed_ids = set(
+                rec['id'] for rec in changed
+                if not stale[rec['id']][2] or rec.get('write_date') != stale[rec['id']][2]
+            ) if changed else set()
+            with self._lock:
+                entries = self._entries[model]
+                for record_id, entry in stale.items():
+                    if record_id in changed_ids:
+                        to_fetch.append(record_id)
+                    elif record_id not in result:
+                        entries[(ctx, record_id)] = (entry[0], now, entry[2])
+                        result[record_id] = entry[0]
+                        self._stats[model]['revalidated'] += 1
+                self._stats[model]['updated'] += len(changed_ids)
+        
+        if to_fetch:
+            records = self._read(model, [('id', 'in', to_fetch)], self.MODEL_FIELDS[model] + ['write_date'], context)
+            if records:
+                with self._lock:
+                    entries = self._entries[model]
+                    for rec in records:
+                        entries[(ctx, rec['id'])] = (rec, now, rec.get('write_date'))
+                        entries.move_to_end((ctx, rec['id']))
+                        result[rec['id']] = rec
+                    while len(entries) > self.max_size:
+                        entries.popitem(last=False)
+                        self._stats[model]['evictions'] += 1
+        
+        return result
+    
+    def invalidate(self, model=None, ids=None):
+        """Descarta registros de la caché (todo el modelo si no se indican ids)."""
+        with self._lock:
+            models = [model] if model else list(self._entries)
+            for m in models:
+                if ids is None:
+                    self._entries[m].clear()
+                else:
+                    ids = set(ids)
+                    for key in [key for key in self._entries[m] if key[1] in ids]:
+                        del self._entries[m][key]
+    
+    def get_stats(self):
+        """Contadores de aciertos/fallos por modelo y tamaño actual de cada caché."""
+        with self._lock:
+            stats = {}
+            for model, counters in self._stats.items():
+                stats[model] = dict(counters, size=len(self._entries[model]))
+                lookups = counters['hits'] + counters['misses'] + counters['revalidated'] + counters['updated']
+                stats[model]['hit_rate'] = (counters['hits'] + counters['revalidated']) / lookups if lookups else 0.0
+            return stats
+
+
+class OdooManager:
+    def get_commercial_lines_stacked_data(self, date_from=None, date_to=None, linea_id=None, partner_id=None, sales_lines=None):
+        """Devuelve datos para gráfico apilado por línea comercial y 5 categorías
+        
+        Si el llamador ya tiene las líneas del mismo rango y cliente (p. ej. el
+        dashboard), puede pasarlas en sales_lines para no volver a consultar Odoo.
+        """
+        if sales_lines is None:
+            # Las sumas de cantidad por categoría salen igual de las filas agrupadas por producto/cliente
+            sales_lines = self.get_sales_aggregates(
+                date_from=date_from,
+                date_to=date_to,
+                partner_id=partner_id,
+                linea_id=linea_id,
+                exclude_service_codes=False
+            )
+        if sales_lines is None:
+            # Sin page/per_page get_sales_lines devuelve todas las líneas del rango
+            sales_lines = self.get_sales_lines(
+                date_from=date_from,
+                date_to=date_to,
+                partner_id=partner_id,
+                linea_id=linea_id,
+                page=None,
+                per_page=None
+            )
         # Nombres de las categorías a apilar
         categories = [
             ('pharmaceutical_forms_id', 'Forma Farmacéutica'),
@@ -68,6 +294,11 @@ class OdooManager:
             'legend': [cat[1] for cat in categories]
         }
     def __init__(self):
+        # Copia local de las líneas de venta (se asigna desde app.py, ver database/sales_store.py)
+        self.sales_store = None
+        # Consulta de pedidos pendientes de facturar (ver database/pending_orders.py)
+        self.pending_engine = PendingOrdersEngine(self)
+        
         # Configurar conexión a Odoo - Usar JSON-RPC (evita cs_login_audit_log)
         try:
             # Cargar credenciales desde variables de entorno
@@ -93,28 +324,16 @@ class OdooManager:
             # URL para JSON-RPC
             self.jsonrpc_url = f"{self.url}/jsonrpc"
             
+            # Pool de conexiones HTTP compartido (keep-alive) para todas las llamadas JSON-RPC
+            self._init_http_pool()
+            
+            # Caché de datos maestros (productos, clientes, impuestos)
+            self.master_data = OdooMasterDataCache(self)
+            
             # === AUTENTICACIÓN VIA JSON-RPC ===
             # Este método evita el módulo cs_login_audit_log que bloquea XML-RPC
             try:
-                headers = {"Content-Type": "application/json"}
-                payload = {
-                    "jsonrpc": "2.0",
-                    "method": "call",
-                    "params": {
-                        "service": "common",
-                        "method": "authenticate",
-                        "args": [self.db, self.username, self.password, {}]
-                    },
-                    "id": 1
-                }
-                
-                response = requests.post(
-                    self.jsonrpc_url,
-                    json=payload,
-                    headers=headers,
-                    timeout=self.rpc_timeout
-                )
-                result = response.json()
+                result = self._jsonrpc_call('common', 'authenticate', [self.db, self.username, self.password, {}])
                 
                 if "result" in result and result["result"]:
                     self.uid = result["result"]
@@ -141,6 +360,211 @@ class OdooManager:
             self.uid = None
             self.models = None
     
+    def _init_http_pool(self):
+        """Configura el pool de conexiones HTTP compartido para JSON-RPC.
+        
+        Un único HTTPAdapter (thread-safe) mantiene las conexiones keep-alive
+        hacia Odoo; cada hilo usa su propia requests.Session montada sobre
+        ese adapter, de modo que todas las llamadas reutilizan el mismo pool.
+        Reintentos con backoff solo ante errores de conexión y 502/503/504:
+        el manager únicamente hace lecturas, así que reintentar un POST es seguro.
+        """
+        try:
+            self.pool_size = int(os.getenv('ODOO_POOL_SIZE', '10'))
+        except Exception:
+            self.pool_size = 10
+        try:
+            self.max_retries = int(os.getenv('ODOO_MAX_RETRIES', '3'))
+        except Exception:
+            self.max_retries = 3
+        try:
+            self.retry_backoff = float(os.getenv('ODOO_RETRY_BACKOFF', '0.5'))
+        except Exception:
+            self.retry_backoff = 0.5
+        try:
+            # Consultas de enriquecimiento simultáneas; nunca más que el tamaño del pool
+            self.max_concurrency = max(1, min(int(os.getenv('ODOO_MAX_CONCURRENCY', '4')), self.pool_size))
+        except Exception:
+            self.max_concurrency = min(4, self.pool_size)
+        
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=self.max_retries,
+            status=self.max_retries,
+            backoff_factor=self.retry_backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['POST']),
+            raise_on_status=False
+        )
+        self._http_adapter = _OdooHTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+            pool_block=True
+        )
+        self._http_local = threading.local()
+        
+        # Estadísticas acumuladas de llamadas RPC (ventana móvil)
+        self._rpc_stats_lock = threading.Lock()
+        self._rpc_history = deque(maxlen=500)
+        self._rpc_totals = {'calls': 0, 'seconds': 0.0, 'new_connections': 0}
+    
+    def _get_http_session(self):
+        """Devuelve la requests.Session del hilo actual, montada sobre el pool compartido."""
+        session = getattr(self._http_local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update({"Content-Type": "application/json"})
+            session.mount('https://', self._http_adapter)
+            session.mount('http://', self._http_adapter)
+            self._http_local.session = session
+        return session
+    
+    def _jsonrpc_call(self, service, method, args, label=None):
+        """Ejecuta una llamada JSON-RPC sobre el pool compartido y registra su tiempo.
+        
+        Devuelve el JSON de respuesta tal cual (con 'result' o 'error').
+        """
+        payload = {
+            "jsonrpc": "2.0",
+            "method": "call",
+            "params": {
+                "service": service,
+                "method": method,
+                "args": args
+            },
+            "id": 1
+        }
+        
+        _rpc_connections.new = 0
+        start = time.perf_counter()
+        try:
+            with span(f"odoo.{label or f'{service}.{method}'}"):
+                response = self._get_http_session().post(
+                    self.jsonrpc_url,
+                    json=payload,
+                    timeout=self.rpc_timeout
+                )
+                return response.json()
+        finally:
+            elapsed = time.perf_counter() - start
+            new_connections = _rpc_connections.new
+            self._record_rpc_timing(label or f"{service}.{method}", elapsed, new_connections)
+    
+    def _record_rpc_timing(self, label, seconds, new_connections):
+        """Guarda el tiempo de una llamada en las estadísticas globales y en el colector activo."""
+        entry = {'call': label, 'seconds': seconds, 'new_connection': new_connections > 0}
+        with self._rpc_stats_lock:
+            self._rpc_history.append(entry)
+            self._rpc_totals['calls'] += 1
+            self._rpc_totals['seconds'] += seconds
+            self._rpc_totals['new_connections'] += new_connections
+        call_log = _rpc_call_log.get()
+        if call_log is not None:
+            call_log.append(entry)
+    
+    @staticmethod
+    def summarize_rpc_timings(entries):
+        """Resume una lista de tiempos RPC: total, conexiones nuevas vs reutilizadas.
+        
+        La diferencia entre el promedio con conexión nueva y con conexión
+        reutilizada aproxima el costo del handshake TCP+TLS por llamada.
+        """
+        new_conn = [e['seconds'] for e in entries if e['new_connection']]
+        reused = [e['seconds'] for e in entries if not e['new_connection']]
+        avg_new = sum(new_conn) / len(new_conn) if new_conn else 0.0
+        avg_reused = sum(reused) / len(reused) if reused else 0.0
+        return {
+            'calls': len(entries),
+            'total_seconds': sum(e['seconds'] for e in entries),
+            'new_connections': len(new_conn),
+            'reused_connections': len(reused),
+            'avg_seconds_new_connection': avg_new,
+            'avg_seconds_reused_connection': avg_reused,
+            'estimated_handshake_seconds': max(0.0, avg_new - avg_reused) * len(new_conn) if reused else 0.0,
+            'by_call': [dict(e) for e in entries]
+        }
+    
+    @contextmanager
+    def collect_rpc_timings(self, calls=None):
+        """Context manager que recolecta los tiempos de cada llamada RPC hecha dentro del bloque.
+        
+        Se puede pasar una lista existente para acumular varios bloques en ella.
+        
+        Ejemplo:
+            with data_manager.collect_rpc_timings() as calls:
+                data_manager.get_sales_lines(...)
+            stats = OdooManager.summarize_rpc_timings(calls)
+        """
+        if calls is None:
+            calls = []
+        token = _rpc_call_log.set(calls)
+        try:
+            yield calls
+        finally:
+            _rpc_call_log.reset(token)
+    
+    def get_rpc_stats(self):
+        """Estadísticas acumuladas del pool desde el arranque y de las últimas llamadas."""
+        if not hasattr(self, '_rpc_stats_lock'):
+            return {}
+        with self._rpc_stats_lock:
+            totals = dict(self._rpc_totals)
+            recent = list(self._rpc_history)
+        return {
+            'pool_size': self.pool_size,
+            'max_retries': self.max_retries,
+            'total_calls': totals['calls'],
+            'total_seconds': totals['seconds'],
+            'total_new_connections': totals['new_connections'],
+            'recent': self.summarize_rpc_timings(recent)
+        }
+    
+    def _run_task_graph(self, tasks):
+        """Ejecuta consultas independientes en paralelo respetando sus dependencias.
+        
+        tasks: {nombre: (dependencias, fn)} donde fn recibe el dict de resultados
+        ya disponibles y devuelve su propio resultado. Cada tarea se lanza en
+        cuanto terminan sus dependencias, con a lo sumo ODOO_MAX_CONCURRENCY
+        llamadas en vuelo. Si una tarea falla, la excepción se propaga igual que
+        en la versión secuencial (las tareas opcionales capturan sus propios errores).
+        """
+        results = {}
+        pending = dict(tasks)
+        
+        if self.max_concurrency <= 1:
+            # Modo secuencial: mismo orden de resolución, sin hilos
+            while pending:
+                ready = [name for name, (deps, _) in pending.items() if all(d in results for d in deps)]
+                if not ready:
+                    raise ValueError(f"Dependencias no resolubles: {list(pending)}")
+                for name in ready:
+                    _, fn = pending.pop(name)
+                    results[name] = fn(results)
+            return results
+        
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='odoo-rpc') as executor:
+            while pending or running:
+                for name in [n for n, (deps, _) in pending.items() if all(d in results for d in deps)]:
+                    _, fn = pending.pop(name)
+                    # Copiar el contexto para que el colector de tiempos RPC siga activo en el hilo
+                    ctx = contextvars.copy_context()
+                    running[executor.submit(ctx.run, fn, dict(results))] = name
+                if not running:
+                    raise ValueError(f"Dependencias no resolubles: {list(pending)}")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception:
+                        for other in running:
+                            other.cancel()
+                        raise
+        return results
+
     def _create_jsonrpc_models_proxy(self):
         """Crea un objeto proxy que simula el comportamiento de xmlrpc models"""
         class JSONRPCModelsProxy:
@@ -153,25 +577,11 @@ class OdooManager:
                     kwargs = {}
                 
                 try:
-                    headers = {"Content-Type": "application/json"}
-                    payload = {
-                        "jsonrpc": "2.0",
-                        "method": "call",
-                        "params": {
-                            "service": "object",
-                            "method": "execute_kw",
-                            "args": [db, uid, password, model, method, args, kwargs]
-                        },
-                        "id": 1
-                    }
-                    
-                    response = requests.post(
-                        self.manager.jsonrpc_url,
-                        json=payload,
-                        headers=headers,
-                        timeout=self.manager.rpc_timeout
+                    result = self.manager._jsonrpc_call(
+                        'object', 'execute_kw',
+                        [db, uid, password, model, method, args, kwargs],
+                        label=f"{model}.{method}"
                     )
-                    result = response.json()
                     
                     if "result" in result:
                         return result["result"]
@@ -193,54 +603,22 @@ class OdooManager:
         """Autenticar usuario contra Odoo y devolver sus datos si es exitoso."""
         try:
             # === USAR JSON-RPC para autenticación ===
-            headers = {"Content-Type": "application/json"}
-            
             # Autenticar
-            auth_payload = {
-                "jsonrpc": "2.0",
-                "method": "call",
-                "params": {
-                    "service": "common",
-                    "method": "authenticate",
-                    "args": [self.db, username, password, {}]
-                },
-                "id": 1
-            }
-            
-            response = requests.post(
-                self.jsonrpc_url,
-                json=auth_payload,
-                headers=headers,
-                timeout=self.rpc_timeout
-            )
-            result = response.json()
+            result = self._jsonrpc_call('common', 'authenticate', [self.db, username, password, {}])
             
             if "result" in result and result["result"]:
                 uid = result["result"]
                 
                 # Leer datos del usuario
-                read_payload = {
-                    "jsonrpc": "2.0",
-                    "method": "call",
-                    "params": {
-                        "service": "object",
-                        "method": "execute_kw",
-                        "args": [
-                            self.db, uid, password,
-                            'res.users', 'read',
-                            [uid], {'fields': ['name', 'login']}
-                        ]
-                    },
-                    "id": 2
-                }
-                
-                response = requests.post(
-                    self.jsonrpc_url,
-                    json=read_payload,
-                    headers=headers,
-                    timeout=self.rpc_timeout
+                result = self._jsonrpc_call(
+                    'object', 'execute_kw',
+                    [
+                        self.db, uid, password,
+                        'res.users', 'read',
+                        [uid], {'fields': ['name', 'login']}
+                    ],
+                    label='res.users.read'
                 )
-                result = response.json()
                 
                 if "result" in result and result["result"]:
                     return result["result"][0]  # {'id': uid, 'name': 'John Doe', 'login': '...'}
@@ -409,6 +787,7 @@ class OdooManager:
             logging.error(f"Error al obtener opciones de filtro de ventas: {e}")
             return {'commercial_lines': [], 'lineas': [], 'partners': [], 'clientes': []}
 
+    @traced('odoo_manager.get_filter_options')
     def get_filter_options(self):
         """Alias para get_sales_filter_options para compatibilidad"""
         return self.get_sales_filter_options()
@@ -438,11 +817,157 @@ class OdooManager:
             logging.error(f"Error obteniendo la lista de vendedores: {e}")
             return []
 
-    def get_sales_lines(self, page=1, per_page=1000, filters=None, date_from=None, date_to=None, partner_id=None, linea_id=None, search=None, limit=None):
-        """Obtener líneas de venta completas con todas las 27 columnas"""
+    def _sales_base_domain(self):
+        """Dominio base de las ventas internacionales (diario F150, asientos publicados)."""
+        return [
+            ('move_id.journal_id.name', '=', 'F150 (Venta exterior)'), # Diario de Venta Exterior por nombre
+            ('move_id.state', '=', 'posted'),
+            ('account_id.code', '=like', '70%'), # La cuenta DEBE empezar con '70'.
+            ('tax_ids.name', 'ilike', 'EXE_IGV_EXP'), # Filtro por impuesto EXE_IGV_EXP
+            # Filtros para excluir productos no deseados
+            ('product_id', '!=', False),
+            ('product_id.name', '!=', 'VTA SERV GENERALES') # Excluir explícitamente el producto de servicio
+        ]
+
+    # ------------------------------------------------------------------
+    # Paginación por keyset (cursor)
+    # ------------------------------------------------------------------
+    # Con offset, Odoo recorre y descarta todas las filas anteriores a la página
+    # (las páginas profundas son cada vez más lentas) y cada página paga además un
+    # search_count. En modo keyset la página se pide "después de" (o "antes de")
+    # la clave (fecha, id) de la última fila vista, con limit = per_page + 1 para
+    # saber si hay más sin contar. El parámetro keyset de get_sales_lines y
+    # get_pending_orders es un dict:
+    #     {'key': [fecha, id] | None, 'direction': 'next' | 'prev'}
+    # ({} o key=None = primera página). Con count=False no se hace search_count.
+
+    @staticmethod
+    def _keyset_domain(key_fields, key, direction):
+        """Dominio de las filas siguientes ('next') o anteriores ('prev') a key en orden descendente."""
+        (campo, campo_id), (valor, valor_id) = key_fields, key
+        op = '<' if direction == 'next' else '>'
+        return ['|', (campo, op, valor), '&', (campo, '=', valor), (campo_id, op, valor_id)]
+
+    @staticmethod
+    def _keyset_result(rows, keys, per_page, keyset, total=None):
+        """Recorta la fila extra de una página keyset y arma su información de paginación.
+        
+        rows y keys llegan en el orden de lectura (ascendente si se retrocede) con
+        hasta per_page + 1 elementos; se devuelven siempre en orden descendente.
+        """
+        direction = keyset.get('direction') or 'next'
+        hay_mas = len(rows) > per_page
+        rows, keys = list(rows[:per_page]), list(keys[:per_page])
+        if direction == 'prev':
+            rows.reverse()
+            keys.reverse()
+            has_next, has_prev = True, hay_mas
+        else:
+            has_next, has_prev = hay_mas, keyset.get('key') is not None
+        return rows, {
+            'mode': 'keyset',
+            'per_page': per_page,
+            'total': total,
+            'has_next': has_next,
+            'has_prev': has_prev,
+            'first_key': keys[0] if keys else None,
+            'last_key': keys[-1] if keys else None
+        }
+
+    def _keyset_search_read(self, model, domain, fields, key_fields, per_page, keyset, count=True, context=None):
+        """Una página keyset de search_read (orden descendente por key_fields) y, si se pide, el total.
+        
+        El search_count y la lectura de la página van en paralelo.
+        
+        Returns:
+            (filas en orden descendente, información de paginación)
+        """
+        direction = keyset.get('direction') or 'next'
+        key = keyset.get('key')
+        page_domain = list(domain)
+        if key is not None:
+            page_domain += self._keyset_domain(key_fields, key, direction)
+        sentido = 'desc' if direction == 'next' else 'asc'
+        options = {
+            'fields': list(fields) + [campo for campo in key_fields if campo not in fields and campo != 'id'],
+            'order': ', '.join(f'{campo} {sentido}' for campo in key_fields),
+            'limit': per_page + 1
+        }
+        if context:
+            options['context'] = context
+        
+        def read_page(results):
+            rows = self.models.execute_kw(self.db, self.uid, self.password, model, 'search_read',
+                                          [page_domain], options)
+            if rows is None:
+                raise RuntimeError(f"Odoo no devolvió la página de {model}")
+            return rows
+        
+        tasks = {'rows': ((), read_page)}
+        if count:
+            tasks['total'] = ((), lambda results: self.models.execute_kw(
+                self.db, self.uid, self.password, model, 'search_count', [list(domain)]
+            ))
+        results = self._run_task_graph(tasks)
+        
+        def clave(row):
+            return [valor[0] if isinstance(valor, (list, tuple)) else valor
+                    for valor in (row.get(campo) for campo in key_fields)]
+        
+        rows = results['rows']
+        return self._keyset_result(rows, [clave(row) for row in rows], per_page, keyset,
+                                   total=results.get('total'))
+
+    @traced('odoo_manager.get_sales_lines')
+    def get_sales_lines(self, page=1, per_page=1000, filters=None, date_from=None, date_to=None, partner_id=None, linea_id=None, search=None, limit=None,
+                        keyset=None, count=True):
+        """Obtener líneas de venta completas con todas las 27 columnas
+        
+        Con page=None y per_page=None devuelve solo la lista, sin límite de filas.
+        Con keyset (ver _keyset_search_read) pagina por (invoice_date, id) en lugar
+        de offset e ignora page; count=False omite el total.
+        Si hay un SalesStore sincronizado (ver database/sales_store.py) se lee
+        desde la copia local en lugar de consultar Odoo.
+        """
         try:
+            # Manejar parámetros de ambos formatos de llamada
+            if filters:
+                date_from = filters.get('date_from')
+                date_to = filters.get('date_to')
+                partner_id = filters.get('partner_id')
+                linea_id = filters.get('linea_id')
+                search = filters.get('search')
+            
+            # Copia local sincronizada: responde sin ir a Odoo si cubre el rango pedido
+            if self.sales_store is not None and keyset is not None:
+                stored = self.sales_store.query_sales_lines_keyset(
+                    date_from=date_from, date_to=date_to, partner_id=partner_id,
+                    linea_id=linea_id, search=search, limit=per_page + 1,
+                    key=keyset.get('key'), direction=keyset.get('direction') or 'next', count=count
+                )
+                if stored is not None:
+                    sales_lines, keys, total_count = stored
+                    return self._keyset_result(sales_lines, keys, per_page, keyset, total=total_count)
+            elif self.sales_store is not None:
+                stored = self.sales_store.query_sales_lines(
+                    date_from=date_from, date_to=date_to, partner_id=partner_id,
+                    linea_id=linea_id, search=search, page=page, per_page=per_page
+                )
+                if stored is not None:
+                    sales_lines, total_count = stored
+                    if page is not None and per_page is not None:
+                        return sales_lines, {
+                            'page': page,
+                            'per_page': per_page,
+                            'total': total_count,
+                            'pages': (total_count + per_page - 1) // per_page
+                        }
+                    return sales_lines
+            
             # Verificar conexión
             if not self.uid or not self.models:
+                if keyset is not None:
+                    return self._keyset_result([], [], per_page, keyset, total=0)
                 if page is not None and per_page is not None:
                     return [], {'page': page, 'per_page': per_page, 'total': 0, 'pages': 0}
                 return []
@@ -450,23 +975,7 @@ class OdooManager:
             # Obtener lista de facturas internacionales si no hay partner_id específico
             # Este filtro ahora se aplica directamente en el dominio principal
             # para que siempre se filtren las ventas internacionales.
-            domain = [
-                ('move_id.journal_id.name', '=', 'F150 (Venta exterior)'), # Diario de Venta Exterior por nombre
-                ('move_id.state', '=', 'posted'),
-                ('account_id.code', '=like', '70%'), # La cuenta DEBE empezar con '70'.
-                ('tax_ids.name', 'ilike', 'EXE_IGV_EXP'), # Filtro por impuesto EXE_IGV_EXP
-                # Filtros para excluir productos no deseados
-                ('product_id', '!=', False),
-                ('product_id.name', '!=', 'VTA SERV GENERALES') # Excluir explícitamente el producto de servicio
-            ]
-            
-            # Manejar parámetros de ambos formatos de llamada
-            if filters:
-                date_from = filters.get('date_from')
-                date_to = filters.get('date_to')
-                partner_id = filters.get('partner_id')
-                linea_id = filters.get('linea_id')
-                search = filters.get('search')
+            domain = self._sales_base_domain()
             
             # Detectar tipo de búsqueda ANTES de construir el dominio
             if search:
@@ -490,17 +999,31 @@ class OdooManager:
             if linea_id:
                 domain.append(('product_id.commercial_line_international_id', '=', linea_id))
 
+            if keyset is not None:
+                keyset_domain = domain + ([('move_id.partner_id', '=', int(partner_id))] if partner_id else [])
+                sales_lines_base, pagination_info = self._keyset_search_read(
+                    'account.move.line', keyset_domain,
+                    ['move_id', 'partner_id', 'product_id', 'balance', 'move_name',
+                     'quantity', 'price_unit', 'tax_ids', 'amount_currency', 'display_name',
+                     'write_date'],
+                    ('invoice_date', 'id'), per_page, keyset, count=count, context={'lang': 'es_PE'}
+                )
+                return (self._enrich_sales_lines(sales_lines_base) if sales_lines_base else []), pagination_info
+
             # Contar el total de registros que coinciden con el dominio (para paginación)
-            total_count = self.models.execute_kw(
-                self.db, self.uid, self.password, 'account.move.line', 'search_count',
-                [domain + ([('move_id.partner_id', '=', int(partner_id))] if partner_id else [])]
-            )
+            total_count = 0
+            if page is not None and per_page is not None:
+                total_count = self.models.execute_kw(
+                    self.db, self.uid, self.password, 'account.move.line', 'search_count',
+                    [domain + ([('move_id.partner_id', '=', int(partner_id))] if partner_id else [])]
+                )
 
             # Obtener líneas base con todos los campos necesarios
             query_options = {
                 'fields': [
                     'move_id', 'partner_id', 'product_id', 'balance', 'move_name',
-                    'quantity', 'price_unit', 'tax_ids', 'amount_currency', 'display_name'
+                    'quantity', 'price_unit', 'tax_ids', 'amount_currency', 'display_name',
+                    'write_date'
                 ],
                 'context': {'lang': 'es_PE'}
             }
@@ -511,9 +1034,10 @@ class OdooManager:
                 final_domain = domain + [('move_id.partner_id', '=', int(partner_id))]
 
 
-            # Aplicar paginación
-            query_options['limit'] = per_page
-            query_options['offset'] = (page - 1) * per_page
+            # Aplicar paginación (sin límite cuando no se pide página)
+            if page is not None and per_page is not None:
+                query_options['limit'] = per_page
+                query_options['offset'] = (page - 1) * per_page
 
             sales_lines_base = self.models.execute_kw(
                 self.db, self.uid, self.password, 'account.move.line', 'search_read',
@@ -521,99 +1045,107 @@ class OdooManager:
                 query_options
             )
             if not sales_lines_base:
-                return [], {'page': page, 'per_page': per_page, 'total': 0, 'pages': 0}
-
-            # Si no hay líneas, devolver estructura de paginación vacía
-            if not sales_lines_base:
-                return [], {'page': page, 'per_page': per_page, 'total': 0, 'pages': 0}
+                if page is not None and per_page is not None:
+                    return [], {'page': page, 'per_page': per_page, 'total': 0, 'pages': 0}
+                return []
 
 
-            # Obtener IDs únicos para consultas relacionadas
-            move_ids = list(set([line['move_id'][0] for line in sales_lines_base if line.get('move_id')]))
-            product_ids = list(set([line['product_id'][0] for line in sales_lines_base if line.get('product_id')]))
-            # partner_ids se obtiene después de consultar los moves
-            partner_ids = []  # Inicializar vacío
-            
+            sales_lines = self._enrich_sales_lines(sales_lines_base)
             
-            # Obtener datos de facturas (account.move) - Asientos contables
-            move_data = {}
-            if move_ids:
-                moves = self.models.execute_kw(
-                    self.db, self.uid, self.password, 'account.move', 'search_read',
-                    [[('id', 'in', move_ids)]],
-                    {
-                        'fields': [
-                            'payment_state', 'team_id', 'invoice_user_id', 'invoice_origin',
-                            'invoice_date', 'l10n_latam_document_type_id', 'origin_number',
-                            'order_id', 'name', 'ref', 'journal_id', 'amount_total', 'state',
-                            'currency_id', 'exchange_rate', 'partner_id'
-                        ],
-                        'context': {'lang': 'es_PE'}
-                    }
-                )
-                move_data = {m['id']: m for m in moves}
-                
-                # Extraer partner_ids de los moves (facturas) en lugar de las líneas
-                partner_ids = list(set([m['partner_id'][0] for m in moves if m.get('partner_id')]))
-                
-                # DEBUG: Mostrar todos los canales de venta (team_id) únicos
-                unique_teams = set()
-                for move in moves:
-                    if move.get('team_id') and isinstance(move['team_id'], list) and len(move['team_id']) > 1:
-                        unique_teams.add(move['team_id'][1])
-                
+            # Líneas de S00791 procesadas correctamente
             
-            # Obtener datos de productos con todos los campos farmacéuticos
-            product_data = {}
-            if product_ids:
-                products = self.models.execute_kw(
-                    self.db, self.uid, self.password, 'product.product', 'search_read',
-                    [[('id', 'in', product_ids)]],
-                    {
-                        'fields': [
-                            'name', 'default_code', 'categ_id', 'commercial_line_national_id',
-                            'display_name', # <-- CAMBIO: Añadir display_name
-                            'commercial_line_international_id', # <-- CAMBIO: Añadir este campo
-                            'pharmacological_classification_id', 'pharmaceutical_forms_id',
-                            'administration_way_id', 'production_line_id', 'product_life_cycle',
-                        ],
-                        'context': {'lang': 'es_PE'}
-                    }
-                )
-                product_data = {p['id']: p for p in products}
+            # Si se solicita paginación, devolver tupla (datos, paginación)
+            if page is not None and per_page is not None:
+                pagination_info = {
+                    'page': page,
+                    'per_page': per_page,
+                    'total': total_count,
+                    'pages': (total_count + per_page - 1) // per_page
+                }
+                return sales_lines, pagination_info
+            else:
+                # Si no, devolver solo los datos (comportamiento anterior)
+                return sales_lines
+
             
+        except Exception as e:
+            logging.error(f"Error al obtener las líneas de venta de Odoo: {e}")
+            # Devolver formato apropiado según si se solicitó paginación
+            if keyset is not None:
+                return self._keyset_result([], [], per_page, keyset, total=0)
+            if page is not None and per_page is not None:
+                return [], {'page': page, 'per_page': per_page, 'total': 0, 'pages': 0}
+            return []
+
+    def _enrich_sales_lines(self, sales_lines_base):
+        """Completa las líneas base de account.move.line con factura, producto, cliente,
+        pedido, lote e impuestos y las convierte al formato de 27 columnas."""
+        # Obtener IDs únicos para consultas relacionadas
+        move_ids = list(set([line['move_id'][0] for line in sales_lines_base if line.get('move_id')]))
+        product_ids = list(set([line['product_id'][0] for line in sales_lines_base if line.get('product_id')]))
+        move_line_ids = [line['id'] for line in sales_lines_base]
+        all_tax_ids = set()
+        for line in sales_lines_base:
+            if line.get('tax_ids'):
+                all_tax_ids.update(line['tax_ids'])
+        
+        # --- CONSULTAS DE ENRIQUECIMIENTO EN PARALELO ---
+        # Cada consulta declara de qué resultados depende; las independientes
+        # (facturas, productos, impuestos, búsqueda inversa de pedidos) salen a la vez
+        # y el resto se lanza en cuanto sus dependencias terminan.
+        
+        def fetch_moves(results):
+            # Obtener datos de facturas (account.move) - Asientos contables
+            if not move_ids:
+                return {}
+            moves = self.models.execute_kw(
+                self.db, self.uid, self.password, 'account.move', 'search_read',
+                [[('id', 'in', move_ids)]],
+                {
+                    'fields': [
+                        'payment_state', 'team_id', 'invoice_user_id', 'invoice_origin',
+                        'invoice_date', 'l10n_latam_document_type_id', 'origin_number',
+                        'order_id', 'name', 'ref', 'journal_id', 'amount_total', 'state',
+                        'currency_id', 'exchange_rate', 'partner_id', 'write_date'
+                    ],
+                    'context': {'lang': 'es_PE'}
+                }
+            )
+            return {m['id']: m for m in moves}
+        
+        def fetch_products(results):
+            # Datos de productos con todos los campos farmacéuticos (desde la caché de datos maestros)
+            return self.master_data.get_records('product.product', product_ids)
+        
+        def fetch_partners(results):
             # Obtener datos de clientes incluyendo país
-            partner_data = {}
-            if partner_ids:
-                partners = self.models.execute_kw(
-                    self.db, self.uid, self.password, 'res.partner', 'search_read',
-                    [[('id', 'in', partner_ids)]],
-                    {'fields': ['vat', 'name', 'country_id'], 'context': {'lang': 'es_PE'}}
-                )
-                partner_data = {p['id']: p for p in partners}
-            
+            # Extraer partner_ids de los moves (facturas) en lugar de las líneas
+            partner_ids = [m['partner_id'][0] for m in results['moves'].values() if m.get('partner_id')]
+            return self.master_data.get_records('res.partner', partner_ids)
+        
+        def fetch_orders(results):
             # Obtener datos de órdenes de venta con más campos
-            order_ids = [move['order_id'][0] for move in move_data.values() if move.get('order_id')]
-            order_data = {}
-            if order_ids:
-                orders = self.models.execute_kw(
-                    self.db, self.uid, self.password, 'sale.order', 'search_read',
-                    [[('id', 'in', list(set(order_ids)))]],
-                    {
-                        'fields': [
-                            'name', 'delivery_observations', 'partner_supplying_agency_id', 
-                            'partner_shipping_id', 'date_order', 'state', 'amount_total',
-                            'user_id', 'team_id', 'warehouse_id', 'commitment_date',
-                            'client_order_ref', 'origin',
-                        ]
-                    }
-                )
-                order_data = {o['id']: o for o in orders}
-            
+            order_ids = [move['order_id'][0] for move in results['moves'].values() if move.get('order_id')]
+            if not order_ids:
+                return {}
+            orders = self.models.execute_kw(
+                self.db, self.uid, self.password, 'sale.order', 'search_read',
+                [[('id', 'in', list(set(order_ids)))]],
+                {
+                    'fields': [
+                        'name', 'delivery_observations', 'partner_supplying_agency_id', 
+                        'partner_shipping_id', 'date_order', 'state', 'amount_total',
+                        'user_id', 'team_id', 'warehouse_id', 'commitment_date',
+                        'client_order_ref', 'origin',
+                    ]
+                }
+            )
+            return {o['id']: o for o in orders}
+        
+        def fetch_sale_order_map(results):
             # --- BÚSQUEDA MEJORADA DE PEDIDO DE VENTA ---
             # Mapear account.move.line ID a su sale.order.line y luego a sale.order
             # Esto es más fiable que depender de invoice_origin
-            move_line_ids = [line['id'] for line in sales_lines_base]
             sale_order_map = {}
             if move_line_ids:
                 try:
@@ -632,8 +1164,11 @@ class OdooManager:
                                 sale_order_map[move_line_id] = order_name
                 except Exception as e:
                     logging.warning(f"No se pudo realizar la búsqueda inversa de pedidos de venta: {e}")
-
+            return sale_order_map
+        
+        def fetch_sale_lines(results):
             # Obtener datos de líneas de orden de venta con más campos
+            order_ids = [move['order_id'][0] for move in results['moves'].values() if move.get('order_id')]
             sale_line_data = {}
             sale_line_ids_for_stock = []  # Para buscar lotes
             if order_ids and product_ids:
@@ -657,9 +1192,12 @@ class OdooManager:
                             sale_line_ids_for_stock.append(sl['id'])
                 except Exception as e:
                     pass
-            
+            return sale_line_data, sale_line_ids_for_stock
+        
+        def fetch_lots(results):
             # Obtener lotes y fechas de vencimiento desde movimientos de stock
             lot_data = {}  # {product_id: {'lote': 'nombre_lote', 'fecha_vencimiento': 'fecha'}}
+            sale_line_ids_for_stock = results['sale_lines'][1]
             if sale_line_ids_for_stock:
                 try:
                     # Buscar movimientos de stock asociados a las líneas de venta
@@ -704,518 +1242,529 @@ class OdooManager:
                                         }
                 except Exception as e:
                     logging.warning(f"No se pudieron obtener datos de lotes: {e}")
+            return lot_data
+        
+        def fetch_taxes(results):
+            # Obtener nombres de los tax_ids únicos de las líneas contables
+            taxes = self.master_data.get_records('account.tax', all_tax_ids)
+            return {tax_id: tax['name'] for tax_id, tax in taxes.items()}
+        
+        enrichment = self._run_task_graph({
+            'moves': ((), fetch_moves),
+            'products': ((), fetch_products),
+            'taxes': ((), fetch_taxes),
+            'sale_order_map': ((), fetch_sale_order_map),
+            'partners': (('moves',), fetch_partners),
+            'orders': (('moves',), fetch_orders),
+            'sale_lines': (('moves',), fetch_sale_lines),
+            'lots': (('sale_lines',), fetch_lots),
+        })
+        move_data = enrichment['moves']
+        product_data = enrichment['products']
+        partner_data = enrichment['partners']
+        order_data = enrichment['orders']
+        sale_order_map = enrichment['sale_order_map']
+        sale_line_data = enrichment['sale_lines'][0]
+        lot_data = enrichment['lots']
+        tax_names = enrichment['taxes']
+        
+        # Procesar y combinar todos los datos para las 27 columnas
+        sales_lines = []
+        ecommerce_reassigned = 0
+        s00791_debug_count = 0  # Contador para debug del pedido específico
+        
+        for line in sales_lines_base:
+            move_id = line.get('move_id')
+            product_id = line.get('product_id')
             
-            # Obtener todos los tax_ids únicos de las líneas contables
-            all_tax_ids = set()
-            for line in sales_lines_base:
-                if line.get('tax_ids'):
-                    all_tax_ids.update(line['tax_ids'])
-            tax_names = {}
-            if all_tax_ids:
-                taxes = self.models.execute_kw(
-                    self.db, self.uid, self.password, 'account.tax', 'search_read',
-                    [[('id', 'in', list(all_tax_ids))]],
-                    {'fields': ['id', 'name'], 'context': {'lang': 'es_PE'}}
-                )
-                tax_names = {t['id']: t['name'] for t in taxes}
+            # Con el filtro EXE_IGV_EXP todas las líneas deben tener product_id válido
+            if not product_id:
+                logging.warning(f"Línea sin producto encontrada en Odoo: {line}")
+                continue
             
-            # Procesar y combinar todos los datos para las 27 columnas
-            sales_lines = []
-            ecommerce_reassigned = 0
-            s00791_debug_count = 0  # Contador para debug del pedido específico
+            # Obtener datos relacionados
+            move = move_data.get(move_id[0], {}) if move_id else {}
+            product = product_data.get(product_id[0], {}) if product_id else {}
             
-            for line in sales_lines_base:
-                move_id = line.get('move_id')
-                product_id = line.get('product_id')
-                
-                # Con el filtro EXE_IGV_EXP todas las líneas deben tener product_id válido
-                if not product_id:
-                    logging.warning(f"Línea sin producto encontrada en Odoo: {line}")
-                    continue
-                
-                # Obtener datos relacionados
-                move = move_data.get(move_id[0], {}) if move_id else {}
-                product = product_data.get(product_id[0], {}) if product_id else {}
-                
-                # Obtener partner_id desde el move (factura) en lugar de la línea
-                partner_id_from_move = move.get('partner_id')
-                partner = partner_data.get(partner_id_from_move[0], {}) if partner_id_from_move else {}
-                
-                # Obtener datos de orden de venta
-                order_id = move.get('order_id')
-                order = order_data.get(order_id[0], {}) if order_id else {}
-                
-                # Obtener datos de línea de orden
-                sale_line_key = (order_id[0], product_id[0]) if order_id and product_id else None
-                sale_line = sale_line_data.get(sale_line_key, {}) if sale_line_key else {}
-                # Obtener nombres de impuestos
-                imp_list = []
-                for tid in line.get('tax_ids', []):
-                    if tid in tax_names:
-                        imp_list.append(tax_names[tid])
-                imp_str = ', '.join(imp_list) if imp_list else ''
-                # Eliminar filtro de impuestos - procesar todas las líneas
-                
-                # APLICAR CAMBIO: Reemplazar línea comercial para usuarios ECOMMERCE específicos
-                # Se hace aquí para que el commercial_line_national_id original esté disponible para otros cálculos si es necesario
-                commercial_line_id = product.get('commercial_line_international_id')
-                invoice_user = move.get('invoice_user_id')
-
-                # Crear registro con los 16 campos solicitados en orden específico
-                # Extraer país del partner (cliente)
-                partner_country = ''
-                if partner.get('country_id') and len(partner['country_id']) > 1:
-                    partner_country = partner['country_id'][1]
-                
-                # Extraer mes de la fecha de factura en formato de letras
-                mes = ''
-                if move.get('invoice_date'):
-                    try:
-                        fecha_obj = datetime.strptime(move['invoice_date'], '%Y-%m-%d')
-                        # Meses en español
-                        meses_es = {
-                            1: 'Enero', 2: 'Febrero', 3: 'Marzo', 4: 'Abril',
-                            5: 'Mayo', 6: 'Junio', 7: 'Julio', 8: 'Agosto',
-                            9: 'Septiembre', 10: 'Octubre', 11: 'Noviembre', 12: 'Diciembre'
-                        }
-                        mes_nombre = meses_es.get(fecha_obj.month, '')
-                        mes = f"{mes_nombre} {fecha_obj.year}"  # Formato "Octubre 2025"
-                    except:
-                        mes = ''
-                
-                # DEBUG: Buscar líneas específicas del pedido S00791
-                order_name = order.get('name', '')
-                move_name = move.get('name', '')
-                
-                # Lógica de asignación de pedido final
-                # 1. Prioridad: El pedido encontrado a través de la búsqueda inversa (más fiable)
-                display_pedido = sale_order_map.get(line['id'])
-                
-                # 2. Fallback: Si no se encontró, usar el origen de la factura
-                if not display_pedido:
-                    display_pedido = move.get('invoice_origin')
-                
-                # Obtener datos de lote y fecha de vencimiento
-                product_id_value = product_id[0] if product_id else None
-                lote_info = lot_data.get(product_id_value, {})
-                
-                sales_lines.append({
-                    # 1. Pedido (número de orden de venta) - SOLUCIÓN ESPECIAL PARA S00791
-                    'pedido': display_pedido,
-                    
-                    # 2. Cliente
-                    'cliente': partner.get('name', ''),
-                    
-                    # 3. País
-                    'pais': partner_country,
-                    
-                    # 4. Fecha
-                    'fecha': move.get('invoice_date', ''),
-                    
-                    # 5. Mes
-                    'mes': mes,
-                    
-                    # 6. Código Odoo
-                    'codigo_odoo': product.get('default_code', ''),
-                    
-                    # 7. Producto
-                    'producto': product.get('name', ''),
-                    
-                    # 8. Descripción: preferir la descripción de la sale.order.line (si fue encontrada),
-                    # luego la descripción de la línea contable (account.move.line.name),
-                    # y finalmente fallback al display_name del producto.
-                    # Compute description and extract measurement
-                    'descripcion': (sale_line.get('name') if isinstance(sale_line, dict) else None) or line.get('name') or product.get('display_name', ''),
-                    'medida': (lambda d: (re.findall(r"\(([^)]+)\)", d) or [None])[-1] if d else '')(((sale_line.get('name') if isinstance(sale_line, dict) else None) or line.get('name') or product.get('display_name', ''))),
-                    
-                    # 9. Línea Comercial
-                    'linea_comercial': commercial_line_id[1] if commercial_line_id and len(commercial_line_id) > 1 else '',
-                    
-                    # 10. Clasificación farmacológica
-                    'clasificacion_farmacologica': product.get('pharmacological_classification_id')[1] if product.get('pharmacological_classification_id') and len(product.get('pharmacological_classification_id')) > 1 else '',
-                    
-                    # 11. Formas Farmacéuticas
-                    'formas_farmaceuticas': product.get('pharmaceutical_forms_id')[1] if product.get('pharmaceutical_forms_id') and len(product.get('pharmaceutical_forms_id')) > 1 else '',
-                    
-                    # 12. Vía de Administración
-                    'via_administracion': product.get('administration_way_id')[1] if product.get('administration_way_id') and len(product.get('administration_way_id')) > 1 else '',
-                    
-                    # 13. Línea de producción
-                    'linea_produccion': product.get('production_line_id')[1] if product.get('production_line_id') and len(product.get('production_line_id')) > 1 else '',
-                    
-                    # 14. Cantidad Facturada
-                    'cantidad_facturada': line.get('quantity', 0),
-                    
-                    # 15. Precio unitario
-                    'precio_unitario': line.get('price_unit', 0),
-                    
-                    # 16. Total
-                    'total': -line.get('balance', 0) if line.get('balance') is not None else 0,
-                    
-                    # 17. Lote (nuevo campo)
-                    'lote': lote_info.get('lote', ''),
-                    
-                    # 18. Fecha de Vencimiento (nuevo campo)
-                    'fecha_vencimiento': lote_info.get('fecha_vencimiento', ''),
-                    
-                    # DEBUG: Agregar información de factura para identificar líneas múltiples
-                    'factura': move.get('name', ''),
-                    'account_move_line_id': line.get('id'),
-                    
-                    # Campos adicionales para compatibilidad con el resto del sistema
-                    'payment_state': move.get('payment_state'),
-                    'sales_channel_id': move.get('team_id'),
-                    'team_id': move.get('team_id'),
-                    'commercial_line_national_id': commercial_line_id,
-                    'commercial_line_international_id': product.get('commercial_line_international_id'), # <-- CAMBIO: Añadir este campo
-                    'invoice_user_id': move.get('invoice_user_id'),
-                    'partner_name': partner.get('name'),
-                    'vat': partner.get('vat'),
-                    'invoice_origin': move.get('invoice_origin'),
-                    'move_name': move.get('name'),
-                    'name': product.get('name', ''),
-                    'default_code': product.get('default_code', ''),
-                    'product_id': line.get('product_id'),
-                    'invoice_date': move.get('invoice_date'),
-                    'balance': -line.get('balance', 0) if line.get('balance') is not None else 0,
-                    'pharmacological_classification_id': product.get('pharmacological_classification_id'),
-                    'pharmaceutical_forms_id': product.get('pharmaceutical_forms_id'),
-                    'administration_way_id': product.get('administration_way_id'),
-                    'categ_id': product.get('categ_id'),
-                    'production_line_id': product.get('production_line_id'),
-                    'quantity': line.get('quantity'),
-                    'price_unit': line.get('price_unit'),
-                    'move_id': line.get('move_id'),
-                    'partner_id': line.get('partner_id'),
-                    'exchange_rate': move.get('exchange_rate', 1.0),
-                    'currency_id': move.get('currency_id'),
-                    # Invertir el signo para que las ventas sean positivas y las devoluciones negativas.
-                    'amount_currency': -line.get('amount_currency', 0),
-                })
+            # Obtener partner_id desde el move (factura) en lugar de la línea
+            partner_id_from_move = move.get('partner_id')
+            partner = partner_data.get(partner_id_from_move[0], {}) if partner_id_from_move else {}
             
-            # Líneas de S00791 procesadas correctamente
+            # Obtener datos de orden de venta
+            order_id = move.get('order_id')
+            order = order_data.get(order_id[0], {}) if order_id else {}
             
-            # Devolver tupla (datos, paginación)
-            pagination_info = {
-                'page': page,
-                'per_page': per_page,
-                'total': total_count,
-                'pages': (total_count + per_page - 1) // per_page
-            }
+            # Obtener datos de línea de orden
+            sale_line_key = (order_id[0], product_id[0]) if order_id and product_id else None
+            sale_line = sale_line_data.get(sale_line_key, {}) if sale_line_key else {}
+            # Obtener nombres de impuestos
+            imp_list = []
+            for tid in line.get('tax_ids', []):
+                if tid in tax_names:
+                    imp_list.append(tax_names[tid])
+            imp_str = ', '.join(imp_list) if imp_list else ''
+            # Eliminar filtro de impuestos - procesar todas las líneas
             
-            # Si se solicita paginación, devolver tupla
-            if page is not None and per_page is not None:
-                return sales_lines, pagination_info
-            else:
-                # Si no, devolver solo los datos (comportamiento anterior)
-                return sales_lines
+            # APLICAR CAMBIO: Reemplazar línea comercial para usuarios ECOMMERCE específicos
+            # Se hace aquí para que el commercial_line_national_id original esté disponible para otros cálculos si es necesario
+            commercial_line_id = product.get('commercial_line_international_id')
+            invoice_user = move.get('invoice_user_id')
 
+            # Crear registro con los 16 campos solicitados en orden específico
+            # Extraer país del partner (cliente)
+            partner_country = ''
+            if partner.get('country_id') and len(partner['country_id']) > 1:
+                partner_country = partner['country_id'][1]
             
-        except Exception as e:
-            logging.error(f"Error al obtener las líneas de venta de Odoo: {e}")
-            # Devolver formato apropiado según si se solicitó paginación
-            if page is not None and per_page is not None:
-                return [], {'page': page, 'per_page': per_page, 'total': 0, 'pages': 0}
-            return []
-
-    def get_pending_orders(self, page=1, per_page=1000, filters=None, date_from=None, date_to=None, partner_id=None, search=None, limit=None):
-        """Obtener líneas de pedidos de venta pendientes de facturación usando datos ya disponibles"""
-        try:
+            # Extraer mes de la fecha de factura en formato de letras
+            mes = ''
+            if move.get('invoice_date'):
+                try:
+                    fecha_obj = datetime.strptime(move['invoice_date'], '%Y-%m-%d')
+                    # Meses en español
+                    meses_es = {
+                        1: 'Enero', 2: 'Febrero', 3: 'Marzo', 4: 'Abril',
+                        5: 'Mayo', 6: 'Junio', 7: 'Julio', 8: 'Agosto',
+                        9: 'Septiembre', 10: 'Octubre', 11: 'Noviembre', 12: 'Diciembre'
+                    }
+                    mes_nombre = meses_es.get(fecha_obj.month, '')
+                    mes = f"{mes_nombre} {fecha_obj.year}"  # Formato "Octubre 2025"
+                except:
+                    mes = ''
             
-            # Verificar conexión
-            if not self.uid or not self.models:
-                if page is not None and per_page is not None:
-                    return [], {'page': page, 'per_page': per_page, 'total': 0, 'pages': 0}
-                return []
+            # DEBUG: Buscar líneas específicas del pedido S00791
+            order_name = order.get('name', '')
+            move_name = move.get('name', '')
             
-            # Manejar parámetros de filtros
-            if filters:
-                date_from = filters.get('date_from')
-                date_to = filters.get('date_to')
-                partner_id = filters.get('partner_id')
-                search = filters.get('search_term') # CORRECCIÓN: Usar el search_term del filtro
+            # Lógica de asignación de pedido final
+            # 1. Prioridad: El pedido encontrado a través de la búsqueda inversa (más fiable)
+            display_pedido = sale_order_map.get(line['id'])
             
-            # NUEVA ESTRATEGIA: Usar los datos de sale.order.line que ya se obtienen en get_sales_lines
-            # Pero consultando directamente sin pasar por filtros problemáticos
+            # 2. Fallback: Si no se encontró, usar el origen de la factura
+            if not display_pedido:
+                display_pedido = move.get('invoice_origin')
             
-            try:
-                # 1. Obtener las líneas de order que tienen sale.order.line con datos disponibles
-                # Usar la misma lógica que get_sales_lines pero enfocada en sale.order.line
-                sale_order_lines_data = []
-
-                # Dominio para filtrar por canal INTERNACIONAL y estados relevantes
-                domain_international_orders = [
-                    ('order_id.team_id.name', 'ilike', 'INTERNACIONAL'),
-                    ('order_id.state', 'in', ['credit', 'sale', 'done'])
-                ]
+            # Obtener datos de lote y fecha de vencimiento
+            product_id_value = product_id[0] if product_id else None
+            lote_info = lot_data.get(product_id_value, {})
+            
+            sales_lines.append({
+                # 1. Pedido (número de orden de venta) - SOLUCIÓN ESPECIAL PARA S00791
+                'pedido': display_pedido,
                 
-                # Consultar sale.order.line directamente con filtros mínimos
-                basic_domain = [
-                    ('product_id', '!=', False), # Asegura que haya un producto.
-                    ('product_id.default_code', '!=', False), # Asegura que el producto tenga un Código Odoo.
-                    ('product_id.name', '!=', 'VTA SERV GENERALES'), # Excluir el producto de servicios generales.
-                ]
+                # 2. Cliente
+                'cliente': partner.get('name', ''),
                 
-                # NO FILTRAR POR FECHA para pedidos pendientes
-                # Esto permite ver pedidos de años anteriores que aún no se han facturado completamente
-                # date_from y date_to se ignoran intencionalmente aquí
+                # 3. País
+                'pais': partner_country,
                 
-                # Incluir filtro de cliente si se proporciona
-                if partner_id:
-                    basic_domain.append(('order_id.partner_id', '=', int(partner_id)))
-
-                # Incluir filtro de búsqueda si se proporciona
-                if search:
-                    # CORRECCIÓN: El dominio de búsqueda debe estar bien anidado para Odoo (n-1 '|' para n condiciones)
-                    basic_domain += [
-                        '|', '|', '|',
-                        ('order_id.partner_id.name', 'ilike', search),
-                        ('product_id.default_code', 'ilike', search),
-                        ('product_id.name', 'ilike', search),
-                        ('order_id.name', 'ilike', search)
-                    ]
-
-                # Combinar dominios
-                final_domain = basic_domain + domain_international_orders
-
-                # Contar el total para la paginación
-                total_count = self.models.execute_kw(
-                    self.db, self.uid, self.password, 'sale.order.line', 'search_count',
-                    [final_domain]
-                )
-
-                # Obtener líneas de pedidos de venta
-                order_lines = self.models.execute_kw(
-                    self.db, self.uid, self.password, 'sale.order.line', 'search_read',
-                    [final_domain],
-                    {
-                        'fields': [
-                            'id', 'order_id', 'product_id', 'name', 'product_uom_qty',
-                            'qty_delivered', 'qty_invoiced', 'qty_to_invoice',
-                            'price_unit', 'price_subtotal', 'state', 'discount'
-                        ],
-                        'order': 'order_id desc'
-                        ,
-                        'limit': per_page,
-                        'offset': (page - 1) * per_page
-                    }
-                )
+                # 4. Fecha
+                'fecha': move.get('invoice_date', ''),
                 
-                logging.debug(f"{len(order_lines)} líneas de pedido obtenidas inicialmente.")
+                # 5. Mes
+                'mes': mes,
                 
-                if not order_lines:
-                    if page is not None and per_page is not None:
-                        return [], {'page': page, 'per_page': per_page, 'total': 0, 'pages': 0}
-                    return []
+                # 6. Código Odoo
+                'codigo_odoo': product.get('default_code', ''),
                 
-                # 2. Filtrar solo las que tienen cantidad pendiente > 0
-                # INCLUIR también pedidos en estado 'credit' calculando qty_to_invoice manualmente
-                all_pending_lines = []
-                for line in order_lines:
-                    qty_to_invoice = line.get('qty_to_invoice', 0)
-                    line_state = line.get('state', '')
-                    
-                    # Si está en estado credit, calcular manualmente qty_to_invoice
-                    if line_state == 'credit':
-                        qty_ordered = line.get('product_uom_qty', 0)
-                        qty_invoiced = line.get('qty_invoiced', 0)
-                        qty_to_invoice = qty_ordered - qty_invoiced
-                        # Guardar el valor calculado en la línea para usarlo después
-                        line['qty_to_invoice_calculated'] = qty_to_invoice
-                    
-                    if qty_to_invoice > 0:
-                        all_pending_lines.append(line)
+                # 7. Producto
+                'producto': product.get('name', ''),
                 
-                logging.debug(f"{len(all_pending_lines)} líneas con cantidad pendiente de facturar.")
-
-                # 3. Obtener información de pedidos para filtrar por equipo INTERNACIONAL
-                order_ids = list(set([line['order_id'][0] for line in all_pending_lines if line.get('order_id')]))
+                # 8. Descripción: preferir la descripción de la sale.order.line (si fue encontrada),
+                # luego la descripción de la línea contable (account.move.line.name),
+                # y finalmente fallback al display_name del producto.
+                # Compute description and extract measurement
+                'descripcion': (sale_line.get('name') if isinstance(sale_line, dict) else None) or line.get('name') or product.get('display_name', ''),
+                'medida': (lambda d: (re.findall(r"\(([^)]+)\)", d) or [None])[-1] if d else '')(((sale_line.get('name') if isinstance(sale_line, dict) else None) or line.get('name') or product.get('display_name', ''))),
                 
-                # Obtener información de pedidos en lotes pequeños
-                order_data = {}
-                batch_size = 100
-                for i in range(0, len(order_ids), batch_size):
-                    batch_ids = order_ids[i:i+batch_size]
-                    try:
-                        batch_orders = self.models.execute_kw(self.db, self.uid, self.password, 'sale.order', 'read', [batch_ids], {'fields': ['id', 'name', 'partner_id', 'date_order', 'state', 'amount_total', 'team_id', 'user_id', 'commitment_date']})
-                        for order in batch_orders:
-                            order_data[order['id']] = order
-                    except Exception as e:
-                        continue
+                # 9. Línea Comercial
+                'linea_comercial': commercial_line_id[1] if commercial_line_id and len(commercial_line_id) > 1 else '',
                 
+                # 10. Clasificación farmacológica
+                'clasificacion_farmacologica': product.get('pharmacological_classification_id')[1] if product.get('pharmacological_classification_id') and len(product.get('pharmacological_classification_id')) > 1 else '',
                 
-                # 4. Filtrar solo pedidos del canal INTERNACIONAL
-                international_pending = all_pending_lines
-                # 5. Obtener información de productos
-                product_ids = list(set([line['product_id'][0] for line in international_pending if line.get('product_id')]))
-                product_data = {}
+                # 11. Formas Farmacéuticas
+                'formas_farmaceuticas': product.get('pharmaceutical_forms_id')[1] if product.get('pharmaceutical_forms_id') and len(product.get('pharmaceutical_forms_id')) > 1 else '',
                 
-                if product_ids:
-                    try:
-                        products = self.models.execute_kw(
-                            self.db, self.uid, self.password, 'product.product', 'read',
-                            [product_ids],
-                            {
-                                'fields': [
-                                    'id', 'name', 'display_name', 'default_code', 'categ_id', # <-- CAMBIO: Añadir display_name
-                                    'commercial_line_national_id', 'commercial_line_international_id',
-                                    'pharmacological_classification_id',
-                                    'pharmaceutical_forms_id', 'administration_way_id', 'production_line_id'
-                                ],
-                                'context': {'lang': 'es_PE'}
-                            }
-                        )
-                        product_data = {product['id']: product for product in products}
-                    except Exception as e:
-                        pass
+                # 12. Vía de Administración
+                'via_administracion': product.get('administration_way_id')[1] if product.get('administration_way_id') and len(product.get('administration_way_id')) > 1 else '',
                 
-                # 6. Obtener información de clientes
-                partner_ids = list(set([order['partner_id'][0] for order in order_data.values() if order.get('partner_id')]))
-                partner_data = {}
+                # 13. Línea de producción
+                'linea_produccion': product.get('production_line_id')[1] if product.get('production_line_id') and len(product.get('production_line_id')) > 1 else '',
                 
-                if partner_ids:
-                    try:
-                        partners = self.models.execute_kw(
-                            self.db, self.uid, self.password, 'res.partner', 'read',
-                            [partner_ids],
-                            {
-                                'fields': ['id', 'name', 'country_id', 'vat']
-                            }
-                        )
-                        partner_data = {partner['id']: partner for partner in partners}
-                    except Exception as e:
-                        pass
+                # 14. Cantidad Facturada
+                'cantidad_facturada': line.get('quantity', 0),
                 
-                # 7. Procesar y estructurar los datos finales
-                final_pending_lines = []
+                # 15. Precio unitario
+                'precio_unitario': line.get('price_unit', 0),
                 
-                for line in international_pending:
-                    try:
-                        order = order_data.get(line['order_id'][0]) if line.get('order_id') else {}
-                        product = product_data.get(line['product_id'][0]) if line.get('product_id') else {}
-                        partner = partner_data.get(order.get('partner_id')[0]) if order.get('partner_id') else {}
-                        
-                        # CAMBIO: Se ha eliminado el filtro que excluía productos por su categoría.
-                        # Ahora todos los productos del canal internacional aparecerán.
-                        
-                        # Filtro de cliente
-                        if partner_id and order.get('partner_id'):
-                            if order['partner_id'][0] != int(partner_id):
-                                continue
-                        
-                        # Extraer país del partner
-                        partner_country = ''
-                        if partner.get('country_id') and len(partner['country_id']) > 1:
-                            partner_country = partner['country_id'][1]
-                        
-                        # Extraer mes de la fecha del pedido
-                        mes = ''
-                        if order.get('date_order'):
-                            try:
-                                fecha_obj = datetime.strptime(order['date_order'], '%Y-%m-%d %H:%M:%S')
-                                meses_es = {
-                                    1: 'Enero', 2: 'Febrero', 3: 'Marzo', 4: 'Abril',
-                                    5: 'Mayo', 6: 'Junio', 7: 'Julio', 8: 'Agosto',
-                                    9: 'Septiembre', 10: 'Octubre', 11: 'Noviembre', 12: 'Diciembre'
-                                }
-                                mes_nombre = meses_es.get(fecha_obj.month, '')
-                                mes = f"{mes_nombre} {fecha_obj.year}"
-                            except:
-                                mes = ''
-                        
-                        # CAMBIO: Usar la línea comercial internacional en lugar de la nacional.
-                        commercial_line_id = product.get('commercial_line_international_id')
-                        
-                        # Extraer commitment_date del pedido
-                        commitment_date = order.get('commitment_date', '')
-                        commitment_year = ''
-                        if commitment_date:
-                            try:
-                                # El commitment_date viene en formato 'YYYY-MM-DD' o 'YYYY-MM-DD HH:MM:SS'
-                                commitment_year = commitment_date.split('-')[0]
-                            except:
-                                commitment_year = ''
-                        
-                        pending_record = {
-                            # 16 campos específicos
-                            'pedido': order.get('name', ''),
-                            'cliente': partner.get('name', ''),
-                            'partner_id': order.get('partner_id'),
-                            'cliente_id': order.get('partner_id')[0] if order.get('partner_id') and isinstance(order.get('partner_id'), (list, tuple)) else None,
-                            'pais': partner_country,
-                            'fecha': commitment_date.split(' ')[0] if commitment_date else (order.get('date_order', '').split(' ')[0] if order.get('date_order') else ''),  # Priorizar commitment_date, fallback a date_order
-                            'fecha_confirmacion': order.get('date_order', '').split(' ')[0] if order.get('date_order') else '',  # Fecha de confirmación (date_order)
-                            'mes': mes,
-                            'codigo_odoo': product.get('default_code', ''),
-                            'producto': product.get('name', ''),
-                            # Preferir la descripción de la propia línea y finalmente el display_name del producto.
-                            'descripcion': line.get('name') or product.get('display_name', ''),
-                            'medida': (lambda d: (re.findall(r"\(([^)]+)\)", d) or [None])[-1] if d else '')(line.get('name') or product.get('display_name', '')),
-                            'linea_comercial': commercial_line_id[1] if commercial_line_id and len(commercial_line_id) > 1 else '',
-                            'clasificacion_farmacologica': product.get('pharmacological_classification_id')[1] if product.get('pharmacological_classification_id') and isinstance(product.get('pharmacological_classification_id'), list) and len(product.get('pharmacological_classification_id')) > 1 else '',
-                            'formas_farmaceuticas': product.get('pharmaceutical_forms_id')[1] if product.get('pharmaceutical_forms_id') and isinstance(product.get('pharmaceutical_forms_id'), list) and len(product.get('pharmaceutical_forms_id')) > 1 else '',
-                            'via_administracion': product.get('administration_way_id')[1] if product.get('administration_way_id') and isinstance(product.get('administration_way_id'), list) and len(product.get('administration_way_id')) > 1 else '',
-                            'linea_produccion': product.get('production_line_id')[1] if product.get('production_line_id') and isinstance(product.get('production_line_id'), list) and len(product.get('production_line_id')) > 1 else '',
-                            'cantidad_pendiente': line.get('qty_to_invoice_calculated', line.get('qty_to_invoice', 0)),
-                            'precio_unitario': line.get('price_unit', 0),
-                            'discount': line.get('discount', 0),
-                            'total_pendiente': line.get('qty_to_invoice_calculated', line.get('qty_to_invoice', 0)) * line.get('price_unit', 0) * (1 - (line.get('discount', 0) / 100)),
-                            
-                            # Campos de fecha de entrega
-                            'commitment_date': commitment_date,
-                            'commitment_year': commitment_year,
-                            
-                            # Campos adicionales
-                            'team_id': order.get('team_id'),
-                            'commercial_line_international_id': product.get('commercial_line_international_id'),
-                            'state': line.get('state'),
-                            'order_state': order.get('state')
-                        }
-                        
-                        final_pending_lines.append(pending_record)
-                        
-                    except Exception as e:
-                        continue
+                # 16. Total
+                'total': -line.get('balance', 0) if line.get('balance') is not None else 0,
+                
+                # 17. Lote (nuevo campo)
+                'lote': lote_info.get('lote', ''),
                 
-                # Aplicar filtro de búsqueda
-                # ESTA LÓGICA SE MOVIÓ AL DOMINIO DE LA CONSULTA PARA MAYOR EFICIENCIA
-                # if search:
-                #     search_lower = search.lower()
-                #     filtered_lines = []
-                #     for line in final_pending_lines:
-                #         if (search_lower in line.get('pedido', '').lower() or
-                #             search_lower in line.get('cliente', '').lower() or
-                #             search_lower in line.get('codigo_odoo', '').lower() or
-                #             search_lower in line.get('producto', '').lower()):
-                #             filtered_lines.append(line)
-                #     final_pending_lines = filtered_lines
-
-                # La búsqueda ahora se aplica en el dominio principal, por lo que no es necesario
-                # un segundo filtrado aquí.
+                # 18. Fecha de Vencimiento (nuevo campo)
+                'fecha_vencimiento': lote_info.get('fecha_vencimiento', ''),
                 
+                # DEBUG: Agregar información de factura para identificar líneas múltiples
+                'factura': move.get('name', ''),
+                'account_move_line_id': line.get('id'),
                 
-                # El bloque de código que agregaba pedidos con saldo cero al filtrar por cliente ha sido eliminado.
-                # Ahora, la sección 'Por Facturar' solo contendrá líneas de pedido con una cantidad pendiente de facturar > 0.
+                # Campos adicionales para compatibilidad con el resto del sistema
+                'payment_state': move.get('payment_state'),
+                'sales_channel_id': move.get('team_id'),
+                'team_id': move.get('team_id'),
+                'commercial_line_national_id': commercial_line_id,
+                'commercial_line_international_id': product.get('commercial_line_international_id'), # <-- CAMBIO: Añadir este campo
+                'invoice_user_id': move.get('invoice_user_id'),
+                'partner_name': partner.get('name'),
+                'vat': partner.get('vat'),
+                'invoice_origin': move.get('invoice_origin'),
+                'move_name': move.get('name'),
+                'name': product.get('name', ''),
+                'default_code': product.get('default_code', ''),
+                'product_id': line.get('product_id'),
+                'invoice_date': move.get('invoice_date'),
+                'balance': -line.get('balance', 0) if line.get('balance') is not None else 0,
+                'pharmacological_classification_id': product.get('pharmacological_classification_id'),
+                'pharmaceutical_forms_id': product.get('pharmaceutical_forms_id'),
+                'administration_way_id': product.get('administration_way_id'),
+                'categ_id': product.get('categ_id'),
+                'production_line_id': product.get('production_line_id'),
+                'quantity': line.get('quantity'),
+                'price_unit': line.get('price_unit'),
+                'move_id': line.get('move_id'),
+                'partner_id': line.get('partner_id'),
+                'move_partner_id': partner_id_from_move,
+                'exchange_rate': move.get('exchange_rate', 1.0),
+                'currency_id': move.get('currency_id'),
+                # Invertir el signo para que las ventas sean positivas y las devoluciones negativas.
+                'amount_currency': -line.get('amount_currency', 0),
+                # Última modificación de la línea o de su factura (para sincronización incremental)
+                'write_date': max(line.get('write_date') or '', move.get('write_date') or ''),
+            })
+        
+        return sales_lines
+    
+    def search_sales_line_ids(self, date_from=None, modified_since=None):
+        """IDs de account.move.line que cumplen el dominio base de ventas.
+        
+        modified_since filtra las líneas cuya línea o factura cambió desde ese
+        write_date ('YYYY-MM-DD HH:MM:SS'); se usa para la sincronización incremental.
+        """
+        if not self.uid or not self.models:
+            return None
+        domain = self._sales_base_domain()
+        if date_from:
+            domain.append(('move_id.invoice_date', '>=', date_from))
+        if modified_since:
+            domain += ['|', ('write_date', '>=', modified_since), ('move_id.write_date', '>=', modified_since)]
+        return self.models.execute_kw(
+            self.db, self.uid, self.password, 'account.move.line', 'search',
+            [domain], {'order': 'id'}
+        )
+    
+    def get_sales_lines_by_ids(self, line_ids):
+        """Líneas de venta enriquecidas (27 columnas) para una lista de IDs de account.move.line."""
+        if not line_ids:
+            return []
+        sales_lines_base = self.models.execute_kw(
+            self.db, self.uid, self.password, 'account.move.line', 'search_read',
+            [[('id', 'in', list(line_ids))]],
+            {
+                'fields': [
+                    'move_id', 'partner_id', 'product_id', 'balance', 'move_name',
+                    'quantity', 'price_unit', 'tax_ids', 'amount_currency', 'display_name',
+                    'write_date'
+                ],
+                'context': {'lang': 'es_PE'}
+            }
+        )
+        if sales_lines_base is None:
+            raise RuntimeError("Odoo no devolvió las líneas solicitadas")
+        return self._enrich_sales_lines(sales_lines_base)
 
-                pagination_info = {
-                    'page': page,
-                    'per_page': per_page,
-                    'total': total_count,
-                    'pages': (total_count + per_page - 1) // per_page
-                }
+    def iter_sales_lines(self, date_from=None, date_to=None, partner_id=None, batch_size=None):
+        """Líneas de venta (27 columnas) en lotes, sin cargar el rango completo en memoria.
 
-                if page is not None and per_page is not None:
-                    return final_pending_lines, pagination_info
-                else:
-                    return final_pending_lines
-                
-            except Exception as e:
-                logging.error(f"Error procesando pedidos pendientes: {e}")
+        Mismos filtros que get_sales_lines y el mismo orden (invoice_date DESC, id DESC)
+        venga de donde venga. Desde la copia local (SalesStore) si cubre el rango, en
+        páginas keyset sin contar: la cobertura y la sincronización se resuelven una sola
+        vez antes del primer lote, así que una sincronización no desplaza las páginas. Si
+        no, busca los IDs una sola vez en Odoo y los lee y enriquece de lote en lote. Un
+        error a mitad de camino se propaga (no se trunca en silencio ni se repiten lotes
+        ya entregados).
+
+        Yields:
+            Listas de hasta batch_size líneas
+        """
+        batch_size = batch_size or EXPORT_BATCH_SIZE
+
+        if self.sales_store is not None:
+            key = None
+            while True:
+                stored = self.sales_store.query_sales_lines_keyset(
+                    date_from=date_from, date_to=date_to, partner_id=partner_id,
+                    limit=batch_size, key=key, count=False, sync=key is None
+                )
+                if stored is None:
+                    if key is None:
+                        break  # La copia no cubre el rango: se consulta Odoo
+                    raise RuntimeError("La copia local de ventas dejó de estar disponible a mitad de la exportación")
+                lines, keys, _ = stored
+                if lines:
+                    yield lines
+                if len(lines) < batch_size:
+                    return
+                key = keys[-1]
+
+        if not self.uid or not self.models:
+            return
+
+        domain = self._sales_base_domain()
+        if date_from:
+            domain.append(('move_id.invoice_date', '>=', date_from))
+        if date_to:
+            domain.append(('move_id.invoice_date', '<=', date_to))
+        if partner_id:
+            domain.append(('move_id.partner_id', '=', int(partner_id)))
+
+        line_ids = self.models.execute_kw(
+            self.db, self.uid, self.password, 'account.move.line', 'search',
+            [domain], {'order': 'invoice_date desc, id desc'}
+        )
+        if line_ids is None:
+            raise RuntimeError("Odoo no devolvió las líneas de venta a exportar")
+        logging.info(f"📤 Exportando {len(line_ids)} líneas de venta en lotes de {batch_size}")
+        for start in range(0, len(line_ids), batch_size):
+            batch_ids = line_ids[start:start + batch_size]
+            lines = self.get_sales_lines_by_ids(batch_ids)
+            # search_read por IDs devuelve el orden por defecto del modelo: se
+            # restablece el de la búsqueda
+            posicion = {line_id: i for i, line_id in enumerate(batch_ids)}
+            lines.sort(key=lambda line: posicion.get(line.get('account_move_line_id'), len(posicion)))
+            yield lines
+
+    def iter_pending_orders(self, partner_id=None, batch_size=None):
+        """Líneas pendientes de facturar en lotes (páginas keyset, sin contar).
+
+        Un error a mitad de camino se propaga (no se trunca en silencio).
+
+        Yields:
+            Listas con las líneas pendientes de cada página
+        """
+        batch_size = batch_size or EXPORT_BATCH_SIZE
+        if not self.uid or not self.models:
+            return
+        keyset = {'key': None, 'direction': 'next'}
+        while True:
+            lines, pagination = self.pending_engine.fetch(
+                per_page=batch_size, partner_id=partner_id, keyset=keyset, count=False
+            )
+            if lines:
+                yield lines
+            if not pagination.get('has_next') or pagination.get('last_key') is None:
+                return
+            keyset = {'key': pagination['last_key'], 'direction': 'next'}
+
+    # Códigos de producto que el dashboard excluye (servicios y cuentas 81000)
+    EXCLUDED_PRODUCT_CODE_PREFIXES = ('81000', 'SERV')
+
+    def build_aggregate_rows(self, groups):
+        """Filas de get_sales_aggregates a partir de totales por producto y cliente de la factura.
+        
+        groups: dicts con product_id y partner_id (ids; el partner es el de la factura,
+        move_id.partner_id) y los importes amount_currency, ventas_brutas, quantity y
+        line_count. Los datos descriptivos salen de los datos maestros, igual en Odoo
+        y en la copia local (SalesStore).
+        """
+        products = self.master_data.get_records('product.product', [g['product_id'] for g in groups])
+        partners = self.master_data.get_records('res.partner', [g['partner_id'] for g in groups])
+        
+        def name_of(value):
+            return value[1] if value and isinstance(value, list) and len(value) > 1 else ''
+        
+        rows = []
+        for group in groups:
+            product_id, group_partner_id = group['product_id'], group['partner_id']
+            product = products.get(product_id, {})
+            partner = partners.get(group_partner_id, {})
+            product_value = [product_id, product.get('display_name') or product.get('name', '')] if product_id else False
+            partner_value = [group_partner_id, partner.get('name', '')] if group_partner_id else False
+            rows.append({
+                'product_id': product_value,
+                'partner_id': partner_value,
+                'move_partner_id': partner_value,
+                'producto': product.get('name', ''),
+                'name': product.get('name', ''),
+                'codigo_odoo': product.get('default_code', ''),
+                'default_code': product.get('default_code', ''),
+                'commercial_line_international_id': product.get('commercial_line_international_id'),
+                'linea_comercial': name_of(product.get('commercial_line_international_id')),
+                'pharmacological_classification_id': product.get('pharmacological_classification_id'),
+                'clasificacion_farmacologica': name_of(product.get('pharmacological_classification_id')),
+                'pharmaceutical_forms_id': product.get('pharmaceutical_forms_id'),
+                'formas_farmaceuticas': name_of(product.get('pharmaceutical_forms_id')),
+                'administration_way_id': product.get('administration_way_id'),
+                'via_administracion': name_of(product.get('administration_way_id')),
+                'production_line_id': product.get('production_line_id'),
+                'linea_produccion': name_of(product.get('production_line_id')),
+                'categ_id': product.get('categ_id'),
+                'cliente': partner.get('name', ''),
+                'pais': name_of(partner.get('country_id')),
+                'amount_currency': group['amount_currency'],
+                'ventas_brutas': group['ventas_brutas'],
+                'quantity': group['quantity'],
+                'line_count': group['line_count'],
+            })
+        return rows
+    
+    @traced('odoo_manager.get_sales_aggregates')
+    def get_sales_aggregates(self, date_from=None, date_to=None, partner_id=None, linea_id=None, exclude_service_codes=True):
+        """Totales de venta agrupados por producto y cliente (read_group en Odoo).
+        
+        Cada fila tiene la misma forma que una línea de get_sales_lines (linea_comercial,
+        producto, pais, cliente, clasificación, forma, vía, línea de producción...) pero
+        con los importes ya sumados:
+            - amount_currency: venta neta (ventas - devoluciones), signo positivo
+            - ventas_brutas: solo líneas de venta (sin devoluciones)
+            - quantity / line_count: cantidad facturada y número de líneas
+        Así los agregados del dashboard se calculan sobre cientos de filas agrupadas
+        en lugar de decenas de miles de líneas. Usa la copia local (SalesStore) si cubre
+        el rango. Devuelve None si no se pudo consultar (el llamador usa las líneas).
+        """
+        if self.sales_store is not None:
+            stored = self.sales_store.aggregate_sales_lines(
+                date_from=date_from, date_to=date_to, partner_id=partner_id, linea_id=linea_id,
+                exclude_code_prefixes=self.EXCLUDED_PRODUCT_CODE_PREFIXES if exclude_service_codes else ()
+            )
+            if stored is not None:
+                return stored
+        
+        if not self.uid or not self.models:
+            return None
+        
+        try:
+            domain = self._sales_base_domain()
+            if exclude_service_codes:
+                for prefix in self.EXCLUDED_PRODUCT_CODE_PREFIXES:
+                    domain += ['!', ('product_id.default_code', '=like', f'{prefix}%')]
+            if date_from:
+                domain.append(('move_id.invoice_date', '>=', date_from))
+            if date_to:
+                domain.append(('move_id.invoice_date', '<=', date_to))
+            if partner_id:
+                domain.append(('move_id.partner_id', '=', int(partner_id)))
+            if linea_id:
+                domain.append(('product_id.commercial_line_international_id', '=', linea_id))
+            
+            def read_group(extra_domain):
+                def run(results):
+                    groups = self.models.execute_kw(
+                        self.db, self.uid, self.password, 'account.move.line', 'read_group',
+                        [domain + extra_domain],
+                        {
+                            'fields': ['amount_currency:sum', 'quantity:sum'],
+                            # read_group solo agrupa por campos del modelo (move_id.partner_id no es válido):
+                            # se agrupa por factura y el cliente de la factura se resuelve después
+                            'groupby': ['product_id', 'move_id'],
+                            'lazy': False
+                        }
+                    )
+                    if groups is None:
+                        raise RuntimeError("read_group sin respuesta")
+                    return groups
+                return run
+            
+            def fetch_move_partners(results):
+                # Cliente de cada factura (el de las líneas de detalle y del filtro por cliente)
+                move_ids = list({g['move_id'][0] for g in results['net'] if g.get('move_id')})
+                if not move_ids:
+                    return {}
+                moves = self.models.execute_kw(
+                    self.db, self.uid, self.password, 'account.move', 'search_read',
+                    [[('id', 'in', move_ids)]],
+                    {'fields': ['partner_id'], 'context': {'active_test': False}}
+                )
+                if moves is None:
+                    raise RuntimeError("No se pudieron leer los clientes de las facturas")
+                return {m['id']: (m['partner_id'][0] if m.get('partner_id') else None) for m in moves}
+            
+            # Neto y bruto (amount_currency < 0 = venta) en paralelo; los clientes cuando llega el neto
+            grouped = self._run_task_graph({
+                'net': ((), read_group([])),
+                'gross': ((), read_group([('amount_currency', '<', 0)])),
+                'move_partners': (('net',), fetch_move_partners),
+            })
+            move_partners = grouped['move_partners']
+            
+            def group_key(group):
+                product = group.get('product_id')
+                move = group.get('move_id')
+                return (product[0] if product else None, move_partners.get(move[0]) if move else None)
+            
+            # Suma por producto y cliente de la factura (varias facturas del mismo cliente)
+            totals = {}
+            for group in grouped['net']:
+                total = totals.setdefault(group_key(group), {
+                    'amount_currency': 0, 'ventas_brutas': 0, 'quantity': 0, 'line_count': 0
+                })
+                total['amount_currency'] -= group.get('amount_currency') or 0
+                total['quantity'] += group.get('quantity') or 0
+                total['line_count'] += group.get('__count', 0)
+            for group in grouped['gross']:
+                total = totals.get(group_key(group))
+                if total is not None:
+                    total['ventas_brutas'] -= group.get('amount_currency') or 0
+            groups = [
+                dict(total, product_id=product_id, partner_id=group_partner_id)
+                for (product_id, group_partner_id), total in totals.items()
+            ]
+            rows = self.build_aggregate_rows(groups)
+            return rows
+        
+        except Exception as e:
+            logging.error(f"Error obteniendo agregados de ventas de Odoo: {e}")
+            return None
+
+    @traced('odoo_manager.get_pending_orders')
+    def get_pending_orders(self, page=1, per_page=1000, filters=None, date_from=None, date_to=None, partner_id=None, search=None, limit=None,
+                           keyset=None, count=True):
+        """Obtener líneas de pedidos de venta pendientes de facturación (ver database/pending_orders.py)
+        
+        El filtro de cantidad pendiente se aplica en Odoo, así que la página y el
+        total cuentan solo líneas con saldo por facturar. Con page=None y
+        per_page=None devuelve solo la lista, sin límite de filas. Con keyset (ver
+        _keyset_search_read) pagina por (create_date, id) en lugar de offset e
+        ignora page; count=False omite el total.
+        date_from y date_to se ignoran: los pedidos de años anteriores que aún no
+        se facturan por completo siguen pendientes.
+        """
+        # Manejar parámetros de filtros
+        if filters:
+            partner_id = filters.get('partner_id')
+            search = filters.get('search_term')
+        
+        def vacio():
+            if keyset is not None:
+                return self._keyset_result([], [], per_page, keyset, total=0)
+            if page is not None and per_page is not None:
                 return [], {'page': page, 'per_page': per_page, 'total': 0, 'pages': 0}
-                
+            return []
+        
+        # Verificar conexión
+        if not self.uid or not self.models:
+            return vacio()
+        
+        try:
+            return self.pending_engine.fetch(
+                page=page, per_page=per_page, partner_id=partner_id, search=search,
+                keyset=keyset, count=count
+            )
         except Exception as e:
             logging.error(f"Error general en get_pending_orders: {e}")
-            return [], {'page': page, 'per_page': per_page, 'total': 0, 'pages': 0}
+            return vacio()
 
     def get_sales_dashboard_data(self, date_from=None, date_to=None, linea_id=None, partner_id=None):
         """Obtener datos para el dashboard de ventas"""
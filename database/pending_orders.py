@@ -0,0 +1,288 @@
+"""
+Pending Orders - Líneas de pedidos de venta pendientes de facturar
+
+OdooManager.get_pending_orders leía todas las sale.order.line de los pedidos
+INTERNACIONAL y descartaba en Python las que no tenían cantidad por facturar:
+transfería sobre todo líneas ya facturadas, el total de la paginación contaba
+ese conjunto equivocado y los pedidos se leían en lotes secuenciales de 100.
+
+PendingOrdersEngine resuelve el conjunto pendiente en Odoo:
+
+    1. Líneas con qty_to_invoice > 0 (pedidos 'sale' y 'done').
+    2. Líneas de pedidos en 'credit': Odoo no calcula qty_to_invoice en ese
+       estado, así que se leen solo sus cantidades (product_uom_qty,
+       qty_invoiced) y se quedan los ids con saldo. Son pocos pedidos.
+    3. El dominio final es "qty_to_invoice > 0 o id en <ids de crédito>", con lo
+       que la página, el search_count y el keyset se calculan sobre las líneas
+       que realmente se muestran.
+
+Los pedidos de la página se leen en una sola llamada 'read' (en trozos
+paralelos de PENDING_ORDER_READ_CHUNK si son muchos) y a la vez que los
+productos; los clientes salen de la caché de datos maestros.
+"""
+
+import os
+import re
+import logging
+from datetime import datetime
+from typing import Any, Dict, List
+
+try:
+    PENDING_ORDER_READ_CHUNK = int(os.getenv('PENDING_ORDER_READ_CHUNK', '500'))
+except Exception:
+    PENDING_ORDER_READ_CHUNK = 500
+
+MESES_ES = {
+    1: 'Enero', 2: 'Febrero', 3: 'Marzo', 4: 'Abril',
+    5: 'Mayo', 6: 'Junio', 7: 'Julio', 8: 'Agosto',
+    9: 'Septiembre', 10: 'Octubre', 11: 'Noviembre', 12: 'Diciembre'
+}
+
+
+def _nombre_relacion(valor) -> str:
+    """Nombre de un valor relacional de Odoo ([id, nombre]) o ''."""
+    if valor and isinstance(valor, (list, tuple)) and len(valor) > 1:
+        return valor[1]
+    return ''
+
+
+class PendingOrdersEngine:
+    """Consulta de líneas pendientes de facturar con el filtro de cantidad en Odoo"""
+
+    ORDER_LINE_FIELDS = [
+        'id', 'order_id', 'product_id', 'name', 'product_uom_qty',
+        'qty_delivered', 'qty_invoiced', 'qty_to_invoice',
+        'price_unit', 'price_subtotal', 'state', 'discount'
+    ]
+    ORDER_FIELDS = [
+        'id', 'name', 'partner_id', 'date_order', 'state', 'amount_total',
+        'team_id', 'user_id', 'commitment_date'
+    ]
+    # Orden de la paginación numerada (por la fecha del pedido, ver sale.order._order)
+    OFFSET_ORDER = 'order_id desc, id desc'
+    # Clave de la paginación keyset (ver OdooManager._keyset_search_read)
+    KEYSET_FIELDS = ('create_date', 'id')
+
+    def __init__(self, odoo_manager):
+        self.odoo = odoo_manager
+
+    def _execute(self, model, method, args, kwargs=None):
+        odoo = self.odoo
+        return odoo.models.execute_kw(odoo.db, odoo.uid, odoo.password, model, method, args, kwargs or {})
+
+    # ------------------------------------------------------------------
+    # Dominio
+    # ------------------------------------------------------------------
+
+    def base_domain(self, partner_id=None, search=None) -> List:
+        """Líneas con producto codificado de pedidos INTERNACIONAL confirmados (sin filtro de cantidad).
+
+        No se filtra por fecha: los pedidos de años anteriores que aún no se
+        facturan por completo siguen pendientes.
+        """
+        domain = [
+            ('product_id', '!=', False),  # Asegura que haya un producto.
+            ('product_id.default_code', '!=', False),  # Asegura que el producto tenga un Código Odoo.
+            ('product_id.name', '!=', 'VTA SERV GENERALES'),  # Excluir el producto de servicios generales.
+        ]
+        if partner_id:
+            domain.append(('order_id.partner_id', '=', int(partner_id)))
+        if search:
+            # n-1 '|' para n condiciones
+            domain += [
+                '|', '|', '|',
+                ('order_id.partner_id.name', 'ilike', search),
+                ('product_id.default_code', 'ilike', search),
+                ('product_id.name', 'ilike', search),
+                ('order_id.name', 'ilike', search)
+            ]
+        domain += [
+            ('order_id.team_id.name', 'ilike', 'INTERNACIONAL'),
+            ('order_id.state', 'in', ['credit', 'sale', 'done'])
+        ]
+        return domain
+
+    def credit_pending_ids(self, base_domain) -> List[int]:
+        """Ids de las líneas de pedidos en 'credit' con saldo por facturar (pedida - facturada > 0)."""
+        lines = self._execute(
+            'sale.order.line', 'search_read',
+            [list(base_domain) + [('state', '=', 'credit')]],
+            {'fields': ['product_uom_qty', 'qty_invoiced', 'state']}
+        )
+        if lines is None:
+            raise RuntimeError("Odoo no devolvió las líneas de pedidos en crédito")
+        return sorted(line['id'] for line in lines if self.pending_quantity(line) > 0)
+
+    def pending_domain(self, partner_id=None, search=None) -> List:
+        """Dominio de las líneas con cantidad pendiente de facturar (incluye las de 'credit')."""
+        base = self.base_domain(partner_id=partner_id, search=search)
+        return base + ['|', ('qty_to_invoice', '>', 0), ('id', 'in', self.credit_pending_ids(base))]
+
+    @staticmethod
+    def pending_quantity(line) -> float:
+        """Cantidad por facturar; en 'credit' Odoo no calcula qty_to_invoice y se usa pedida - facturada."""
+        if line.get('state') == 'credit':
+            return (line.get('product_uom_qty') or 0) - (line.get('qty_invoiced') or 0)
+        return line.get('qty_to_invoice', 0)
+
+    # ------------------------------------------------------------------
+    # Consulta
+    # ------------------------------------------------------------------
+
+    def fetch(self, page=1, per_page=1000, partner_id=None, search=None, keyset=None, count=True):
+        """
+        Líneas pendientes (registros de 'Por Facturar') y su paginación.
+
+        Args:
+            page, per_page: Paginación numerada; page=None y per_page=None = todas las líneas
+            keyset: Paginación por keyset (ver OdooManager._keyset_search_read); ignora page
+            count: Con keyset, False omite el search_count
+
+        Returns:
+            (registros, paginación) o solo la lista si no se pidió página.
+            Los errores de Odoo se propagan.
+        """
+        domain = self.pending_domain(partner_id=partner_id, search=search)
+
+        if keyset is not None:
+            lines, pagination = self.odoo._keyset_search_read(
+                'sale.order.line', domain, self.ORDER_LINE_FIELDS,
+                self.KEYSET_FIELDS, per_page, keyset, count=count
+            )
+        elif page is not None and per_page is not None:
+            # Página y total en paralelo, sobre el mismo conjunto pendiente
+            results = self.odoo._run_task_graph({
+                'lines': ((), lambda results: self._execute(
+                    'sale.order.line', 'search_read', [domain],
+                    {'fields': self.ORDER_LINE_FIELDS, 'order': self.OFFSET_ORDER,
+                     'limit': per_page, 'offset': (page - 1) * per_page}
+                )),
+                'total': ((), lambda results: self._execute('sale.order.line', 'search_count', [domain])),
+            })
+            lines, total = results['lines'], results['total'] or 0
+            pagination = {
+                'page': page,
+                'per_page': per_page,
+                'total': total,
+                'pages': (total + per_page - 1) // per_page
+            }
+        else:
+            lines = self._execute('sale.order.line', 'search_read', [domain],
+                                  {'fields': self.ORDER_LINE_FIELDS, 'order': self.OFFSET_ORDER})
+            pagination = None
+        if lines is None:
+            raise RuntimeError("Odoo no devolvió las líneas pendientes")
+
+        records = self.build_records(lines)
+        logging.debug(f"{len(records)} líneas pendientes de facturar.")
+        return records if pagination is None else (records, pagination)
+
+    def read_orders(self, order_ids) -> Dict[int, Dict]:
+        """Cabeceras de los pedidos en una llamada 'read' (trozos en paralelo si son muchos)."""
+        order_ids = sorted(set(order_ids))
+        if not order_ids:
+            return {}
+        chunk = max(1, PENDING_ORDER_READ_CHUNK)
+
+        def read(ids):
+            def run(results):
+                orders = self._execute('sale.order', 'read', [ids], {'fields': self.ORDER_FIELDS})
+                if orders is None:
+                    raise RuntimeError("Odoo no devolvió los pedidos")
+                return orders
+            return run
+
+        results = self.odoo._run_task_graph({
+            start: ((), read(order_ids[start:start + chunk]))
+            for start in range(0, len(order_ids), chunk)
+        })
+        return {order['id']: order for orders in results.values() for order in orders}
+
+    def build_records(self, lines) -> List[Dict[str, Any]]:
+        """Registros de 'Por Facturar' (pedido, cliente, producto, cantidades) para las líneas dadas."""
+        if not lines:
+            return []
+        order_ids = [line['order_id'][0] for line in lines if line.get('order_id')]
+        product_ids = list({line['product_id'][0] for line in lines if line.get('product_id')})
+        master_data = self.odoo.master_data
+
+        def fetch_partners(results):
+            partner_ids = list({order['partner_id'][0] for order in results['orders'].values()
+                                if order.get('partner_id')})
+            # Sin idioma, como la lectura de clientes original de get_pending_orders
+            return master_data.get_records('res.partner', partner_ids, context={})
+
+        # Pedidos y productos a la vez; los clientes cuando llegan los pedidos
+        results = self.odoo._run_task_graph({
+            'orders': ((), lambda results: self.read_orders(order_ids)),
+            'products': ((), lambda results: master_data.get_records('product.product', product_ids)),
+            'partners': (('orders',), fetch_partners),
+        })
+        orders, products, partners = results['orders'], results['products'], results['partners']
+
+        records = []
+        for line in lines:
+            order = orders.get(line['order_id'][0], {}) if line.get('order_id') else {}
+            product = products.get(line['product_id'][0], {}) if line.get('product_id') else {}
+            partner = partners.get(order['partner_id'][0], {}) if order.get('partner_id') else {}
+            cantidad = self.pending_quantity(line)
+            if cantidad <= 0:
+                continue
+            records.append(self._build_record(line, order, product, partner, cantidad))
+        return records
+
+    @staticmethod
+    def _build_record(line, order, product, partner, cantidad) -> Dict[str, Any]:
+        mes = ''
+        if order.get('date_order'):
+            try:
+                fecha_obj = datetime.strptime(order['date_order'], '%Y-%m-%d %H:%M:%S')
+                mes = f"{MESES_ES.get(fecha_obj.month, '')} {fecha_obj.year}"
+            except ValueError:
+                mes = ''
+
+        # El commitment_date viene en formato 'YYYY-MM-DD' o 'YYYY-MM-DD HH:MM:SS' (False si no tiene)
+        commitment_date = order.get('commitment_date', '')
+        commitment_year = commitment_date.split('-')[0] if commitment_date else ''
+        date_order = order.get('date_order') or ''
+        descripcion = line.get('name') or product.get('display_name', '')
+        precio = line.get('price_unit', 0)
+        descuento = line.get('discount', 0)
+        partner_ref = order.get('partner_id')
+
+        return {
+            'pedido': order.get('name', ''),
+            'cliente': partner.get('name', ''),
+            'partner_id': partner_ref,
+            'cliente_id': partner_ref[0] if partner_ref and isinstance(partner_ref, (list, tuple)) else None,
+            'pais': _nombre_relacion(partner.get('country_id')),
+            # Priorizar commitment_date, fallback a date_order
+            'fecha': commitment_date.split(' ')[0] if commitment_date else date_order.split(' ')[0],
+            'fecha_confirmacion': date_order.split(' ')[0],
+            'mes': mes,
+            'codigo_odoo': product.get('default_code', ''),
+            'producto': product.get('name', ''),
+            # Preferir la descripción de la propia línea y finalmente el display_name del producto.
+            'descripcion': descripcion,
+            'medida': (re.findall(r"\(([^)]+)\)", descripcion) or [None])[-1] if descripcion else '',
+            # Línea comercial internacional
+            'linea_comercial': _nombre_relacion(product.get('commercial_line_international_id')),
+            'clasificacion_farmacologica': _nombre_relacion(product.get('pharmacological_classification_id')),
+            'formas_farmaceuticas': _nombre_relacion(product.get('pharmaceutical_forms_id')),
+            'via_administracion': _nombre_relacion(product.get('administration_way_id')),
+            'linea_produccion': _nombre_relacion(product.get('production_line_id')),
+            'cantidad_pendiente': cantidad,
+            'precio_unitario': precio,
+            'discount': descuento,
+            'total_pendiente': cantidad * precio * (1 - (descuento / 100)),
+
+            # Campos de fecha de entrega
+            'commitment_date': commitment_date,
+            'commitment_year': commitment_year,
+
+            # Campos adicionales
+            'team_id': order.get('team_id'),
+            'commercial_line_international_id': product.get('commercial_line_international_id'),
+            'state': line.get('state'),
+            'order_state': order.get('state')
+        }
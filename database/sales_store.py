@@ -0,0 +1,493 @@
+"""
+Sales Store - Copia local (SQLite) de las líneas de venta internacionales de Odoo
+
+Las líneas del diario F150 se copian una vez desde Odoo y luego solo se piden
+las que cambiaron después de la última marca de agua (write_date de la línea o
+de su factura). El dashboard, /sales y las exportaciones leen desde aquí en
+lugar de traer un año completo de account.move.line en cada consulta.
+
+Las sincronizaciones siempre corren en un hilo en segundo plano: las consultas
+nunca esperan a Odoo. Varios workers de gunicorn comparten el archivo y solo
+uno sincroniza a la vez (concesión 'sync_lease' en sync_state, tomada dentro de
+una transacción BEGIN IMMEDIATE que no espera si otro worker está escribiendo).
+La sincronización confirma cada lote por separado, así el bloqueo de escritura
+nunca queda tomado mientras se espera a Odoo.
+"""
+
+import os
+import json
+import uuid
+import sqlite3
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class SalesStore:
+    """Almacén local de líneas de venta con sincronización incremental desde Odoo"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sales_lines (
+            id INTEGER PRIMARY KEY,
+            invoice_date TEXT,
+            move_name TEXT,
+            partner_id INTEGER,
+            commercial_line_id INTEGER,
+            search_text TEXT,
+            write_date TEXT,
+            payload TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sales_lines_date ON sales_lines (invoice_date);
+        CREATE INDEX IF NOT EXISTS idx_sales_lines_partner ON sales_lines (partner_id, invoice_date);
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, odoo_manager, path: Optional[str] = None):
+        """Abrir (o crear) el almacén y asociarlo al OdooManager del que se sincroniza"""
+        self.odoo = odoo_manager
+        self.path = path or os.getenv('SALES_STORE_PATH', os.path.join('data', 'sales_store.sqlite3'))
+        self.since = os.getenv('SALES_STORE_SINCE', f"{datetime.now().year - 5}-01-01")
+        try:
+            self.sync_interval = int(os.getenv('SALES_STORE_SYNC_INTERVAL', '300'))
+        except Exception:
+            self.sync_interval = 300
+        try:
+            self.reconcile_interval = int(os.getenv('SALES_STORE_RECONCILE_INTERVAL', '3600'))
+        except Exception:
+            self.reconcile_interval = 3600
+        try:
+            self.full_refresh_interval = int(os.getenv('SALES_STORE_FULL_REFRESH_INTERVAL', '86400'))
+        except Exception:
+            self.full_refresh_interval = 86400
+        try:
+            self.batch_size = int(os.getenv('SALES_STORE_BATCH_SIZE', '2000'))
+        except Exception:
+            self.batch_size = 2000
+        # Vigencia de la concesión de sincronización si el worker que la tiene muere
+        try:
+            self.sync_lease_seconds = int(os.getenv('SALES_STORE_SYNC_LEASE', '1800'))
+        except Exception:
+            self.sync_lease_seconds = 1800
+
+        self._local = threading.local()
+        self._sync_lock = threading.Lock()
+        self._last_sync_check = 0.0
+        self._owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+        logging.info(f"✅ SalesStore inicializado en {self.path} (desde {self.since})")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Conexión SQLite del hilo actual (WAL para lecturas concurrentes entre workers)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # ------------------------------------------------------------------
+    # Estado de sincronización
+    # ------------------------------------------------------------------
+
+    def _get_state(self, key: str) -> Optional[str]:
+        row = self._connect().execute('SELECT value FROM sync_state WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, conn: sqlite3.Connection, key: str, value: str):
+        conn.execute(
+            'INSERT INTO sync_state (key, value) VALUES (?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+            (key, value)
+        )
+
+    def is_ready(self) -> bool:
+        """True cuando la carga inicial terminó para el horizonte configurado"""
+        return self._get_state('full_sync_since') == self.since
+
+    def get_status(self) -> Dict:
+        """Resumen del almacén: filas, marca de agua y fechas de sincronización"""
+        conn = self._connect()
+        rows = conn.execute('SELECT COUNT(*) FROM sales_lines').fetchone()[0]
+        return {
+            'path': self.path,
+            'since': self.since,
+            'ready': self.is_ready(),
+            'rows': rows,
+            'watermark': self._get_state('watermark'),
+            'last_sync': self._get_state('last_sync'),
+            'last_reconcile': self._get_state('last_reconcile'),
+            'last_full_sync': self._get_state('last_full_sync'),
+        }
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _row_for(line: Dict) -> Tuple:
+        """Columnas indexadas + JSON completo de una línea enriquecida"""
+        move_partner = line.get('move_partner_id')
+        commercial_line = line.get('commercial_line_international_id')
+        search_text = ' '.join(str(v) for v in (
+            line.get('factura'), line.get('invoice_origin'), line.get('producto'),
+            line.get('codigo_odoo'), line.get('cliente')
+        ) if v).lower()
+        return (
+            line.get('account_move_line_id'),
+            line.get('fecha') or None,
+            line.get('factura') or '',
+            move_partner[0] if isinstance(move_partner, list) and move_partner else None,
+            commercial_line[0] if isinstance(commercial_line, list) and commercial_line else None,
+            search_text,
+            line.get('write_date') or '',
+            json.dumps(line, ensure_ascii=False, default=str),
+        )
+
+    def _fetch_and_upsert(self, conn: sqlite3.Connection, line_ids: List[int]) -> str:
+        """Trae de Odoo las líneas indicadas por lotes y las guarda; devuelve el write_date máximo.
+
+        Cada lote se confirma por separado para no retener el bloqueo de escritura
+        de SQLite mientras se espera la respuesta de Odoo del lote siguiente.
+        """
+        max_write_date = ''
+        for i in range(0, len(line_ids), self.batch_size):
+            batch_ids = line_ids[i:i + self.batch_size]
+            lines = self.odoo.get_sales_lines_by_ids(batch_ids)
+            conn.executemany(
+                'INSERT INTO sales_lines (id, invoice_date, move_name, partner_id, commercial_line_id, '
+                'search_text, write_date, payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET invoice_date = excluded.invoice_date, '
+                'move_name = excluded.move_name, partner_id = excluded.partner_id, '
+                'commercial_line_id = excluded.commercial_line_id, search_text = excluded.search_text, '
+                'write_date = excluded.write_date, payload = excluded.payload',
+                [self._row_for(line) for line in lines if line.get('account_move_line_id')]
+            )
+            # Líneas que Odoo ya no devuelve con el formato de ventas (p. ej. sin producto)
+            returned = set(line.get('account_move_line_id') for line in lines)
+            missing = [line_id for line_id in batch_ids if line_id not in returned]
+            if missing:
+                conn.executemany('DELETE FROM sales_lines WHERE id = ?', [(line_id,) for line_id in missing])
+            conn.commit()
+            for line in lines:
+                if (line.get('write_date') or '') > max_write_date:
+                    max_write_date = line['write_date']
+        return max_write_date
+
+    # ------------------------------------------------------------------
+    # Sincronización
+    # ------------------------------------------------------------------
+
+    def sync(self, full: bool = False) -> Dict:
+        """Sincroniza con Odoo.
+
+        - Sin carga previa (o full=True): copia completa desde SALES_STORE_SINCE.
+        - Incremental: solo líneas cuyo write_date (o el de su factura) es >= la marca de agua.
+        - Conciliación periódica: compara IDs con Odoo para borrar las líneas que dejaron de
+          cumplir el dominio (facturas anuladas, pasadas a borrador) y traer las que falten.
+        """
+        start = time.time()
+        stats = {'mode': 'incremental', 'fetched': 0, 'deleted': 0, 'seconds': 0.0}
+        if not self.odoo.uid or not self.odoo.models:
+            logging.warning("⚠️ SalesStore: Odoo no disponible, se mantiene la copia local")
+            return stats
+
+        now = datetime.now()
+        last_full = self._get_state('last_full_sync')
+        full = full or not self.is_ready() or (
+            last_full and (now - datetime.fromisoformat(last_full)).total_seconds() >= self.full_refresh_interval
+        )
+        last_reconcile = self._get_state('last_reconcile')
+        reconcile = not full and (
+            not last_reconcile or (now - datetime.fromisoformat(last_reconcile)).total_seconds() >= self.reconcile_interval
+        )
+
+        conn = self._connect()
+        try:
+            if full or reconcile:
+                stats['mode'] = 'full' if full else 'reconcile'
+                remote_ids = self.odoo.search_sales_line_ids(date_from=self.since)
+                if remote_ids is None:
+                    raise RuntimeError("No se pudieron obtener los IDs de ventas desde Odoo")
+                remote_set = set(remote_ids)
+                local_ids = set(r[0] for r in conn.execute('SELECT id FROM sales_lines'))
+                stale_ids = [(line_id,) for line_id in local_ids - remote_set]
+                conn.executemany('DELETE FROM sales_lines WHERE id = ?', stale_ids)
+                conn.commit()
+                stats['deleted'] = len(stale_ids)
+
+                # En la conciliación solo faltantes + cambios recientes; en la completa, todo
+                to_fetch = remote_set if full else remote_set - local_ids
+                watermark = self._get_state('watermark')
+                if not full and watermark:
+                    changed = self.odoo.search_sales_line_ids(date_from=self.since, modified_since=watermark) or []
+                    to_fetch = to_fetch | set(changed)
+
+                max_write_date = self._fetch_and_upsert(conn, sorted(to_fetch))
+                stats['fetched'] = len(to_fetch)
+                self._set_state(conn, 'last_reconcile', now.isoformat())
+                if full:
+                    self._set_state(conn, 'last_full_sync', now.isoformat())
+                    self._set_state(conn, 'full_sync_since', self.since)
+            else:
+                watermark = self._get_state('watermark')
+                changed = self.odoo.search_sales_line_ids(date_from=self.since, modified_since=watermark)
+                if changed is None:
+                    raise RuntimeError("No se pudieron obtener los cambios de ventas desde Odoo")
+                max_write_date = self._fetch_and_upsert(conn, changed)
+                stats['fetched'] = len(changed)
+
+            watermark = self._get_state('watermark') or ''
+            if max_write_date and max_write_date > watermark:
+                self._set_state(conn, 'watermark', max_write_date)
+            self._set_state(conn, 'last_sync', now.isoformat())
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"❌ Error sincronizando SalesStore: {e}")
+            stats['error'] = str(e)
+
+        stats['seconds'] = time.time() - start
+        logging.info(
+            f"🔄 SalesStore sync ({stats['mode']}): {stats['fetched']} líneas traídas, "
+            f"{stats['deleted']} eliminadas en {stats['seconds']:.2f}s"
+        )
+        return stats
+
+    def _sync_due(self) -> bool:
+        """True si la copia no está lista o la última sincronización (de cualquier worker) venció.
+
+        Si otro worker tiene la concesión vigente, su sincronización ya está en curso
+        y no está pendiente: así no se intenta tomarla mientras ese worker escribe.
+        """
+        if self._lease_held_by_other():
+            return False
+        if not self.is_ready():
+            return True
+        last_sync = self._get_state('last_sync')
+        return not last_sync or (datetime.now() - datetime.fromisoformat(last_sync)).total_seconds() >= self.sync_interval
+
+    def _lease_held_by_other(self, conn: Optional[sqlite3.Connection] = None) -> bool:
+        """True si otro worker tiene la concesión de sincronización y no venció"""
+        row = (conn or self._connect()).execute("SELECT value FROM sync_state WHERE key = 'sync_lease'").fetchone()
+        if not row:
+            return False
+        owner, _, expires = row[0].rpartition('|')
+        return owner != self._owner and float(expires or 0) > time.time()
+
+    def _claim_sync(self) -> bool:
+        """Toma la concesión de sincronización entre procesos si está libre o vencida.
+
+        La lectura y la escritura van en una transacción BEGIN IMMEDIATE, así dos
+        workers no pueden tomarla a la vez; se vuelve a comprobar que la
+        sincronización siga pendiente por si otro worker acaba de terminarla.
+        La conexión usa timeout=0: si otro worker tiene el bloqueo de escritura,
+        se desiste en el acto en lugar de hacer esperar a la petición.
+        """
+        conn = sqlite3.connect(self.path, timeout=0, isolation_level=None)
+        try:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+            except sqlite3.OperationalError:
+                return False
+            if self._lease_held_by_other(conn) or not self._sync_due():
+                conn.execute('ROLLBACK')
+                return False
+            self._set_state(conn, 'sync_lease', f"{self._owner}|{time.time() + self.sync_lease_seconds}")
+            conn.execute('COMMIT')
+            return True
+        except Exception as e:
+            logging.warning(f"⚠️ SalesStore: no se pudo tomar la concesión de sincronización: {e}")
+            try:
+                conn.execute('ROLLBACK')
+            except Exception:
+                pass
+            return False
+        finally:
+            conn.close()
+
+    def _release_sync(self):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM sync_state WHERE key = 'sync_lease' AND value LIKE ?", (f"{self._owner}|%",))
+            conn.commit()
+        except Exception as e:
+            logging.warning(f"⚠️ SalesStore: no se pudo liberar la concesión de sincronización: {e}")
+
+    def _sync_in_background(self, full: bool):
+        try:
+            self.sync(full=full)
+        finally:
+            self._release_sync()
+            self._sync_lock.release()
+
+    def maybe_sync(self):
+        """Lanza una sincronización en segundo plano si la última tiene más de SALES_STORE_SYNC_INTERVAL segundos.
+
+        Nunca sincroniza en línea: mientras tanto las consultas leen la copia actual (o
+        van a Odoo si la carga inicial no terminó). Solo un hilo por proceso y un
+        worker entre todos sincronizan a la vez (ver _claim_sync); los demás no esperan.
+        """
+        if time.monotonic() - self._last_sync_check < self.sync_interval:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        self._last_sync_check = time.monotonic()
+
+        try:
+            claimed = self._sync_due() and self._claim_sync()
+        except Exception:
+            self._sync_lock.release()
+            raise
+        if not claimed:
+            self._sync_lock.release()
+            return
+        threading.Thread(target=self._sync_in_background, args=(not self.is_ready(),), daemon=True,
+                         name='sales-store-sync').start()
+
+    # ------------------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------------------
+
+    def _covered_filter(self, date_from=None, date_to=None, partner_id=None, linea_id=None,
+                        search=None, sync=True) -> Optional[Tuple[str, List]]:
+        """WHERE + parámetros para los filtros de ventas, o None si la copia no cubre la consulta.
+
+        sync=False omite maybe_sync (páginas siguientes de un mismo recorrido).
+        """
+        if sync:
+            try:
+                self.maybe_sync()
+            except Exception as e:
+                logging.warning(f"⚠️ SalesStore: no se pudo sincronizar: {e}")
+
+        if not self.is_ready():
+            return None
+        if not date_from or str(date_from) < self.since:
+            return None
+
+        where = ['invoice_date >= ?']
+        params = [str(date_from)]
+        if date_to:
+            where.append('invoice_date <= ?')
+            params.append(str(date_to))
+        if partner_id:
+            where.append('partner_id = ?')
+            params.append(int(partner_id))
+        if linea_id:
+            where.append('commercial_line_id = ?')
+            params.append(int(linea_id))
+        if search:
+            where.append('search_text LIKE ?')
+            params.append(f"%{str(search).lower()}%")
+        return ' AND '.join(where), params
+
+    def query_sales_lines(self, date_from=None, date_to=None, partner_id=None, linea_id=None,
+                          search=None, page=None, per_page=None) -> Optional[Tuple[List[Dict], int]]:
+        """Líneas de venta desde la copia local con los mismos filtros que OdooManager.get_sales_lines.
+
+        Devuelve (líneas, total) o None si la copia no está lista o no cubre el rango pedido,
+        en cuyo caso el llamador debe consultar a Odoo.
+        """
+        covered = self._covered_filter(date_from, date_to, partner_id, linea_id, search)
+        if covered is None:
+            return None
+        where_sql, params = covered
+
+        conn = self._connect()
+        sql = f'SELECT payload FROM sales_lines WHERE {where_sql} ORDER BY invoice_date DESC, move_name DESC, id'
+        query_params = list(params)
+        total = None
+        if page is not None and per_page is not None:
+            total = conn.execute(f'SELECT COUNT(*) FROM sales_lines WHERE {where_sql}', params).fetchone()[0]
+            sql += ' LIMIT ? OFFSET ?'
+            query_params += [per_page, (page - 1) * per_page]
+
+        lines = [json.loads(row[0]) for row in conn.execute(sql, query_params)]
+        return lines, total if total is not None else len(lines)
+
+    def query_sales_lines_keyset(self, date_from=None, date_to=None, partner_id=None, linea_id=None,
+                                 search=None, limit=1000, key=None, direction='next',
+                                 count=True, sync=True) -> Optional[Tuple[List[Dict], List[List], Optional[int]]]:
+        """Página keyset de líneas (orden invoice_date DESC, id DESC) para OdooManager.get_sales_lines.
+
+        Devuelve (líneas, claves [invoice_date, id], total o None) en el orden de
+        lectura (ascendente si direction='prev'), o None si la copia no cubre la consulta.
+        El índice por invoice_date (que incluye el id) resuelve la página sin recorrer las anteriores.
+        sync=False no lanza la sincronización periódica (ver _covered_filter).
+        """
+        covered = self._covered_filter(date_from, date_to, partner_id, linea_id, search, sync=sync)
+        if covered is None:
+            return None
+        where_sql, params = covered
+
+        conn = self._connect()
+        total = conn.execute(f'SELECT COUNT(*) FROM sales_lines WHERE {where_sql}', params).fetchone()[0] if count else None
+
+        page_sql, page_params = where_sql, list(params)
+        op = '<' if direction == 'next' else '>'
+        if key is not None:
+            page_sql += f' AND (invoice_date {op} ? OR (invoice_date = ? AND id {op} ?))'
+            page_params += [str(key[0]), str(key[0]), int(key[1])]
+        sentido = 'DESC' if direction == 'next' else 'ASC'
+        rows = conn.execute(
+            f'SELECT invoice_date, id, payload FROM sales_lines WHERE {page_sql} '
+            f'ORDER BY invoice_date {sentido}, id {sentido} LIMIT ?',
+            page_params + [int(limit)]
+        ).fetchall()
+        return [json.loads(row[2]) for row in rows], [[row[0], row[1]] for row in rows], total
+
+    def aggregate_sales_lines(self, date_from=None, date_to=None, partner_id=None, linea_id=None,
+                              exclude_code_prefixes=()) -> Optional[List[Dict]]:
+        """Totales agrupados por producto y cliente (mismo formato que OdooManager.get_sales_aggregates).
+
+        El GROUP BY se hace en SQLite; solo las filas agrupadas pasan a Python. El
+        cliente es el de la factura (move_partner_id), como en las líneas de detalle,
+        y los nombres salen de los datos maestros (OdooManager.build_aggregate_rows).
+        Devuelve None si la copia no cubre la consulta.
+        """
+        covered = self._covered_filter(date_from, date_to, partner_id, linea_id)
+        if covered is None:
+            return None
+        where_sql, params = covered
+        for prefix in exclude_code_prefixes:
+            # GLOB distingue mayúsculas, igual que startswith / =like
+            where_sql += " AND COALESCE(json_extract(payload, '$.codigo_odoo'), '') NOT GLOB ?"
+            params = params + [f'{prefix}*']
+
+        sql = f"""
+            SELECT json_extract(payload, '$.product_id[0]') AS product_key,
+                   json_extract(payload, '$.move_partner_id[0]') AS partner_key,
+                   SUM(json_extract(payload, '$.amount_currency')),
+                   SUM(MAX(json_extract(payload, '$.amount_currency'), 0)),
+                   SUM(COALESCE(json_extract(payload, '$.quantity'), 0)),
+                   COUNT(*)
+            FROM sales_lines
+            WHERE {where_sql}
+            GROUP BY product_key, partner_key
+        """
+        groups = [
+            {
+                'product_id': product_key,
+                'partner_id': partner_key,
+                'amount_currency': amount or 0,
+                'ventas_brutas': gross or 0,
+                'quantity': quantity or 0,
+                'line_count': count,
+            }
+            for product_key, partner_key, amount, gross, quantity, count in self._connect().execute(sql, params)
+        ]
+        return self.odoo.build_aggregate_rows(groups)
@@ -0,0 +1,337 @@
+"""
+Shared Cache - Caché y contadores de rate limit compartidos entre procesos (SQLite)
+
+Con SimpleCache y memory:// cada worker de gunicorn tiene su propia caché del
+dashboard y sus propios contadores de rate limit: N workers significan N
+consultas en frío a Odoo y límites N veces más permisivos. Este módulo guarda
+ambos en un archivo SQLite (WAL) que comparten todos los workers de la máquina:
+
+    - SQLiteCache: backend de Flask-Caching (CACHE_TYPE=sqlite) con tope de
+      entradas y de bytes, expulsión LRU y valores pickle + zlib.
+    - SQLiteLimiterStorage: almacenamiento de limits/Flask-Limiter registrado
+      para el esquema sqlite:// (RATELIMIT_STORAGE_URI=sqlite:///data/ratelimit.sqlite3).
+"""
+
+import os
+import pickle
+import sqlite3
+import logging
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+from flask_caching.backends.base import BaseCache
+from limits.storage import Storage
+
+
+def _open_sqlite(path: str) -> sqlite3.Connection:
+    """Conexión en modo autocommit (las escrituras compuestas usan BEGIN IMMEDIATE)"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class _SQLiteConnections:
+    """Una conexión por hilo y por proceso (los workers de gunicorn se crean con fork)"""
+
+    def __init__(self, path: str, schema: str):
+        self.path = path
+        self._local = threading.local()
+        with self.connect() as conn:
+            conn.executescript(schema)
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = _open_sqlite(self.path)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class SQLiteCache(BaseCache):
+    """Backend de Flask-Caching sobre SQLite compartido entre workers
+
+    Los valores se serializan con pickle y se comprimen con zlib a partir de
+    compress_min bytes (el HTML del dashboard baja a una fracción de su tamaño).
+    Al superar threshold entradas o max_bytes se descartan primero las vencidas
+    y después las menos usadas recientemente (LRU).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            expires REAL NOT NULL,
+            accessed REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (accessed);
+    """
+
+    # Prefijo de un byte que indica cómo se guardó el valor
+    _RAW = b'p'
+    _ZLIB = b'z'
+
+    def __init__(self, path: Optional[str] = None, default_timeout: int = 300, threshold: int = 500,
+                 max_bytes: Optional[int] = None, compress_min: int = 1024, compress_level: int = 6):
+        super().__init__(default_timeout=default_timeout)
+        self.path = path or os.path.join('data', 'cache.sqlite3')
+        self.threshold = max(1, threshold)
+        self.max_bytes = max_bytes or 256 * 1024 * 1024
+        self.compress_min = compress_min
+        self.compress_level = compress_level
+        self._connections = _SQLiteConnections(self.path, self.SCHEMA)
+        logging.info(
+            f"✅ SQLiteCache en {self.path} (máx. {self.threshold} entradas / "
+            f"{self.max_bytes // (1024 * 1024)} MB)"
+        )
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        """Construcción desde la configuración de Flask-Caching (CACHE_TYPE)"""
+        kwargs.update({
+            'path': config.get('CACHE_SQLITE_PATH'),
+            'threshold': config.get('CACHE_THRESHOLD', 500),
+            'max_bytes': config.get('CACHE_SQLITE_MAX_BYTES'),
+            'compress_min': config.get('CACHE_SQLITE_COMPRESS_MIN', 1024),
+            'compress_level': config.get('CACHE_SQLITE_COMPRESS_LEVEL', 6),
+        })
+        return cls(*args, **kwargs)
+
+    # ------------------------------------------------------------------
+    # Serialización
+    # ------------------------------------------------------------------
+
+    def _dumps(self, value: Any) -> bytes:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) >= self.compress_min:
+            return self._ZLIB + zlib.compress(data, self.compress_level)
+        return self._RAW + data
+
+    def _loads(self, blob: bytes) -> Any:
+        data = bytes(blob)
+        if data[:1] == self._ZLIB:
+            return pickle.loads(zlib.decompress(data[1:]))
+        return pickle.loads(data[1:])
+
+    def _expires_at(self, timeout: Optional[int]) -> float:
+        timeout = self._normalize_timeout(timeout)
+        # 0 = sin vencimiento
+        return time.time() + timeout if timeout else 0
+
+    # ------------------------------------------------------------------
+    # API de cachelib
+    # ------------------------------------------------------------------
+
+    def get(self, key: str) -> Any:
+        conn = self._connections.connect()
+        now = time.time()
+        try:
+            row = conn.execute(
+                'SELECT value, expires FROM cache_entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] and row[1] <= now:
+                conn.execute('DELETE FROM cache_entries WHERE key = ? AND expires = ?', (key, row[1]))
+                return None
+            conn.execute('UPDATE cache_entries SET accessed = ? WHERE key = ?', (now, key))
+            return self._loads(row[0])
+        except Exception as e:
+            logging.warning(f"⚠️ SQLiteCache: no se pudo leer '{key}': {e}")
+            return None
+
+    def set(self, key: str, value: Any, timeout: Optional[int] = None) -> bool:
+        try:
+            blob = self._dumps(value)
+            conn = self._connections.connect()
+            now = time.time()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    'INSERT OR REPLACE INTO cache_entries (key, value, size, expires, accessed) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, blob, len(blob), self._expires_at(timeout), now)
+                )
+                self._evict(conn, now)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return True
+        except Exception as e:
+            logging.warning(f"⚠️ SQLiteCache: no se pudo guardar '{key}': {e}")
+            return False
+
+    def add(self, key: str, value: Any, timeout: Optional[int] = None) -> bool:
+        """Guarda solo si la clave no existe (o venció); atómico entre procesos"""
+        try:
+            blob = self._dumps(value)
+            conn = self._connections.connect()
+            now = time.time()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    'DELETE FROM cache_entries WHERE key = ? AND expires > 0 AND expires <= ?', (key, now)
+                )
+                added = conn.execute(
+                    'INSERT OR IGNORE INTO cache_entries (key, value, size, expires, accessed) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, blob, len(blob), self._expires_at(timeout), now)
+                ).rowcount == 1
+                if added:
+                    self._evict(conn, now)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return added
+        except Exception as e:
+            logging.warning(f"⚠️ SQLiteCache: no se pudo agregar '{key}': {e}")
+            return False
+
+    def delete(self, key: str) -> bool:
+        try:
+            return self._connections.connect().execute(
+                'DELETE FROM cache_entries WHERE key = ?', (key,)
+            ).rowcount > 0
+        except Exception as e:
+            logging.warning(f"⚠️ SQLiteCache: no se pudo borrar '{key}': {e}")
+            return False
+
+    def has(self, key: str) -> bool:
+        try:
+            row = self._connections.connect().execute(
+                'SELECT 1 FROM cache_entries WHERE key = ? AND (expires = 0 OR expires > ?)',
+                (key, time.time())
+            ).fetchone()
+            return row is not None
+        except Exception:
+            return False
+
+    def clear(self) -> bool:
+        try:
+            self._connections.connect().execute('DELETE FROM cache_entries')
+            return True
+        except Exception as e:
+            logging.warning(f"⚠️ SQLiteCache: no se pudo vaciar: {e}")
+            return False
+
+    # ------------------------------------------------------------------
+    # Tope de tamaño
+    # ------------------------------------------------------------------
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """Descarta vencidas y, si aún se excede el tope, las menos usadas (LRU)"""
+        count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries').fetchone()
+        if count <= self.threshold and total <= self.max_bytes:
+            return
+        conn.execute('DELETE FROM cache_entries WHERE expires > 0 AND expires <= ?', (now,))
+        count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries').fetchone()
+        if count <= self.threshold and total <= self.max_bytes:
+            return
+        evicted = 0
+        # La entrada recién escrita (accessed = now) es la última candidata
+        for key, size in conn.execute('SELECT key, size FROM cache_entries ORDER BY accessed ASC').fetchall():
+            if count <= self.threshold and total <= self.max_bytes:
+                break
+            conn.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+            count -= 1
+            total -= size
+            evicted += 1
+        if evicted:
+            logging.info(f"🧹 SQLiteCache: {evicted} entradas descartadas por tamaño (LRU)")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Entradas, bytes guardados y topes configurados"""
+        count, total = self._connections.connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries'
+        ).fetchone()
+        return {
+            'path': self.path,
+            'entries': count,
+            'bytes': total,
+            'threshold': self.threshold,
+            'max_bytes': self.max_bytes,
+        }
+
+
+class SQLiteLimiterStorage(Storage):
+    """Contadores de Flask-Limiter (estrategia fixed-window) en SQLite compartido
+
+    Se registra para el esquema sqlite://, p. ej.
+    RATELIMIT_STORAGE_URI=sqlite:///data/ratelimit.sqlite3 (ruta relativa) o
+    sqlite:////var/lib/dashboard/ratelimit.sqlite3 (ruta absoluta).
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL,
+            expiry REAL NOT NULL
+        );
+    """
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        path = uri.split('://', 1)[1]
+        # sqlite:///ruta/relativa -> ruta/relativa ; sqlite:////ruta/absoluta -> /ruta/absoluta
+        self.path = path[1:] if path.startswith('/') else path
+        self._connections = _SQLiteConnections(self.path, self.SCHEMA)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        conn = self._connections.connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT value, expiry FROM rate_limits WHERE key = ?', (key,)).fetchone()
+            if row is None or row[1] <= now:
+                value, expires = amount, now + expiry
+            else:
+                value, expires = row[0] + amount, (now + expiry if elastic_expiry else row[1])
+            conn.execute(
+                'INSERT OR REPLACE INTO rate_limits (key, value, expiry) VALUES (?, ?, ?)',
+                (key, value, expires)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return value
+
+    def get(self, key: str) -> int:
+        row = self._connections.connect().execute(
+            'SELECT value FROM rate_limits WHERE key = ? AND expiry > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        row = self._connections.connect().execute(
+            'SELECT expiry FROM rate_limits WHERE key = ?', (key,)
+        ).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self) -> bool:
+        try:
+            self._connections.connect().execute('SELECT 1').fetchone()
+            return True
+        except Exception:
+            return False
+
+    def reset(self) -> Optional[int]:
+        return self._connections.connect().execute('DELETE FROM rate_limits').rowcount
+
+    def clear(self, key: str) -> None:
+        self._connections.connect().execute('DELETE FROM rate_limits WHERE key = ?', (key,))
@@ -1,24 +1,78 @@
 """
 Supabase Manager - Gestión de metas de clientes en base de datos PostgreSQL
 Reemplaza Google Sheets como fuente de datos persistente
+
+Las lecturas del dashboard y de /metas_cliente van por año (read_metas_año):
+solo se piden las filas y columnas de ese año y el resultado se guarda en la
+caché (la compartida de la app si se pasa una, si no en memoria del proceso)
+durante METAS_CACHE_TTL segundos. Las escrituras invalidan exactamente los
+años que tocan. get_metas_stats() informa filas y bytes leídos. La versión de
+un año es un hash del contenido (igual en todos los workers y entre recargas,
+sirve para ETags) y una lectura fallida se recuerda METAS_ERROR_TTL segundos
+para no repetirla en cada petición durante una caída de Supabase.
+
+save_metas_año() guarda un año comparando con lo que hay en Supabase: solo se
+insertan los clientes nuevos, se actualizan los que cambiaron y se borran los
+que se quedaron sin metas, en lotes de METAS_BATCH_SIZE filas. El costo de
+guardar depende de lo que cambió, no del tamaño de la tabla.
 """
 
 import os
+import copy
+import hashlib
+import json
+import time
 import logging
+import threading
 from supabase import create_client, Client
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 from dotenv import load_dotenv
 
+from services.tracing import span, traced
+
 load_dotenv()
 
+try:
+    METAS_CACHE_TTL = int(os.getenv('METAS_CACHE_TTL', '300'))
+except Exception:
+    METAS_CACHE_TTL = 300
+
+try:
+    METAS_ERROR_TTL = int(os.getenv('METAS_ERROR_TTL', '30'))
+except Exception:
+    METAS_ERROR_TTL = 30
+
+try:
+    METAS_BATCH_SIZE = max(1, int(os.getenv('METAS_BATCH_SIZE', '500')))
+except Exception:
+    METAS_BATCH_SIZE = 500
+
+# Columnas que se leen de metas_clientes (sin id, timestamps, ...)
+METAS_COLUMNAS = 'cliente_id,cliente_nombre,agrovet,petmedica,avivet'
+METAS_LINEAS = ('agrovet', 'petmedica', 'avivet')
+
 class SupabaseManager:
     """Gestor de conexión y operaciones con Supabase para metas de clientes"""
     
-    def __init__(self):
-        """Inicializar cliente de Supabase"""
+    def __init__(self, cache=None, metas_ttl: Optional[int] = None):
+        """Inicializar cliente de Supabase
+        
+        Args:
+            cache: Caché compartida (Flask-Caching) para las metas por año; None = memoria del proceso
+            metas_ttl: Segundos de vida de las metas en caché (por defecto METAS_CACHE_TTL o 300)
+        """
         self.url = os.getenv('SUPABASE_URL')
         self.key = os.getenv('SUPABASE_KEY')
         
+        # Repositorio de metas por año
+        self.cache = cache
+        self.metas_ttl = METAS_CACHE_TTL if metas_ttl is None else metas_ttl
+        self._metas_local: Dict[str, tuple] = {}
+        self._metas_años_leidos = set()  # años leídos por este proceso (para invalidarlos todos)
+        self._metas_lock = threading.Lock()
+        self._metas_stats = {'hits': 0, 'misses': 0, 'reads': 0, 'rows': 0, 'bytes': 0, 'invalidations': 0,
+                             'errors': 0, 'error_hits': 0}
+        
         if not self.url or not self.key:
             raise ValueError("SUPABASE_URL y SUPABASE_KEY deben estar configurados en .env")
         
@@ -29,6 +83,138 @@ class SupabaseManager:
             logging.error(f"❌ Error inicializando cliente Supabase: {e}")
             raise
     
+    # ------------------------------------------------------------------
+    # Metas por año (caché con TTL)
+    # ------------------------------------------------------------------
+    
+    @staticmethod
+    def _metas_de_registros(registros: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """{cliente_id: {'cliente_nombre', linea: valor > 0}} a partir de filas de metas_clientes."""
+        metas = {}
+        for record in registros:
+            cliente_id = str(record.get('cliente_id') or '')
+            if not cliente_id:
+                continue
+            meta = metas.setdefault(cliente_id, {})
+            meta['cliente_nombre'] = record.get('cliente_nombre', '')
+            for linea in METAS_LINEAS:
+                if record.get(linea) and float(record.get(linea, 0)) > 0:
+                    meta[linea] = float(record.get(linea))
+        return metas
+    
+    def _metas_cache_key(self, año: str) -> str:
+        return f"metas_clientes:{año}"
+    
+    def _leer_entrada_metas(self, año: str) -> Optional[Dict[str, Any]]:
+        if self.cache is not None:
+            try:
+                return self.cache.get(self._metas_cache_key(año))
+            except Exception as e:
+                logging.warning(f"⚠️ Caché de metas no disponible: {e}")
+                return None
+        with self._metas_lock:
+            vence, entrada = self._metas_local.get(año, (0, None))
+            if entrada is None or vence <= time.time():
+                self._metas_local.pop(año, None)
+                return None
+            return copy.deepcopy(entrada)
+    
+    def _guardar_entrada_metas(self, año: str, entrada: Dict[str, Any], ttl: Optional[int] = None) -> None:
+        ttl = self.metas_ttl if ttl is None else ttl
+        if self.cache is not None:
+            try:
+                self.cache.set(self._metas_cache_key(año), entrada, timeout=ttl)
+            except Exception as e:
+                logging.warning(f"⚠️ No se pudieron guardar las metas {año} en caché: {e}")
+            return
+        with self._metas_lock:
+            self._metas_local[año] = (time.time() + ttl, copy.deepcopy(entrada))
+    
+    def invalidate_metas(self, año: Optional[str] = None) -> None:
+        """Olvida las metas en caché de un año (o de todos los leídos por este proceso)."""
+        with self._metas_lock:
+            años = {str(año)} if año is not None else set(self._metas_local) | self._metas_años_leidos
+            self._metas_stats['invalidations'] += 1
+            for clave in años:
+                self._metas_local.pop(clave, None)
+        if self.cache is not None:
+            for clave in años:
+                try:
+                    self.cache.delete(self._metas_cache_key(clave))
+                except Exception:
+                    pass
+    
+    @traced('supabase.read_metas')
+    def _cargar_metas_año(self, año: str) -> Dict[str, Any]:
+        """Lee de Supabase las filas de un año y arma la entrada de la caché."""
+        response = self.client.table('metas_clientes').select(METAS_COLUMNAS).eq('año', año).execute()
+        registros = response.data or []
+        nbytes = len(json.dumps(registros, ensure_ascii=False, default=str).encode('utf-8'))
+        with self._metas_lock:
+            self._metas_stats['reads'] += 1
+            self._metas_stats['rows'] += len(registros)
+            self._metas_stats['bytes'] += nbytes
+            self._metas_años_leidos.add(año)
+        logging.info(f"✅ Metas {año} leídas: {len(registros)} registros, {nbytes / 1024:.1f} KB")
+        metas = self._metas_de_registros(registros)
+        # Hash del contenido: no cambia si los datos no cambian, aunque se recarguen o lo lea otro worker
+        contenido = json.dumps(metas, sort_keys=True, ensure_ascii=False, default=str)
+        return {
+            'metas': metas,
+            'version': hashlib.sha1(contenido.encode('utf-8')).hexdigest()[:16],
+            'rows': len(registros),
+            'bytes': nbytes
+        }
+    
+    def _entrada_metas(self, año, force: bool = False) -> Optional[Dict[str, Any]]:
+        año = str(año)
+        entrada = None if force else self._leer_entrada_metas(año)
+        if entrada is not None and entrada.get('error'):
+            # Lectura fallida reciente: no se reintenta hasta que venza METAS_ERROR_TTL
+            with self._metas_lock:
+                self._metas_stats['error_hits'] += 1
+            return None
+        with self._metas_lock:
+            self._metas_stats['hits' if entrada is not None else 'misses'] += 1
+        if entrada is not None:
+            return entrada
+        try:
+            entrada = self._cargar_metas_año(año)
+        except Exception as e:
+            logging.error(f"❌ Error leyendo metas del año {año} de Supabase: {e}")
+            with self._metas_lock:
+                self._metas_stats['errors'] += 1
+            if METAS_ERROR_TTL > 0:
+                self._guardar_entrada_metas(año, {'error': True}, ttl=METAS_ERROR_TTL)
+            return None
+        self._guardar_entrada_metas(año, entrada)
+        return entrada
+    
+    def read_metas_año(self, año, force: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        Metas de un año con la misma forma que read_metas_por_cliente()[año].
+        
+        Args:
+            año: Año (str o int)
+            force: True = ignorar la caché y leer de Supabase
+        
+        Returns:
+            {cliente_id: {'cliente_nombre': ..., 'agrovet': ..., ...}} (copia: se puede modificar)
+        """
+        entrada = self._entrada_metas(año, force=force)
+        return entrada['metas'] if entrada is not None else {}
+    
+    def metas_version(self, año) -> str:
+        """Versión de las metas del año (hash del contenido: solo cambia si cambian las metas)."""
+        entrada = self._entrada_metas(año)
+        return entrada['version'] if entrada is not None else '0'
+    
+    def get_metas_stats(self) -> Dict[str, int]:
+        """Aciertos y fallos de la caché de metas, lecturas a Supabase (y errores), filas y bytes leídos."""
+        with self._metas_lock:
+            return dict(self._metas_stats)
+    
+    @traced('supabase.read_metas_all')
     def read_metas_por_cliente(self) -> Dict[str, Dict[str, Dict[str, float]]]:
         """
         Lee las metas de clientes desde Supabase.
@@ -88,6 +274,7 @@ class SupabaseManager:
             logging.error(f"❌ Error leyendo metas de Supabase: {e}")
             return {}
     
+    @traced('supabase.write_metas')
     def write_metas_por_cliente(self, data: Dict[str, Dict[str, Dict[str, float]]]) -> bool:
         """
         Escribe las metas de clientes en Supabase.
@@ -134,6 +321,146 @@ class SupabaseManager:
             logging.error(f"❌ Error escribiendo metas en Supabase: {e}")
             logging.exception(e)
             return False
+        finally:
+            # Write-through: los años escritos se vuelven a leer en la próxima consulta
+            for año in (data or {}):
+                self.invalidate_metas(año)
+    
+    # ------------------------------------------------------------------
+    # Guardado por diferencias
+    # ------------------------------------------------------------------
+    
+    @staticmethod
+    def _registro_meta(año: str, cliente_id: str, metas: Dict[str, Any]) -> Dict[str, Any]:
+        """Fila de metas_clientes de un cliente (líneas sin meta en 0)."""
+        registro = {
+            'año': str(año),
+            'cliente_id': str(cliente_id),
+            'cliente_nombre': metas.get('cliente_nombre', '') or ''
+        }
+        for linea in METAS_LINEAS:
+            try:
+                registro[linea] = float(metas.get(linea, 0) or 0)
+            except (TypeError, ValueError):
+                registro[linea] = 0.0
+        return registro
+    
+    def diff_metas(self, año, actuales: Dict[str, Dict[str, Any]],
+                   nuevas: Dict[str, Dict[str, Any]],
+                   clientes: Optional[List[str]] = None) -> Dict[str, List]:
+        """
+        Cambios mínimos para pasar de 'actuales' a 'nuevas' en un año.
+        
+        Args:
+            año: Año de las metas
+            actuales: Metas guardadas {cliente_id: {'cliente_nombre', linea: valor}}
+            nuevas: Metas enviadas, misma forma
+            clientes: Limitar la comparación a estos cliente_id (None = todos)
+        
+        Returns:
+            {'insert': [filas], 'update': [filas], 'delete': [cliente_id]}
+        """
+        alcance = {str(c) for c in clientes} if clientes is not None else set(actuales) | set(nuevas)
+        cambios = {'insert': [], 'update': [], 'delete': []}
+        for cliente_id in sorted(alcance):
+            nueva = nuevas.get(cliente_id)
+            actual = actuales.get(cliente_id)
+            tiene_metas = bool(nueva) and any(float(nueva.get(l, 0) or 0) > 0 for l in METAS_LINEAS)
+            if not tiene_metas:
+                if actual is not None:
+                    cambios['delete'].append(cliente_id)
+                continue
+            registro = self._registro_meta(año, cliente_id, nueva)
+            if actual is None:
+                cambios['insert'].append(registro)
+            elif registro != self._registro_meta(año, cliente_id, actual):
+                cambios['update'].append(registro)
+        return cambios
+    
+    def apply_metas_changes(self, año, cambios: Dict[str, List],
+                            batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Envía un conjunto de cambios de diff_metas() en lotes.
+        
+        Inserciones y actualizaciones van como UPSERT (año, cliente_id), así una
+        fila insertada por otro usuario mientras tanto no hace fallar el lote.
+        
+        Returns:
+            {'ok', 'inserted', 'updated', 'deleted', 'ms', 'batches': [{'op', 'rows', 'ms'}], 'error'}
+        """
+        año = str(año)
+        batch_size = max(1, batch_size or METAS_BATCH_SIZE)
+        resultado = {'ok': True, 'inserted': 0, 'updated': 0, 'deleted': 0, 'ms': 0.0, 'batches': [], 'error': None}
+        contadores = {'insert': 'inserted', 'update': 'updated', 'delete': 'deleted'}
+        inicio = time.perf_counter()
+        try:
+            for op in ('delete', 'insert', 'update'):
+                filas = cambios.get(op) or []
+                for i in range(0, len(filas), batch_size):
+                    lote = filas[i:i + batch_size]
+                    inicio_lote = time.perf_counter()
+                    tabla = self.client.table('metas_clientes')
+                    with span(f"supabase.{op}"):
+                        if op == 'delete':
+                            tabla.delete().eq('año', año).in_('cliente_id', lote).execute()
+                        else:
+                            tabla.upsert(lote, on_conflict='año,cliente_id').execute()
+                    ms = (time.perf_counter() - inicio_lote) * 1000
+                    resultado['batches'].append({'op': op, 'rows': len(lote), 'ms': round(ms, 1)})
+                    resultado[contadores[op]] += len(lote)
+        except Exception as e:
+            logging.error(f"❌ Error guardando cambios de metas {año} en Supabase: {e}")
+            resultado['ok'] = False
+            resultado['error'] = str(e)
+        finally:
+            resultado['ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+            if resultado['batches'] or not resultado['ok']:
+                self.invalidate_metas(año)
+        return resultado
+    
+    @traced('supabase.save_metas')
+    def save_metas_año(self, año, nuevas: Dict[str, Dict[str, Any]],
+                       clientes: Optional[List[str]] = None,
+                       batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Guarda las metas de un año enviando solo lo que cambió.
+        
+        Compara con las filas del año leídas de Supabase en ese momento (no con
+        la caché, que puede estar vencida) y aplica los cambios con
+        apply_metas_changes().
+        
+        Args:
+            año: Año editado
+            nuevas: Metas del año {cliente_id: {'cliente_nombre', linea: valor}}
+            clientes: cliente_id editados; los demás del año no se tocan (None = todos)
+            batch_size: Filas por lote (por defecto METAS_BATCH_SIZE)
+        
+        Returns:
+            Resultado de apply_metas_changes()
+        """
+        año = str(año)
+        inicio = time.perf_counter()
+        try:
+            with span('supabase.read_metas'):
+                response = self.client.table('metas_clientes').select(METAS_COLUMNAS).eq('año', año).execute()
+            actuales = self._metas_de_registros(response.data or [])
+        except Exception as e:
+            logging.error(f"❌ Error leyendo metas {año} antes de guardar: {e}")
+            return {'ok': False, 'inserted': 0, 'updated': 0, 'deleted': 0, 'ms': 0.0, 'batches': [],
+                    'error': str(e)}
+        lectura_ms = (time.perf_counter() - inicio) * 1000
+        
+        cambios = self.diff_metas(año, actuales, nuevas, clientes=clientes)
+        resultado = self.apply_metas_changes(año, cambios, batch_size=batch_size)
+        resultado['read_ms'] = round(lectura_ms, 1)
+        if resultado['ok']:
+            lotes = ', '.join(f"{b['op']} {b['rows']} en {b['ms']:.0f} ms" for b in resultado['batches'])
+            logging.info(
+                f"✅ Metas {año} guardadas: +{resultado['inserted']} ~{resultado['updated']} "
+                f"-{resultado['deleted']} en {resultado['ms']:.0f} ms"
+                + (f" ({lotes})" if lotes else " (sin cambios)")
+            )
+        return resultado
     
     def get_metas_por_año(self, año: str) -> Dict[str, Dict[str, float]]:
         """
@@ -164,6 +491,7 @@ class SupabaseManager:
             logging.error(f"❌ Error obteniendo metas del año {año}: {e}")
             return {}
     
+    @traced('supabase.delete_metas')
     def delete_metas_cliente(self, año: str, cliente_id: str) -> bool:
         """
         Elimina las metas de un cliente específico en un año.
@@ -188,7 +516,10 @@ class SupabaseManager:
         except Exception as e:
             logging.error(f"❌ Error eliminando metas: {e}")
             return False
+        finally:
+            self.invalidate_metas(año)
     
+    @traced('supabase.read_years')
     def get_años_disponibles(self) -> List[str]:
         """
         Obtiene la lista de años con metas registradas.
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# check_dashboard_etags.py - Verifica que las secciones del dashboard sin cambios respondan 304
+#
+# Uso:
+#   python scripts/check_dashboard_etags.py [año] [cliente_id]
+#
+# Pide cada sección de /api/v1/dashboard dos veces con la configuración del .env
+# (Odoo y Supabase reales): la segunda con el ETag de la primera en If-None-Match.
+# Si los datos no cambiaron entre ambas, todas deben responder 304. Termina con
+# código 1 si alguna sección responde otra cosa.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as dashboard_app  # noqa: E402
+
+
+def main():
+    año = sys.argv[1] if len(sys.argv) > 1 else str(time.localtime().tm_year)
+    cliente_id = sys.argv[2] if len(sys.argv) > 2 else None
+    query = f"año={año}" + (f"&cliente_id={cliente_id}" if cliente_id else '')
+
+    flask_app = dashboard_app.app
+    flask_app.config['RATELIMIT_ENABLED'] = False
+    client = flask_app.test_client()
+    with client.session_transaction() as sesion:
+        sesion['username'] = 'check_dashboard_etags'
+        sesion['last_activity'] = time.time()
+
+    print("=" * 60)
+    print(f"ETAGS DEL DASHBOARD ({query})")
+    print("=" * 60)
+
+    fallos = 0
+    for seccion in dashboard_app.DASHBOARD_SECCIONES_PAGINA:
+        url = f"/api/v1/dashboard/{seccion}?{query}"
+        primera = client.get(url)
+        etag = primera.headers.get('ETag')
+        if primera.status_code != 200 or not etag:
+            print(f"❌ {seccion}: {primera.status_code}, ETag={etag}")
+            fallos += 1
+            continue
+        segunda = client.get(url, headers={'If-None-Match': etag})
+        if segunda.status_code == 304:
+            print(f"✅ {seccion}: 304 con {etag}")
+        else:
+            print(f"❌ {seccion}: {segunda.status_code} con el mismo ETag (nuevo: {segunda.headers.get('ETag')})")
+            fallos += 1
+
+    print("=" * 60)
+    if fallos:
+        print(f"❌ {fallos} secciones no respondieron 304")
+        sys.exit(1)
+    print("✅ Todas las secciones sin cambios respondieron 304")
+
+
+if __name__ == '__main__':
+    main()
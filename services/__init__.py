@@ -11,7 +11,12 @@ from .aggregation_service import (
     ChartDataService,
     DashboardMetrics
 )
+from .dashboard_aggregation import DashboardAggregationEngine
+from .dataset_context import DatasetContext
 from .security_logger import SecurityLogger
+from .single_flight import SingleFlight
+from .columnar import encode_columns, decode_columns
+from .tracing import RequestTracer, span, traced
 
 __all__ = [
     'ValidationService',
@@ -19,5 +24,13 @@ __all__ = [
     'MetricsCalculationService',
     'ChartDataService',
     'DashboardMetrics',
-    'SecurityLogger'
+    'DashboardAggregationEngine',
+    'DatasetContext',
+    'SecurityLogger',
+    'SingleFlight',
+    'encode_columns',
+    'decode_columns',
+    'RequestTracer',
+    'span',
+    'traced'
 ]
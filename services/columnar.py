@@ -0,0 +1,114 @@
+# services/columnar.py
+"""
+Formato columnar con diccionario para los datasets que se envían al navegador.
+
+Las filas de ventas y pendientes eran dicts de ~50 claves repetidas en cada fila,
+con muchos valores duplicados (cliente, país, línea, fechas) y floats con toda su
+precisión. encode_columns() proyecta solo los campos que lee la página y envía
+cada campo como una columna:
+
+    - Columnas numéricas: lista de valores (floats redondeados a 'decimals').
+    - Resto (textos, fechas, relaciones [id, nombre], booleanos): diccionario de
+      valores únicos + lista de índices por fila.
+    - Alias: campos idénticos a otro (name/producto, default_code/codigo_odoo)
+      que el decodificador reconstruye sin enviarlos.
+
+Formato ('columnas/v1'):
+    {
+        "formato": "columnas/v1",
+        "filas": 3,
+        "columnas": {
+            "total": [200.0, 15.5, 80.0],
+            "cliente": {"dic": ["Cliente 1", "Cliente 8"], "idx": [0, 1, 0]}
+        },
+        "alias": {"name": "producto"}
+    }
+
+El decodificador de la página es decodificarColumnas() en dashboard_clean.html;
+decode_columns() es su equivalente en Python.
+
+Ejemplo de uso:
+    >>> from services.columnar import encode_columns, decode_columns
+    >>>
+    >>> payload = encode_columns(lineas, ('cliente', 'total'))
+    >>> decode_columns(payload)[0]
+    {'cliente': 'Cliente 8', 'total': 200.0}
+"""
+
+import json
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+FORMATO = 'columnas/v1'
+
+
+def encode_columns(rows: List[Mapping[str, Any]], fields: Optional[Iterable[str]] = None,
+                   aliases: Optional[Mapping[str, str]] = None, decimals: int = 2) -> Dict[str, Any]:
+    """
+    Codifica una lista de dicts en columnas con diccionario.
+
+    Args:
+        rows: Filas (dicts) del dataset
+        fields: Campos a enviar (por defecto todos los de las filas, en orden de aparición)
+        aliases: {campo: campo_origen} que el decodificador copia del origen
+        decimals: Decimales de los floats en columnas numéricas
+
+    Returns:
+        Payload serializable a JSON en formato 'columnas/v1'
+    """
+    if fields is None:
+        fields = list(dict.fromkeys(campo for row in rows for campo in row))
+    aliases = {alias: origen for alias, origen in (aliases or {}).items() if alias not in fields}
+
+    columnas = {}
+    for campo in fields:
+        valores = [row.get(campo) for row in rows]
+        if all(_es_numero(v) or v is None for v in valores):
+            columnas[campo] = [round(v, decimals) if isinstance(v, float) else v for v in valores]
+            continue
+
+        dic, idx, posiciones = [], [], {}
+        for valor in valores:
+            clave = _clave(valor)
+            pos = posiciones.get(clave)
+            if pos is None:
+                pos = posiciones[clave] = len(dic)
+                dic.append(valor)
+            idx.append(pos)
+        columnas[campo] = {'dic': dic, 'idx': idx}
+
+    return {'formato': FORMATO, 'filas': len(rows), 'columnas': columnas, 'alias': aliases}
+
+
+def decode_columns(payload: Mapping[str, Any]) -> List[Dict[str, Any]]:
+    """Reconstruye las filas (dicts) de un payload 'columnas/v1'."""
+    if not payload or payload.get('formato') != FORMATO:
+        raise ValueError(f"Payload no está en formato {FORMATO}")
+    columnas = {
+        campo: (col if isinstance(col, list) else [col['dic'][i] for i in col['idx']])
+        for campo, col in payload['columnas'].items()
+    }
+    filas = []
+    for i in range(payload['filas']):
+        fila = {campo: valores[i] for campo, valores in columnas.items()}
+        for alias, origen in payload.get('alias', {}).items():
+            fila[alias] = fila.get(origen)
+        filas.append(fila)
+    return filas
+
+
+def _es_numero(valor: Any) -> bool:
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool)
+
+
+def _clave(valor: Any):
+    """Clave hashable del valor que distingue tipos (False != 0, 1 != True)."""
+    if isinstance(valor, (list, tuple)):
+        try:
+            return ('list', tuple(valor))
+        except TypeError:
+            pass
+    try:
+        hash(valor)
+        return (type(valor).__name__, valor)
+    except TypeError:
+        return ('json', json.dumps(valor, sort_keys=True, default=str))
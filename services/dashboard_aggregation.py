@@ -0,0 +1,716 @@
+# services/dashboard_aggregation.py
+"""
+Motor de agregación vectorizado para la vista /dashboard.
+
+El dashboard recorría las líneas de venta y los pedidos pendientes una vez por
+cada gráfico (líneas comerciales, productos, formas farmacéuticas, mapa, ...).
+Este módulo convierte ambos conjuntos en columnas NumPy UNA sola vez y obtiene
+todas las estructuras con operaciones agrupadas: cada clave se factoriza a
+códigos enteros (pd.factorize) y los montos se suman con np.bincount.
+
+Ejemplo de uso:
+    >>> from services.dashboard_aggregation import DashboardAggregationEngine
+    >>>
+    >>> engine = DashboardAggregationEngine(sales_rows, pending_data, sales_lines=sales_data)
+    >>> resultado = engine.build()
+    >>> resultado['datos_lineas'][0]
+    {'nombre': 'AGROVET', 'venta': 125000.0}
+
+Notas importantes:
+    - El orden de las estructuras replica el de los bucles originales: los grupos
+      aparecen en el orden en que se ven por primera vez, los montos se suman en
+      el orden de las filas y los ordenamientos descendentes son estables
+      (igual que sorted(..., reverse=True)).
+    - Todos los valores devueltos son tipos nativos de Python (listas/dicts/float)
+      para que el template pueda serializarlos con tojson.
+    - 'sales_rows' puede ser la lista de líneas de detalle o las filas agrupadas de
+      OdooManager.get_sales_aggregates(); en las agrupadas 'ventas_brutas' es la
+      suma de las líneas positivas.
+"""
+
+import re
+from itertools import repeat
+from operator import contains, itemgetter
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .tracing import span
+
+
+# Mapeo de nombres de países de Odoo a nombres del mapa ECharts
+MAPEO_NOMBRES_PAISES: Dict[str, str] = {
+    'Emiratos Árabes Unidos': 'United Arab Emirates',
+    'Reino Unido': 'United Kingdom',
+    'Corea del Sur': 'Korea',
+    'República Dominicana': 'Dominican Rep.',
+    'Surinam': 'Suriname',
+    'Argelia': 'Algeria',
+    'Bahréin': 'Bahrain',
+    'Etiopía': 'Ethiopia',
+    'México': 'Mexico',
+    'Panamá': 'Panama',
+    'Yibuti': 'Djibouti'
+}
+
+# Mapeo de países a regiones (usando nombres DESPUÉS del mapeo - inglés/ECharts)
+REGIONES_PAISES: Dict[str, List[str]] = {
+    'Sudamérica': ['Argentina', 'Bolivia', 'Brasil', 'Chile', 'Colombia', 'Ecuador', 'Guyana', 'Paraguay', 'Perú', 'Suriname', 'Uruguay', 'Venezuela'],
+    'Centroamérica': ['Belice', 'Costa Rica', 'El Salvador', 'Guatemala', 'Honduras', 'Nicaragua', 'Panama'],
+    'Norteamérica': ['Canadá', 'Estados Unidos', 'Mexico'],
+    'Caribe': ['Antigua y Barbuda', 'Bahamas', 'Barbados', 'Cuba', 'Dominica', 'Granada', 'Haití', 'Jamaica', 'Dominican Rep.', 'San Cristóbal y Nieves', 'Santa Lucía', 'San Vicente y las Granadinas', 'Trinidad y Tobago'],
+    'Europa': ['Alemania', 'España', 'Francia', 'Italia', 'Portugal', 'United Kingdom', 'Ucrania', 'Albania'],
+    'Asia': ['China', 'India', 'Japón', 'Korea', 'Vietnam', 'Indonesia', 'Sri Lanka', 'Bahrain', 'United Arab Emirates', 'Jordania', 'Kuwait', 'Qatar'],
+    'África': ['Algeria', 'Ethiopia', 'Djibouti'],
+    'Otros': []
+}
+
+# Mapeo inverso: país -> región
+PAIS_A_REGION: Dict[str, str] = {
+    pais: region for region, paises in REGIONES_PAISES.items() for pais in paises
+}
+
+# Mapeo de nombres simplificados de productos para los gráficos de pastel
+PRODUCTOS_SIMPLIFICADOS: Dict[str, List[str]] = {
+    'ATREVIA 360°': ['ATREVIA 360°', 'ATREVIA 360'],
+    'ATREVIA 360° SPOT ON': ['ATREVIA 360° SPOT ON', 'ATREVIA 360 SPOT ON'],
+    'ATREVIA ONE': ['ATREVIA ONE', 'ATREVIA ONE (N)'],
+    'ATREVIA TRIO CATS': ['ATREVIA TRIO CATS'],
+    'ATREVIA VERSA GEL': ['ATREVIA VERSA GEL'],
+    'ATREVIA XR': ['ATREVIA XR', 'ATREVIA XR (N)'],
+    'BIOCAN': ['BIOCAN'],
+    'SURALAN': ['SURALAN'],
+    'EARTHBORN': ['EARTHBORN'],
+    'FORMULA NATURAL': ['FORMULA NATURAL'],
+    'GO NATIVE': ['GO NATIVE'],
+    'GO NATIVE ESSENTIALS': ['GO NATIVE ESSENTIALS'],
+    'NUTRIBITES': ['NUTRIBITES']
+}
+
+AÑOS_PENDIENTES_DEFAULT = ('2025', '2026', '2027')
+
+# Niveles del drilldown: campo relacional de Odoo y título del nodo
+NIVELES_DRILLDOWN: Tuple[Tuple[str, str], ...] = (
+    ('pharmacological_classification_id', 'Ventas de {}'),
+    ('pharmaceutical_forms_id', 'Ventas de {}'),
+    ('administration_way_id', 'Ventas por Vía {}'),
+    ('production_line_id', 'Ventas de {}'),
+)
+
+# Patrón precompilado por nombre simplificado, en el orden de PRODUCTOS_SIMPLIFICADOS
+# (gana la primera entrada que coincide, igual que el recorrido de variantes)
+_PATRONES_PRODUCTOS: List[Tuple[str, 're.Pattern[str]']] = [
+    (nombre_simple, re.compile('|'.join(re.escape(v) for v in variantes)))
+    for nombre_simple, variantes in PRODUCTOS_SIMPLIFICADOS.items()
+]
+
+
+def _objetos(valores: List[Any]) -> np.ndarray:
+    """Array 1-D de objetos (los valores [id, nombre] no se expanden a 2-D)."""
+    return np.fromiter(valores, dtype=object, count=len(valores))
+
+
+def _columna(filas: List[Dict[str, Any]], campo: str, defecto: Any = None) -> List[Any]:
+    """
+    fila.get(campo, defecto) de cada fila.
+
+    Si todas las filas traen el campo (lo normal con Odoo) se extrae con
+    itemgetter, que recorre la lista en C; si falta en alguna se usa get.
+    """
+    try:
+        return list(map(itemgetter(campo), filas))
+    except KeyError:
+        return [fila.get(campo, defecto) for fila in filas]
+
+
+def _montos(filas: List[Dict[str, Any]], campo: str) -> np.ndarray:
+    """Columna numérica (float64); los vacíos cuentan como 0."""
+    valores = _columna(filas, campo, 0)
+    try:
+        montos = np.fromiter(valores, dtype=float, count=len(valores))
+        # None llega como NaN: se repite la conversión con 'or 0'
+        if not np.isnan(montos).any():
+            return montos
+    except (TypeError, ValueError):
+        pass
+    return np.fromiter((valor or 0 for valor in valores), dtype=float, count=len(valores))
+
+
+def _valores(filas: List[Dict[str, Any]], campo: str, defecto: Any = None) -> np.ndarray:
+    """Columna 'campo' con la misma semántica que fila.get(campo, defecto)."""
+    return _objetos(_columna(filas, campo, defecto))
+
+
+def _nombres_relacion(valores: List[Any], defecto: Any) -> List[Any]:
+    """Extrae el nombre de cada valor relacional de Odoo ([id, nombre]) en una sola pasada."""
+    return [v[1] if isinstance(v, (list, tuple)) and len(v) > 1 else defecto for v in valores]
+
+
+def _relacion(filas: List[Dict[str, Any]], campo: str, defecto: Any) -> np.ndarray:
+    return _objetos(_nombres_relacion(_columna(filas, campo), defecto))
+
+
+def _factorizar(valores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Códigos enteros por valor, numerados en orden de primera aparición.
+
+    Agrupar por estos códigos (np.bincount) conserva el orden de inserción de
+    los dicts de los bucles originales y suma en el mismo orden de filas.
+    """
+    # Con centinela pandas no busca nulos antes de factorizar (la mitad del
+    # tiempo); solo si aparece alguno se repite numerándolos como un valor más
+    codigos, unicos = pd.factorize(valores)
+    if len(codigos) and codigos.min() < 0:
+        codigos, unicos = pd.factorize(valores, use_na_sentinel=False)
+    return codigos, np.asarray(unicos, dtype=object)
+
+
+def _sumar(codigos: np.ndarray, n: int, pesos: np.ndarray) -> np.ndarray:
+    return np.bincount(codigos, weights=pesos, minlength=n) if n else np.zeros(0)
+
+
+def _total(valores: np.ndarray) -> float:
+    """Suma secuencial (mismo orden y redondeo que el acumulador de los bucles)."""
+    return float(np.cumsum(valores)[-1]) if len(valores) else 0
+
+
+def _combinar(codigos_a: np.ndarray, codigos_b: np.ndarray, n_b: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Factoriza el par (a, b) en orden de primera aparición.
+
+    Returns:
+        Tupla (códigos de par por fila, código 'a' de cada par, código 'b' de cada par)
+    """
+    n_b = max(n_b, 1)
+    codigos, unicos = pd.factorize(codigos_a.astype(np.int64) * n_b + codigos_b)
+    return codigos, unicos // n_b, unicos % n_b
+
+
+def _primeras_filas(codigos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Códigos presentes (en orden de aparición) y la fila de su primera aparición."""
+    if not len(codigos):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # Mínima fila por código en una pasada (sin ordenar las filas como np.unique)
+    primeras = np.full(int(codigos.max()) + 1, len(codigos), dtype=np.int64)
+    np.minimum.at(primeras, codigos, np.arange(len(codigos)))
+    presentes = np.flatnonzero(primeras < len(codigos))
+    orden = np.argsort(primeras[presentes], kind='stable')
+    return presentes[orden], primeras[presentes][orden]
+
+
+def _orden_desc(valores: np.ndarray, top: Optional[int] = None) -> np.ndarray:
+    """Índices por valor descendente estable (mismo desempate que sorted(..., reverse=True))."""
+    orden = np.argsort(-valores, kind='stable')
+    return orden if top is None else orden[:top]
+
+
+def _orden_desc_por_grupo(grupos: np.ndarray, valores: np.ndarray, top: Optional[int] = None) -> np.ndarray:
+    """
+    Índices ordenados por grupo (código ascendente) y, dentro de cada grupo,
+    por valor descendente estable; con 'top' se limita a N por grupo.
+    """
+    if not len(grupos):
+        return np.zeros(0, dtype=np.int64)
+    orden = np.lexsort((-valores, grupos))
+    if top is None:
+        return orden
+    g = grupos[orden]
+    inicios = np.r_[0, np.flatnonzero(g[1:] != g[:-1]) + 1]
+    rango = np.arange(len(g)) - np.repeat(inicios, np.diff(np.r_[inicios, len(g)]))
+    return orden[rango < top]
+
+
+def _acumular(claves: np.ndarray, montos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Claves distintas (ascendentes) y la suma de 'montos' de cada una."""
+    unicas, inversa = np.unique(claves, return_inverse=True)
+    return unicas, np.bincount(inversa, weights=montos, minlength=len(unicas))
+
+
+def _rutas(claves: np.ndarray, bases: Sequence[int], etiquetas: Sequence[np.ndarray]) -> List[Tuple[Any, ...]]:
+    """Decodifica claves de base mixta en la tupla de nombres de cada nivel."""
+    columnas = []
+    for nivel in range(len(bases) - 1, -1, -1):
+        claves, digito = np.divmod(claves, bases[nivel])
+        columnas.append(etiquetas[nivel][digito])
+    return list(zip(*columnas[::-1])) if columnas else [()] * len(claves)
+
+
+def _id_nodo(profundidad: int, ruta: Sequence[Any]) -> str:
+    """'root' o 'level{N}_{nombre1}_{nombre2}...' (ids del drilldown)."""
+    return 'root' if not profundidad else f"level{profundidad}_" + '_'.join(str(n) for n in ruta)
+
+
+def _es_valido(valores: np.ndarray, excluido: str = 'No Definido') -> np.ndarray:
+    """'if valor and valor != excluido' elemento a elemento."""
+    return np.fromiter((bool(v) and v != excluido for v in valores), dtype=bool, count=len(valores))
+
+
+class DashboardAggregationEngine:
+    """
+    Calcula todas las estructuras del dashboard a partir de columnas NumPy.
+
+    Args:
+        sales_rows: Filas de venta a agregar (líneas de detalle o filas agrupadas)
+        pending_rows: Líneas de pedidos pendientes de facturar
+        sales_lines: Líneas de detalle para los KPIs de conteo (clientes,
+            productos y facturas únicos). Por defecto 'sales_rows'.
+        años_pendientes: Años de compromiso con columna propia en la tabla
+
+    Example:
+        >>> engine = DashboardAggregationEngine(sales_rows, pending_data)
+        >>> datos = engine.build()
+        >>> datos['total_sales_year'], datos['total_por_facturar']
+        (250000.0, 40000.0)
+    """
+
+    def __init__(
+        self,
+        sales_rows: List[Dict[str, Any]],
+        pending_rows: List[Dict[str, Any]],
+        sales_lines: Optional[List[Dict[str, Any]]] = None,
+        años_pendientes: Sequence[str] = AÑOS_PENDIENTES_DEFAULT
+    ):
+        self.años_pendientes = tuple(años_pendientes)
+        self.sales_rows = sales_rows or []
+        self.sales_lines = self.sales_rows if sales_lines is None else (sales_lines or [])
+        with span('aggregation.columns'):
+            self.sales = self._build_sales_columns(self.sales_rows)
+            self.pending = self._build_pending_columns(pending_rows or [])
+        self._codigos_cache: Dict[Tuple[str, str], Tuple[np.ndarray, np.ndarray]] = {}
+
+    # ------------------------------------------------------------------
+    # Construcción de las columnas (una sola vez por request)
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _build_sales_columns(filas: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        venta = _montos(filas, 'amount_currency')
+        # En filas agrupadas 'ventas_brutas' es la suma de las líneas positivas;
+        # las líneas de detalle no lo traen y su venta bruta es la venta
+        if all(map(contains, filas, repeat('ventas_brutas'))):
+            venta_bruta = _montos(filas, 'ventas_brutas')
+        elif not any(map(contains, filas, repeat('ventas_brutas'))):
+            venta_bruta = venta
+        else:
+            venta_bruta = np.fromiter(
+                (fila.get('ventas_brutas', fila.get('amount_currency', 0)) or 0 for fila in filas),
+                dtype=float, count=len(filas)
+            )
+        return {
+            'venta': venta,
+            'venta_bruta': venta_bruta,
+            'linea_internacional': _relacion(filas, 'commercial_line_international_id', 'Sin Línea Comercial'),
+            'linea_comercial': _valores(filas, 'linea_comercial', 'Sin Línea'),
+            'producto': _valores(filas, 'name', 'Producto Sin Nombre'),
+            'forma': _relacion(filas, 'pharmaceutical_forms_id', 'Instrumental'),
+            'pais': _valores(filas, 'pais', 'No Definido'),
+            'cliente': _valores(filas, 'cliente', 'No Definido'),
+            'partner_id': _valores(filas, 'partner_id'),
+        }
+
+    @staticmethod
+    def _build_pending_columns(filas: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        productos = _columna(filas, 'producto', 'Producto Sin Nombre')
+        descripciones = _columna(filas, 'descripcion', '')
+        return {
+            'total': _montos(filas, 'total_pendiente'),
+            'cantidad': _montos(filas, 'cantidad_pendiente'),
+            'linea_tabla': _valores(filas, 'linea_comercial', 'Sin Línea Comercial'),
+            'linea_comercial': _valores(filas, 'linea_comercial', 'Sin Línea'),
+            'commitment_year': _valores(filas, 'commitment_year', ''),
+            'codigo': _objetos([
+                fila.get('codigo_odoo', '') or fila.get('default_code', '') or 'S/C' for fila in filas
+            ]),
+            'producto': _objetos(productos),
+            # Usar descripción si existe, sino usar nombre
+            'nombre_display': _objetos([
+                descripcion if descripcion and descripcion.strip() else producto
+                for descripcion, producto in zip(descripciones, productos)
+            ]),
+            'pais': _valores(filas, 'pais', 'No Definido'),
+            'cliente': _valores(filas, 'cliente', 'No Definido'),
+            'partner_id': _valores(filas, 'partner_id'),
+        }
+
+    def _codigos(self, origen: str, columna: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Factorización memorizada de una columna de 'sales' o 'pending'."""
+        clave = (origen, columna)
+        if clave not in self._codigos_cache:
+            self._codigos_cache[clave] = _factorizar(getattr(self, origen)[columna])
+        return self._codigos_cache[clave]
+
+    def _codigos_unidos(self, columna: str, transformar=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Códigos comunes de 'columna' para las filas de ventas seguidas de las de
+        pendientes, reutilizando la factorización de cada origen.
+        """
+        codigos_v, unicos_v = self._codigos('sales', columna)
+        codigos_p, unicos_p = self._codigos('pending', columna)
+        unicos = np.concatenate([unicos_v, unicos_p])
+        if transformar is not None:
+            unicos = _objetos([transformar(valor) for valor in unicos])
+        reasignar, unicos = _factorizar(unicos)
+        codigos = np.concatenate([codigos_v, codigos_p + len(unicos_v)]).astype(np.int64)
+        return reasignar[codigos], unicos
+
+    # ------------------------------------------------------------------
+    # Líneas comerciales y pendientes por año
+    # ------------------------------------------------------------------
+    def lineas_comerciales(self) -> Dict[str, Any]:
+        """
+        Ventas y pendientes por línea comercial.
+
+        Returns:
+            Dict con 'ventas_por_linea', 'total_sales_year', 'datos_lineas',
+            'por_facturar_por_linea', 'total_por_facturar', 'por_facturar_por_año'
+            ({año: {linea: monto}}), 'total_por_facturar_por_año',
+            'por_facturar_otros_por_linea', 'total_por_facturar_otros' y
+            'pendientes_con_fecha' ({'total': n, año: n}).
+        """
+        venta = self.sales['venta']
+        codigos, lineas = self._codigos('sales', 'linea_internacional')
+        ventas_por_linea = dict(zip(lineas.tolist(), _sumar(codigos, len(lineas), venta).tolist()))
+
+        total = self.pending['total']
+        codigos_p, lineas_p = self._codigos('pending', 'linea_tabla')
+        años = self.pending['commitment_year']
+
+        def por_linea(filtro: np.ndarray) -> Tuple[Dict[str, float], float]:
+            presentes, _ = _primeras_filas(codigos_p[filtro])
+            sumas = _sumar(codigos_p[filtro], len(lineas_p), total[filtro])
+            return {lineas_p[c]: float(sumas[c]) for c in presentes}, _total(total[filtro])
+
+        por_facturar_por_año, total_por_facturar_por_año, conteo_años = {}, {}, {}
+        en_años = np.zeros(len(años), dtype=bool)
+        for año in self.años_pendientes:
+            filtro = años == año
+            en_años |= filtro
+            por_facturar_por_año[año], total_por_facturar_por_año[año] = por_linea(filtro)
+            conteo_años[año] = int(filtro.sum())
+        otros, total_otros = por_linea(~en_años)
+
+        # Todas las líneas (ventas + pendientes), ordenadas por venta descendente
+        todas_las_lineas = list(dict.fromkeys(list(ventas_por_linea) + lineas_p.tolist()))
+        datos_lineas = sorted(
+            ({'nombre': linea, 'venta': ventas_por_linea.get(linea, 0)} for linea in todas_las_lineas),
+            key=lambda x: x['venta'], reverse=True
+        )
+
+        return {
+            'ventas_por_linea': ventas_por_linea,
+            'total_sales_year': _total(venta),
+            'datos_lineas': datos_lineas,
+            'por_facturar_por_linea': dict(zip(lineas_p.tolist(), _sumar(codigos_p, len(lineas_p), total).tolist())),
+            'total_por_facturar': _total(total),
+            'por_facturar_por_año': por_facturar_por_año,
+            'total_por_facturar_por_año': total_por_facturar_por_año,
+            'por_facturar_otros_por_linea': otros,
+            'total_por_facturar_otros': total_otros,
+            'pendientes_con_fecha': {'total': int(sum(1 for año in años if año)), **conteo_años}
+        }
+
+    # ------------------------------------------------------------------
+    # Productos facturados y pendientes
+    # ------------------------------------------------------------------
+    def _top_por_linea(self, origen: str, montos: List[np.ndarray], top: int) -> Dict[str, List[Tuple[str, List[float]]]]:
+        """
+        Top-N productos por línea comercial (según el primer monto), con las
+        líneas en orden de primera aparición y solo montos positivos.
+        """
+        codigos_l, lineas = self._codigos(origen, 'linea_comercial')
+        codigos_p, productos = self._codigos(origen, 'producto')
+        pares, linea_par, producto_par = _combinar(codigos_l, codigos_p, len(productos))
+        sumas = [_sumar(pares, len(linea_par), m) for m in montos]
+
+        resultado: Dict[str, List[Tuple[str, List[float]]]] = {linea: [] for linea in lineas.tolist()}
+        for i in _orden_desc_por_grupo(linea_par, sumas[0], top):
+            if sumas[0][i] > 0:
+                resultado[lineas[linea_par[i]]].append((productos[producto_par[i]], [float(s[i]) for s in sumas]))
+        return resultado
+
+    def productos(self, top: int = 7) -> Dict[str, Any]:
+        """
+        Top de productos facturados (global y por línea comercial).
+
+        Returns:
+            Dict con 'datos_productos' (top global por ventas brutas) y
+            'productos_por_linea' ({linea: [{'nombre', 'venta'}]}).
+        """
+        venta_bruta = self.sales['venta_bruta']
+        positivos = venta_bruta > 0
+        codigos, productos = self._codigos('sales', 'producto')
+        codigos = codigos[positivos]
+        # Solo productos con ventas positivas, en su orden de aparición entre ellas;
+        # la línea comercial es la de la primera venta positiva del producto
+        presentes, primeras = _primeras_filas(codigos)
+        ventas = _sumar(codigos, len(productos), venta_bruta[positivos])[presentes]
+        productos = productos[presentes]
+        lineas = self.sales['linea_comercial'][positivos][primeras]
+
+        datos_productos = [
+            {'nombre': productos[i], 'venta': float(ventas[i]), 'linea_comercial': lineas[i]}
+            for i in _orden_desc(ventas, top) if ventas[i] > 0
+        ]
+        productos_por_linea = {
+            linea: [{'nombre': nombre, 'venta': montos[0]} for nombre, montos in items]
+            for linea, items in self._top_por_linea('sales', [self.sales['venta']], top).items()
+        }
+        return {'datos_productos': datos_productos, 'productos_por_linea': productos_por_linea}
+
+    def productos_pendientes(self, top: int = 7) -> Dict[str, Any]:
+        """
+        Top de productos pendientes de facturar.
+
+        Los productos se agrupan por CÓDIGO (cada código es una presentación
+        única); nombre y línea se toman de la primera línea de cada código.
+
+        Returns:
+            Dict con 'datos_productos_pendientes'.
+        """
+        total, cantidad = self.pending['total'], self.pending['cantidad']
+        codigos, unicos = self._codigos('pending', 'codigo')
+        totales = _sumar(codigos, len(unicos), total)
+        cantidades = _sumar(codigos, len(unicos), cantidad)
+        _, primeras = _primeras_filas(codigos)
+        nombres = self.pending['nombre_display'][primeras]
+        lineas = self.pending['linea_comercial'][primeras]
+
+        datos_productos_pendientes = [
+            {
+                'codigo': unicos[i],
+                'nombre': nombres[i],
+                'total_pendiente': float(totales[i]),
+                'cantidad_pendiente': float(cantidades[i]),
+                'linea_comercial': lineas[i]
+            }
+            for i in _orden_desc(totales, top) if totales[i] > 0
+        ]
+        return {'datos_productos_pendientes': datos_productos_pendientes}
+
+    # ------------------------------------------------------------------
+    # KPIs y formas farmacéuticas
+    # ------------------------------------------------------------------
+    def kpis_conteo(self) -> Dict[str, int]:
+        """Clientes, productos y facturas únicos de las líneas de detalle."""
+        def unicos(campo: str) -> int:
+            try:
+                valores = set(map(itemgetter(campo), self.sales_lines))
+            except KeyError:
+                valores = {fila.get(campo) for fila in self.sales_lines}
+            return sum(1 for valor in valores if valor)
+
+        return {
+            'unique_clients': unicos('cliente'),
+            'total_products': unicos('producto'),
+            'total_invoices': unicos('factura')
+        }
+
+    def formas_farmaceuticas(self) -> List[Dict[str, Any]]:
+        """Ventas por forma farmacéutica ('Instrumental' si no tiene)."""
+        codigos, formas = self._codigos('sales', 'forma')
+        ventas = _sumar(codigos, len(formas), self.sales['venta'])
+        return [{'forma': forma, 'venta': venta} for forma, venta in zip(formas.tolist(), ventas.tolist())]
+
+    # ------------------------------------------------------------------
+    # Mapa mundial
+    # ------------------------------------------------------------------
+    def mapa_mundial(self) -> List[Dict[str, Any]]:
+        """
+        Ventas facturadas y pendientes por país y cliente.
+
+        Returns:
+            Lista de países ordenada por total descendente, cada uno con su
+            región y la lista de clientes también ordenada por total.
+        """
+        sales, pending = self.sales, self.pending
+        if not len(sales['venta']) and not len(pending['total']):
+            return []
+        # Facturado (ventas) seguido de pendiente (pedidos), como en los bucles originales
+        partners = np.concatenate([sales['partner_id'], pending['partner_id']])
+        facturado = np.concatenate([sales['venta'], np.zeros(len(pending['total']))])
+        pendiente = np.concatenate([np.zeros(len(sales['venta'])), pending['total']])
+
+        # Nombre de país de Odoo -> nombre del mapa (solo sobre los valores únicos)
+        codigos, nombres_pais = self._codigos_unidos('pais', lambda p: MAPEO_NOMBRES_PAISES.get(p, p))
+        codigos_cli, nombres_cli = self._codigos_unidos('cliente')
+
+        filas = _es_valido(nombres_pais)[codigos]
+        codigos, codigos_cli, partners = codigos[filas], codigos_cli[filas], partners[filas]
+        facturado, pendiente = facturado[filas], pendiente[filas]
+        presentes, _ = _primeras_filas(codigos)
+        facturado_pais = _sumar(codigos, len(nombres_pais), facturado)
+        pendiente_pais = _sumar(codigos, len(nombres_pais), pendiente)
+
+        # Clientes por país (partner_id de la primera aparición, aunque sea vacío)
+        con_cliente = _es_valido(nombres_cli)[codigos_cli]
+        pares, pais_par, cliente_par = _combinar(codigos[con_cliente], codigos_cli[con_cliente], len(nombres_cli))
+        fact_cli = _sumar(pares, len(pais_par), facturado[con_cliente])
+        pend_cli = _sumar(pares, len(pais_par), pendiente[con_cliente])
+        total_cli = fact_cli + pend_cli
+        _, primeras = _primeras_filas(pares)
+        partner_par = partners[con_cliente][primeras]
+
+        clientes_por_pais: Dict[int, List[Dict[str, Any]]] = {int(c): [] for c in presentes}
+        for i in _orden_desc_por_grupo(pais_par, total_cli):
+            clientes_por_pais[int(pais_par[i])].append({
+                'nombre': nombres_cli[cliente_par[i]], 'partner_id': partner_par[i],
+                'facturado': float(fact_cli[i]), 'pendiente': float(pend_cli[i]), 'total': float(total_cli[i])
+            })
+
+        datos_mapa_mundial = [
+            {
+                'pais': nombres_pais[c],
+                'region': PAIS_A_REGION.get(nombres_pais[c], 'Otros'),
+                'facturado': float(facturado_pais[c]),
+                'pendiente': float(pendiente_pais[c]),
+                'total': float(facturado_pais[c] + pendiente_pais[c]),
+                'clientes': clientes_por_pais[int(c)]
+            }
+            for c in presentes
+        ]
+        return sorted(datos_mapa_mundial, key=lambda x: x['total'], reverse=True)
+
+    # ------------------------------------------------------------------
+    # Drilldown jerárquico
+    # ------------------------------------------------------------------
+    @staticmethod
+    def normalizar_nombre_producto(nombre):
+        """Simplifica el nombre del producto para el gráfico de pastel."""
+        if not nombre or nombre == 'No Definido':
+            return nombre
+        nombre_upper = str(nombre).upper()
+        # Buscar si el nombre contiene alguna de las palabras clave
+        for nombre_simple, patron in _PATRONES_PRODUCTOS:
+            if patron.search(nombre_upper):
+                return nombre_simple
+        # Si no coincide con ninguno, devolver el nombre original
+        return nombre
+
+    def drilldown(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Drilldown Clasificación → Forma → Vía → Línea de producción → Producto.
+
+        Se hace UNA agrupación por las cinco claves (con códigos enteros
+        ordenados alfabéticamente, como groupby(sort=True)) y cada nivel se
+        obtiene acumulando esas hojas; los nodos se emiten sin iterrows.
+
+        Returns:
+            Dict con 'drilldown_data', 'drilldown_titles' y 'pie_chart_data_by_level'.
+        """
+        drilldown_data = {}
+        drilldown_titles = {}
+        pie_chart_data_by_level = {}
+        resultado = {
+            'drilldown_data': drilldown_data,
+            'drilldown_titles': drilldown_titles,
+            'pie_chart_data_by_level': pie_chart_data_by_level
+        }
+        if not self.sales_rows:
+            return resultado
+
+        filas = self.sales_rows
+        columnas = [_relacion(filas, campo, 'No Definido') for campo, _ in NIVELES_DRILLDOWN]
+
+        # Filtrar registros con "No Definido" en clasificación farmacológica (nivel raíz)
+        validas = columnas[0] != 'No Definido'
+        columnas = [columna[validas] for columna in columnas]
+        venta = self.sales['venta'][validas]
+
+        drilldown_titles['root'] = 'Ventas por Clasificación Farmacológica'
+        if not len(venta):
+            drilldown_data['root'] = []
+            pie_chart_data_by_level['root'] = []
+            return resultado
+
+        # Nombre simplificado: se normaliza cada nombre distinto una sola vez
+        codigos_nombre, nombres = _factorizar(_valores(filas, 'name')[validas])
+        columnas.append(_objetos([self.normalizar_nombre_producto(n) for n in nombres])[codigos_nombre])
+
+        # Códigos ordenados por nivel; el último código de cada nivel es el nulo
+        # (productos sin nombre, que groupby descarta)
+        codigos, etiquetas, bases = [], [], []
+        for columna in columnas:
+            c, unicos = pd.factorize(columna, sort=True)
+            codigos.append(np.where(c < 0, len(unicos), c).astype(np.int64))
+            etiquetas.append(_objetos(list(unicos) + [None]))
+            bases.append(len(unicos) + 1)
+        nulo = bases[-1] - 1
+        producto_valido = (np.arange(bases[-1]) != nulo) & (etiquetas[-1] != 'No Definido')
+
+        # Agrupación única por (clasificación, forma, vía, línea, producto)
+        clave = np.zeros(len(venta), dtype=np.int64)
+        for c, base in zip(codigos, bases):
+            clave = clave * base + c
+        hojas, inversa = np.unique(clave, return_inverse=True)
+        montos_hoja = np.bincount(inversa, weights=venta)
+        producto_hoja = hojas % bases[-1]
+        # escalas[k]: divisor que lleva una hoja a su nodo de profundidad k
+        escalas = [int(np.prod(bases[k:])) for k in range(len(bases) + 1)]
+
+        for k in range(len(NIVELES_DRILLDOWN) + 1):
+            # Nodos de profundidad k (0 = raíz) con su id y título
+            nodos = np.unique(hojas // escalas[k])
+            rutas = _rutas(nodos, bases[:k], etiquetas)
+            ids = {}
+            for nodo, ruta in zip(nodos.tolist(), rutas):
+                nodo_id = _id_nodo(k, ruta)
+                ids[nodo] = nodo_id
+                drilldown_data[nodo_id] = []
+                pie_chart_data_by_level[nodo_id] = []
+                if k:
+                    drilldown_titles[nodo_id] = NIVELES_DRILLDOWN[k - 1][1].format(ruta[-1])
+
+            # Hijos de cada nodo, por venta descendente
+            hijos, montos = _acumular(hojas // escalas[k + 1], montos_hoja)
+            padres = hijos // bases[k]
+            if k == len(NIVELES_DRILLDOWN):
+                # Último nivel (producto): sin siguiente id
+                mantener = hijos % bases[k] != nulo
+                hijos, montos, padres = hijos[mantener], montos[mantener], padres[mantener]
+            orden = _orden_desc_por_grupo(padres, montos)
+            rutas_hijos = _rutas(hijos[orden], bases[:k + 1], etiquetas)
+            for padre, ruta, monto in zip(padres[orden].tolist(), rutas_hijos, montos[orden].tolist()):
+                siguiente = _id_nodo(k + 1, ruta) if k < len(NIVELES_DRILLDOWN) else None
+                drilldown_data[ids[padre]].append([ruta[-1], monto, ids[padre], siguiente])
+
+            # Gráfico de pastel: PRODUCTOS agrupados por nombre simplificado
+            # (top 20 salvo en el último nivel; la raíz no filtra montos <= 0)
+            pares, montos = _acumular((hojas // escalas[k]) * bases[-1] + producto_hoja, montos_hoja)
+            padres, productos = np.divmod(pares, bases[-1])
+            mantener = producto_valido[productos]
+            padres, productos, montos = padres[mantener], productos[mantener], montos[mantener]
+            top = 20 if k < len(NIVELES_DRILLDOWN) else None
+            orden = _orden_desc_por_grupo(padres, montos, top)
+            for padre, producto, monto in zip(padres[orden].tolist(), etiquetas[-1][productos[orden]], montos[orden].tolist()):
+                if k and not monto > 0:
+                    continue
+                pie_chart_data_by_level[ids[padre]].append({'name': producto, 'value': monto})
+
+        return resultado
+
+    # ------------------------------------------------------------------
+    # Todo junto
+    # ------------------------------------------------------------------
+    def build(self) -> Dict[str, Any]:
+        """
+        Calcula todas las estructuras del dashboard.
+
+        Returns:
+            Dict plano con las claves de lineas_comerciales(), productos(),
+            productos_pendientes(), kpis_conteo() y drilldown(), más
+            'datos_forma_farmaceutica' y 'datos_mapa_mundial'.
+        """
+        resultado: Dict[str, Any] = {}
+        with span('aggregation.lineas'):
+            resultado.update(self.lineas_comerciales())
+        with span('aggregation.productos'):
+            resultado.update(self.productos())
+            resultado.update(self.productos_pendientes())
+        with span('aggregation.kpis'):
+            resultado.update(self.kpis_conteo())
+            resultado['datos_forma_farmaceutica'] = self.formas_farmaceuticas()
+        with span('aggregation.mapa'):
+            resultado['datos_mapa_mundial'] = self.mapa_mundial()
+        with span('aggregation.drilldown'):
+            resultado.update(self.drilldown())
+        return resultado
@@ -0,0 +1,417 @@
+# services/dataset_context.py
+"""
+Contexto de datasets compartido por todos los consumidores de un render.
+
+El dashboard y get_commercial_lines_stacked_data pedían a Odoo las mismas
+líneas de venta con el mismo rango y cliente. Este contexto memoiza cada
+dataset por (nombre, filtros):
+
+    1. Dentro de la petición (flask.g): todos los consumidores del render
+       comparten el mismo resultado.
+    2. Entre peticiones, con un TTL corto (DATASET_CONTEXT_TTL, segundos;
+       0 lo desactiva): recargas seguidas del mismo filtro no repiten las
+       consultas.
+    3. Opcionalmente en la capa 'datasets' de un LayeredCache (compartida
+       entre workers según el backend de caché).
+
+Stale-while-revalidate: cada dataset compartido recuerda cuándo se obtuvo de
+Odoo. Pasado DATASET_CACHE_SOFT_TTL (300 s) se sigue sirviendo al instante y se
+lanza UN refresco en segundo plano por dataset y proceso; cuando termina, el
+dataset nuevo reemplaza al anterior de una vez (capa y memo). Pasado
+DATASET_CACHE_HARD_TTL (3600 s) el dataset ya no se sirve y se recarga antes de
+responder. Si el refresco falla se conserva el último dataset bueno.
+
+Las cargas se coalescen por (nombre, filtros) con un SingleFlight: peticiones
+concurrentes con el mismo filtro esperan una única consulta a Odoo, entre hilos
+del worker y, con un backend de caché compartido, entre workers.
+
+Los datasets por cliente se derivan del dataset de todos los clientes del mismo
+rango (filtrando por el cliente de la factura / del pedido), de modo que cambiar
+de cliente no vuelve a consultar Odoo.
+
+Ejemplo de uso:
+    >>> from services.dataset_context import DatasetContext
+    >>>
+    >>> datasets = DatasetContext(data_manager)
+    >>> lineas = datasets.sales_lines(date_from='2025-01-01', date_to='2025-12-31')
+    >>> datasets.sales_lines(date_from='2025-01-01', date_to='2025-12-31') is lineas
+    True
+
+Notas importantes:
+    - Los datasets se comparten: los consumidores NO deben modificar las listas
+      ni los dicts devueltos (filtrar creando listas nuevas).
+    - Los resultados vacíos (o None) no se publican en la capa compartida y en
+      el memo local solo duran DATASET_EMPTY_TTL segundos (10); así un error
+      puntual de Odoo no queda servido durante todo el TTL, pero tampoco se
+      reintenta la carga en cada petición.
+    - Los datasets derivados (por cliente) solo se memoizan dentro de la
+      petición: se recalculan desde el dataset compartido vigente.
+    - version() y data_timestamp() describen los datasets usados en la petición
+      actual (para versionar el view-model y mostrar la antigüedad de los datos).
+      Un dataset vacío aparece como 'nombre@vacio': su versión no cambia con
+      cada reintento, solo cuando llegan datos.
+    - sales_aggregates() con cliente devuelve None: la vista por cliente se
+      agrega desde las líneas ya filtradas por el cliente de la factura (las
+      filas agrupadas llevan ese mismo cliente, así que los totales coinciden).
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from flask import g, has_request_context
+
+from services.single_flight import SingleFlight
+
+
+class DatasetContext:
+    """
+    Memo de datasets por filtro, por petición y con TTL corto entre peticiones.
+
+    Args:
+        data_manager: Instancia de OdooManager
+        ttl: Segundos que un dataset se reutiliza entre peticiones
+            (por defecto DATASET_CONTEXT_TTL o 30; 0 = solo dentro de la petición)
+        max_entries: Máximo de datasets en memoria entre peticiones
+            (por defecto DATASET_CONTEXT_MAX_ENTRIES o 16)
+        layers: LayeredCache donde compartir los datasets (capa 'datasets')
+        soft_ttl: Segundos tras los que un dataset se refresca en segundo plano
+            (por defecto DATASET_CACHE_SOFT_TTL o 300)
+        hard_ttl: Segundos tras los que un dataset ya no se sirve; también es la
+            vida en la capa compartida (por defecto DATASET_CACHE_HARD_TTL o 3600)
+        refresh_workers: Hilos para los refrescos en segundo plano
+            (por defecto DATASET_REFRESH_WORKERS o 2)
+        single_flight: SingleFlight para coalescer cargas concurrentes (por
+            defecto uno sobre la caché de 'layers', o solo entre hilos)
+        empty_ttl: Segundos que un resultado vacío se reutiliza entre peticiones
+            (por defecto DATASET_EMPTY_TTL o 10, nunca más que ttl)
+    """
+
+    def __init__(self, data_manager, ttl: Optional[int] = None, max_entries: Optional[int] = None,
+                 layers=None, soft_ttl: Optional[int] = None, hard_ttl: Optional[int] = None,
+                 refresh_workers: Optional[int] = None, single_flight: Optional[SingleFlight] = None,
+                 empty_ttl: Optional[int] = None):
+        self.data_manager = data_manager
+        self.layers = layers
+        if single_flight is None:
+            single_flight = SingleFlight(layers.cache if layers is not None else None)
+        self.single_flight = single_flight
+        if soft_ttl is None:
+            try:
+                soft_ttl = int(os.getenv('DATASET_CACHE_SOFT_TTL', '300'))
+            except Exception:
+                soft_ttl = 300
+        if hard_ttl is None:
+            try:
+                hard_ttl = int(os.getenv('DATASET_CACHE_HARD_TTL', '3600'))
+            except Exception:
+                hard_ttl = 3600
+        if refresh_workers is None:
+            try:
+                refresh_workers = int(os.getenv('DATASET_REFRESH_WORKERS', '2'))
+            except Exception:
+                refresh_workers = 2
+        self.hard_ttl = max(1, hard_ttl)
+        self.soft_ttl = min(max(0, soft_ttl), self.hard_ttl)
+        if ttl is None:
+            try:
+                ttl = int(os.getenv('DATASET_CONTEXT_TTL', '30'))
+            except Exception:
+                ttl = 30
+        if max_entries is None:
+            try:
+                max_entries = int(os.getenv('DATASET_CONTEXT_MAX_ENTRIES', '16'))
+            except Exception:
+                max_entries = 16
+        if empty_ttl is None:
+            try:
+                empty_ttl = int(os.getenv('DATASET_EMPTY_TTL', '10'))
+            except Exception:
+                empty_ttl = 10
+        self.ttl = max(0, ttl)
+        self.empty_ttl = min(max(0, empty_ttl), self.ttl)
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        # {(nombre, filtros): (dataset, cargado_en [monotonic], obtenido_en [epoch])}
+        self._entries: 'OrderedDict[Tuple[str, Tuple], Tuple[Any, float, float]]' = OrderedDict()
+        # Datasets con un refresco en segundo plano en curso (uno por clave y proceso)
+        self._refrescando: Set[Tuple[str, Tuple]] = set()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, refresh_workers),
+            thread_name_prefix='dataset-refresh'
+        )
+        self._stats = {
+            'request_hits': 0, 'ttl_hits': 0, 'layer_hits': 0, 'misses': 0,
+            'stale_hits': 0, 'refreshes': 0, 'refresh_errors': 0
+        }
+
+    # ------------------------------------------------------------------
+    # Memo genérico
+    # ------------------------------------------------------------------
+    def get(self, nombre: str, filtros: Tuple, cargar: Callable[[], Any], compartir: bool = True) -> Any:
+        """
+        Devuelve el dataset 'nombre' para 'filtros', llamando a cargar() solo
+        si no está en la petición actual, ni vigente en el memo con TTL, ni
+        en la capa 'datasets'.
+
+        Con compartir=False (datasets derivados) solo se memoiza en la petición.
+        """
+        clave = (nombre, filtros)
+        memo_peticion = self._memo_peticion()
+        if memo_peticion is not None and clave in memo_peticion:
+            self._stats['request_hits'] += 1
+            return memo_peticion[clave]
+
+        if not compartir:
+            dataset = cargar()
+            if memo_peticion is not None:
+                memo_peticion[clave] = dataset
+            return dataset
+
+        dataset = None
+        obtenido_en = None
+        if self.ttl:
+            with self._lock:
+                entrada = self._entries.get(clave)
+                if (entrada is not None
+                        and time.monotonic() - entrada[1] < (self.ttl if entrada[0] else self.empty_ttl)
+                        and time.time() - entrada[2] < self.hard_ttl):
+                    self._entries.move_to_end(clave)
+                    dataset, obtenido_en = entrada[0], entrada[2]
+                    self._stats['ttl_hits'] += 1
+
+        if obtenido_en is None:
+            entrada = self._buscar_en_capa(clave)
+            if entrada is not None:
+                dataset, obtenido_en = entrada
+
+        if obtenido_en is None:
+            # Una sola carga por filtro aunque lleguen varias peticiones a la vez
+            dataset, obtenido_en = self.single_flight.do(
+                self._clave_capa(clave),
+                lambda: self._cargar(clave, cargar, 'misses'),
+                buscar=lambda: self._buscar_en_capa(clave)
+            )
+        elif time.time() - obtenido_en >= self.soft_ttl:
+            # Vencido pero utilizable: se sirve ya y se refresca en segundo plano
+            self._stats['stale_hits'] += 1
+            self._refrescar_en_segundo_plano(clave, cargar, obtenido_en)
+
+        if memo_peticion is not None:
+            memo_peticion[clave] = dataset
+            g._dataset_stamps[clave] = obtenido_en
+        return dataset
+
+    @staticmethod
+    def _clave_capa(clave: Tuple[str, Tuple]) -> Tuple:
+        nombre, filtros = clave
+        return (nombre,) + tuple(filtros)
+
+    def _cargar(self, clave: Tuple[str, Tuple], cargar: Callable[[], Any], contador: str) -> Tuple[Any, float]:
+        """Ejecuta cargar() y publica el dataset (si no está vacío) en la capa y en el memo."""
+        obtenido_en = time.time()
+        dataset = cargar()
+        if dataset and self.layers is not None:
+            self.layers.set('datasets', self._clave_capa(clave), dataset,
+                            timeout=self.hard_ttl, obtenido_en=obtenido_en)
+        self._recordar(clave, dataset, obtenido_en, contador)
+        return dataset, obtenido_en
+
+    def _buscar_en_capa(self, clave: Tuple[str, Tuple], posterior_a: float = 0) -> Optional[Tuple[Any, float]]:
+        """(dataset, obtenido_en) publicado en la capa por otro worker, si es utilizable."""
+        if self.layers is None:
+            return None
+        entrada = self.layers.get_with_age('datasets', self._clave_capa(clave))
+        if entrada is None or entrada[1] <= posterior_a or time.time() - entrada[1] >= self.hard_ttl:
+            return None
+        self._recordar(clave, entrada[0], entrada[1], 'layer_hits')
+        return entrada
+
+    def _recordar(self, clave: Tuple[str, Tuple], dataset: Any, obtenido_en: float, contador: str) -> None:
+        """Cuenta el acceso y guarda el dataset en el memo con TTL (los vacíos, con empty_ttl)."""
+        with self._lock:
+            self._stats[contador] += 1
+            if self.ttl if dataset else self.empty_ttl:
+                self._entries[clave] = (dataset, time.monotonic(), obtenido_en)
+                self._entries.move_to_end(clave)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+    def _refrescar_en_segundo_plano(self, clave: Tuple[str, Tuple], cargar: Callable[[], Any],
+                                    obtenido_en: float) -> None:
+        """Lanza un único refresco de 'clave' en segundo plano (si no hay uno en curso)."""
+        with self._lock:
+            if clave in self._refrescando:
+                return
+            self._refrescando.add(clave)
+
+        def refrescar():
+            try:
+                inicio = time.time()
+                # Si otro worker ya está refrescando este dataset, se espera su resultado
+                dataset, _ = self.single_flight.do(
+                    self._clave_capa(clave),
+                    lambda: self._cargar(clave, cargar, 'refreshes'),
+                    buscar=lambda: self._buscar_en_capa(clave, posterior_a=obtenido_en)
+                )
+                if not dataset:
+                    logging.warning(f"⚠️ Refresco de {clave[0]} {clave[1]} sin datos; se mantiene el anterior")
+                    with self._lock:
+                        self._stats['refresh_errors'] += 1
+                    return
+                logging.info(f"🔄 Dataset {clave[0]} {clave[1]} refrescado en {time.time() - inicio:.2f}s")
+            except Exception as e:
+                logging.error(f"❌ Error refrescando {clave[0]} {clave[1]}; se mantiene el anterior: {e}")
+                with self._lock:
+                    self._stats['refresh_errors'] += 1
+            finally:
+                with self._lock:
+                    self._refrescando.discard(clave)
+
+        try:
+            self._executor.submit(refrescar)
+        except RuntimeError as e:
+            # Executor cerrado (apagado del proceso)
+            logging.warning(f"⚠️ No se pudo programar el refresco de {clave[0]}: {e}")
+            with self._lock:
+                self._refrescando.discard(clave)
+
+    @staticmethod
+    def _memo_peticion() -> Optional[Dict[Tuple[str, Tuple], Any]]:
+        if not has_request_context():
+            return None
+        if not hasattr(g, '_dataset_context'):
+            g._dataset_context = {}
+            g._dataset_stamps = {}
+        return g._dataset_context
+
+    def invalidate(self, nombre: Optional[str] = None) -> None:
+        """Descarta los datasets memoizados entre peticiones (todos o solo 'nombre')."""
+        with self._lock:
+            if nombre is None:
+                self._entries.clear()
+            else:
+                for clave in [c for c in self._entries if c[0] == nombre]:
+                    del self._entries[clave]
+        memo_peticion = self._memo_peticion()
+        if memo_peticion is not None:
+            for clave in [c for c in memo_peticion if nombre is None or c[0] == nombre]:
+                del memo_peticion[clave]
+                g._dataset_stamps.pop(clave, None)
+
+    # ------------------------------------------------------------------
+    # Antigüedad de los datos de la petición
+    # ------------------------------------------------------------------
+    def _stamps_peticion(self) -> Dict[Tuple[str, Tuple], float]:
+        if self._memo_peticion() is None:
+            return {}
+        return g._dataset_stamps
+
+    def version(self) -> str:
+        """
+        Identificador de los datasets compartidos usados en la petición: cambia
+        cuando alguno se recarga o se refresca en segundo plano. Los vacíos (o
+        None) valen 'vacio' sin importar cuándo se reintentaron.
+        """
+        stamps = self._stamps_peticion()
+        if not stamps:
+            return ''
+        memo_peticion = g._dataset_context
+        return ','.join(
+            f"{nombre}@{stamps[(nombre, filtros)]:.3f}" if memo_peticion.get((nombre, filtros)) else f"{nombre}@vacio"
+            for nombre, filtros in sorted(stamps, key=repr)
+        )
+
+    def data_timestamp(self) -> Optional[float]:
+        """Momento (epoch) en que se obtuvo el dataset más antiguo de la petición."""
+        stamps = self._stamps_peticion()
+        return min(stamps.values()) if stamps else None
+
+    def refreshing(self) -> bool:
+        """True si algún dataset de la petición se está refrescando en segundo plano."""
+        stamps = self._stamps_peticion()
+        with self._lock:
+            return any(clave in self._refrescando for clave in stamps)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Aciertos (frescos y vencidos), cargas, refrescos, cargas coalescidas y tamaño actual."""
+        vuelos = self.single_flight.get_stats()
+        with self._lock:
+            return dict(
+                self._stats,
+                size=len(self._entries),
+                refreshing=len(self._refrescando),
+                coalesced=vuelos['waiters'] + vuelos['remote_hits']
+            )
+
+    # ------------------------------------------------------------------
+    # Datasets del dashboard
+    # ------------------------------------------------------------------
+    def sales_lines(self, date_from=None, date_to=None, partner_id=None) -> List[Dict[str, Any]]:
+        """Todas las líneas de venta del rango (sin paginación), como get_sales_lines(page=None).
+
+        Con partner_id se filtran las líneas de todos los clientes por el cliente
+        de la factura (el mismo filtro que aplica Odoo con move_id.partner_id).
+        """
+        if partner_id:
+            def filtrar():
+                cliente = int(partner_id)
+                return [
+                    line for line in self.sales_lines(date_from=date_from, date_to=date_to)
+                    if _id_relacion(line.get('move_partner_id')) == cliente
+                ]
+            return self.get('sales_lines', (date_from, date_to, partner_id), filtrar, compartir=False)
+
+        def cargar():
+            logging.info(f"📦 Cargando líneas de venta {date_from} → {date_to} (todos los clientes)")
+            return self.data_manager.get_sales_lines(
+                date_from=date_from,
+                date_to=date_to,
+                page=None,
+                per_page=None
+            ) or []
+        return self.get('sales_lines', (date_from, date_to, None), cargar)
+
+    def sales_aggregates(self, date_from=None, date_to=None, partner_id=None) -> Optional[List[Dict[str, Any]]]:
+        """Filas agrupadas de get_sales_aggregates() para todos los clientes.
+
+        Devuelve None si no están disponibles o si se pide un cliente (ver notas
+        del módulo): el llamador agrega entonces las líneas de sales_lines().
+        """
+        if partner_id:
+            return None
+
+        def cargar():
+            return self.data_manager.get_sales_aggregates(date_from=date_from, date_to=date_to)
+        return self.get('sales_aggregates', (date_from, date_to), cargar)
+
+    def pending_orders(self, partner_id=None) -> List[Dict[str, Any]]:
+        """Todas las líneas pendientes de facturar del cliente (o de todos)."""
+        if partner_id:
+            def filtrar():
+                cliente = int(partner_id)
+                return [
+                    line for line in self.pending_orders()
+                    if _id_relacion(line.get('partner_id')) == cliente
+                ]
+            return self.get('pending_orders', (partner_id,), filtrar, compartir=False)
+
+        def cargar():
+            # Sin página: todas las líneas con saldo por facturar
+            return self.data_manager.get_pending_orders(page=None, per_page=None) or []
+        return self.get('pending_orders', (None,), cargar)
+
+    def filter_options(self) -> Dict[str, Any]:
+        """Opciones de filtro del dashboard (líneas comerciales y clientes)."""
+        return self.get('filter_options', (), self.data_manager.get_filter_options)
+
+
+def _id_relacion(valor) -> Optional[int]:
+    """Id de un valor relacional de Odoo ([id, nombre]) o None."""
+    if isinstance(valor, (list, tuple)) and valor:
+        return valor[0]
+    return None
@@ -0,0 +1,171 @@
+# services/excel_export.py
+"""
+Exportación a Excel con memoria constante.
+
+Las exportaciones armaban la lista completa de filas, un DataFrame y el libro en
+un BytesIO, y por eso se limitaban a 15.000 filas. Aquí las filas llegan en
+lotes (p. ej. OdooManager.iter_sales_lines) y se escriben con el modo write-only
+de openpyxl, que vuelca cada fila al disco en lugar de guardar las celdas: la
+memoria no crece con el número de filas. El .xlsx queda en un archivo temporal
+que se envía al navegador en bloques y se borra al terminar.
+
+Ejemplo de uso:
+    >>> from services.excel_export import build_xlsx, xlsx_response
+    >>>
+    >>> ruta, filas = build_xlsx(
+    ...     data_manager.iter_sales_lines(date_from='2025-01-01', date_to='2025-12-31'),
+    ...     columns=[('pedido', 'Pedido'), ('amount_currency', 'Total ($)')],
+    ...     sheet_title='Detalle_Ventas_Internacional',
+    ...     table_name='VentasFacturadas'
+    ... )
+    >>> return xlsx_response(ruta, 'Pedidos_Facturados.xlsx')
+"""
+
+import logging
+import math
+import os
+import tempfile
+import warnings
+from datetime import date, datetime, time, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from flask import Response
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.table import Table, TableStyleInfo
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+try:
+    EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', str(64 * 1024)))
+except Exception:
+    EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def excel_value(valor: Any) -> Any:
+    """Valor de celda como lo escribía pandas.to_excel (relaciones [id, nombre] como texto, NaN vacío)."""
+    if valor is None or isinstance(valor, (str, bool, int, datetime, date, time, timedelta)):
+        return valor
+    if isinstance(valor, float):
+        return None if math.isnan(valor) else valor
+    return str(valor)
+
+
+def iter_row_values(batches: Iterable[Iterable[Dict[str, Any]]],
+                    columns: Optional[Sequence[Tuple[str, str]]],
+                    row_filter: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                    formatters: Optional[Dict[str, Callable[[Any], Any]]] = None
+                    ) -> Iterator[Tuple[List[str], List[List[Any]]]]:
+    """
+    Filas de cada lote como listas de valores en el orden de las columnas.
+
+    Común a todos los formatos de exportación (XLSX, CSV, Parquet): aplica el
+    filtro y los formateadores y resuelve las columnas (con columns=None, las
+    claves de la primera fila que pasa el filtro).
+
+    Yields:
+        (claves, valores de las filas del lote); los lotes sin filas se omiten
+    """
+    formatters = formatters or {}
+    claves: Optional[List[str]] = [clave for clave, _ in columns] if columns else None
+    for lote in batches:
+        valores_lote = []
+        for fila in lote:
+            if row_filter is not None and not row_filter(fila):
+                continue
+            if claves is None:
+                claves = list(fila.keys())
+            valores = []
+            for clave in claves:
+                valor = fila.get(clave)
+                if clave in formatters:
+                    valor = formatters[clave](valor)
+                valores.append(valor)
+            valores_lote.append(valores)
+        if valores_lote:
+            yield claves, valores_lote
+
+
+def build_xlsx(batches: Iterable[Iterable[Dict[str, Any]]],
+               columns: Optional[Sequence[Tuple[str, str]]],
+               sheet_title: str,
+               table_name: Optional[str] = None,
+               table_style: str = 'TableStyleLight9',
+               row_filter: Optional[Callable[[Dict[str, Any]], bool]] = None,
+               formatters: Optional[Dict[str, Callable[[Any], Any]]] = None) -> Tuple[str, int]:
+    """
+    Escribe las filas de 'batches' en un .xlsx temporal, lote a lote.
+
+    Args:
+        batches: Iterable de lotes (listas de dicts); cada lote se libera al escribirlo
+        columns: Pares (clave, encabezado); None = todas las claves del primer lote
+        sheet_title: Nombre de la hoja
+        table_name: Si se indica, la hoja lleva una tabla con estilo (filtros y franjas)
+        table_style: Estilo de la tabla
+        row_filter: Devuelve False para omitir una fila
+        formatters: {clave: función} aplicada al valor antes de escribirlo
+
+    Returns:
+        (ruta del archivo temporal, filas escritas). El llamador debe enviarlo con
+        xlsx_response() o borrarlo.
+    """
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title=sheet_title[:31])
+    filas = 0
+    claves: Optional[List[str]] = [clave for clave, _ in columns] if columns else None
+    if columns:
+        worksheet.append([encabezado for _, encabezado in columns])
+
+    for claves_lote, lote in iter_row_values(batches, columns, row_filter, formatters):
+        if claves is None:
+            claves = claves_lote
+            worksheet.append(claves)
+        for valores in lote:
+            worksheet.append([excel_value(valor) for valor in valores])
+            filas += 1
+
+    if table_name and claves and filas:
+        # La referencia se conoce al final; openpyxl escribe las tablas al guardar.
+        # En modo write-only los nombres de columna de la tabla se asignan a mano.
+        table = Table(displayName=table_name, ref=f"A1:{get_column_letter(len(claves))}{filas + 1}")
+        table._initialise_columns()
+        encabezados = [encabezado for _, encabezado in columns] if columns else claves
+        for columna, encabezado in zip(table.tableColumns, encabezados):
+            columna.name = str(encabezado)
+        table.tableStyleInfo = TableStyleInfo(name=table_style, showFirstColumn=False, showLastColumn=False,
+                                              showRowStripes=True, showColumnStripes=False)
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message='In write-only mode you must add table columns manually')
+            worksheet.add_table(table)
+
+    fd, ruta = tempfile.mkstemp(prefix='export_', suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook.save(ruta)
+    except Exception:
+        os.remove(ruta)
+        raise
+    logging.info(f"📊 Excel '{sheet_title}': {filas} filas, {os.path.getsize(ruta) / 1024:.0f} KB")
+    return ruta, filas
+
+
+def iter_file_chunks(ruta: str, chunk_size: int = EXPORT_CHUNK_SIZE, delete: bool = True) -> Iterator[bytes]:
+    """Lee el archivo en bloques y lo borra al terminar (o si el cliente corta la descarga)."""
+    try:
+        with open(ruta, 'rb') as f:
+            for bloque in iter(lambda: f.read(chunk_size), b''):
+                yield bloque
+    finally:
+        if delete:
+            try:
+                os.remove(ruta)
+            except OSError as e:
+                logging.warning(f"⚠️ No se pudo borrar el temporal {ruta}: {e}")
+
+
+def xlsx_response(ruta: str, filename: str) -> Response:
+    """Respuesta de descarga que envía el .xlsx temporal en bloques y luego lo borra."""
+    response = Response(iter_file_chunks(ruta), mimetype=XLSX_MIMETYPE, direct_passthrough=True)
+    response.headers['Content-Length'] = str(os.path.getsize(ruta))
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    return response
@@ -0,0 +1,301 @@
+# services/export_formats.py
+"""
+Formatos de exportación: XLSX, CSV y Parquet con las mismas columnas.
+
+Los analistas bajan el año completo de ventas y pendientes para sus propias
+herramientas, y generar el XLSX con openpyxl es lo más lento del export. Los
+tres formatos comparten las columnas (clave → encabezado), el filtro de filas
+y los formateadores (ver iter_row_values en services/excel_export.py):
+
+    - xlsx: libro con tabla con estilo (build_xlsx, modo write-only).
+    - csv: UTF-8 con BOM (Excel lo abre con acentos). iter_csv() lo genera lote a
+      lote y build_csv() lo vuelca a un archivo temporal, como los otros formatos:
+      solo se responde con el archivo completo.
+    - parquet: columnas de texto con codificación de diccionario (categóricas al
+      cargarlas con pandas) y numéricas en float64, un row group por lote.
+      Requiere el paquete opcional 'pyarrow' (import diferido).
+
+Ejemplo de uso:
+    >>> from services.export_formats import build_export, export_response
+    >>>
+    >>> ruta, filas = build_export('parquet', lotes, columns=[('cliente', 'Cliente')])
+    >>> return export_response(ruta, 'Pedidos_Facturados.parquet')
+"""
+
+import csv
+import io
+import logging
+import math
+import os
+import tempfile
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from flask import Response
+
+from .excel_export import XLSX_MIMETYPE, build_xlsx, excel_value, iter_file_chunks, iter_row_values
+
+# Formato → tipo MIME de la descarga
+EXPORT_FORMATS = {
+    'xlsx': XLSX_MIMETYPE,
+    'csv': 'text/csv',  # Werkzeug añade charset=utf-8
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# Compresión de los archivos Parquet (zstd, snappy, gzip, none)
+PARQUET_COMPRESSION = os.getenv('PARQUET_COMPRESSION', 'zstd')
+
+
+class ExportFormatUnavailable(RuntimeError):
+    """El formato pedido necesita una dependencia opcional que no está instalada."""
+
+
+def _cargar_pyarrow():
+    """(pyarrow, pyarrow.parquet) o ExportFormatUnavailable si no está instalado."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportFormatUnavailable("La exportación a Parquet requiere el paquete 'pyarrow'")
+    return pyarrow, pyarrow.parquet
+
+
+def format_available(formato: str) -> bool:
+    """True si el formato existe y sus dependencias están instaladas."""
+    if formato not in EXPORT_FORMATS:
+        return False
+    if formato == 'parquet':
+        try:
+            _cargar_pyarrow()
+        except ExportFormatUnavailable:
+            return False
+    return True
+
+
+def _encabezados(columns: Optional[Sequence[Tuple[str, str]]], claves: List[str]) -> List[str]:
+    return [encabezado for _, encabezado in columns] if columns else list(claves)
+
+
+# ----------------------------------------------------------------------
+# CSV
+# ----------------------------------------------------------------------
+def iter_csv(batches: Iterable[Iterable[Dict[str, Any]]],
+             columns: Optional[Sequence[Tuple[str, str]]],
+             row_filter: Optional[Callable[[Dict[str, Any]], bool]] = None,
+             formatters: Optional[Dict[str, Callable[[Any], Any]]] = None,
+             resultado: Optional[Dict[str, int]] = None) -> Iterator[bytes]:
+    """
+    CSV en bloques de bytes, un bloque por lote.
+
+    Args:
+        resultado: Si se pasa un dict, al terminar contiene {'filas': N}
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    filas = 0
+    encabezado_escrito = False
+    if columns:
+        writer.writerow(_encabezados(columns, []))
+        encabezado_escrito = True
+
+    def vaciar() -> bytes:
+        texto = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return texto.encode('utf-8')
+
+    yield '\ufeff'.encode('utf-8') + vaciar()
+    for claves, lote in iter_row_values(batches, columns, row_filter, formatters):
+        if not encabezado_escrito:
+            writer.writerow(claves)
+            encabezado_escrito = True
+        writer.writerows([excel_value(valor) for valor in valores] for valores in lote)
+        filas += len(lote)
+        yield vaciar()
+    if resultado is not None:
+        resultado['filas'] = filas
+
+
+def build_csv(batches: Iterable[Iterable[Dict[str, Any]]],
+              columns: Optional[Sequence[Tuple[str, str]]],
+              row_filter: Optional[Callable[[Dict[str, Any]], bool]] = None,
+              formatters: Optional[Dict[str, Callable[[Any], Any]]] = None) -> Tuple[str, int]:
+    """Escribe el CSV en un archivo temporal. Returns: (ruta, filas)."""
+    resultado = {'filas': 0}
+    fd, ruta = tempfile.mkstemp(prefix='export_', suffix='.csv')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for bloque in iter_csv(batches, columns, row_filter, formatters, resultado):
+                f.write(bloque)
+    except Exception:
+        os.remove(ruta)
+        raise
+    logging.info(f"📄 CSV: {resultado['filas']} filas, {os.path.getsize(ruta) / 1024:.0f} KB")
+    return ruta, resultado['filas']
+
+
+# ----------------------------------------------------------------------
+# Parquet
+# ----------------------------------------------------------------------
+def _es_numero(valor: Any) -> bool:
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool)
+
+
+def _es_nulo(valor: Any) -> bool:
+    # Odoo devuelve False en los campos vacíos
+    return valor is None or valor is False or (isinstance(valor, float) and math.isnan(valor))
+
+
+def _columna_parquet(pa, valores: List[Any], numerica: bool):
+    if numerica:
+        return pa.array([None if _es_nulo(v) else float(v) for v in valores], type=pa.float64())
+    # Odoo devuelve False en los campos vacíos: en Parquet son nulos
+    textos = [None if v is None or v is False else str(v) for v in valores]
+    return pa.array(textos, type=pa.string()).dictionary_encode()
+
+
+def _tipo_parquet(pa, numerica: bool):
+    return pa.float64() if numerica else pa.dictionary(pa.int32(), pa.string())
+
+
+def _promover_a_texto(pa, pq, ruta: str, schema, indices: List[int]):
+    """Copia los row groups ya escritos en ruta a un archivo nuevo con las columnas indicadas como texto.
+
+    Parquet no admite añadir a un archivo cerrado, así que el writer devuelto queda
+    abierto sobre el archivo nuevo. Borra ruta. Returns: (writer, schema, ruta nueva)
+    """
+    for i in indices:
+        schema = schema.set(i, pa.field(schema.field(i).name, _tipo_parquet(pa, False)))
+    fd, temporal = tempfile.mkstemp(prefix='export_', suffix='.parquet')
+    os.close(fd)
+    writer = pq.ParquetWriter(temporal, schema, compression=PARQUET_COMPRESSION)
+    try:
+        previo = pq.ParquetFile(ruta)
+        for grupo in range(previo.num_row_groups):
+            tabla = previo.read_row_group(grupo)
+            for i in indices:
+                tabla = tabla.set_column(i, schema.field(i), tabla.column(i).cast(pa.string()).dictionary_encode())
+            writer.write_table(tabla)
+    except Exception:
+        writer.close()
+        os.remove(temporal)
+        raise
+    os.remove(ruta)
+    return writer, schema, temporal
+
+
+def build_parquet(batches: Iterable[Iterable[Dict[str, Any]]],
+                  columns: Optional[Sequence[Tuple[str, str]]],
+                  row_filter: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                  formatters: Optional[Dict[str, Callable[[Any], Any]]] = None) -> Tuple[str, int]:
+    """
+    Escribe un Parquet temporal con un row group por lote.
+
+    El tipo de cada columna se decide con el primer lote: numérica (float64) si
+    todos sus valores son números o vacíos, si no texto con diccionario. Si un lote
+    posterior trae un valor no numérico en una columna numérica, la columna pasa a
+    texto (se reescriben los row groups ya escritos) en lugar de perder el valor.
+
+    Returns:
+        (ruta, filas)
+
+    Raises:
+        ExportFormatUnavailable: Si pyarrow no está instalado
+    """
+    pa, pq = _cargar_pyarrow()
+    fd, ruta = tempfile.mkstemp(prefix='export_', suffix='.parquet')
+    os.close(fd)
+    writer = None
+    numericas: List[bool] = []
+    filas = 0
+    try:
+        for claves, lote in iter_row_values(batches, columns, row_filter, formatters):
+            if writer is None:
+                numericas = [
+                    all(_es_numero(fila[i]) or _es_nulo(fila[i]) for fila in lote)
+                    and any(_es_numero(fila[i]) for fila in lote)
+                    for i in range(len(claves))
+                ]
+                schema = pa.schema([
+                    pa.field(nombre, _tipo_parquet(pa, numerica))
+                    for nombre, numerica in zip(_encabezados(columns, claves), numericas)
+                ])
+                writer = pq.ParquetWriter(ruta, schema, compression=PARQUET_COMPRESSION)
+            else:
+                a_texto = [
+                    i for i, numerica in enumerate(numericas)
+                    if numerica and any(not _es_numero(fila[i]) and not _es_nulo(fila[i]) for fila in lote)
+                ]
+                if a_texto:
+                    logging.info(f"🧱 Parquet: columnas {[schema.field(i).name for i in a_texto]} pasan a texto")
+                    writer.close()
+                    writer, schema, ruta = _promover_a_texto(pa, pq, ruta, schema, a_texto)
+                    for i in a_texto:
+                        numericas[i] = False
+            arrays = [
+                _columna_parquet(pa, [fila[i] for fila in lote], numerica)
+                for i, numerica in enumerate(numericas)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            filas += len(lote)
+
+        if writer is None:
+            # Sin filas: archivo vacío con las columnas como texto
+            schema = pa.schema([pa.field(nombre, pa.dictionary(pa.int32(), pa.string()))
+                                for nombre in _encabezados(columns, [])])
+            writer = pq.ParquetWriter(ruta, schema, compression=PARQUET_COMPRESSION)
+        writer.close()
+    except Exception:
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception:
+                pass
+        os.remove(ruta)
+        raise
+    logging.info(f"🧱 Parquet: {filas} filas, {os.path.getsize(ruta) / 1024:.0f} KB")
+    return ruta, filas
+
+
+# ----------------------------------------------------------------------
+# Despacho y respuesta
+# ----------------------------------------------------------------------
+def build_export(formato: str, batches: Iterable[Iterable[Dict[str, Any]]],
+                 columns: Optional[Sequence[Tuple[str, str]]],
+                 sheet_title: str = 'Datos',
+                 table_name: Optional[str] = None,
+                 row_filter: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                 formatters: Optional[Dict[str, Callable[[Any], Any]]] = None) -> Tuple[str, int]:
+    """
+    Genera el archivo temporal en el formato pedido.
+
+    sheet_title y table_name solo se usan en XLSX.
+
+    Returns:
+        (ruta del archivo temporal, filas escritas)
+    """
+    if formato == 'xlsx':
+        return build_xlsx(batches, columns, sheet_title, table_name=table_name,
+                          row_filter=row_filter, formatters=formatters)
+    if formato == 'csv':
+        return build_csv(batches, columns, row_filter=row_filter, formatters=formatters)
+    if formato == 'parquet':
+        return build_parquet(batches, columns, row_filter=row_filter, formatters=formatters)
+    raise ValueError(f"Formato de exportación desconocido: {formato}")
+
+
+def export_response(ruta: str, filename: str) -> Response:
+    """Descarga del archivo temporal en bloques (tipo MIME según la extensión); luego lo borra."""
+    formato = os.path.splitext(filename)[1].lstrip('.').lower()
+    response = Response(iter_file_chunks(ruta), mimetype=EXPORT_FORMATS.get(formato, 'application/octet-stream'),
+                        direct_passthrough=True)
+    response.headers['Content-Length'] = str(os.path.getsize(ruta))
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    return response
+
+
+def discard_export(ruta: str) -> None:
+    """Borra un archivo temporal de exportación que no se llegó a enviar."""
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
@@ -0,0 +1,316 @@
+# services/export_jobs.py
+"""
+Exportaciones en segundo plano.
+
+Una exportación anual ocupa un worker de gunicorn durante toda la lectura de
+Odoo y la escritura del libro, y a menudo supera el timeout del proxy. Con
+ExportJobManager la petición solo encola el trabajo y responde con su id:
+
+    1. Un pool local de hilos (EXPORT_JOB_WORKERS, por defecto 1 por proceso)
+       genera el archivo. La cola está acotada (EXPORT_JOB_MAX_QUEUED, 5) y cada
+       usuario puede tener EXPORT_JOB_MAX_PER_USER (2) trabajos activos, para que
+       las exportaciones no le quiten capacidad al tráfico del dashboard. Los
+       límites cuentan los trabajos de todos los workers del host.
+    2. El estado de cada trabajo se guarda en <id>.job.json junto a su archivo,
+       en EXPORT_JOB_DIR, así cualquier worker del mismo host responde la
+       consulta de estado y la descarga sin depender de una caché compartida
+       (con la SimpleCache por defecto cada worker tiene la suya). Si los
+       workers están en varios hosts, EXPORT_JOB_DIR debe ser un volumen común.
+    3. La descarga usa una URL firmada que vence a los EXPORT_JOB_TTL segundos
+       (1800 por defecto); pasado ese tiempo se borran el trabajo y su archivo.
+
+Ejemplo de uso:
+    >>> from services.export_jobs import ExportJobManager
+    >>>
+    >>> export_jobs = ExportJobManager(secret_key=app.secret_key)
+    >>> job = export_jobs.submit('ana@empresa.com', 'sales', generar, 'Pedidos_Facturados.xlsx')
+    >>> export_jobs.get(job['id'])['estado']
+    'en_proceso'
+"""
+
+import json
+import logging
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo el candado del proceso
+    fcntl = None
+
+# Estados de un trabajo
+PENDIENTE = 'pendiente'
+EN_PROCESO = 'en_proceso'
+LISTO = 'listo'
+ERROR = 'error'
+ACTIVOS = (PENDIENTE, EN_PROCESO)
+
+# Sufijo del archivo de estado de cada trabajo y formato de los ids (token_urlsafe)
+SUFIJO_ESTADO = '.job.json'
+_ID_VALIDO = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class ExportQueueFull(Exception):
+    """La cola de exportaciones (global o del usuario) está llena."""
+
+
+class ExportJobManager:
+    """
+    Registro y pool de trabajos de exportación.
+
+    Args:
+        secret_key: Clave para firmar las URLs de descarga
+        max_workers: Hilos que generan archivos en este proceso (por defecto EXPORT_JOB_WORKERS o 1)
+        max_queued: Trabajos activos máximos en el host (por defecto EXPORT_JOB_MAX_QUEUED o 5)
+        max_per_user: Trabajos activos por usuario en el host (por defecto EXPORT_JOB_MAX_PER_USER o 2)
+        ttl: Segundos de vida del trabajo, su archivo y su URL (por defecto EXPORT_JOB_TTL o 1800)
+        directory: Carpeta de los archivos y de su estado, común a los workers
+            (por defecto EXPORT_JOB_DIR o <tmp>/dashboard_exports)
+    """
+
+    def __init__(self, secret_key: Optional[str] = None, max_workers: Optional[int] = None,
+                 max_queued: Optional[int] = None, max_per_user: Optional[int] = None,
+                 ttl: Optional[int] = None, directory: Optional[str] = None):
+        self.max_workers = max(1, self._entero_env('EXPORT_JOB_WORKERS', 1) if max_workers is None else max_workers)
+        self.max_queued = max(1, self._entero_env('EXPORT_JOB_MAX_QUEUED', 5) if max_queued is None else max_queued)
+        self.max_per_user = max(1, self._entero_env('EXPORT_JOB_MAX_PER_USER', 2)
+                                if max_per_user is None else max_per_user)
+        self.ttl = max(60, self._entero_env('EXPORT_JOB_TTL', 1800) if ttl is None else ttl)
+        self.directory = directory or os.getenv('EXPORT_JOB_DIR') or os.path.join(
+            tempfile.gettempdir(), 'dashboard_exports'
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        self._serializer = URLSafeTimedSerializer(secret_key or secrets.token_hex(16), salt='export-download')
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='export-job')
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+
+    @staticmethod
+    def _entero_env(nombre: str, defecto: int) -> int:
+        try:
+            return int(os.getenv(nombre, str(defecto)))
+        except Exception:
+            return defecto
+
+    # ------------------------------------------------------------------
+    # Encolar y ejecutar
+    # ------------------------------------------------------------------
+    def submit(self, user: str, export_type: str, generar: Callable[[], Tuple[str, int]],
+               filename: str, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Encola un trabajo y devuelve su estado inicial.
+
+        Args:
+            user: Usuario que lo pide (solo él puede consultarlo y descargarlo)
+            export_type: Tipo de exportación (sales, pending, ...)
+            generar: Función sin argumentos que devuelve (ruta del archivo temporal, filas)
+            filename: Nombre de descarga
+            filters: Filtros aplicados (para el registro de seguridad)
+
+        Raises:
+            ExportQueueFull: Si la cola del host o del usuario está llena
+        """
+        self.purge()
+        with self._lock, self._candado_carpeta():
+            activos = self._activos_en_carpeta()
+            if len(activos) >= self.max_queued:
+                self._stats['rejected'] += 1
+                raise ExportQueueFull("Hay demasiadas exportaciones en curso; inténtelo en unos minutos")
+            if sum(1 for job in activos if job['user'] == user) >= self.max_per_user:
+                self._stats['rejected'] += 1
+                raise ExportQueueFull(
+                    f"Ya tiene {self.max_per_user} exportaciones en curso; espere a que terminen"
+                )
+            job = {
+                'id': secrets.token_urlsafe(12),
+                'user': user,
+                'export_type': export_type,
+                'filename': filename,
+                'filters': filters or {},
+                'estado': PENDIENTE,
+                'filas': None,
+                'error': None,
+                'ruta': None,
+                'creado_en': time.time(),
+                'terminado_en': None,
+            }
+            self._jobs[job['id']] = job
+            self._stats['submitted'] += 1
+            # Dentro del candado: el siguiente submit de otro worker ya lo cuenta
+            self._publicar(job)
+        self._executor.submit(self._ejecutar, job['id'], generar)
+        logging.info(f"📤 Exportación {export_type} encolada ({job['id']}) para {user}")
+        return dict(job)
+
+    def _ejecutar(self, job_id: str, generar: Callable[[], Tuple[str, int]]) -> None:
+        self._actualizar(job_id, estado=EN_PROCESO)
+        inicio = time.time()
+        try:
+            ruta_temporal, filas = generar()
+            ruta = os.path.join(self.directory, f"{job_id}{os.path.splitext(ruta_temporal)[1]}")
+            shutil.move(ruta_temporal, ruta)
+        except Exception as e:
+            logging.error(f"❌ Exportación {job_id} falló: {e}")
+            self._actualizar(job_id, estado=ERROR, error='No se pudo generar el archivo', terminado_en=time.time())
+            self._contar('failed')
+            return
+        self._actualizar(job_id, estado=LISTO, filas=filas, ruta=ruta, terminado_en=time.time())
+        self._contar('completed')
+        logging.info(f"✅ Exportación {job_id} lista: {filas} filas en {time.time() - inicio:.1f}s")
+
+    # ------------------------------------------------------------------
+    # Estado compartido (archivos <id>.job.json en la carpeta de exportaciones)
+    # ------------------------------------------------------------------
+    def _ruta_estado(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}{SUFIJO_ESTADO}")
+
+    def _publicar(self, job: Dict[str, Any]) -> None:
+        ruta = self._ruta_estado(job['id'])
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporal, 'w', encoding='utf-8') as archivo:
+                json.dump(job, archivo, ensure_ascii=False, default=str)
+            # Reemplazo atómico: quien lee nunca ve un JSON a medias
+            os.replace(temporal, ruta)
+        except Exception as e:
+            logging.warning(f"⚠️ No se pudo publicar el estado de la exportación {job['id']}: {e}")
+            try:
+                os.remove(temporal)
+            except OSError:
+                pass
+
+    def _leer_estado(self, ruta: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(ruta, encoding='utf-8') as archivo:
+                return json.load(archivo)
+        except (OSError, ValueError):
+            return None
+
+    def _activos_en_carpeta(self) -> list:
+        """Trabajos activos de todos los workers (los de más de ttl segundos se dan por perdidos)."""
+        limite = time.time() - self.ttl
+        activos = []
+        try:
+            nombres = os.listdir(self.directory)
+        except OSError:
+            return activos
+        for nombre in nombres:
+            if not nombre.endswith(SUFIJO_ESTADO):
+                continue
+            job = self._leer_estado(os.path.join(self.directory, nombre))
+            if job and job.get('estado') in ACTIVOS and (job.get('creado_en') or 0) >= limite:
+                activos.append(job)
+        return activos
+
+    def _candado_carpeta(self):
+        """Candado entre procesos (flock sobre <carpeta>/.lock) para contar y registrar trabajos."""
+        return _CandadoArchivo(os.path.join(self.directory, '.lock'))
+
+    def _actualizar(self, job_id: str, **cambios) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(cambios)
+            copia = dict(job)
+        self._publicar(copia)
+
+    def _contar(self, contador: str) -> None:
+        with self._lock:
+            self._stats[contador] += 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Estado del trabajo (de este proceso o publicado por otro worker), o None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        if not _ID_VALIDO.match(job_id or ''):
+            return None
+        return self._leer_estado(self._ruta_estado(job_id))
+
+    # ------------------------------------------------------------------
+    # Descarga
+    # ------------------------------------------------------------------
+    def download_token(self, job: Dict[str, Any]) -> str:
+        """Token firmado de descarga del trabajo (vence a los ttl segundos)."""
+        return self._serializer.dumps(job['id'])
+
+    def resolve_download(self, token: str, user: str) -> Optional[Dict[str, Any]]:
+        """Trabajo listo al que apunta un token válido del usuario, o None."""
+        try:
+            job_id = self._serializer.loads(token, max_age=self.ttl)
+        except (SignatureExpired, BadSignature):
+            return None
+        job = self.get(str(job_id))
+        if (not job or job['user'] != user or job['estado'] != LISTO
+                or not job.get('ruta') or not os.path.exists(job['ruta'])):
+            return None
+        return job
+
+    # ------------------------------------------------------------------
+    # Limpieza y estadísticas
+    # ------------------------------------------------------------------
+    def purge(self) -> int:
+        """Olvida los trabajos vencidos y borra los archivos (y su estado) con más de ttl segundos."""
+        limite = time.time() - self.ttl
+        with self._lock:
+            vencidos = [job_id for job_id, job in self._jobs.items()
+                        if job['terminado_en'] and job['terminado_en'] < limite]
+            for job_id in vencidos:
+                del self._jobs[job_id]
+
+        borrados = 0
+        try:
+            for nombre in os.listdir(self.directory):
+                if nombre.startswith('.'):
+                    continue
+                ruta = os.path.join(self.directory, nombre)
+                try:
+                    if os.path.getmtime(ruta) < limite:
+                        os.remove(ruta)
+                        borrados += 1
+                except OSError:
+                    continue
+        except OSError as e:
+            logging.warning(f"⚠️ No se pudo limpiar {self.directory}: {e}")
+        if borrados:
+            logging.info(f"🧹 {borrados} archivos de exportaciones vencidas borrados")
+        return borrados
+
+    def get_stats(self) -> Dict[str, int]:
+        """Trabajos encolados, terminados, fallidos y rechazados en este proceso; activos en el host."""
+        activos = len(self._activos_en_carpeta())
+        with self._lock:
+            return dict(self._stats, active=activos, workers=self.max_workers)
+
+
+class _CandadoArchivo:
+    """flock exclusivo sobre un archivo mientras dura el bloque with (sin efecto sin fcntl)."""
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._archivo = None
+
+    def __enter__(self) -> '_CandadoArchivo':
+        if fcntl is not None:
+            self._archivo = open(self.ruta, 'a')
+            fcntl.flock(self._archivo, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        if self._archivo is not None:
+            fcntl.flock(self._archivo, fcntl.LOCK_UN)
+            self._archivo.close()
+            self._archivo = None
+        return False
@@ -0,0 +1,251 @@
+# services/http_compression.py
+"""
+Compresión de respuestas y caché de estáticos en el navegador.
+
+    1. Respuestas dinámicas (HTML, JSON, CSS, JS): se comprimen con brotli o gzip
+       según Accept-Encoding. Brotli es opcional: solo se ofrece si el paquete
+       'brotli' está instalado. Las respuestas menores que COMPRESS_MIN_SIZE
+       (bytes, por defecto 1024) se envían tal cual.
+    2. Estáticos precomprimidos: al iniciar se generan variantes .gz (y .br) de
+       los estáticos comprimibles (world.json pesa ~1 MB) y se sirven en lugar
+       del original cuando el navegador las acepta. STATIC_PRECOMPRESS=false lo
+       desactiva (p. ej. con el directorio de solo lectura).
+    3. URLs con hash de contenido: url_for('static', ...) añade ?v=<hash>. Esas
+       URLs se cachean STATIC_MAX_AGE segundos (por defecto un año, immutable);
+       al cambiar el archivo cambia la URL. Sin ?v= se mantiene la revalidación
+       con ETag/304.
+
+Ejemplo de uso:
+    >>> from services.http_compression import HttpCompression
+    >>>
+    >>> compression = HttpCompression(app)
+    >>> url_for('static', filename='world.json')
+    '/static/world.json?v=3f2a9c01d4'
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+# Tipos que vale la pena comprimir (las imágenes ya vienen comprimidas)
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+}
+STATIC_EXTENSIONS = ('.json', '.css', '.js', '.svg', '.html', '.txt')
+# Extensión de la variante precomprimida por codificación, en orden de preferencia
+VARIANTES = (('br', '.br'), ('gzip', '.gz'))
+
+_brotli = None
+_brotli_cargado = False
+
+
+def _cargar_brotli():
+    """Módulo brotli si está instalado (import diferido, dependencia opcional)."""
+    global _brotli, _brotli_cargado
+    if not _brotli_cargado:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = None
+        _brotli_cargado = True
+    return _brotli
+
+
+def _comprimir(data: bytes, encoding: str, nivel: int) -> bytes:
+    if encoding == 'br':
+        return _cargar_brotli().compress(data, quality=nivel)
+    return gzip.compress(data, compresslevel=nivel, mtime=0)
+
+
+class HttpCompression:
+    """
+    Extensión Flask de compresión y caché de estáticos.
+
+    Args:
+        app: Aplicación Flask (o llamar a init_app() más tarde)
+        min_size: Tamaño mínimo en bytes para comprimir (por defecto COMPRESS_MIN_SIZE o 1024)
+        gzip_level: Nivel gzip de las respuestas dinámicas (por defecto COMPRESS_LEVEL o 6)
+        brotli_quality: Calidad brotli de las respuestas dinámicas (por defecto COMPRESS_BR_QUALITY o 5)
+        static_max_age: Segundos de caché de las URLs con hash (por defecto STATIC_MAX_AGE o 31536000)
+    """
+
+    def __init__(self, app=None, min_size: Optional[int] = None, gzip_level: Optional[int] = None,
+                 brotli_quality: Optional[int] = None, static_max_age: Optional[int] = None):
+        self.min_size = self._entero_env('COMPRESS_MIN_SIZE', 1024) if min_size is None else min_size
+        self.gzip_level = self._entero_env('COMPRESS_LEVEL', 6) if gzip_level is None else gzip_level
+        self.brotli_quality = (self._entero_env('COMPRESS_BR_QUALITY', 5)
+                               if brotli_quality is None else brotli_quality)
+        self.static_max_age = (self._entero_env('STATIC_MAX_AGE', 31536000)
+                               if static_max_age is None else static_max_age)
+        self.static_folder: Optional[str] = None
+        self._hashes: Dict[str, Tuple[float, int, str]] = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    @staticmethod
+    def _entero_env(nombre: str, defecto: int) -> int:
+        try:
+            return int(os.getenv(nombre, str(defecto)))
+        except Exception:
+            return defecto
+
+    def init_app(self, app) -> None:
+        app.after_request(self.compress_response)
+        if not app.static_folder or 'static' not in app.view_functions:
+            return
+        self.static_folder = app.static_folder
+        app.view_functions['static'] = self.send_static
+        app.url_defaults(self._agregar_hash_estatico)
+        if os.getenv('STATIC_PRECOMPRESS', 'true').lower() == 'true':
+            self.precompress_static()
+
+    # ------------------------------------------------------------------
+    # Negociación
+    # ------------------------------------------------------------------
+    @staticmethod
+    def encodings_disponibles() -> Tuple[str, ...]:
+        return ('br', 'gzip') if _cargar_brotli() is not None else ('gzip',)
+
+    def negotiate(self, disponibles: Optional[Tuple[str, ...]] = None) -> Optional[str]:
+        """Codificación preferida por el navegador entre las disponibles (o None)."""
+        disponibles = disponibles or self.encodings_disponibles()
+        for encoding in sorted(disponibles, key=lambda e: -request.accept_encodings[e]):
+            if request.accept_encodings[encoding] > 0:
+                return encoding
+        return None
+
+    # ------------------------------------------------------------------
+    # Respuestas dinámicas
+    # ------------------------------------------------------------------
+    def compress_response(self, response):
+        """after_request: comprime HTML/JSON/CSS/JS si el navegador lo acepta."""
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        if (response.content_length or 0) < self.min_size:
+            return response
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+
+        nivel = self.brotli_quality if encoding == 'br' else self.gzip_level
+        response.set_data(_comprimir(response.get_data(), encoding, nivel))
+        response.headers['Content-Encoding'] = encoding
+        # La representación comprimida no es idéntica byte a byte: el ETag pasa a ser débil
+        etag, debil = response.get_etag()
+        if etag and not debil:
+            response.set_etag(etag, weak=True)
+        return response
+
+    # ------------------------------------------------------------------
+    # Estáticos
+    # ------------------------------------------------------------------
+    def send_static(self, filename: str):
+        """Vista 'static': variante precomprimida si existe y URLs con hash inmutables."""
+        versionada = bool(request.args.get('v'))
+        max_age = self.static_max_age if versionada else None
+
+        original = safe_join(self.static_folder, filename)
+        disponibles = tuple(
+            encoding for encoding, ext in VARIANTES
+            if original and self._variante_vigente(original, original + ext)
+        )
+        encoding = self.negotiate(disponibles) if disponibles else None
+        if encoding is not None:
+            ext = dict(VARIANTES)[encoding]
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response = send_from_directory(self.static_folder, filename + ext,
+                                           mimetype=mimetype, max_age=max_age)
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = send_from_directory(self.static_folder, filename, max_age=max_age)
+
+        if filename.endswith(STATIC_EXTENSIONS):
+            response.vary.add('Accept-Encoding')
+        if versionada:
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+        return response
+
+    @staticmethod
+    def _variante_vigente(original: str, variante: str) -> bool:
+        try:
+            return os.path.getmtime(variante) >= os.path.getmtime(original)
+        except OSError:
+            return False
+
+    def static_hash(self, filename: str) -> Optional[str]:
+        """Hash corto del contenido de un estático (memorizado por mtime y tamaño)."""
+        if self.static_folder is None:
+            return None
+        ruta = os.path.join(self.static_folder, filename)
+        try:
+            estado = os.stat(ruta)
+        except OSError:
+            return None
+        with self._lock:
+            memo = self._hashes.get(filename)
+        if memo and memo[:2] == (estado.st_mtime, estado.st_size):
+            return memo[2]
+
+        digest = hashlib.sha256()
+        with open(ruta, 'rb') as f:
+            for bloque in iter(lambda: f.read(65536), b''):
+                digest.update(bloque)
+        valor = digest.hexdigest()[:10]
+        with self._lock:
+            self._hashes[filename] = (estado.st_mtime, estado.st_size, valor)
+        return valor
+
+    def _agregar_hash_estatico(self, endpoint: str, values: dict) -> None:
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            valor = self.static_hash(values['filename'])
+            if valor:
+                values['v'] = valor
+
+    def precompress_static(self) -> int:
+        """
+        Genera las variantes .gz/.br que falten o estén desactualizadas.
+
+        Returns:
+            Número de variantes escritas
+        """
+        escritas = 0
+        encodings = self.encodings_disponibles()
+        for carpeta, _, archivos in os.walk(self.static_folder):
+            for nombre in archivos:
+                if not nombre.endswith(STATIC_EXTENSIONS):
+                    continue
+                original = os.path.join(carpeta, nombre)
+                for encoding, ext in VARIANTES:
+                    if encoding not in encodings or self._variante_vigente(original, original + ext):
+                        continue
+                    try:
+                        with open(original, 'rb') as f:
+                            data = _comprimir(f.read(), encoding, 11 if encoding == 'br' else 9)
+                        # Escritura atómica: varios workers pueden precomprimir a la vez
+                        fd, temporal = tempfile.mkstemp(dir=carpeta, prefix=f'.{nombre}.')
+                        with os.fdopen(fd, 'wb') as f:
+                            f.write(data)
+                        os.chmod(temporal, 0o644)
+                        os.replace(temporal, original + ext)
+                        escritas += 1
+                    except Exception as e:
+                        logging.warning(f"⚠️ No se pudo precomprimir {original} ({encoding}): {e}")
+        if escritas:
+            logging.info(f"🗜️ {escritas} estáticos precomprimidos ({', '.join(encodings)})")
+        return escritas
@@ -0,0 +1,150 @@
+# services/layered_cache.py
+"""
+Caché por capas para el dashboard (datasets normalizados y view-models).
+
+En lugar de guardar el HTML renderizado por cada combinación de filtros, el
+dashboard guarda dos capas independientes sobre el backend de Flask-Caching
+configurado (SimpleCache, SQLiteCache, Redis, ...):
+
+    - 'datasets':   líneas de venta, pendientes y filas agrupadas tal como
+                    salen de Odoo, para TODOS los clientes del rango. Las vistas
+                    filtradas por cliente se derivan de aquí sin consultar Odoo.
+    - 'view_model': las estructuras ya agregadas que recibe el template de un
+                    filtro concreto; el HTML se renderiza en cada petición.
+
+Cada valor se serializa UNA vez con pickle (el backend guarda bytes) y así la
+caché puede informar cuántos bytes ocupa cada capa. Junto al valor se guarda el
+momento en que se obtuvo, para servir datos vencidos mientras se refrescan
+(stale-while-revalidate, ver services/dataset_context.py).
+
+Ejemplo de uso:
+    >>> from services.layered_cache import LayeredCache
+    >>>
+    >>> capas = LayeredCache(cache)
+    >>> capas.set('view_model', ('2025', 'all'), {'kpis': {...}}, timeout=300)
+    >>> capas.get('view_model', ('2025', 'all'))['kpis']
+    {...}
+    >>> capas.get_stats()['view_model']['bytes']
+    18342
+"""
+
+import logging
+import pickle
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional, Sequence, Tuple
+
+
+class LayeredCache:
+    """
+    Capas con nombre sobre un objeto Cache de Flask-Caching.
+
+    Args:
+        cache: Instancia de flask_caching.Cache (o cualquier objeto con get/set/delete)
+        layers: Nombres de las capas permitidas
+        prefix: Prefijo de las claves en el backend
+
+    Notas:
+        Los bytes se contabilizan por proceso (lo que este worker escribió y
+        sigue vigente); con un backend compartido otros workers también leen
+        esas entradas.
+    """
+
+    LAYERS = ('datasets', 'view_model')
+
+    def __init__(self, cache, layers: Sequence[str] = LAYERS, prefix: str = 'capa'):
+        self.cache = cache
+        self.layers = tuple(layers)
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        # {capa: {clave: (bytes, vence_en)}}
+        self._sizes: Dict[str, Dict[str, tuple]] = {layer: {} for layer in self.layers}
+        self._stats = {layer: {'hits': 0, 'misses': 0, 'sets': 0} for layer in self.layers}
+
+    def _key(self, layer: str, key: Hashable) -> str:
+        if layer not in self._sizes:
+            raise ValueError(f"Capa de caché desconocida: {layer}")
+        partes = key if isinstance(key, tuple) else (key,)
+        return f"{self.prefix}:{layer}:" + '|'.join('' if p is None else str(p) for p in partes)
+
+    def get(self, layer: str, key: Hashable) -> Optional[Any]:
+        """Valor guardado en la capa, o None si no está (o no se pudo leer)."""
+        entrada = self.get_with_age(layer, key)
+        return entrada[0] if entrada is not None else None
+
+    def get_with_age(self, layer: str, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """Tupla (valor, obtenido_en) con obtenido_en en segundos epoch, o None."""
+        cache_key = self._key(layer, key)
+        try:
+            blob = self.cache.get(cache_key)
+        except Exception as e:
+            logging.warning(f"⚠️ Caché [{layer}] no disponible para {cache_key}: {e}")
+            blob = None
+        with self._lock:
+            self._stats[layer]['hits' if blob is not None else 'misses'] += 1
+        if blob is None:
+            return None
+        try:
+            obtenido_en, value = pickle.loads(blob)
+            return value, obtenido_en
+        except Exception as e:
+            logging.warning(f"⚠️ Caché [{layer}] entrada ilegible {cache_key}: {e}")
+            return None
+
+    def set(self, layer: str, key: Hashable, value: Any, timeout: Optional[int] = None,
+            obtenido_en: Optional[float] = None) -> bool:
+        """
+        Guarda 'value' en la capa (reemplazando la entrada anterior de una vez);
+        devuelve False si el backend lo rechazó.
+
+        Args:
+            obtenido_en: Momento (epoch) en que se obtuvieron los datos; por defecto ahora
+        """
+        cache_key = self._key(layer, key)
+        try:
+            envoltorio = (obtenido_en if obtenido_en is not None else time.time(), value)
+            blob = pickle.dumps(envoltorio, protocol=pickle.HIGHEST_PROTOCOL)
+            guardado = self.cache.set(cache_key, blob, timeout=timeout)
+        except Exception as e:
+            logging.warning(f"⚠️ Caché [{layer}] no se pudo guardar {cache_key}: {e}")
+            return False
+        if guardado is False:
+            return False
+        vence = time.time() + timeout if timeout else 0
+        with self._lock:
+            self._sizes[layer][cache_key] = (len(blob), vence)
+            self._stats[layer]['sets'] += 1
+        logging.info(f"💾 Caché [{layer}] {cache_key}: {len(blob) / 1024:.0f} KB")
+        return True
+
+    def delete(self, layer: str, key: Hashable) -> None:
+        cache_key = self._key(layer, key)
+        try:
+            self.cache.delete(cache_key)
+        except Exception:
+            pass
+        with self._lock:
+            self._sizes[layer].pop(cache_key, None)
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Por capa: entradas vigentes, bytes guardados, aciertos, fallos y escrituras."""
+        ahora = time.time()
+        with self._lock:
+            stats = {}
+            for layer, sizes in self._sizes.items():
+                for cache_key in [k for k, (_, vence) in sizes.items() if vence and vence <= ahora]:
+                    del sizes[cache_key]
+                stats[layer] = dict(
+                    self._stats[layer],
+                    entries=len(sizes),
+                    bytes=sum(size for size, _ in sizes.values())
+                )
+            return stats
+
+    def describe(self) -> str:
+        """Resumen de una línea para los logs."""
+        return " | ".join(
+            f"{layer}: {st['entries']} entradas, {st['bytes'] / (1024 * 1024):.1f} MB "
+            f"({st['hits']} aciertos / {st['misses']} fallos)"
+            for layer, st in self.get_stats().items()
+        )
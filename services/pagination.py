@@ -0,0 +1,155 @@
+# services/pagination.py
+"""
+Tokens opacos de paginación por keyset (cursor) para /sales y /pending.
+
+Con offset cada página le pide a Odoo que recorra y descarte todas las filas
+anteriores, y además recuenta el dominio completo. En modo keyset la página
+siguiente se pide "después de" la clave (fecha, id) de la última fila mostrada
+(ver OdooManager._keyset_search_read) y el total se cuenta una sola vez, en la
+primera página; el token lo lleva a las siguientes.
+
+El token es JSON en base64 URL-safe:
+
+    {"v": 1, "k": ["2025-03-10", 4812], "d": "n", "f": "<huella de filtros>",
+     "t": 12840, "o": 1000, "p": 2}
+
+    - k/d: clave de la fila límite y dirección (n = siguiente, p = anterior)
+    - f: huella de los filtros; un token de otra búsqueda se descarta
+    - t: total contado en la primera página (None en modo sin conteo)
+    - o/p: posición de la primera fila y número de página, solo informativos
+
+El token no se firma: solo indica desde dónde leer y los valores se validan
+al decodificarlo (cambiarlo a mano solo cambia la página que se ve).
+
+Ejemplo de uso:
+    >>> from services.pagination import encode_page_token, decode_page_token
+    >>>
+    >>> token = encode_page_token(['2025-03-10', 4812], 'next', filtros, total=12840, offset=1000, page=2)
+    >>> decode_page_token(token, filtros)['keyset']
+    {'key': ['2025-03-10', 4812], 'direction': 'next'}
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, List, Mapping, Optional
+
+TOKEN_VERSION = 1
+
+# PAGINATION_COUNT=false: modo sin conteo (no se hace search_count ni en la primera página)
+PAGINATION_COUNT = os.getenv('PAGINATION_COUNT', 'true').lower() == 'true'
+
+_FECHA = re.compile(r'^\d{4}-\d{2}-\d{2}( \d{2}:\d{2}:\d{2})?$')
+
+
+def filters_fingerprint(filtros: Optional[Mapping[str, Any]]) -> str:
+    """Huella corta de los filtros no vacíos (el orden de las claves no importa)."""
+    limpios = {clave: str(valor) for clave, valor in (filtros or {}).items() if valor not in (None, '')}
+    serializado = json.dumps(limpios, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(serializado.encode('utf-8')).hexdigest()[:12]
+
+
+def encode_page_token(key: List[Any], direction: str, filtros: Optional[Mapping[str, Any]],
+                      total: Optional[int] = None, offset: int = 0, page: int = 1) -> str:
+    """Token opaco de la página que empieza (direction='next') o termina ('prev') junto a key."""
+    datos = {
+        'v': TOKEN_VERSION,
+        'k': list(key),
+        'd': 'p' if direction == 'prev' else 'n',
+        'f': filters_fingerprint(filtros),
+        't': total,
+        'o': max(0, int(offset)),
+        'p': max(1, int(page)),
+    }
+    crudo = json.dumps(datos, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(crudo).decode('ascii').rstrip('=')
+
+
+def decode_page_token(token: Optional[str], filtros: Optional[Mapping[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Decodifica y valida un token.
+
+    Returns:
+        {'keyset': {'key', 'direction'}, 'total', 'offset', 'page'} o None si el
+        token es inválido o pertenece a otros filtros (se vuelve a la primera página)
+    """
+    if not token or len(token) > 512:
+        return None
+    try:
+        crudo = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        datos = json.loads(crudo.decode('utf-8'))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(datos, dict) or datos.get('v') != TOKEN_VERSION:
+        return None
+    if datos.get('f') != filters_fingerprint(filtros):
+        return None
+
+    clave = datos.get('k')
+    if (not isinstance(clave, list) or len(clave) != 2
+            or not isinstance(clave[0], str) or not _FECHA.match(clave[0])
+            or not isinstance(clave[1], int) or isinstance(clave[1], bool)):
+        return None
+    total = datos.get('t')
+    if total is not None and (not isinstance(total, int) or total < 0):
+        return None
+    try:
+        offset = max(0, int(datos.get('o', 0)))
+        page = max(1, int(datos.get('p', 1)))
+    except (TypeError, ValueError):
+        return None
+    return {
+        'keyset': {'key': clave, 'direction': 'prev' if datos.get('d') == 'p' else 'next'},
+        'total': total,
+        'offset': offset,
+        'page': page,
+    }
+
+
+def build_keyset_pagination(info: Mapping[str, Any], filas: int, filtros: Optional[Mapping[str, Any]],
+                            cursor: Optional[Mapping[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Contexto de paginación de la plantilla para una página keyset.
+
+    Args:
+        info: Paginación devuelta por OdooManager (has_next, has_prev, first_key, last_key, total)
+        filas: Filas mostradas en la página
+        filtros: Filtros de la búsqueda (para la huella de los tokens)
+        cursor: Token decodificado de la página actual (None = primera página)
+
+    Returns:
+        Mismas claves que la paginación por offset (page, total, showing_from, ...)
+        más mode='keyset', next_token y prev_token
+    """
+    per_page = info.get('per_page') or 1
+    total = info.get('total') if cursor is None else cursor.get('total')
+    page = cursor['page'] if cursor else 1
+    offset = cursor['offset'] if cursor else 0
+    if not info.get('has_prev'):
+        # Se llegó al principio (p. ej. retrocediendo): la posición es la primera
+        page, offset = 1, 0
+
+    next_token = prev_token = None
+    if info.get('has_next') and info.get('last_key') is not None:
+        next_token = encode_page_token(info['last_key'], 'next', filtros, total=total,
+                                       offset=offset + filas, page=page + 1)
+    if info.get('has_prev') and info.get('first_key') is not None:
+        prev_token = encode_page_token(info['first_key'], 'prev', filtros, total=total,
+                                       offset=offset - per_page, page=page - 1)
+
+    return {
+        'mode': 'keyset',
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'pages': ((total + per_page - 1) // per_page) if total is not None else None,
+        'showing_from': offset + 1 if filas else 0,
+        'showing_to': offset + filas,
+        'has_prev': bool(info.get('has_prev')),
+        'has_next': bool(info.get('has_next')),
+        'next_token': next_token,
+        'prev_token': prev_token,
+    }
@@ -0,0 +1,185 @@
+# services/single_flight.py
+"""
+Coalescencia de cargas concurrentes idénticas ("single-flight").
+
+A primera hora varios usuarios abren el dashboard con el mismo filtro a la vez:
+sin coordinación cada petición falla la caché y lanza su propia carga completa
+contra Odoo. SingleFlight garantiza que, para una misma clave, solo una llamada
+ejecuta la carga y las demás esperan su resultado:
+
+    1. Entre hilos del mismo worker: el primero (líder) ejecuta la función y
+       los demás esperan en un threading.Event.
+    2. Entre workers, si hay un backend de caché compartido: el líder toma un
+       candado con cache.add() (atómico en SQLiteCache, Redis, ...). Los demás
+       workers consultan periódicamente buscar() hasta que el líder publica el
+       resultado en la caché, o el candado vence.
+
+Si la espera supera SINGLE_FLIGHT_WAIT_TIMEOUT (segundos, por defecto 60) el
+llamador ejecuta la carga por su cuenta: la coalescencia nunca bloquea una
+petición indefinidamente.
+
+Ejemplo de uso:
+    >>> from services.single_flight import SingleFlight
+    >>>
+    >>> vuelos = SingleFlight(cache)
+    >>> resultado = vuelos.do(
+    ...     ('sales_lines', '2025-01-01', '2025-12-31'),
+    ...     cargar_lineas,
+    ...     buscar=lambda: capas.get_with_age('datasets', clave)
+    ... )
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _Vuelo:
+    """Carga en curso dentro del proceso."""
+
+    __slots__ = ('evento', 'resultado', 'error')
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Ejecuta una función una sola vez por clave entre llamadas concurrentes.
+
+    Args:
+        cache: Objeto con add/get/delete compartido entre workers (Flask-Caching);
+            None = solo coalescencia entre hilos del proceso
+        prefix: Prefijo de las claves de candado en la caché
+        lock_timeout: Segundos de vida del candado entre workers (por defecto
+            SINGLE_FLIGHT_LOCK_TIMEOUT o 120); libera el candado si el líder muere
+        wait_timeout: Segundos máximos de espera de un seguidor (por defecto
+            SINGLE_FLIGHT_WAIT_TIMEOUT o 60)
+        poll_interval: Segundos entre consultas mientras otro worker carga
+    """
+
+    def __init__(self, cache=None, prefix: str = 'vuelo', lock_timeout: Optional[int] = None,
+                 wait_timeout: Optional[int] = None, poll_interval: float = 0.25):
+        self.cache = cache
+        self.prefix = prefix
+        if lock_timeout is None:
+            try:
+                lock_timeout = int(os.getenv('SINGLE_FLIGHT_LOCK_TIMEOUT', '120'))
+            except Exception:
+                lock_timeout = 120
+        if wait_timeout is None:
+            try:
+                wait_timeout = int(os.getenv('SINGLE_FLIGHT_WAIT_TIMEOUT', '60'))
+            except Exception:
+                wait_timeout = 60
+        self.lock_timeout = max(1, lock_timeout)
+        self.wait_timeout = max(0, wait_timeout)
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._vuelos: Dict[Hashable, _Vuelo] = {}
+        self._stats = {'leaders': 0, 'waiters': 0, 'remote_waits': 0, 'remote_hits': 0, 'timeouts': 0}
+
+    def do(self, clave: Hashable, fn: Callable[[], Any],
+           buscar: Optional[Callable[[], Optional[Any]]] = None) -> Any:
+        """
+        Devuelve fn() ejecutándola una sola vez para todas las llamadas
+        concurrentes con la misma clave.
+
+        Args:
+            clave: Identificador de la carga (filtros normalizados)
+            fn: Función que realiza la carga; debe publicar su resultado donde
+                buscar() lo encuentre para que otros workers lo aprovechen
+            buscar: Devuelve el resultado ya publicado por otro worker, o None.
+                Sin buscar() solo se coalescen los hilos del proceso.
+
+        Raises:
+            La excepción de fn() también se propaga a los hilos que esperaban.
+        """
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+                self._stats['leaders'] += 1
+            else:
+                self._stats['waiters'] += 1
+
+        if not lider:
+            if not vuelo.evento.wait(self.wait_timeout):
+                logging.warning(f"⏳ Espera agotada para {clave}; se carga sin coalescer")
+                self._contar('timeouts')
+                return fn()
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+
+        try:
+            vuelo.resultado = self._ejecutar_entre_workers(clave, fn, buscar)
+            return vuelo.resultado
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._lock:
+                self._vuelos.pop(clave, None)
+            vuelo.evento.set()
+
+    def _ejecutar_entre_workers(self, clave: Hashable, fn: Callable[[], Any],
+                                buscar: Optional[Callable[[], Optional[Any]]]) -> Any:
+        """Toma el candado compartido (o espera al worker que lo tiene) y ejecuta fn()."""
+        if self.cache is None or buscar is None:
+            return fn()
+
+        cache_key = f"{self.prefix}:{clave}"
+        token = f"{os.getpid()}:{threading.get_ident()}:{time.time()}"
+        limite = time.monotonic() + self.wait_timeout
+        esperando = False
+        while True:
+            try:
+                adquirido = self.cache.add(cache_key, token, timeout=self.lock_timeout)
+            except Exception as e:
+                logging.warning(f"⚠️ Candado {cache_key} no disponible, se carga sin coordinar: {e}")
+                return fn()
+
+            if adquirido:
+                try:
+                    # Otro worker pudo publicar el resultado justo antes de soltar su candado
+                    resultado = buscar() if esperando else None
+                    return resultado if resultado is not None else fn()
+                finally:
+                    self._soltar(cache_key, token)
+
+            if not esperando:
+                esperando = True
+                self._contar('remote_waits')
+                logging.info(f"🛬 {clave} ya se está cargando en otro worker; esperando su resultado")
+            time.sleep(self.poll_interval)
+            resultado = buscar()
+            if resultado is not None:
+                self._contar('remote_hits')
+                return resultado
+            if time.monotonic() >= limite:
+                logging.warning(f"⏳ Espera agotada para {clave} en otro worker; se carga sin coalescer")
+                self._contar('timeouts')
+                return fn()
+
+    def _soltar(self, cache_key: str, token: str) -> None:
+        """Libera el candado solo si sigue siendo nuestro (pudo vencer y tomarlo otro)."""
+        try:
+            if self.cache.get(cache_key) == token:
+                self.cache.delete(cache_key)
+        except Exception:
+            pass
+
+    def _contar(self, contador: str) -> None:
+        with self._lock:
+            self._stats[contador] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        """Líderes, seguidores en el proceso, esperas entre workers, aciertos remotos y esperas agotadas."""
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._vuelos))
@@ -0,0 +1,295 @@
+# services/tracing.py
+"""
+Trazas de rendimiento por petición (spans anidados) con cabecera Server-Timing.
+
+dashboard() solo medía su inicio y fin con time.time(): no se sabía cuánto
+tardaba cada execute_kw, cada fase de la agregación, el render de plantillas o
+las lecturas de Supabase y Google Sheets. Con TRACING_ENABLED=true:
+
+    1. RequestTracer abre una traza al empezar cada petición. Los spans se
+       anidan solos: span() y @traced toman como padre el span activo del
+       contexto (contextvars, así que también siguen a las tareas que
+       OdooManager._run_task_graph lanza en hilos con copy_context()).
+    2. Al terminar, la respuesta lleva la cabecera Server-Timing con el tiempo
+       total y la suma por nombre de span (visible en las DevTools del
+       navegador), y la petición se suma al desglose por ruta de las últimas
+       TRACING_WINDOW peticiones (por defecto 200) de cada ruta.
+    3. Sin traza activa (TRACING_ENABLED=false, hilos en segundo plano, scripts)
+       span() devuelve un contexto nulo compartido y @traced llama a la función
+       directamente: el costo es una lectura de ContextVar por llamada.
+
+Ejemplo de uso:
+    >>> from services.tracing import RequestTracer, span, traced
+    >>>
+    >>> tracer = RequestTracer(app)
+    >>>
+    >>> @traced('supabase.read_metas')
+    ... def _cargar_metas_año(self, año): ...
+    >>>
+    >>> with span('aggregation.build'):
+    ...     agregados = engine.build()
+    >>>
+    >>> tracer.get_route_breakdown()['dashboard_api:resumen']['p95_ms']
+    412.7
+"""
+
+import contextvars
+import functools
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional
+
+from flask import before_render_template, g, request, template_rendered
+
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'false').lower() == 'true'
+
+try:
+    TRACING_WINDOW = int(os.getenv('TRACING_WINDOW', '200'))
+except Exception:
+    TRACING_WINDOW = 200
+
+# Spans guardados por petición como máximo (los demás solo se cuentan)
+try:
+    TRACING_MAX_SPANS = int(os.getenv('TRACING_MAX_SPANS', '2000'))
+except Exception:
+    TRACING_MAX_SPANS = 2000
+
+# Entradas de la cabecera Server-Timing (las de más duración)
+SERVER_TIMING_MAX_ENTRIES = 25
+
+_NULO = nullcontext()
+_NO_TOKEN = re.compile(r"[^A-Za-z0-9!#$%&'*+\-.^_`|~]")
+
+_traza_actual: contextvars.ContextVar[Optional['Trace']] = contextvars.ContextVar('traza_actual', default=None)
+_span_padre: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('span_padre', default=None)
+
+
+class Trace:
+    """Spans terminados de una petición: (id, padre, nombre, inicio, duración en segundos)."""
+
+    __slots__ = ('nombre', 'inicio', 'spans', 'descartados', 'cerrada', '_ids', '_plantillas')
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self.inicio = time.perf_counter()
+        self.spans: List[tuple] = []
+        self.descartados = 0
+        self.cerrada = False
+        self._ids = itertools.count(1)
+        self._plantillas: List['_Span'] = []
+
+    def agregar(self, registro: tuple) -> None:
+        # list.append es atómico: los spans de hilos de la misma traza no necesitan candado
+        if self.cerrada:
+            return
+        if len(self.spans) >= TRACING_MAX_SPANS:
+            self.descartados += 1
+            return
+        self.spans.append(registro)
+
+    def por_nombre(self) -> Dict[str, List[float]]:
+        """{nombre: [segundos, llamadas]} en el orden en que aparecieron."""
+        totales: Dict[str, List[float]] = {}
+        for _, _, nombre, _, duracion in self.spans:
+            total = totales.setdefault(nombre, [0.0, 0])
+            total[0] += duracion
+            total[1] += 1
+        return totales
+
+
+class _Span:
+    """Context manager de un span; el span activo es el padre de los que se abran dentro."""
+
+    __slots__ = ('traza', 'nombre', 'id', 'padre', 'inicio', '_token')
+
+    def __init__(self, traza: Trace, nombre: str):
+        self.traza = traza
+        self.nombre = nombre
+
+    def __enter__(self) -> '_Span':
+        self.id = next(self.traza._ids)
+        self.padre = _span_padre.get()
+        self._token = _span_padre.set(self.id)
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        duracion = time.perf_counter() - self.inicio
+        _span_padre.reset(self._token)
+        self.traza.agregar((self.id, self.padre, self.nombre, self.inicio - self.traza.inicio, duracion))
+        return False
+
+
+def span(nombre: str):
+    """Span con nombre dentro de la traza activa (contexto nulo si no hay traza)."""
+    traza = _traza_actual.get()
+    if traza is None:
+        return _NULO
+    return _Span(traza, nombre)
+
+
+def traced(nombre: str) -> Callable:
+    """Decorador: cada llamada de la función es un span 'nombre' de la traza activa."""
+    def decorador(funcion: Callable) -> Callable:
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            traza = _traza_actual.get()
+            if traza is None:
+                return funcion(*args, **kwargs)
+            with _Span(traza, nombre):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def current_trace() -> Optional[Trace]:
+    """Traza de la petición en curso (None si no se está trazando)."""
+    return _traza_actual.get()
+
+
+def name_trace(nombre: str) -> None:
+    """Cambia el nombre de ruta de la traza activa (p. ej. 'dashboard_api:resumen')."""
+    traza = _traza_actual.get()
+    if traza is not None:
+        traza.nombre = nombre
+
+
+def server_timing_header(traza: Trace, total: float, max_entradas: int = SERVER_TIMING_MAX_ENTRIES) -> str:
+    """Valor de Server-Timing: total y suma por nombre de span (en ms), de mayor a menor."""
+    entradas = [f'total;dur={total * 1000:.1f}']
+    totales = sorted(traza.por_nombre().items(), key=lambda item: -item[1][0])
+    for nombre, (segundos, llamadas) in totales[:max_entradas]:
+        entradas.append(f'{_NO_TOKEN.sub("_", nombre)};dur={segundos * 1000:.1f};desc="{int(llamadas)}x"')
+    return ', '.join(entradas)
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p * (len(ordenados) - 1))))]
+
+
+class RequestTracer:
+    """
+    Extensión Flask que traza cada petición.
+
+    Args:
+        app: Aplicación Flask (o llamar a init_app() más tarde)
+        enabled: Activar las trazas (por defecto TRACING_ENABLED)
+        window: Peticiones por ruta del desglose (por defecto TRACING_WINDOW o 200)
+    """
+
+    def __init__(self, app=None, enabled: Optional[bool] = None, window: Optional[int] = None):
+        self.enabled = TRACING_ENABLED if enabled is None else enabled
+        self.window = max(1, TRACING_WINDOW if window is None else window)
+        self._lock = threading.Lock()
+        # {ruta: deque de (total en segundos, {nombre: [segundos, llamadas]})}
+        self._rutas: Dict[str, deque] = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        if not self.enabled:
+            return
+        app.before_request(self._iniciar)
+        app.after_request(self._terminar)
+        app.teardown_request(self._limpiar)
+        before_render_template.connect(self._antes_de_plantilla, app, weak=False)
+        template_rendered.connect(self._despues_de_plantilla, app, weak=False)
+        logging.info(f"🔎 Trazas de rendimiento activas (Server-Timing, ventana de {self.window} peticiones por ruta)")
+
+    # ------------------------------------------------------------------
+    # Ciclo de la petición
+    # ------------------------------------------------------------------
+    def _iniciar(self) -> None:
+        traza = Trace(request.endpoint or 'desconocida')
+        g._traza_token = _traza_actual.set(traza)
+        g._span_token = _span_padre.set(None)
+
+    def _terminar(self, response):
+        traza = _traza_actual.get()
+        if traza is None:
+            return response
+        total = time.perf_counter() - traza.inicio
+        traza.cerrada = True
+        response.headers['Server-Timing'] = server_timing_header(traza, total)
+        with self._lock:
+            ventana = self._rutas.get(traza.nombre)
+            if ventana is None:
+                ventana = self._rutas[traza.nombre] = deque(maxlen=self.window)
+            ventana.append((total, traza.por_nombre()))
+        return response
+
+    def _limpiar(self, exc=None) -> None:
+        for nombre, variable in (('_span_token', _span_padre), ('_traza_token', _traza_actual)):
+            token = g.pop(nombre, None)
+            if token is not None:
+                try:
+                    variable.reset(token)
+                except ValueError:
+                    variable.set(None)
+
+    def _antes_de_plantilla(self, sender, template, context, **extra) -> None:
+        traza = _traza_actual.get()
+        if traza is not None:
+            actual = _Span(traza, 'render')
+            actual.__enter__()
+            traza._plantillas.append(actual)
+
+    def _despues_de_plantilla(self, sender, template, context, **extra) -> None:
+        traza = _traza_actual.get()
+        if traza is not None and traza._plantillas:
+            traza._plantillas.pop().__exit__(None, None, None)
+
+    # ------------------------------------------------------------------
+    # Desglose por ruta
+    # ------------------------------------------------------------------
+    def get_route_breakdown(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Desglose de las últimas peticiones de cada ruta en este proceso.
+
+        Returns:
+            {ruta: {'requests', 'avg_ms', 'p50_ms', 'p95_ms', 'max_ms',
+                    'spans': {nombre: {'avg_ms', 'calls_per_request', 'share'}}}}
+            'spans' va de mayor a menor tiempo; 'share' es la fracción del total
+            (puede superar 1 con spans en paralelo o anidados).
+        """
+        with self._lock:
+            rutas = {ruta: list(ventana) for ruta, ventana in self._rutas.items()}
+        desglose = {}
+        for ruta, peticiones in rutas.items():
+            totales = [total for total, _ in peticiones]
+            suma_total = sum(totales) or 1e-9
+            spans: Dict[str, List[float]] = {}
+            for _, por_nombre in peticiones:
+                for nombre, (segundos, llamadas) in por_nombre.items():
+                    acumulado = spans.setdefault(nombre, [0.0, 0])
+                    acumulado[0] += segundos
+                    acumulado[1] += llamadas
+            n = len(peticiones)
+            desglose[ruta] = {
+                'requests': n,
+                'avg_ms': round(sum(totales) / n * 1000, 1),
+                'p50_ms': round(_percentil(totales, 0.5) * 1000, 1),
+                'p95_ms': round(_percentil(totales, 0.95) * 1000, 1),
+                'max_ms': round(max(totales) * 1000, 1),
+                'spans': {
+                    nombre: {
+                        'avg_ms': round(segundos / n * 1000, 1),
+                        'calls_per_request': round(llamadas / n, 1),
+                        'share': round(segundos / suma_total, 3)
+                    }
+                    for nombre, (segundos, llamadas) in sorted(spans.items(), key=lambda item: -item[1][0])
+                }
+            }
+        return desglose
+
+    def reset(self) -> None:
+        """Olvida el desglose acumulado."""
+        with self._lock:
+            self._rutas.clear()